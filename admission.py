@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi.responses import JSONResponse, Response
+
+from query_log import normalise_question
+
+# Admission control in front of /ask and /retrieve, as HTTP middleware so it runs on the event loop
+# before a request takes a worker thread:
+#
+#   1. rate limit : token bucket per client (RATE_LIMIT_RPS refill, RATE_LIMIT_BURST capacity). A
+#                   client is its X-API-Key when that key is listed in RATE_LIMIT_KEYS, otherwise its
+#                   IP (the ADMISSION_PROXY_HOPS-th X-Forwarded-For entry from the right behind a
+#                   proxy such as Railway's). Over the limit → 429 with Retry-After. A frontend that
+#                   serves many users from one IP (streamlit_ui.py) sends a listed key plus
+#                   X-Client-Id per user session; only with a listed key is X-Client-Id trusted, and
+#                   then each user gets a bucket of their own.
+#   2. coalesce   : identical concurrent requests (same normalised question, history, tier, prefetched
+#                   ids, experiment variant) wait for the one already running and get a copy of its
+#                   response (X-Coalesced: 1), so they share one retrieval and one LLM call. The variant
+#                   is the one the request will be served with (its conversation's bucket), not just
+#                   the one it names.
+#   3. queue      : at most ADMISSION_MAX_CONCURRENT requests run at once and ADMISSION_MAX_QUEUE wait;
+#                   beyond that, or after ADMISSION_QUEUE_TIMEOUT_S in the queue → 429 straight away
+#                   instead of piling up behind the thread pool.
+#
+# The rate limit stays off until RATE_LIMIT_KEYS is set (or RATE_LIMIT_RPS is given explicitly):
+# without a listed key every Streamlit user would share the UI server's IP bucket, and each question
+# costs two tokens (/retrieve, then /ask). Set RATE_LIMIT_KEYS to the UI's BACKEND_API_KEY to turn it on.
+#
+# Limits are per worker process (serve.py runs several). ADMISSION=0 turns it all off; the counters
+# are at /debug/admission.
+
+ADMISSION_ENABLED = os.environ.get("ADMISSION", "1") == "1"
+ADMISSION_PATHS = tuple(p.strip() for p in os.environ.get("ADMISSION_PATHS", "/ask,/retrieve").split(",") if p.strip())
+RATE_LIMIT_KEYS = {k.strip() for k in os.environ.get("RATE_LIMIT_KEYS", "").split(",") if k.strip()}
+RATE_LIMIT_RPS = float(os.environ.get("RATE_LIMIT_RPS", "1.0" if RATE_LIMIT_KEYS else "0"))  # 0 = no rate limit
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", "20"))
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", "10000"))
+ADMISSION_PROXY_HOPS = int(os.environ.get("ADMISSION_PROXY_HOPS", "1"))
+ADMISSION_MAX_CONCURRENT = int(os.environ.get("ADMISSION_MAX_CONCURRENT", "16"))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_QUEUE_TIMEOUT_S = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT_S", "30"))
+ADMISSION_COALESCE = os.environ.get("ADMISSION_COALESCE", "1") == "1"
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Token bucket per key; the least recently seen keys are forgotten past `max_keys`."""
+
+    def __init__(self, rate: float = RATE_LIMIT_RPS, burst: float = RATE_LIMIT_BURST, max_keys: int = RATE_LIMIT_MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()  # key -> [tokens, updated]
+        self._lock = threading.Lock()
+
+    def allow(self, key: str, cost: float = 1.0) -> Tuple[bool, float]:
+        """(allowed, seconds until `cost` tokens are available)."""
+        if self.rate <= 0:
+            return True, 0.0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return True, 0.0
+            return False, (cost - bucket[0]) / self.rate
+
+
+class ConcurrencyGate:
+    """At most `max_concurrent` holders and `max_queue` waiters; more waiters are rejected at once."""
+
+    def __init__(self, max_concurrent: int = ADMISSION_MAX_CONCURRENT, max_queue: int = ADMISSION_MAX_QUEUE,
+                 timeout: float = ADMISSION_QUEUE_TIMEOUT_S):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.running = 0
+        self.waiting = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def acquire(self) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                raise Rejected("queue_full", 1.0)
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                raise Rejected("queue_timeout", 1.0)
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        self.running += 1
+
+    def release(self) -> None:
+        self.running -= 1
+        self._semaphore.release()
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share the first caller's result (or exception). A leader that
+    is cancelled (its client went away) publishes nothing: the first waiter runs its own `fn` instead."""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """(result, shared): `shared` is True for callers that waited on another's call."""
+        while key in self._inflight:
+            pending = self._inflight[key]
+            try:
+                return await asyncio.shield(pending), True
+            except asyncio.CancelledError:
+                # The leader was cancelled, not us: take over (or wait on whoever already has)
+                if pending.cancelled() and not asyncio.current_task().cancelling():
+                    continue
+                raise
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # retrieved, even when nobody else was waiting
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._inflight[key]
+
+
+def client_key(request, api_keys=RATE_LIMIT_KEYS, proxy_hops: int = ADMISSION_PROXY_HOPS) -> str:
+    api_key = request.headers.get("x-api-key")
+    if api_key and api_key in api_keys:
+        key = "key:" + hashlib.sha1(api_key.encode("utf-8")).hexdigest()[:12]
+        client_id = (request.headers.get("x-client-id") or "").strip()
+        return key + ":" + client_id[:64] if client_id else key
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded and proxy_hops > 0:
+        # Proxies append: the entry our own proxy added is the trustworthy one, not the leftmost
+        hops = [h.strip() for h in forwarded.split(",") if h.strip()]
+        if hops:
+            return "ip:" + hops[-min(proxy_hops, len(hops))]
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+
+def coalesce_key(path: str, body: bytes,
+                 variant_of: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None) -> Optional[str]:
+    """Requests that would produce the same answer; None when the body isn't a question payload.
+    `variant_of` gives the experiment variant a payload is served with."""
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError:
+        return None
+    if not isinstance(payload, dict) or not str(payload.get("question") or "").strip():
+        return None
+    identity = {
+        "question": normalise_question(str(payload["question"])),
+        **{k: payload.get(k) for k in ("history", "tier", "retrieved_ids", "search_question", "workspace")},
+        "variant": variant_of(payload) if variant_of is not None else payload.get("variant"),
+    }
+    blob = json.dumps(identity, sort_keys=True, ensure_ascii=False, default=str)
+    return path + ":" + hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class Admission:
+    def __init__(self, limiter: Optional[RateLimiter] = None, gate: Optional[ConcurrencyGate] = None,
+                 coalesce: bool = ADMISSION_COALESCE, paths=ADMISSION_PATHS,
+                 variant_of: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None):
+        self.limiter = limiter or RateLimiter()
+        self.gate = gate or ConcurrencyGate()
+        self.flights = SingleFlight()
+        self.coalesce = coalesce
+        self.variant_of = variant_of
+        self.paths = tuple(paths)
+        self.stats = {"admitted": 0, "coalesced": 0, "rate_limited": 0, "queue_full": 0, "queue_timeout": 0}
+
+    def _reject(self, reason: str, retry_after: float) -> JSONResponse:
+        self.stats[reason] += 1
+        return JSONResponse(
+            status_code=429,
+            content={"status": "error", "error": "Too many requests, please retry shortly.", "reason": reason},
+            headers={"Retry-After": str(max(int(retry_after + 0.999), 1))},
+        )
+
+    async def dispatch(self, request, call_next):
+        if request.method != "POST" or request.url.path not in self.paths:
+            return await call_next(request)
+
+        allowed, retry_after = self.limiter.allow(client_key(request))
+        if not allowed:
+            return self._reject("rate_limited", retry_after)
+
+        async def run() -> Tuple[int, Any, bytes]:
+            await self.gate.acquire()
+            try:
+                self.stats["admitted"] += 1
+                response = await call_next(request)
+                body = b"".join([chunk async for chunk in response.body_iterator])
+                return response.status_code, response.raw_headers, body
+            finally:
+                self.gate.release()
+
+        key = coalesce_key(request.url.path, await request.body(), self.variant_of) if self.coalesce else None
+        try:
+            if key is None:
+                (status, headers, body), shared = await run(), False
+            else:
+                (status, headers, body), shared = await self.flights.do(key, run)
+        except Rejected as e:
+            return self._reject(e.reason, e.retry_after)
+        response = Response(content=body, status_code=status)
+        response.raw_headers = [(k, v) for k, v in headers]
+        if shared:
+            self.stats["coalesced"] += 1
+            response.headers["X-Coalesced"] = "1"
+        return response
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "running": self.gate.running,
+            "waiting": self.gate.waiting,
+            "clients_tracked": len(self.limiter._buckets),
+            "limits": {
+                "rate_rps": self.limiter.rate, "burst": self.limiter.burst,
+                "max_concurrent": self.gate.max_concurrent, "max_queue": self.gate.max_queue,
+                "queue_timeout_s": self.gate.timeout, "coalesce": self.coalesce, "paths": list(self.paths),
+            },
+        }
+
+
+def install_admission(app, admission: Optional[Admission] = None,
+                      variant_of: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None) -> Optional[Admission]:
+    """Add the middleware to a FastAPI app (before CORS, so 429s still carry CORS headers)."""
+    if not ADMISSION_ENABLED:
+        return None
+    admission = admission or Admission(variant_of=variant_of)
+    app.middleware("http")(admission.dispatch)
+    return admission
@@ -1,21 +1,47 @@
 import os
 import io
+import time
 import zipfile
 import shutil
-from typing import List, Dict, Any
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional
 
 from dotenv import load_dotenv
 from fastapi import FastAPI, UploadFile, File, Path
 from fastapi.responses import JSONResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from chromadb import PersistentClient
 from openai import OpenAI
 
 # Optional helpers you already have
 from ingest_supabase import ingest_supabase_docs
-from zip_chroma import zip_chroma_store
-from utils import format_response_with_citations
+from zip_chroma import ZIP_PART_BASE, zip_chroma_store
+from snapshot import apply_snapshot, build_manifest, is_snapshot_zip, load_manifest, validate_store
+from utils import format_response_with_citations, page_label
+from text_store import text_store
+from source_index import SOURCES_COLLECTION
+from embeddings import backend_dimension, backend_name, get_embedding_function, open_collection
+from retrieval import (
+    ADAPTIVE_K, RETRIEVAL_MAX_K, RETRIEVAL_MODE, adaptive_cutoff, distance_to_similarity, results_from_ids, retrieve,
+    trim_results,
+)
+from lowmem_index import LOWMEM_INDEX_PATH, open_lowmem_store
+from history import WEB_CONTEXT_PREFIX, compact_history, condense_question
+from prompting import assemble_messages, completion_budget
+from routing import Router
+from query_log import log_query, question_hash
+from admission import install_admission
+from experiments import ExperimentMetrics, load_experiment
+from compact_store import compact_store, compare, fragmentation, load_hnsw_config, measure_store
+from workspaces import (
+    DEFAULT_WORKSPACE, UnknownWorkspace, Workspace, WorkspacePool, bump_workspace, create_workspace, ingest_options,
+    list_workspaces, lock_name, read_meta, release_client, swap_in, workspace_name, workspace_path,
+)
+from jobs import JobManager, STORE_LOCK, ZIP_LOCK
+from shared_store import (
+    CHROMA_MODE, CHROMA_PATH, GenerationWatcher, bump_generation, open_chroma_client,
+    release_embedded_clients, request_swap, staging_path, wait_for_generation,
+)
 
 # ---------- Env / Paths ----------
 load_dotenv()
@@ -26,38 +52,78 @@ LOCALE = os.environ.get("LOCALE", "en-GB")
 RESPONSE_DETAIL = os.environ.get("RESPONSE_DETAIL", "double")  # "default" | "double"
 OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4-turbo")
 OPENAI_MAX_TOKENS = int(os.environ.get("OPENAI_MAX_TOKENS", "900"))  # allow longer answers
+OPENAI_FAST_MODEL = os.environ.get("OPENAI_FAST_MODEL", "gpt-4o-mini")  # simple lookups (routing.py)
+HISTORY_MODEL = os.environ.get("HISTORY_MODEL", "gpt-4o-mini")  # cheap model for summaries / standalone questions
 
 SKIP_INGEST = os.environ.get("SKIP_INGEST", "1") == "1"
 
-CHROMA_PATH = "/tmp/chroma_store"
+# "chroma" = Chroma on CHROMA_PATH (embedded, or via a shared local server with CHROMA_MODE=http);
+# "lowmem" = memory-mapped float16 index exported by lowmem_index.py
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "chroma")
+
+NO_SOURCES_RESPONSE = (
+    "I couldn't find anything relevant to that in the CocktailGPT library, so I'd rather not guess. "
+    "Try rephrasing, or ask about a specific drink, ingredient or technique."
+)
+
 UPLOAD_PARTS_DIR = "/tmp/upload_parts"
 ZIP_PATH = "/tmp/chroma_store.zip"
 
 os.makedirs(CHROMA_PATH, exist_ok=True)
 os.makedirs(UPLOAD_PARTS_DIR, exist_ok=True)
 
-print(f"✅ API starting | LOCALE={LOCALE} | DETAIL={RESPONSE_DETAIL} | MODEL={OPENAI_MODEL} | MAX_TOKENS={OPENAI_MAX_TOKENS} | SKIP_INGEST={SKIP_INGEST}")
+print(f"✅ API starting | LOCALE={LOCALE} | DETAIL={RESPONSE_DETAIL} | MODEL={OPENAI_MODEL} | FAST_MODEL={OPENAI_FAST_MODEL} | MAX_TOKENS={OPENAI_MAX_TOKENS} | SKIP_INGEST={SKIP_INGEST} | RETRIEVAL={RETRIEVAL_MODE} | BACKEND={VECTOR_BACKEND} | EMBEDDING={backend_name()} | CHROMA_MODE={CHROMA_MODE} | PID={os.getpid()}")
 
 # ---------- Chroma client (global) ----------
-client = PersistentClient(path=CHROMA_PATH)
-collection = client.get_or_create_collection("cocktailgpt")
+# EMBEDDING_BACKEND (embeddings.py), the same one the ingest scripts use; held explicitly so the
+# question is embedded once and reused for both the source-level and chunk-level queries.
+embedding_function = get_embedding_function()
+
+
+def open_store():
+    """(client, collection, sources_collection) for the configured backend. client is None in lowmem mode.
+    Raises EmbeddingMismatchError when the store was embedded with another backend."""
+    if VECTOR_BACKEND == "lowmem":
+        chunks, sources = open_lowmem_store(LOWMEM_INDEX_PATH, embedding_function=embedding_function)
+        return None, chunks, sources
+    chroma = open_chroma_client(CHROMA_PATH)
+    return (
+        chroma,
+        open_collection(chroma, "cocktailgpt"),
+        open_collection(chroma, SOURCES_COLLECTION),
+    )
+
+
+# Seen before opening, so a restore finished in another worker meanwhile still triggers a reopen
+store_generation = GenerationWatcher()
+client, collection, sources_collection = open_store()
+
+# Other workspaces (workspaces.py): opened on first use, least recently used closed past
+# WORKSPACE_POOL_SIZE / WORKSPACE_POOL_MB
+workspace_pool = WorkspacePool()
 
 # ---------- OpenAI client (global) ----------
 openai_api_key = os.getenv("OPENAI_API_KEY")
 oa = OpenAI(api_key=openai_api_key)
+# Fast vs large model per question (OPENAI_FAST_MODEL / OPENAI_MODEL), see routing.py
+router = Router(strong_model=OPENAI_MODEL, fast_model=OPENAI_FAST_MODEL, strong_max_tokens=OPENAI_MAX_TOKENS)
+# Optional A/B experiment over detail / max tokens / n_results (EXPERIMENT, see experiments.py)
+experiment = load_experiment()
+experiment_metrics = ExperimentMetrics()
+if experiment is not None:
+    print(f"🧪 Experiment {experiment.name}: {[v.name for v in experiment.variants]}")
 
-# ---------- Optional ingestion on boot ----------
-if not SKIP_INGEST:
-    print("🚀 Ingesting from Supabase...")
-    try:
-        ingest_supabase_docs(collection)
-    except Exception as e:
-        print(f"❌ Ingest failed: {e}")
-else:
-    print("⏩ SKIP_INGEST=1, skipping ingestion on boot.")
+# ---------- Background jobs (ingest, retag, normalise, zip, restore) ----------
+# Own thread pool, separate from the request threads; state persisted to JOB_STATE_PATH
+job_manager = JobManager()
 
 # ---------- FastAPI ----------
 app = FastAPI()
+# Per-client rate limit, bounded queue with fast 429s and coalescing of identical concurrent questions
+# on /ask and /retrieve (see admission.py); installed first so CORS wraps its 429s
+admission_control = install_admission(
+    app, variant_of=(lambda payload: experiment.choose(payload).name) if experiment is not None else None,
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # tighten if you want to lock to Softr domain
@@ -68,19 +134,74 @@ app.add_middleware(
 
 # ---------- Helpers ----------
 def reopen_collection() -> bool:
-    """Reopen Chroma after replacing /tmp/chroma_store."""
-    global client, collection
+    """Reopen Chroma (or the lowmem index) after replacing it on disk."""
+    global client, collection, sources_collection
     try:
-        client = PersistentClient(path=CHROMA_PATH)
-        collection = client.get_or_create_collection("cocktailgpt")
+        if VECTOR_BACKEND == "chroma" and CHROMA_MODE == "embedded":
+            release_embedded_clients()
+        client, collection, sources_collection = open_store()
+        text_store.clear()
         return True
     except Exception as e:
         print(f"❌ reopen_collection failed: {e}")
         return False
 
 
+def ensure_current_store() -> None:
+    """Reopen when another worker (or serve.py) restored/reloaded the store since we opened it."""
+    if store_generation.changed():
+        print(f"🔄 Store generation {store_generation.generation}: reopening in worker {os.getpid()}")
+        reopen_collection()
+
+
+def get_workspace(name: Optional[str]) -> Workspace:
+    """The main store for the default workspace, otherwise the pooled one. Raises ValueError for a bad
+    name (or in lowmem mode) and UnknownWorkspace for one that was never created."""
+    ensure_current_store()
+    name = workspace_name(name)
+    if name == DEFAULT_WORKSPACE:
+        return Workspace(name, CHROMA_PATH, client, collection, sources_collection, text_store)
+    if VECTOR_BACKEND == "lowmem":
+        raise ValueError("Workspaces need VECTOR_BACKEND=chroma")
+    return workspace_pool.get(name)
+
+
+@contextmanager
+def held_workspace(name: Optional[str]):
+    """get_workspace for a job: a pooled workspace stays open until the job is done (see WorkspacePool.pinned)."""
+    ws = get_workspace(name)
+    if ws.name == DEFAULT_WORKSPACE:
+        yield ws
+        return
+    with workspace_pool.pinned(ws.name) as ws:
+        yield ws
+
+
+def job_workspace(name: Optional[str]) -> Dict[str, Any]:
+    """Job params for a ?workspace= parameter; {} for the default workspace, so those jobs look as before.
+    Raises like get_workspace, without opening the workspace in the request thread."""
+    name = workspace_name(name)
+    if name == DEFAULT_WORKSPACE:
+        return {}
+    if VECTOR_BACKEND == "lowmem":
+        raise ValueError("Workspaces need VECTOR_BACKEND=chroma")
+    read_meta(name)
+    return {"workspace": name}
+
+
+def part_base(workspace: str) -> str:
+    """Where /zip-chroma writes a workspace's snapshot parts (/export-chroma-part serves them)."""
+    return ZIP_PART_BASE if workspace == DEFAULT_WORKSPACE else f"/tmp/workspace_{workspace}_part"
+
+
+def workspace_error(e: Exception) -> JSONResponse:
+    if isinstance(e, UnknownWorkspace):
+        return JSONResponse(status_code=404, content={"error": f"Unknown workspace {e.args[0]}; create it with POST /workspaces."})
+    return JSONResponse(status_code=400, content={"error": str(e)})
+
+
 def results_to_sources(results: Dict[str, Any]) -> List[str]:
-    """Convert Chroma query results to a flat list of 'filename (chunk N)' strings."""
+    """Convert Chroma query results to a flat list of 'filename (chunk N, p. 4)' strings."""
     metas = results.get("metadatas") or []
     if not metas:
         return []
@@ -94,46 +215,87 @@ def results_to_sources(results: Dict[str, Any]) -> List[str]:
             chunk = m.get("chunk")
         elif isinstance(m, str):
             source = m
-        label = f"{source}" if chunk is None else f"{source} (chunk {chunk})"
+        where = ", ".join(x for x in ((f"chunk {chunk}" if chunk is not None else None), page_label(m)) if x)
+        label = f"{source}" if not where else f"{source} ({where})"
+        if isinstance(m, dict) and m.get("also_in"):
+            # Same passage in other books/chapters (skipped at ingest as duplicates, see dedup.py)
+            label += f" · also in {m['also_in']}"
         if label not in seen:
             seen.add(label)
             out.append(label)
     return out
 
 
-def build_context_from_results(results: Dict[str, Any]) -> str:
-    """Build a quoted context block from the top documents returned by Chroma."""
+def context_rows_from_results(results: Dict[str, Any]) -> List[str]:
+    """One quoted block per retrieved document, in rank order."""
     docs = results.get("documents") or [[]]
     metas = results.get("metadatas") or [[]]
     rows = []
     for i, (doc, meta) in enumerate(zip(docs[0], metas[0]), start=1):
         src = meta.get("source") if isinstance(meta, dict) else "Unknown"
         ch = meta.get("chunk") if isinstance(meta, dict) else None
-        head = f"[{i}] {src}" + (f" (chunk {ch})" if ch is not None else "")
+        where = ", ".join(x for x in ((f"chunk {ch}" if ch is not None else None), page_label(meta)) if x)
+        head = f"[{i}] {src}" + (f" ({where})" if where else "")
         body = doc.strip()
         rows.append(f"{head}\n{body}")
-    return "\n\n".join(rows)
-
-
-def make_system_prompt() -> str:
-    """System prompt that enforces UK English and ~2x detail."""
-    base = (
-        "You are CocktailGPT, a precise assistant for cocktails, flavour, and food science.\n"
-        f"- Use {LOCALE} spelling and grammar (UK English).\n"
-        "- Use metric units (mL, grams, °C) by default; include imperial only if the source uses it explicitly.\n"
-        "- Use ingredient and technique names faithfully as written in the sources.\n"
-        "- If the answer is not present in the provided context, say you don't know.\n"
-        "- Always stay faithful to the context; do not invent sources.\n"
+    return rows
+
+
+def citations_from_results(results: Dict[str, Any], workspace: str = DEFAULT_WORKSPACE) -> List[Dict[str, Any]]:
+    """Per retrieved chunk: source, chunk and page range straight from the metadata, plus the
+    /source link that serves its pages. No extra lookups."""
+    query = "" if workspace == DEFAULT_WORKSPACE else f"?workspace={workspace}"
+    ids = (results.get("ids") or [[]])[0] or []
+    metas = (results.get("metadatas") or [[]])[0] or []
+    out = []
+    for chunk_id, meta in zip(ids, metas):
+        meta = meta if isinstance(meta, dict) else {}
+        out.append({
+            "id": chunk_id,
+            "source": meta.get("source") or meta.get("path") or "Unknown",
+            "chunk": meta.get("chunk"),
+            "page_start": meta.get("page_start"),
+            "page_end": meta.get("page_end"),
+            "pages": page_label(meta),
+            "url": f"/source/{chunk_id}{query}",
+        })
+    return out
+
+
+def search_chunks(search_question: str, timings: Dict[str, float], ws: Workspace, n_results: Optional[int] = None) -> Dict[str, Any]:
+    """Embed the question once and run the configured retrieval over the workspace's store (coarse-to-fine
+    over the source index when RETRIEVAL_MODE=two_stage; with ADAPTIVE_K the number of chunks follows
+    the similarity scores, and an experiment's n_results caps it instead of RETRIEVAL_MAX_K)."""
+    mark = time.perf_counter()
+    query_embedding = embedding_function([search_question])[0]
+    timings["embed"] = time.perf_counter() - mark
+    mark = time.perf_counter()
+    results = retrieve(
+        ws.collection,
+        ws.sources_collection,
+        query_embedding,
+        n_results=n_results or 5,
+        include=["documents", "metadatas", "distances"],
+        max_k=n_results,
     )
-    if RESPONSE_DETAIL.lower() == "double":
-        base += (
-            "\nDetail & structure:\n"
-            "- Provide approximately twice the normal detail.\n"
-            "- When relevant, add two short sections at the end:\n"
-            "  * Why it matters — one or two sentences that explain the practical significance.\n"
-            "  * Practical tips — concise, actionable pointers a bartender or chef can use immediately.\n"
-        )
-    return base
+    timings["retrieve"] = time.perf_counter() - mark
+    return results
+
+
+def standalone_question(question: str, history_msgs: List[Dict[str, str]]) -> str:
+    """The question to retrieve with, from compact_history's output (shared by /ask and /retrieve)."""
+    return condense_question(question, [m for m in history_msgs if m["role"] != "system"], history_complete)
+
+
+def history_complete(messages: List[Dict[str, str]], max_tokens: int) -> str:
+    """Small completions used by history compaction (rolling summaries, standalone questions)."""
+    completion = oa.chat.completions.create(
+        model=HISTORY_MODEL,
+        messages=messages,
+        temperature=0,
+        max_tokens=max_tokens,
+    )
+    return completion.choices[0].message.content or ""
 
 
 # ---------- Routes ----------
@@ -148,9 +310,24 @@ def root():
 @app.get("/health")
 def health():
     try:
-        _ = client.list_collections()  # touch to avoid stale handle
+        ensure_current_store()
+        if client is not None:
+            _ = client.list_collections()  # touch to avoid stale handle
         count = collection.count()
-        return {"status": "ok", "chroma_count": count, "locale": LOCALE, "detail": RESPONSE_DETAIL}
+        return {
+            "status": "ok",
+            "chroma_count": count,
+            "source_index_count": sources_collection.count() if sources_collection is not None else 0,
+            "retrieval": RETRIEVAL_MODE,
+            "backend": VECTOR_BACKEND,
+            "embedding": {"backend": backend_name(), "dim": backend_dimension()},
+            "chroma_mode": CHROMA_MODE,
+            "store_generation": store_generation.generation,
+            "workspaces_open": len(workspace_pool),
+            "worker_pid": os.getpid(),
+            "locale": LOCALE,
+            "detail": RESPONSE_DETAIL,
+        }
     except Exception as e:
         return {"status": "fail", "error": str(e)}
 
@@ -163,8 +340,32 @@ def check_chroma_dir():
     return {"exists": True, "files": files}
 
 
+@app.get("/debug/admission")
+def admission_stats():
+    """Admitted / coalesced / rejected counts and current queue depth in this worker."""
+    return admission_control.snapshot() if admission_control is not None else {"enabled": False}
+
+
+@app.get("/debug/routing")
+def routing_stats():
+    """Requests and p50/p95 latency per model tier in this worker."""
+    return router.stats()
+
+
+@app.get("/debug/experiments")
+def experiment_stats():
+    """The running experiment and per-variant latency, tokens and retrieval scores in this worker."""
+    return {
+        "experiment": experiment.to_dict() if experiment is not None else None,
+        "variants": experiment_metrics.snapshot(),
+    }
+
+
 @app.get("/debug/collections")
 def list_collections():
+    ensure_current_store()
+    if client is None:
+        return {"status": "ok", "backend": VECTOR_BACKEND, "collections": [{"name": collection.name, "count": collection.count()}]}
     try:
         cols = client.list_collections()
         return {
@@ -181,43 +382,149 @@ def ask(payload: Dict[str, Any]):
     """
     Body: {
       "question": str,
-      "history": Optional[List[{"role":"user"|"assistant","content":str}]]
+      "history": Optional[List[{"role":"user"|"assistant","content":str}]],
+      "conversation_id": Optional[str],
+      "tier": Optional["fast" | "strong"]   (skip routing for this request),
+      "retrieved_ids": Optional[List[str]],
+      "search_question": Optional[str]       (from /retrieve: skip condensing and the vector query; the
+                                              chunks are scored here against it, not taken on trust),
+      "workspace": Optional[str]             (a bar group's private documents; default: the main library),
+      "variant": Optional[str]               (experiment variant, e.g. the one /retrieve returned)
     }
-    Returns: { "response": str, "sources": [str, ...] }
+    Returns: { "response": str, "sources": [str, ...], "citations": [{id, source, chunk, pages, url}, ...],
+               "history": {token stats},
+               "routing": {tier, model, reason, ...}, "retrieval": {adaptive k decision},
+               "experiment": {name, variant} | null, "debug": {"tokens": {per-segment breakdown}} }
     """
+    started = time.perf_counter()
+    timings: Dict[str, float] = {}
+    log_fields: Dict[str, Any] = {}
+    question, results, variant = "", None, None
     try:
-        question: str = (payload or {}).get("question", "").strip()
+        question = (payload or {}).get("question", "").strip()
         history = (payload or {}).get("history") or []
+        conversation_id = (payload or {}).get("conversation_id")
+        tier_override = (payload or {}).get("tier")
+        prefetched_ids = (payload or {}).get("retrieved_ids")
         if not question:
             return JSONResponse(status_code=400, content={"error": "Question is required."})
+        if prefetched_ids is not None and not (
+            isinstance(prefetched_ids, list) and all(isinstance(i, str) for i in prefetched_ids)
+        ):
+            return JSONResponse(status_code=400, content={"error": "retrieved_ids must be a list of chunk id strings."})
+        try:
+            ws = get_workspace((payload or {}).get("workspace"))
+        except (ValueError, UnknownWorkspace) as e:
+            return workspace_error(e)
+        if ws.name != DEFAULT_WORKSPACE:
+            log_fields["workspace"] = ws.name
+        log_fields["conversation"] = question_hash(str(conversation_id)) if conversation_id else None
+        if experiment is not None:
+            variant = experiment.choose(payload)
+            log_fields["experiment"] = {"name": experiment.name, "variant": variant.name}
 
-        # Query Chroma
-        results = collection.query(
-            query_texts=[question],
-            n_results=5,
-            include=["documents", "metadatas"]
+        # Recent turns verbatim within budget, older ones as a cached rolling summary
+        history_msgs, history_stats = compact_history(
+            history, history_complete, conversation_id=conversation_id, question=question
         )
+        # Follow-ups like "what about with lime?" are retrieved as a standalone question (already done
+        # by /retrieve when the UI sends its results along)
+        if prefetched_ids is not None:
+            search_question = str((payload or {}).get("search_question") or question)
+        else:
+            search_question = standalone_question(question, history_msgs)
+        history_stats["search_question"] = search_question
+        timings["history"] = time.perf_counter() - started
+        log_fields["cache"] = {"history_summary": history_stats["summary_cached"]}
+        log_fields["condensed"] = search_question != question
+        print(f"🧾 History: {history_stats['history_tokens_in']} → {history_stats['history_tokens_sent']} tokens "
+              f"(saved {history_stats['history_tokens_saved']}, summary cached: {history_stats['summary_cached']})")
+
+        if prefetched_ids is not None:
+            # Chunks the UI fetched from /retrieve while this request was put together: read them by id
+            # and score them against the search question here (routing, the short circuit and the
+            # logged scores never rest on numbers from the client), skipping only the vector query
+            mark = time.perf_counter()
+            query_embedding = embedding_function([search_question])[0]
+            timings["embed"] = time.perf_counter() - mark
+            mark = time.perf_counter()
+            max_k = (variant and variant.n_results) or RETRIEVAL_MAX_K
+            results = results_from_ids(
+                ws.collection,
+                prefetched_ids[:max_k],
+                query_embedding,
+                include=["documents", "metadatas"],
+            )
+            timings["retrieve"] = time.perf_counter() - mark
+            distances = (results.get("distances") or [[]])[0]
+            if ADAPTIVE_K:
+                retrieval_meta = adaptive_cutoff(distances, max_k=max_k)
+                results = trim_results(results, retrieval_meta["k"])
+            else:
+                retrieval_meta = {
+                    "k": len(distances),
+                    "stopped_by": "prefetched" if distances else "no_relevant_sources",
+                    "scores": [round(distance_to_similarity(d), 4) for d in distances],
+                }
+            retrieval_meta["prefetched"] = True
+            log_fields["prefetched"] = True
+        else:
+            results = search_chunks(search_question, timings, ws, n_results=variant and variant.n_results)
+            retrieval_meta = results.get("adaptive_k")
+        if retrieval_meta:
+            log_fields["retrieval"] = {"k": retrieval_meta["k"], "stopped_by": retrieval_meta["stopped_by"]}
+
+        # Nothing cleared RETRIEVAL_MIN_SCORE: answer without calling the model, unless the UI sent
+        # web context for this turn for the model to work from
+        has_web_context = any(m["content"].lstrip().startswith(WEB_CONTEXT_PREFIX) for m in history_msgs)
+        if retrieval_meta and retrieval_meta["k"] == 0 and not has_web_context:
+            print(f"🚫 No relevant sources (best score {max(retrieval_meta['scores'], default=None)}); skipped the LLM call")
+            log_fields["short_circuit"] = True
+            log_fields["retrieval"]["candidate_scores"] = retrieval_meta["scores"]
+            return {
+                "response": NO_SOURCES_RESPONSE,
+                "sources": [],
+                "citations": [],
+                "history": history_stats,
+                "routing": None,
+                "retrieval": retrieval_meta,
+                "experiment": log_fields.get("experiment"),
+                "debug": {"tokens": None},
+            }
 
-        # Build prompt with retrieved context
-        context_block = build_context_from_results(results)
-        sys_msg = make_system_prompt()
+        # Simple lookups with a close match go to the fast model, everything else to OPENAI_MODEL
+        decision = router.decide(question, results, override=tier_override, history_turns=len(history_msgs))
+        if variant is not None and variant.max_tokens:
+            decision.max_tokens = variant.max_tokens
 
-        msgs = [{"role": "system", "content": sys_msg}]
-        # Optionally include a little recent history to keep style consistent
-        for m in history[-8:]:
-            r = m.get("role")
-            c = m.get("content")
-            if r in ("user", "assistant") and isinstance(c, str):
-                msgs.append({"role": r, "content": c})
-        msgs.append({"role": "user", "content": f"Context:\n{context_block}\n\nQuestion: {question}"})
+        # Build prompt with retrieved context; each segment is held to its token budget and the
+        # whole prompt is trimmed to fit the model window
+        msgs, max_tokens, token_breakdown = assemble_messages(
+            question,
+            context_rows_from_results(results),
+            history_msgs,
+            model=decision.model,
+            locale=LOCALE,
+            detail=(variant and variant.response_detail) or RESPONSE_DETAIL,
+            max_tokens=decision.max_tokens,
+        )
+        if any(v for k, v in token_breakdown["truncated"].items()):
+            print(f"✂️ Prompt trimmed: {token_breakdown['truncated']} → {token_breakdown['prompt_total']} tokens")
 
         # Call OpenAI
-        completion = oa.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=msgs,
-            temperature=0.2,
-            max_tokens=OPENAI_MAX_TOKENS,
+        mark = time.perf_counter()
+        log_fields.update(model=decision.model, tier=decision.tier, tokens=token_breakdown)
+        # Should the fast model fail, the strong one answers at its own cap (or the variant's)
+        fallback_max_tokens = completion_budget(
+            router.models["strong"], (variant and variant.max_tokens) or router.max_tokens["strong"],
         )
+        completion = router.complete(oa, msgs, decision, max_tokens=max_tokens,
+                                     fallback_max_tokens=fallback_max_tokens, temperature=0.2)
+        timings["llm"] = time.perf_counter() - mark
+        log_fields["model"] = decision.model  # after a fallback
+        usage = getattr(completion, "usage", None)
+        if usage is not None:
+            log_fields["usage"] = {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
         answer = completion.choices[0].message.content.strip()
 
         # Build structured sources list
@@ -228,23 +535,130 @@ def ask(payload: Dict[str, Any]):
 
         return {
             "response": answer_with_block,   # includes '📚 Sources:' fallback
-            "sources": sources               # preferred by the Streamlit UI
+            "sources": sources,              # preferred by the Streamlit UI
+            "citations": citations_from_results(results, ws.name),
+            "history": history_stats,
+            "routing": decision.to_dict(),
+            "retrieval": retrieval_meta,
+            "experiment": log_fields.get("experiment"),
+            "debug": {"tokens": token_breakdown},
         }
 
     except Exception as e:
+        log_fields["error"] = str(e)[:500]
         return JSONResponse(status_code=500, content={"status": "error", "error": str(e)})
+    finally:
+        # Queued for the background writer; nothing here touches the disk
+        if question:
+            timings["total"] = time.perf_counter() - started
+            log_query(question, results, timings, **log_fields)
+            if variant is not None:
+                experiment_metrics.record(variant.name, timings, log_fields, results)
 
 
-# ---------- Export / Maintenance ----------
-@app.get("/zip-chroma")
-def zip_route():
+@app.get("/source/{chunk_id}")
+def source_pages(chunk_id: str, page: Optional[int] = None, workspace: Optional[str] = None):
+    """
+    The page(s) a retrieved chunk came from, read from the ingest-time text store (no PDF parsing).
+    ?page=N returns one page of the same source instead. Chunks ingested before page provenance
+    existed (and CSV rows) come back as the chunk text alone.
+    """
     try:
-        zip_chroma_store()
-        return JSONResponse(content={"status": "ok", "stdout": f"✅ Zipped to {ZIP_PATH}", "stderr": ""})
+        ws = get_workspace(workspace)
+    except (ValueError, UnknownWorkspace) as e:
+        return workspace_error(e)
+    found = ws.collection.get(ids=[chunk_id], include=["documents", "metadatas"])
+    if not found.get("ids"):
+        return JSONResponse(status_code=404, content={"error": f"Unknown chunk {chunk_id}"})
+    meta = (found.get("metadatas") or [None])[0] or {}
+    doc = (found.get("documents") or [""])[0] or ""
+    source = meta.get("source") or meta.get("path") or "Unknown"
+    out: Dict[str, Any] = {"id": chunk_id, "source": source, "chunk": meta.get("chunk"), "pages": page_label(meta), "text": doc}
+
+    if meta.get("page_start") is None or not ws.text_store.has(source):
+        out["page_text"] = None
+        return out
+    try:
+        first, last = (page, page) if page is not None else (meta["page_start"], meta.get("page_end", meta["page_start"]))
+        out["page_count"] = ws.text_store.page_count(source)
+        out["page_text"] = [{"page": n, "text": ws.text_store.page_text(source, n)} for n in range(first, last + 1)]
+    except IndexError as e:
+        return JSONResponse(status_code=404, content={"error": str(e)})
+    return out
+
+
+@app.post("/retrieve")
+def retrieve_chunks(payload: Dict[str, Any]):
+    """
+    Body: { "question": str, "history": Optional[List[{"role","content"}]], "workspace": Optional[str],
+            "conversation_id": Optional[str], "variant": Optional[str] }
+    Returns: { "ids": [...], "scores": [...], "search_question": str, "sources": [str, ...],
+               "citations": [{id, source, chunk, pages, url, snippet}, ...], "retrieval": {...},
+               "experiment": {name, variant} | null, "ms": {stage: ms} }
+
+    Only the vector search (plus condensing a follow-up), so the UI can show sources straight after
+    submit while /ask is put together; send ids, scores and search_question back to /ask as
+    retrieved_ids / search_question and it skips its own search.
+    """
+    started = time.perf_counter()
+    timings: Dict[str, float] = {}
+    try:
+        question = (payload or {}).get("question", "").strip()
+        history = (payload or {}).get("history") or []
+        conversation_id = (payload or {}).get("conversation_id")
+        if not question:
+            return JSONResponse(status_code=400, content={"error": "Question is required."})
+        try:
+            ws = get_workspace((payload or {}).get("workspace"))
+        except (ValueError, UnknownWorkspace) as e:
+            return workspace_error(e)
+        # Bucketed like /ask (same key), so n_results follows the variant; send "variant" back to /ask
+        variant = experiment.choose(payload) if experiment is not None else None
+        # The same history handling as /ask, so the search question (and the ids) match what /ask would
+        # retrieve; the rolling summary this computes is cached for the /ask that follows
+        history_msgs, _ = compact_history(history, history_complete, conversation_id=conversation_id, question=question)
+        search_question = standalone_question(question, history_msgs)
+        results = search_chunks(search_question, timings, ws, n_results=variant and variant.n_results)
+
+        citations = citations_from_results(results, ws.name)
+        for citation, doc in zip(citations, (results.get("documents") or [[]])[0]):
+            citation["snippet"] = " ".join((doc or "").split())[:240]
+        distances = (results.get("distances") or [[]])[0]
+        return {
+            "ids": (results.get("ids") or [[]])[0],
+            "scores": [round(distance_to_similarity(d), 4) for d in distances],
+            "search_question": search_question,
+            "sources": results_to_sources(results),
+            "citations": citations,
+            "retrieval": results.get("adaptive_k"),
+            "experiment": {"name": experiment.name, "variant": variant.name} if variant is not None else None,
+            "ms": {k: round(v * 1000, 1) for k, v in {**timings, "total": time.perf_counter() - started}.items()},
+        }
     except Exception as e:
         return JSONResponse(status_code=500, content={"status": "error", "error": str(e)})
 
 
+# ---------- Export / Maintenance ----------
+def zip_workspace(job, workspace: str = DEFAULT_WORKSPACE) -> Dict[str, Any]:
+    with held_workspace(workspace) as ws:
+        return zip_chroma_store(job=job, client=ws.client, chroma_dir=ws.path, zip_base=part_base(ws.name))
+
+
+@app.get("/zip-chroma")
+def zip_route(wait: bool = False, workspace: Optional[str] = None):
+    """
+    Runs as a background job; poll /jobs/{id} (or pass ?wait=true for the old blocking behaviour).
+    ?workspace= snapshots that workspace's store instead; fetch its parts with the same parameter.
+    """
+    try:
+        params = job_workspace(workspace)
+    except (ValueError, UnknownWorkspace) as e:
+        return workspace_error(e)
+    name = params.get("workspace", DEFAULT_WORKSPACE)
+    locks = [STORE_LOCK, ZIP_LOCK] if name == DEFAULT_WORKSPACE else [lock_name(name, STORE_LOCK)]
+    return job_response(job_manager.submit("zip", zip_workspace, params=params, locks=locks), wait)
+
+
 @app.get("/export-chroma")
 def export_chroma():
     if os.path.exists(ZIP_PATH):
@@ -254,6 +668,8 @@ def export_chroma():
 
 @app.post("/upload-chroma")
 async def upload_chroma(file: UploadFile = File(...)):
+    if job_manager.locked(ZIP_LOCK):
+        return JSONResponse(status_code=409, content={"error": f"{ZIP_PATH} is in use by a running job; see /jobs."})
     try:
         with open(ZIP_PATH, "wb") as out:
             while True:
@@ -283,65 +699,398 @@ async def upload_chroma_part(part_num: int = Path(..., ge=1), file: UploadFile =
         return JSONResponse(status_code=500, content={"status": "error", "error": str(e)})
 
 
-@app.post("/assemble-uploaded-zip")
-def assemble_uploaded_zip():
+def assemble_zip_parts(job) -> Dict[str, Any]:
     """Concatenate chroma_store_partN.zip (N ascending) -> /tmp/chroma_store.zip."""
+    parts = [p for p in os.listdir(UPLOAD_PARTS_DIR) if p.startswith("chroma_store_part") and p.endswith(".zip")]
+    if not parts:
+        raise FileNotFoundError("No parts found in /tmp/upload_parts")
+
+    def part_index(name: str) -> int:
+        base = os.path.splitext(name)[0]
+        return int(base.replace("chroma_store_part", ""))
+
+    parts_sorted = sorted(parts, key=part_index)
+    job.progress(files_total=len(parts_sorted))
+
+    with open(ZIP_PATH, "wb") as out:
+        for p in parts_sorted:
+            job.raise_if_cancelled()
+            with open(os.path.join(UPLOAD_PARTS_DIR, p), "rb") as src:
+                shutil.copyfileobj(src, out)
+            job.add(files_done=1, bytes=os.path.getsize(os.path.join(UPLOAD_PARTS_DIR, p)))
+
+    size = os.path.getsize(ZIP_PATH)
+
     try:
-        parts = [p for p in os.listdir(UPLOAD_PARTS_DIR) if p.startswith("chroma_store_part") and p.endswith(".zip")]
-        if not parts:
-            return JSONResponse(status_code=400, content={"error": "No parts found in /tmp/upload_parts"})
+        with zipfile.ZipFile(ZIP_PATH, "r") as zf:
+            _ = zf.namelist()
+    except Exception as ze:
+        raise RuntimeError(f"ZIP verify failed: {ze}")
 
-        def part_index(name: str) -> int:
-            base = os.path.splitext(name)[0]
-            return int(base.replace("chroma_store_part", ""))
+    return {"message": f"Assembled {len(parts_sorted)} parts → {ZIP_PATH}", "size": size}
 
-        parts_sorted = sorted(parts, key=part_index)
 
-        with open(ZIP_PATH, "wb") as out:
-            for p in parts_sorted:
-                with open(os.path.join(UPLOAD_PARTS_DIR, p), "rb") as src:
-                    shutil.copyfileobj(src, out)
+def extract_plain_zip(job, target: str) -> None:
+    with zipfile.ZipFile(ZIP_PATH, "r") as zf:
+        members = zf.infolist()
+        job.progress(files_total=len(members))
+        job.raise_if_cancelled()
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        os.makedirs(target, exist_ok=True)
+        for m in members:
+            zf.extract(m, target)
+            job.add(files_done=1, bytes=m.file_size)
 
-        size = os.path.getsize(ZIP_PATH)
 
-        try:
-            with zipfile.ZipFile(ZIP_PATH, "r") as zf:
-                _ = zf.namelist()
-        except Exception as ze:
-            return JSONResponse(status_code=500, content={"status": "error", "error": f"ZIP verify failed: {ze}"})
+def restore_workspace(job, workspace: str) -> Dict[str, Any]:
+    """restore_from_zip for a workspace other than the default: unpacked and checked next to its store,
+    then swapped in. Only workers that have that workspace open reopen it."""
+    path = workspace_path(workspace)
+    target = path + ".incoming"
+    manifest, validation = None, None
+    if is_snapshot_zip(ZIP_PATH):
+        job.raise_if_cancelled()
+        manifest = apply_snapshot(ZIP_PATH, target, base_dir=path, job=job)
+        validation = validate_store(target, manifest, check_files=False)
+        if not validation["ok"]:
+            release_client(target)
+            shutil.rmtree(target, ignore_errors=True)
+            raise ValueError(f"Snapshot {manifest['id']} failed validation: " + "; ".join(validation["errors"][:5]))
+    else:
+        extract_plain_zip(job, target)
+    swap_in(workspace, target, workspace_pool)
+    return {
+        "message": f"Restored workspace {workspace} from ZIP",
+        "workspace": workspace,
+        "count": workspace_pool.get(workspace).chunks,
+        "manifest_id": manifest["id"] if manifest else None,
+        "differential": bool(manifest and manifest.get("base_id")),
+        "validation": validation,
+    }
+
+
+def incoming_path() -> str:
+    """Where a replacement for the default store is put together before install_store."""
+    if VECTOR_BACKEND == "lowmem":
+        return LOWMEM_INDEX_PATH
+    return staging_path(CHROMA_PATH) if CHROMA_MODE == "http" else CHROMA_PATH + ".incoming"
+
+
+def install_store(job, target: str, reason: str) -> int:
+    """Swap the store at `target` (from incoming_path) in for the default store and reopen it here."""
+    if VECTOR_BACKEND == "chroma" and CHROMA_MODE == "http":
+        job.progress(message="waiting for serve.py to swap the store")
+        generation = wait_for_generation(request_swap(CHROMA_PATH))
+        job.progress(message="")
+    else:
+        if VECTOR_BACKEND == "chroma":
+            release_embedded_clients()
+            old = CHROMA_PATH + ".old"
+            shutil.rmtree(old, ignore_errors=True)
+            if os.path.exists(CHROMA_PATH):
+                os.rename(CHROMA_PATH, old)
+            os.rename(target, CHROMA_PATH)
+            shutil.rmtree(old, ignore_errors=True)
+        generation = bump_generation(reason)
+    # Every other worker reopens on its next request
+    store_generation.mark_seen(generation)
+    if not reopen_collection():
+        raise RuntimeError("Failed to reopen collection")
+    return generation
+
+
+def restore_from_zip(job, workspace: str = DEFAULT_WORKSPACE) -> Dict[str, Any]:
+    """
+    Unpack /tmp/chroma_store.zip next to the store, check it, then swap it in and reopen.
+    Snapshot ZIPs (zip_chroma.py / snapshot.py) may be differential and are validated against their
+    manifest (files, collection counts, chunks per source); plain ZIPs of the store still work.
+    """
+    if not os.path.exists(ZIP_PATH):
+        raise FileNotFoundError(f"No {ZIP_PATH} present.")
+    if workspace != DEFAULT_WORKSPACE:
+        return restore_workspace(job, workspace)
+
+    # In lowmem mode the ZIP is an exported lowmem index directory rather than a Chroma store.
+    # With CHROMA_MODE=http the server owns CHROMA_PATH, so unpack next to it and let serve.py swap it in.
+    target = incoming_path()
+
+    manifest, validation = None, None
+    if VECTOR_BACKEND == "chroma" and is_snapshot_zip(ZIP_PATH):
+        # Last point where cancelling leaves the current store untouched
+        job.raise_if_cancelled()
+        manifest = apply_snapshot(ZIP_PATH, target, base_dir=CHROMA_PATH, job=job)
+        validation = validate_store(target, manifest, check_files=False)
+        release_embedded_clients()  # the validation opened `target`
+        if not validation["ok"]:
+            shutil.rmtree(target, ignore_errors=True)
+            raise ValueError(f"Snapshot {manifest['id']} failed validation: " + "; ".join(validation["errors"][:5]))
+    else:
+        extract_plain_zip(job, target)
+
+    install_store(job, target, "restore")
+    return {
+        "message": "Restored Chroma from ZIP",
+        "count": collection.count(),
+        "manifest_id": manifest["id"] if manifest else None,
+        "differential": bool(manifest and manifest.get("base_id")),
+        "validation": validation,
+    }
+
 
-        return {"status": "ok", "message": f"Assembled {len(parts_sorted)} parts → {ZIP_PATH}", "size": size}
+@app.get("/snapshot/manifest")
+def snapshot_manifest(counts: bool = True, workspace: Optional[str] = None):
+    """
+    Manifest of the store (or ?workspace=) as it is on disk here. Pass its URL as --base to
+    `python snapshot.py export` to build a differential snapshot that only carries what changed.
+    """
+    try:
+        ws = get_workspace(workspace)
+    except (ValueError, UnknownWorkspace) as e:
+        return workspace_error(e)
+    try:
+        if VECTOR_BACKEND == "lowmem":
+            return build_manifest(LOWMEM_INDEX_PATH, counts=False)
+        return build_manifest(ws.path, client=ws.client, counts=counts)
     except Exception as e:
         return JSONResponse(status_code=500, content={"status": "error", "error": str(e)})
 
 
+def validate_live_store(job, workspace: str = DEFAULT_WORKSPACE) -> Dict[str, Any]:
+    """Counts of the served store against the manifest it was restored from."""
+    with held_workspace(workspace) as ws:
+        try:
+            manifest = load_manifest(ws.path)
+        except FileNotFoundError:
+            raise FileNotFoundError("The store has no snapshot manifest (it wasn't restored from a snapshot)")
+        report = validate_store(ws.path, manifest, client=ws.client, check_files=False)
+    if not report["ok"]:
+        raise ValueError("; ".join(report["errors"][:5]))
+    return report
+
+
+@app.post("/snapshot/validate")
+def snapshot_validate(wait: bool = False, workspace: Optional[str] = None):
+    if VECTOR_BACKEND == "lowmem":
+        return JSONResponse(status_code=400, content={"error": "Snapshot validation is for the Chroma backend."})
+    try:
+        params = job_workspace(workspace)
+    except (ValueError, UnknownWorkspace) as e:
+        return workspace_error(e)
+    locks = [lock_name(params.get("workspace", DEFAULT_WORKSPACE), STORE_LOCK)]
+    return job_response(job_manager.submit("validate", validate_live_store, params=params, locks=locks), wait)
+
+
+@app.post("/reload-store")
+def reload_store():
+    """Reopen the store in every worker, e.g. after a script wrote to it or a lowmem index was re-exported."""
+    store_generation.mark_seen(bump_generation("reload"))
+    ok = reopen_collection()
+    return {"status": "ok" if ok else "error", "store_generation": store_generation.generation}
+
+
+@app.post("/assemble-uploaded-zip")
+def assemble_uploaded_zip(wait: bool = False):
+    job = job_manager.submit("assemble", assemble_zip_parts, locks=[ZIP_LOCK])
+    return job_response(job, wait)
+
+
 @app.post("/force-restore")
-def force_restore():
-    """Delete /tmp/chroma_store, unzip /tmp/chroma_store.zip into it, reopen collection."""
+def force_restore(wait: bool = False, workspace: Optional[str] = None):
+    """
+    Waits for any running ingest/retag/zip (they hold the store lock) before replacing the store.
+    ?workspace= restores the uploaded ZIP into that (already created) workspace instead.
+    """
     try:
-        if not os.path.exists(ZIP_PATH):
-            return JSONResponse(status_code=400, content={"error": f"No {ZIP_PATH} present."})
+        params = job_workspace(workspace)
+    except (ValueError, UnknownWorkspace) as e:
+        return workspace_error(e)
+    locks = [lock_name(params.get("workspace", DEFAULT_WORKSPACE), STORE_LOCK), ZIP_LOCK]
+    job = job_manager.submit("restore", restore_from_zip, params=params, locks=locks)
+    return job_response(job, wait)
 
-        if os.path.exists(CHROMA_PATH):
-            shutil.rmtree(CHROMA_PATH)
-        os.makedirs(CHROMA_PATH, exist_ok=True)
 
-        with zipfile.ZipFile(ZIP_PATH, "r") as zf:
-            zf.extractall(CHROMA_PATH)
+# ---------- Jobs ----------
+def run_ingest(job, workspace: str = DEFAULT_WORKSPACE) -> Dict[str, Any]:
+    if workspace == DEFAULT_WORKSPACE:
+        try:
+            return ingest_supabase_docs(collection, sources_collection, job=job)
+        finally:
+            # Other workers reopen the store (and its segments) instead of serving their old view
+            store_generation.mark_seen(bump_generation("ingest"))
+    # From the bucket's workspaces/<name>/ folder into the workspace's own store, up to its limit
+    with held_workspace(workspace) as ws:
+        try:
+            return ingest_supabase_docs(ws.collection, ws.sources_collection, job=job, **ingest_options(ws))
+        finally:
+            ws.refresh()
+            bump_workspace(ws.name, "ingest", workspace_pool)
 
-        ok = reopen_collection()
-        if not ok:
-            return JSONResponse(status_code=500, content={"status": "error", "error": "Failed to reopen collection"})
 
-        count = collection.count()
-        return {"status": "ok", "message": "Restored Chroma from ZIP", "count": count}
-    except Exception as e:
-        return JSONResponse(status_code=500, content={"status": "error", "error": str(e)})
+def run_compact(job, workspace: str = DEFAULT_WORKSPACE, force: bool = False) -> Dict[str, Any]:
+    """Rebuild the store (or a workspace's) without tombstones and with the HNSW settings from
+    HNSW_CONFIG_PATH, then swap it in; see compact_store.py."""
+    with held_workspace(workspace) as ws:
+        before = measure_store(ws.path)
+        if not before["needs_compaction"] and not force:
+            return {"message": "Not fragmented enough to compact", "before": before}
+        target = incoming_path() if ws.name == DEFAULT_WORKSPACE else ws.path + ".incoming"
+        rebuild = compact_store(ws.client, target, load_hnsw_config(), job=job, source_path=ws.path)
+        after = measure_store(target)
+        job.raise_if_cancelled()  # last point where the live store is untouched
+        if ws.name == DEFAULT_WORKSPACE:
+            install_store(job, target, "compact")
+        else:
+            swap_in(ws.name, target, workspace_pool, reason="compact")
+    return {"message": f"Compacted {workspace}", "before": before, "after": after,
+            "change": compare(before, after), "rebuild": rebuild}
+
+
+def run_retag(job, page_size: int = 100) -> Dict[str, Any]:
+    from retag import retag_all  # imported lazily: only the retag job needs the OpenAI tagging prompt
+    try:
+        return retag_all(page_size=page_size, job=job, target=collection)
+    finally:
+        store_generation.mark_seen(bump_generation("retag"))
+
+
+def run_normalise(job) -> Dict[str, Any]:
+    """Canonicalise the store's tag metadata with the map built by `tag_normalise.py build`."""
+    from tag_normalise import apply_to_collection, load_canonical_map
+    try:
+        return {"chunks": apply_to_collection(collection, load_canonical_map(), job=job)}
+    finally:
+        store_generation.mark_seen(bump_generation("normalise"))
+
+
+# ---------- Optional ingestion on boot ----------
+# Submitted only now that the job functions exist: a pool thread may pick it up straight away
+if not SKIP_INGEST and VECTOR_BACKEND == "lowmem":
+    print("⏩ VECTOR_BACKEND=lowmem is read-only, skipping ingestion on boot.")
+elif not SKIP_INGEST:
+    print("🚀 Ingesting from Supabase in the background...")
+    job_manager.submit("ingest", run_ingest, locks=[STORE_LOCK])
+else:
+    print("⏩ SKIP_INGEST=1, skipping ingestion on boot.")
+
+
+def job_response(job, wait: bool = False):
+    if wait:
+        job = job_manager.wait(job.id)
+        code = 200 if job.status == "succeeded" else 500
+        return JSONResponse(status_code=code, content={"status": "ok" if code == 200 else "error", "job": job.to_dict()})
+    return JSONResponse(status_code=202, content={"status": "queued", "job": job.to_dict()})
+
+
+@app.get("/jobs")
+def list_jobs(status: Optional[str] = None, kind: Optional[str] = None):
+    return {
+        "jobs": [j.to_dict() for j in job_manager.list(status=status, kind=kind)],
+        "locks": {name: job_manager.locked(name) for name in (STORE_LOCK, ZIP_LOCK)},
+    }
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Job {job_id} not found."})
+    return job.to_dict()
+
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Job {job_id} not found."})
+    return job.to_dict()
+
+
+@app.post("/jobs/ingest")
+def submit_ingest(workspace: Optional[str] = None):
+    if VECTOR_BACKEND == "lowmem":
+        return JSONResponse(status_code=400, content={"error": "VECTOR_BACKEND=lowmem is read-only."})
+    try:
+        params = job_workspace(workspace)
+    except (ValueError, UnknownWorkspace) as e:
+        return workspace_error(e)
+    locks = [lock_name(params.get("workspace", DEFAULT_WORKSPACE), STORE_LOCK)]
+    return job_response(job_manager.submit("ingest", run_ingest, params=params, locks=locks))
+
+
+@app.post("/jobs/compact")
+def submit_compact(workspace: Optional[str] = None, force: bool = False, wait: bool = False):
+    """Skipped (with the measurements) unless the store is fragmented past COMPACT_MIN_DEAD_RATIO or ?force=true."""
+    if VECTOR_BACKEND == "lowmem":
+        return JSONResponse(status_code=400, content={"error": "VECTOR_BACKEND=lowmem has no Chroma store to compact."})
+    try:
+        params = job_workspace(workspace)
+    except (ValueError, UnknownWorkspace) as e:
+        return workspace_error(e)
+    params["force"] = force
+    locks = [lock_name(params.get("workspace", DEFAULT_WORKSPACE), STORE_LOCK)]
+    return job_response(job_manager.submit("compact", run_compact, params=params, locks=locks), wait)
+
+
+@app.get("/debug/fragmentation")
+def store_fragmentation(workspace: Optional[str] = None):
+    """HNSW tombstones, sqlite free pages and sizes of the store (or ?workspace=), read from its files."""
+    try:
+        ws = get_workspace(workspace)
+    except (ValueError, UnknownWorkspace) as e:
+        return workspace_error(e)
+    if VECTOR_BACKEND == "lowmem":
+        return JSONResponse(status_code=400, content={"error": "VECTOR_BACKEND=lowmem has no Chroma store."})
+    return fragmentation(ws.path)
+
+
+@app.post("/jobs/retag")
+def submit_retag(payload: Optional[Dict[str, Any]] = None):
+    if VECTOR_BACKEND == "lowmem":
+        return JSONResponse(status_code=400, content={"error": "VECTOR_BACKEND=lowmem is read-only."})
+    params = {"page_size": int((payload or {}).get("page_size", 100))}
+    return job_response(job_manager.submit("retag", run_retag, params=params, locks=[STORE_LOCK]))
+
+
+@app.post("/jobs/normalise")
+def submit_normalise(wait: bool = False):
+    if VECTOR_BACKEND == "lowmem":
+        return JSONResponse(status_code=400, content={"error": "VECTOR_BACKEND=lowmem is read-only."})
+    return job_response(job_manager.submit("normalise", run_normalise, locks=[STORE_LOCK]), wait)
 
 
 @app.get("/export-chroma-part/{part_num}")
-def export_chroma_chunk(part_num: int = Path(..., ge=1)):
-    file_path = f"/tmp/chroma_store_part{part_num}.zip"
+def export_chroma_chunk(part_num: int = Path(..., ge=1), workspace: Optional[str] = None):
+    try:
+        base = part_base(workspace_name(workspace))
+    except ValueError as e:
+        return workspace_error(e)
+    file_path = f"{base}{part_num}.zip"
     if os.path.exists(file_path):
-        return FileResponse(file_path, filename=f"chroma_store_part{part_num}.zip", media_type="application/zip")
+        return FileResponse(file_path, filename=os.path.basename(file_path), media_type="application/zip")
     return JSONResponse(status_code=404, content={"error": f"Part {part_num} not found."})
+
+
+# ---------- Workspaces ----------
+@app.get("/workspaces")
+def workspaces_list():
+    """Every workspace with its limit, plus what this worker has open (chunks and estimated MB)."""
+    return {
+        "workspaces": [read_meta(name) for name in list_workspaces()],
+        "pool": workspace_pool.snapshot(),
+    }
+
+
+@app.post("/workspaces")
+def workspaces_create(payload: Dict[str, Any]):
+    """Body: { "name": str, "max_mb": Optional[float] } — creates the workspace (or updates its limit)."""
+    if VECTOR_BACKEND == "lowmem":
+        return JSONResponse(status_code=400, content={"error": "Workspaces need VECTOR_BACKEND=chroma"})
+    try:
+        max_mb = (payload or {}).get("max_mb")
+        meta = create_workspace((payload or {}).get("name") or "", float(max_mb) if max_mb is not None else None)
+    except ValueError as e:
+        return workspace_error(e)
+    # Not reopened for this (a job may be using it); ingest reads the limit from the meta file as it starts
+    workspace_pool.set_max_mb(meta["name"], meta.get("max_mb"))
+    return {"status": "ok", "workspace": meta}
@@ -0,0 +1,139 @@
+import os
+import sys
+import time
+import resource
+from typing import Any, Dict, Iterator, List, Optional
+
+# Default number of records pulled from Chroma per request.
+# Small enough that a page of documents + metadatas stays in the low MB range.
+DEFAULT_PAGE_SIZE = int(os.environ.get("CHROMA_PAGE_SIZE", "500"))
+DEFAULT_INCLUDE = ["documents", "metadatas"]
+
+
+def iter_pages(
+    collection,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    where: Optional[Dict[str, Any]] = None,
+    include: Optional[List[str]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Stream a Chroma collection in pages of at most `page_size` records.
+    Each page is the dict returned by `collection.get` (ids + requested fields),
+    so only one page is held in memory at a time.
+    """
+    if page_size < 1:
+        raise ValueError("page_size must be >= 1")
+    include = list(include) if include is not None else list(DEFAULT_INCLUDE)
+
+    offset = 0
+    while True:
+        kwargs = {"limit": page_size, "offset": offset, "include": include}
+        if where:
+            kwargs["where"] = where
+        page = collection.get(**kwargs)
+        ids = page.get("ids") or []
+        if not ids:
+            break
+        yield page
+        if len(ids) < page_size:
+            break
+        offset += len(ids)
+
+
+def iter_records(
+    collection,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    where: Optional[Dict[str, Any]] = None,
+    include: Optional[List[str]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Same as iter_pages but yields one record at a time:
+    {"id": ..., "document": ..., "metadata": ..., "embedding": ...} (requested fields only).
+    """
+    for page in iter_pages(collection, page_size=page_size, where=where, include=include):
+        ids = page["ids"]
+        fields = [
+            (singular, page.get(plural))
+            for plural, singular in (
+                ("documents", "document"),
+                ("metadatas", "metadata"),
+                ("embeddings", "embedding"),
+                ("uris", "uri"),
+            )
+            if page.get(plural) is not None
+        ]
+        for i, chunk_id in enumerate(ids):
+            record = {"id": chunk_id}
+            for singular, values in fields:
+                record[singular] = values[i]
+            yield record
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB (ru_maxrss is KB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def current_rss_mb() -> float:
+    """Resident set size right now in MB (Linux /proc; falls back to the peak elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+
+def measure_paged_scan(collection, page_size: int = DEFAULT_PAGE_SIZE, include: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Walk the whole collection page by page and report record count, timing and peak RSS growth."""
+    before = peak_rss_mb()
+    start = time.perf_counter()
+    records = 0
+    pages = 0
+    for page in iter_pages(collection, page_size=page_size, include=include):
+        pages += 1
+        records += len(page["ids"])
+    return {
+        "mode": f"paged ({page_size}/page)",
+        "records": records,
+        "pages": pages,
+        "seconds": round(time.perf_counter() - start, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "peak_rss_growth_mb": round(peak_rss_mb() - before, 1),
+    }
+
+
+def measure_full_get(collection, include: Optional[List[str]] = None) -> Dict[str, Any]:
+    """The old approach: one collection.get() that materialises everything at once."""
+    before = peak_rss_mb()
+    start = time.perf_counter()
+    results = collection.get(include=list(include) if include is not None else list(DEFAULT_INCLUDE))
+    records = len(results.get("ids") or [])
+    del results
+    return {
+        "mode": "full get",
+        "records": records,
+        "seconds": round(time.perf_counter() - start, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "peak_rss_growth_mb": round(peak_rss_mb() - before, 1),
+    }
+
+
+if __name__ == "__main__":
+    # Usage: python chroma_pages.py [page_size] [--compare-full]
+    # The paged scan runs first: ru_maxrss only ever goes up, so the full get must come last.
+    # Reads the configured store (CHROMA_PATH, or the server with CHROMA_MODE=http).
+    from shared_store import open_chroma_client
+
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    size = int(args[0]) if args else DEFAULT_PAGE_SIZE
+
+    collection = open_chroma_client().get_collection("cocktailgpt")  # read-only: never creates one
+    print(f"🧮 Chroma collection count: {collection.count()} · baseline peak RSS {peak_rss_mb():.1f} MB")
+
+    print(f"📏 {measure_paged_scan(collection, page_size=size)}")
+    if "--compare-full" in sys.argv:
+        print(f"📏 {measure_full_get(collection)}")
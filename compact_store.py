@@ -0,0 +1,327 @@
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import struct
+import subprocess
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from shared_store import CHROMA_PATH
+from chroma_pages import iter_pages
+from embeddings import get_embedding_function, open_collection
+
+# Compaction of a Chroma store and its HNSW settings.
+#
+# Every ingest run deletes and re-adds each batch (ingest_supabase.py), and a deleted vector stays in
+# the HNSW index as a tombstone: its slot in data_level0.bin is kept, only flagged. The sqlite file
+# keeps the freed pages as well. So the store, its snapshots and the time to load it keep growing with
+# the same number of chunks. Compaction copies every collection, with the embeddings it already has
+# (nothing is re-embedded), into a fresh store whose HNSW index holds the live vectors only, built
+# with the M / ef_construction / ef_search from HNSW_CONFIG_PATH:
+#
+#   {"M": 16, "ef_construction": 100, "ef_search": 100,
+#    "collections": {"cocktailgpt_sources": {"M": 8}}}     (per-collection overrides; all keys optional)
+#
+# A key the file doesn't set keeps the collection's current value; the distance space is always kept
+# (scores assume l2). Fragmentation is read straight from the files: the HNSW header and delete flags
+# of each vector segment, sqlite's free pages and the embeddings_queue log. The HNSW files only reflect
+# the last sync (every sync_threshold writes), so a few recent deletes may not show yet.
+#
+# Load time and query latency are measured in a fresh process (open + first query, which loads the
+# index, then QUERY_SAMPLE fixture questions), before and after.
+#
+#   python compact_store.py report [store]
+#   python compact_store.py compact [store] [--out=<store>.compact] [--config=hnsw_config.json] [--force]
+#
+# `compact` builds the compacted copy next to the store and prints before/after; the live store is
+# compacted and swapped in by the API's job (POST /jobs/compact), which takes the store lock.
+
+HNSW_CONFIG_PATH = os.environ.get(
+    "HNSW_CONFIG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "hnsw_config.json")
+)
+COMPACT_MIN_DEAD_RATIO = float(os.environ.get("COMPACT_MIN_DEAD_RATIO", "0.2"))
+COMPACT_BATCH = int(os.environ.get("COMPACT_BATCH", "1000"))
+QUERY_SAMPLE = 20
+
+HNSW_KEYS = {"M": "max_neighbors", "ef_construction": "ef_construction", "ef_search": "ef_search"}
+CHUNKS_COLLECTION = "cocktailgpt"
+MANIFEST_NAME = "snapshot_manifest.json"  # describes the old files; not carried over
+# hnswlib's header.bin as written by Chroma: version, then offsetLevel0, max_elements, cur_element_count,
+# size_data_per_element, label_offset, offsetData, maxlevel, enterpoint_node, maxM, maxM0, M, mult,
+# ef_construction
+_HEADER = struct.Struct("<IQQQQQQiIQQQdQ")
+DELETE_MARK = 0x01  # third byte of an element's level-0 link-list header
+
+
+# ---------- Fragmentation ----------
+def dir_bytes(path: str) -> int:
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def hnsw_header(segment_dir: str) -> Optional[Dict[str, int]]:
+    try:
+        with open(os.path.join(segment_dir, "header.bin"), "rb") as f:
+            raw = f.read(_HEADER.size)
+    except OSError:
+        return None
+    if len(raw) < _HEADER.size:
+        return None
+    h = _HEADER.unpack(raw)
+    return {"offset_level0": h[1], "capacity": h[2], "elements": h[3], "element_bytes": h[4], "M": h[11],
+            "ef_construction": h[13]}
+
+
+def hnsw_deleted(segment_dir: str, header: Dict[str, int]) -> int:
+    """Elements flagged deleted, from the level-0 records (read through a memory map)."""
+    n, size = header["elements"], header["element_bytes"]
+    path = os.path.join(segment_dir, "data_level0.bin")
+    if n == 0 or os.path.getsize(path) < n * size:
+        return 0
+    data = np.memmap(path, dtype=np.uint8, mode="r", shape=(n, size))
+    return int(np.count_nonzero(data[:, header["offset_level0"] + 2] & DELETE_MARK))
+
+
+def _sqlite(path: str) -> sqlite3.Connection:
+    return sqlite3.connect(f"file:{os.path.join(path, 'chroma.sqlite3')}?mode=ro", uri=True)
+
+
+def store_segments(path: str) -> Dict[str, Dict[str, Any]]:
+    """collection name -> {id, segments: {scope: segment id}}"""
+    out: Dict[str, Dict[str, Any]] = {}
+    with _sqlite(path) as db:
+        rows = db.execute("SELECT c.name, c.id, s.scope, s.id FROM collections c JOIN segments s ON s.collection = c.id")
+        for name, cid, scope, sid in rows:
+            out.setdefault(name, {"id": cid, "segments": {}})["segments"][scope] = sid
+    return out
+
+
+def fragmentation(path: str = CHROMA_PATH, min_dead_ratio: float = COMPACT_MIN_DEAD_RATIO) -> Dict[str, Any]:
+    """Sizes, live records and HNSW tombstones per collection, sqlite free pages, and whether it's worth compacting."""
+    collections: Dict[str, Any] = {}
+    with _sqlite(path) as db:
+        page_size = db.execute("PRAGMA page_size").fetchone()[0]
+        pages = db.execute("PRAGMA page_count").fetchone()[0]
+        free = db.execute("PRAGMA freelist_count").fetchone()[0]
+        queue_rows = db.execute("SELECT COUNT(*) FROM embeddings_queue").fetchone()[0]
+        for name, info in store_segments(path).items():
+            live = db.execute("SELECT COUNT(*) FROM embeddings WHERE segment_id = ?",
+                              (info["segments"].get("METADATA"),)).fetchone()[0]
+            row: Dict[str, Any] = {"live": live}
+            segment_dir = os.path.join(path, info["segments"].get("VECTOR", ""))
+            header = hnsw_header(segment_dir)
+            if header is not None:
+                deleted = hnsw_deleted(segment_dir, header)
+                row.update({
+                    "hnsw_elements": header["elements"], "hnsw_deleted": deleted, "hnsw_capacity": header["capacity"],
+                    "hnsw_mb": round(dir_bytes(segment_dir) / 1e6, 2),
+                    "dead_ratio": round(deleted / header["elements"], 4) if header["elements"] else 0.0,
+                    "M": header["M"], "ef_construction": header["ef_construction"],
+                })
+            collections[name] = row
+
+    elements = sum(c.get("hnsw_elements", 0) for c in collections.values())
+    deleted = sum(c.get("hnsw_deleted", 0) for c in collections.values())
+    dead_ratio = round(deleted / elements, 4) if elements else 0.0
+    sqlite_free = round(free / pages, 4) if pages else 0.0
+    return {
+        "path": path,
+        "store_mb": round(dir_bytes(path) / 1e6, 2),
+        "sqlite_mb": round(pages * page_size / 1e6, 2),
+        "sqlite_free_ratio": sqlite_free,
+        "log_rows": queue_rows,
+        "dead_ratio": dead_ratio,
+        "needs_compaction": dead_ratio >= min_dead_ratio or sqlite_free >= min_dead_ratio,
+        "collections": collections,
+    }
+
+
+# ---------- Load time / query latency ----------
+def timing(path: str, sample: int = QUERY_SAMPLE) -> Dict[str, Any]:
+    """Open + first query (the HNSW load), then per-query latency. Meant for a fresh process: see measure_store."""
+    from chromadb import PersistentClient
+    from fixture_store import load_questions
+
+    questions = [q["question"] for q in load_questions()][:sample]
+    vectors = get_embedding_function()(questions)  # embedded before the clock starts
+
+    start = time.perf_counter()
+    collection = open_collection(PersistentClient(path=path), CHUNKS_COLLECTION, create=False, check=False)
+    opened = time.perf_counter()
+    collection.query(query_embeddings=[vectors[0]], n_results=5)
+    loaded = time.perf_counter()
+    latencies = []
+    for v in vectors:
+        t = time.perf_counter()
+        collection.query(query_embeddings=[v], n_results=5)
+        latencies.append((time.perf_counter() - t) * 1000)
+    latencies.sort()
+    return {
+        "open_ms": round((opened - start) * 1000, 1),
+        "load_ms": round((loaded - start) * 1000, 1),
+        "query_ms": {"p50": round(latencies[len(latencies) // 2], 2),
+                     "p95": round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)], 2)},
+        "queries": len(latencies),
+    }
+
+
+def measure_store(path: str, sample: int = QUERY_SAMPLE) -> Dict[str, Any]:
+    """fragmentation() plus timing() run in a subprocess, so nothing is already loaded or cached."""
+    out = fragmentation(path)
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "timing", path, f"--sample={sample}"],
+        capture_output=True, text=True, timeout=900,
+    )
+    lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+    out["timing"] = json.loads(lines[-1]) if proc.returncode == 0 and lines else {"error": proc.stderr.strip()[-500:]}
+    return out
+
+
+# ---------- Rebuild ----------
+def load_hnsw_config(path: str = HNSW_CONFIG_PATH) -> Dict[str, Any]:
+    """{} when there is no config file (every collection keeps its settings)."""
+    try:
+        with open(path) as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return {}
+    for scope in [config] + list((config.get("collections") or {}).values()):
+        unknown = set(scope) - set(HNSW_KEYS) - {"collections"}
+        if unknown:
+            raise ValueError(f"Unknown HNSW settings in {path}: {sorted(unknown)} (allowed: {sorted(HNSW_KEYS)})")
+    return config
+
+
+def hnsw_settings(name: str, current: Dict[str, Any], config: Dict[str, Any]) -> Dict[str, Any]:
+    """Chroma hnsw configuration for the rebuilt collection: current values, then the file's, then its per-collection ones."""
+    settings = {k: v for k, v in (current or {}).items() if v is not None}
+    for scope in (config, (config.get("collections") or {}).get(name) or {}):
+        settings.update({HNSW_KEYS[k]: int(v) for k, v in scope.items() if k in HNSW_KEYS})
+    return settings
+
+
+def copy_sidecar_files(source: str, target: str) -> List[str]:
+    """Everything in the store directory that isn't Chroma's (text store, dedup index) goes along."""
+    chroma = {"chroma.sqlite3", MANIFEST_NAME}
+    for info in store_segments(source).values():
+        chroma.update(info["segments"].values())
+    copied = []
+    for name in sorted(os.listdir(source)):
+        if name in chroma or name.startswith("chroma.sqlite3") or name.endswith((".lock", ".tmp")):
+            continue
+        src, dst = os.path.join(source, name), os.path.join(target, name)
+        if os.path.isdir(src):
+            shutil.copytree(src, dst)
+        else:
+            shutil.copy2(src, dst)
+        copied.append(name)
+    return copied
+
+
+def compact_store(source_client, target: str, config: Optional[Dict[str, Any]] = None, job=None,
+                  source_path: Optional[str] = None, batch_size: int = COMPACT_BATCH) -> Dict[str, Any]:
+    """
+    Copy every collection `source_client` serves into a new store at `target` with its stored embeddings,
+    documents and metadatas. `source_path` (the store's directory) also brings its non-Chroma files along.
+    """
+    from chromadb import PersistentClient
+    from workspaces import release_client
+
+    config = load_hnsw_config() if config is None else config
+    if os.path.exists(target):
+        shutil.rmtree(target)
+    dest = PersistentClient(path=target)
+    ef = get_embedding_function()
+    names = [c.name for c in source_client.list_collections()]
+    if job is not None:
+        job.progress(files_total=len(names))
+    collections: Dict[str, Any] = {}
+    try:
+        for name in names:
+            source = open_collection(source_client, name, create=False, check=False)
+            settings = hnsw_settings(name, (source.configuration_json or {}).get("hnsw") or {}, config)
+            # hnsw:* metadata keys are the pre-configuration way of setting the same thing
+            metadata = {k: v for k, v in (source.metadata or {}).items() if not k.startswith("hnsw:")}
+            rebuilt = dest.create_collection(name, configuration={"hnsw": settings}, metadata=metadata or None,
+                                             embedding_function=ef)
+            expected = source.count()
+            for page in iter_pages(source, page_size=batch_size, include=["embeddings", "documents", "metadatas"]):
+                if job is not None:
+                    job.raise_if_cancelled()
+                rebuilt.add(ids=page["ids"], embeddings=page["embeddings"], documents=page["documents"],
+                            metadatas=page["metadatas"])
+                if job is not None:
+                    job.add(chunks=len(page["ids"]))
+            copied = rebuilt.count()
+            if copied != expected:
+                raise RuntimeError(f"Compacted {name} holds {copied} records, the store {expected}")
+            collections[name] = {"records": copied, "hnsw": settings}
+            if job is not None:
+                job.add(files_done=1)
+            print(f"🧱 Compacted {name}: {copied} records, hnsw {settings}")
+    except BaseException:
+        release_client(target)
+        shutil.rmtree(target, ignore_errors=True)
+        raise
+    release_client(target)
+    # Chroma trims its write log as it goes, which leaves free pages behind even in a new file
+    db = sqlite3.connect(os.path.join(target, "chroma.sqlite3"))
+    try:
+        db.execute("VACUUM")
+    finally:
+        db.close()
+    sidecars = copy_sidecar_files(source_path, target) if source_path else []
+    return {"target": target, "collections": collections, "copied_files": sidecars}
+
+
+def compare(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
+    def delta(a, b):
+        return round(b - a, 2) if a is not None and b is not None else None
+
+    tb, ta = before.get("timing") or {}, after.get("timing") or {}
+    return {
+        "store_mb": delta(before["store_mb"], after["store_mb"]),
+        "sqlite_mb": delta(before["sqlite_mb"], after["sqlite_mb"]),
+        "dead_ratio": delta(before["dead_ratio"], after["dead_ratio"]),
+        "load_ms": delta(tb.get("load_ms"), ta.get("load_ms")),
+        "query_p50_ms": delta((tb.get("query_ms") or {}).get("p50"), (ta.get("query_ms") or {}).get("p50")),
+        "query_p95_ms": delta((tb.get("query_ms") or {}).get("p95"), (ta.get("query_ms") or {}).get("p95")),
+    }
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    opts = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    command = args[0] if args else "report"
+    store = args[1] if len(args) > 1 else CHROMA_PATH
+    if command == "timing":
+        print(json.dumps(timing(store, int(opts.get("sample", QUERY_SAMPLE)))))
+    elif command == "report":
+        print(json.dumps(measure_store(store), indent=2))
+    elif command == "compact":
+        from chromadb import PersistentClient
+
+        before = measure_store(store)
+        if not before["needs_compaction"] and "--force" not in sys.argv:
+            print(f"📏 {store}: dead ratio {before['dead_ratio']}, sqlite free {before['sqlite_free_ratio']}; "
+                  f"below {COMPACT_MIN_DEAD_RATIO}, nothing to do (--force to rebuild anyway)")
+            sys.exit(0)
+        out = opts.get("out", store.rstrip("/") + ".compact")
+        result = compact_store(PersistentClient(path=store), out, load_hnsw_config(opts.get("config", HNSW_CONFIG_PATH)),
+                               source_path=store)
+        after = measure_store(out)
+        print(json.dumps({"before": before, "after": after, "change": compare(before, after), "rebuild": result}, indent=2))
+        print(f"📏 {store} → {out}: {compare(before, after)}")
+    else:
+        print("usage: python compact_store.py report [store] | compact [store] [--out=DIR] [--config=hnsw_config.json] [--force]")
+        sys.exit(1)
@@ -0,0 +1,167 @@
+import io
+import os
+import re
+import csv
+import sys
+import time
+import tracemalloc
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+
+# Row-aware CSV chunking for recipe/spec sheets.
+# Rows are read as a stream and grouped until the chunk budget is reached; every chunk starts
+# with the header so the model always sees which column is which, rows are never split across
+# chunks, and values from key columns (name, category, ...) are copied into chunk metadata.
+
+MAX_CHUNK_CHARS = 500 * 4  # same ~500 token budget as utils.chunk_text
+MAX_META_CHARS = 500
+CELL_SEPARATOR = " | "
+
+# Columns worth filtering/citing on; matched case-insensitively against the header.
+# Override with CSV_KEY_COLUMNS="Name,Category" if a sheet uses other headings.
+KEY_COLUMNS = [
+    c.strip().lower()
+    for c in os.environ.get(
+        "CSV_KEY_COLUMNS",
+        "name,cocktail,cocktail_name,title,recipe,ingredient,ingredients,category,type,base_spirit,glass,produce/pantry,origin",
+    ).split(",")
+    if c.strip()
+]
+
+def _meta_key(column: str) -> str:
+    return "csv_" + re.sub(r"[^a-z0-9]+", "_", column.lower()).strip("_")
+
+
+def _cell(value: str) -> str:
+    return " ".join(value.split())
+
+
+def _open_text(source: Union[str, bytes, BinaryIO]) -> io.TextIOBase:
+    if isinstance(source, str):
+        return open(source, "r", encoding="utf-8-sig", errors="replace", newline="")
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    return io.TextIOWrapper(source, encoding="utf-8-sig", errors="replace", newline="")
+
+
+def iter_csv_chunks(
+    source: Union[str, bytes, BinaryIO],
+    filename: str,
+    max_chars: int = MAX_CHUNK_CHARS,
+    key_columns: Optional[List[str]] = None,
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Yield (chunk_text, metadata) for a CSV, one row group at a time.
+    `source` may be a path, raw bytes or a binary file object; only the current group is held in memory.
+    """
+    key_columns = [k.lower() for k in (key_columns or KEY_COLUMNS)]
+    text = _open_text(source)
+    try:
+        reader = csv.reader(text)
+        header = next(reader, None)
+        if not header:
+            return
+        header = [_cell(h) or f"column_{i + 1}" for i, h in enumerate(header)]
+        header_line = CELL_SEPARATOR.join(header)
+        keys = [(i, _meta_key(h)) for i, h in enumerate(header) if h.lower() in key_columns]
+        base_meta = {"source": filename, "content_type": "csv", "columns": ", ".join(header)[:MAX_META_CHARS]}
+
+        chunk_idx = 0
+        rows: List[str] = []
+        size = len(header_line)
+        key_values: Dict[str, List[str]] = {}
+        first_row = 1
+
+        def flush(last_row: int):
+            meta = {**base_meta, "chunk": chunk_idx, "row_start": first_row, "row_end": last_row}
+            for key, values in key_values.items():
+                meta[key] = ", ".join(values)[:MAX_META_CHARS]
+            return header_line + "\n" + "\n".join(rows), meta
+
+        row_num = 0
+        for row in reader:
+            cells = [_cell(c) for c in row]
+            if not any(cells):
+                continue
+            row_num += 1
+            line = CELL_SEPARATOR.join(cells)
+            if rows and size + len(line) + 1 > max_chars:
+                yield flush(row_num - 1)
+                chunk_idx += 1
+                rows, size, key_values, first_row = [], len(header_line), {}, row_num
+            rows.append(line)
+            size += len(line) + 1
+            for i, key in keys:
+                if i < len(cells) and cells[i]:
+                    values = key_values.setdefault(key, [])
+                    if cells[i] not in values:
+                        values.append(cells[i])
+        if rows:
+            yield flush(row_num)
+    finally:
+        if isinstance(source, str):
+            text.close()
+        else:
+            text.detach()  # leave the caller's binary stream open
+
+
+# ---------- Benchmark ----------
+def write_sample_csv(path: str, rows: int) -> None:
+    """Synthetic recipe sheet roughly shaped like our spec CSVs."""
+    spirits = ["gin", "rum", "mezcal", "rye whiskey", "vodka", "cognac"]
+    glasses = ["coupe", "highball", "rocks", "nick & nora"]
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["Name", "Base_Spirit", "Glass", "Ingredients", "Recipe/Method", "Notes"])
+        for i in range(rows):
+            w.writerow([
+                f"House Sour {i}",
+                spirits[i % len(spirits)],
+                glasses[i % len(glasses)],
+                f"50 mL {spirits[i % len(spirits)]}, 25 mL lemon, 20 mL 1:1 syrup, {i % 3} dashes bitters",
+                "Dry shake, shake hard with ice, double strain into a chilled glass.",
+                "Batch up to 2 L; keep acid fresh." if i % 5 == 0 else "",
+            ])
+
+
+def benchmark(path: str) -> Dict[str, Dict[str, float]]:
+    """Time and peak Python allocation for the old decode+prose-chunker path, the old pandas path and this module."""
+    from utils import clean_text, chunk_text
+
+    def run(fn):
+        # Timed without tracemalloc (it slows pure-Python loops badly), then re-run for peak memory
+        start = time.perf_counter()
+        n = fn()
+        seconds = time.perf_counter() - start
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {"chunks": n, "seconds": round(seconds, 3), "peak_mb": round(peak / 1e6, 1),
+                "mb_per_s": round(os.path.getsize(path) / 1e6 / seconds, 1)}
+
+    def old_decode():
+        with open(path, "rb") as f:
+            return len(chunk_text(clean_text(f.read().decode("utf-8"))))
+
+    def old_pandas():
+        import pandas as pd
+        with open(path, "rb") as f:
+            return len(chunk_text(clean_text(pd.read_csv(f).to_string(index=False))))
+
+    def streaming():
+        with open(path, "rb") as f:
+            return sum(1 for _ in iter_csv_chunks(f, os.path.basename(path)))
+
+    return {"decode + chunk_text": run(old_decode), "pandas to_string": run(old_pandas), "csv_ingest": run(streaming)}
+
+
+if __name__ == "__main__":
+    # Usage: python csv_ingest.py [file.csv | --rows=50000]
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    opts = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    csv_path = args[0] if args else "/tmp/csv_ingest_sample.csv"
+    if not args:
+        write_sample_csv(csv_path, int(opts.get("rows", 50000)))
+    print(f"📄 {csv_path} · {os.path.getsize(csv_path) / 1e6:.1f} MB")
+    for name, stats in benchmark(csv_path).items():
+        print(f"📏 {name}: {stats}")
@@ -1,18 +1,12 @@
-import os
 from dotenv import load_dotenv
-from supabase import create_client
+from storage import open_storage, list_folder
 
 load_dotenv()
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-SUPABASE_BUCKET = os.getenv("SUPABASE_BUCKET", "cocktailgpt-pdfs")
-
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+storage = open_storage()
 
 print("🔍 Listing contents of 'cocktailgpt-pdfs/pdfs'")
-files = supabase.storage.from_(SUPABASE_BUCKET).list("pdfs")
+files = list_folder(storage, "pdfs")
 
 for f in files:
-    print("📄", f["name"])
-
+    print("📄", f.name)
@@ -0,0 +1,332 @@
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import mmh3
+import numpy as np
+
+from shared_store import CHROMA_PATH
+
+# Near-duplicate detection for ingestion.
+# The bucket holds the same books several times (whole textbooks next to their split chapters), so
+# the same passages get chunked and embedded again and again. Before a chunk is embedded it is
+# checked against every chunk already in the store:
+#   1. exact: sha1 of the normalised text (lower case, punctuation/whitespace collapsed)
+#   2. near : MinHash over word 5-gram shingles, LSH bands to find candidates, then the estimated
+#             Jaccard similarity must reach DEDUP_THRESHOLD
+# A duplicate is not embedded; its source is added to the canonical chunk's `also_in` metadata so
+# citations can still name every book it appears in. Its text and metadata are kept in the index:
+# when the canonical chunk is re-ingested (possibly with different text), the duplicates that pointed
+# at it are checked again, relinked if they still match, and embedded if they no longer do.
+#
+# Signatures live in a small sqlite file inside the Chroma directory, so they travel with snapshots.
+
+DEDUP_INDEX_PATH = os.environ.get("DEDUP_INDEX_PATH", os.path.join(CHROMA_PATH, "dedup_index.sqlite3"))
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", "0.85"))
+SHINGLE_WORDS = 5
+NUM_PERM = 128
+BANDS = 16  # 16 bands x 8 rows: candidates from ~0.7 Jaccard upwards, verified against the threshold
+ROWS = NUM_PERM // BANDS
+MIN_WORDS = 8  # shorter chunks (headings, page furniture) are only checked for exact duplicates
+MAX_ALSO_IN_CHARS = 1000
+EMBEDDING_BYTES = int(os.environ.get("DEDUP_EMBEDDING_BYTES", str(384 * 4)))  # float32 all-MiniLM-L6-v2
+
+_PRIME = np.uint64(4294967291)  # largest prime below 2**32, so every permuted value fits in uint32
+_rng = np.random.RandomState(1)
+_A = _rng.randint(1, 2 ** 31, size=NUM_PERM).astype(np.uint64)
+_B = _rng.randint(0, 2 ** 31, size=NUM_PERM).astype(np.uint64)
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id TEXT PRIMARY KEY,
+    source TEXT,
+    exact TEXT NOT NULL,
+    signature BLOB,
+    canonical_id TEXT,
+    doc_bytes INTEGER,
+    added_at REAL,
+    document TEXT,
+    metadata TEXT
+);
+CREATE INDEX IF NOT EXISTS chunks_exact ON chunks(exact);
+CREATE INDEX IF NOT EXISTS chunks_canonical ON chunks(canonical_id);
+CREATE TABLE IF NOT EXISTS bands (
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    chunk_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bands_lookup ON bands(band, bucket);
+CREATE INDEX IF NOT EXISTS bands_chunk ON bands(chunk_id);
+"""
+
+
+def normalise(text: str) -> List[str]:
+    return _WORD_RE.findall(text.lower())
+
+
+def exact_hash(words: Sequence[str]) -> str:
+    return hashlib.sha1(" ".join(words).encode("utf-8")).hexdigest()
+
+
+def minhash(words: Sequence[str]) -> Optional[np.ndarray]:
+    """uint32[NUM_PERM] signature of the word shingles, or None for chunks too short to shingle."""
+    if len(words) < MIN_WORDS:
+        return None
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(len(words) - SHINGLE_WORDS + 1, 1))}
+    hashes = np.fromiter((mmh3.hash(s, signed=False) for s in shingles), dtype=np.uint64, count=len(shingles))
+    # (a*h + b) mod p for every permutation at once; a, b < 2**31 and h < 2**32 keep it inside uint64
+    permuted = (np.outer(hashes, _A) + _B) % _PRIME
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def band_buckets(signature: np.ndarray) -> List[int]:
+    rows = signature.reshape(BANDS, ROWS)
+    return [mmh3.hash(r.tobytes(), signed=True) for r in rows]
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of the two shingle sets."""
+    return float(np.mean(a == b))
+
+
+class DedupIndex:
+    """
+    Persistent exact-hash + MinHash/LSH index of the chunks in the store.
+
+        index = DedupIndex()
+        canonical = index.check(ids, docs, metas)  # None = new, else id of the chunk it duplicates
+        ...collection.add(new ones)...
+        index.commit()                              # or index.rollback() if the add failed
+    """
+
+    def __init__(self, path: str = DEDUP_INDEX_PATH, threshold: float = DEDUP_THRESHOLD):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.threshold = threshold
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(chunks)")}
+        for column in ("document", "metadata"):  # indexes written before duplicates kept their text
+            if column not in columns:
+                self.db.execute(f"ALTER TABLE chunks ADD COLUMN {column} TEXT")
+        self.stats = {"checked": 0, "exact_duplicates": 0, "near_duplicates": 0, "doc_bytes_skipped": 0}
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def commit(self) -> None:
+        self.db.commit()
+
+    def rollback(self) -> None:
+        self.db.rollback()
+
+    def _forget(self, chunk_id: str) -> None:
+        self.db.execute("DELETE FROM bands WHERE chunk_id = ?", (chunk_id,))
+        self.db.execute("DELETE FROM chunks WHERE id = ?", (chunk_id,))
+
+    def _signature(self, chunk_id: str) -> Optional[np.ndarray]:
+        row = self.db.execute("SELECT signature FROM chunks WHERE id = ?", (chunk_id,)).fetchone()
+        return np.frombuffer(row[0], dtype=np.uint32) if row and row[0] else None
+
+    def find(self, chunk_id: str, signature: Optional[np.ndarray], exact: str) -> Tuple[Optional[str], str]:
+        """(canonical id, "exact" | "near" | "") for one chunk, ignoring the chunk's own earlier entry."""
+        row = self.db.execute(
+            "SELECT id FROM chunks WHERE exact = ? AND canonical_id IS NULL AND id != ? LIMIT 1", (exact, chunk_id)
+        ).fetchone()
+        if row:
+            return row[0], "exact"
+        if signature is None:
+            return None, ""
+        candidates = set()
+        for band, bucket in enumerate(band_buckets(signature)):
+            candidates.update(
+                r[0] for r in self.db.execute("SELECT chunk_id FROM bands WHERE band = ? AND bucket = ?", (band, bucket))
+            )
+        candidates.discard(chunk_id)
+        best, best_sim = None, 0.0
+        for candidate in candidates:
+            other = self._signature(candidate)
+            if other is None:
+                continue
+            sim = similarity(signature, other)
+            if sim > best_sim:
+                best, best_sim = candidate, sim
+        if best is not None and best_sim >= self.threshold:
+            return best, "near"
+        return None, ""
+
+    def check(self, ids: Sequence[str], docs: Sequence[str], metas: Sequence[Dict[str, Any]]) -> List[Optional[str]]:
+        """
+        Classify a batch and record it (uncommitted). Chunks later in the batch are checked against
+        earlier ones too, so two copies inside one file are also caught.
+        """
+        out = []
+        now = time.time()
+        for chunk_id, doc, meta in zip(ids, docs, metas):
+            words = normalise(doc)
+            exact = exact_hash(words)
+            signature = minhash(words)
+            canonical, kind = self.find(chunk_id, signature, exact)
+            self._forget(chunk_id)  # re-ingesting the same chunk replaces its entry
+            source = (meta or {}).get("source")
+            self.db.execute(
+                "INSERT INTO chunks (id, source, exact, signature, canonical_id, doc_bytes, added_at, document, metadata) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (chunk_id, source, exact, signature.tobytes() if signature is not None and canonical is None else None,
+                 canonical, len(doc.encode("utf-8")), now,
+                 doc if canonical is not None else None,
+                 json.dumps(meta or {}, ensure_ascii=False) if canonical is not None else None),
+            )
+            if canonical is None and signature is not None:
+                self.db.executemany(
+                    "INSERT INTO bands (band, bucket, chunk_id) VALUES (?, ?, ?)",
+                    [(band, bucket, chunk_id) for band, bucket in enumerate(band_buckets(signature))],
+                )
+            self.stats["checked"] += 1
+            if canonical is not None:
+                self.stats[f"{kind}_duplicates"] += 1
+                self.stats["doc_bytes_skipped"] += len(doc.encode("utf-8"))
+            out.append(canonical)
+        return out
+
+    def dependants(self, ids: Sequence[str]) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """(id, document, metadata) of the duplicates that point at any of `ids`, other than `ids` themselves.
+        Duplicates recorded before the index kept their text can't be checked again and are left as they are."""
+        out, legacy = [], 0
+        for start in range(0, len(ids), 500):
+            part = list(ids[start:start + 500])
+            marks = ",".join("?" * len(part))
+            for chunk_id, document, metadata in self.db.execute(
+                f"SELECT id, document, metadata FROM chunks WHERE canonical_id IN ({marks}) AND id NOT IN ({marks})",
+                part + part,
+            ):
+                if document is None:
+                    legacy += 1
+                else:
+                    out.append((chunk_id, document, json.loads(metadata or "{}")))
+        if legacy:
+            print(f"⚠️ {legacy} duplicates of re-ingested chunks have no stored text; re-ingest their files to recheck them")
+        return out
+
+    def report(self) -> Dict[str, Any]:
+        """Totals over everything ever ingested through the index."""
+        total, dups, dup_bytes = self.db.execute(
+            "SELECT COUNT(*), COUNT(canonical_id), COALESCE(SUM(CASE WHEN canonical_id IS NOT NULL THEN doc_bytes END), 0) FROM chunks"
+        ).fetchone()
+        return {
+            "chunks_seen": total,
+            "canonical_chunks": total - dups,
+            "duplicates_skipped": dups,
+            "embedding_calls_saved": dups,
+            "index_bytes_saved_est": dups * EMBEDDING_BYTES + dup_bytes,
+            "dedup_index_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+        }
+
+
+def add_deduplicated(collection, index: DedupIndex, ids: List[str], docs: List[str], metas: List[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    collection.add() for the chunks that aren't duplicates; duplicates get their source recorded on
+    the canonical chunk's `also_in` instead. Duplicates of chunks in this batch (stored in the index
+    from earlier files) are checked again against the new text and embedded when they no longer match.
+    Returns {"added": n, "duplicates": n, "restored": n}.
+    """
+    n = len(ids)
+    try:
+        canonical = index.check(ids, docs, metas)
+        # The batch replaced these chunks, and with them whatever their duplicates were matched against
+        restored = index.dependants(ids)
+        if restored:
+            ids = list(ids) + [r[0] for r in restored]
+            docs = list(docs) + [r[1] for r in restored]
+            metas = list(metas) + [r[2] for r in restored]
+            counted = dict(index.stats)  # rechecks, not new chunks: keep them out of this run's counts
+            canonical += index.check(ids[n:], docs[n:], metas[n:])
+            index.stats = counted
+        new = [i for i, c in enumerate(canonical) if c is None]
+        if new:
+            collection.add(
+                documents=[docs[i] for i in new],
+                metadatas=[metas[i] for i in new],
+                ids=[ids[i] for i in new],
+            )
+        links: Dict[str, List[str]] = {}
+        for i, c in enumerate(canonical):
+            if c is not None:
+                links.setdefault(c, []).append(metas[i].get("source") or "Unknown")
+        if links:
+            _link_sources(collection, links)
+        index.commit()
+    except Exception:
+        index.rollback()
+        raise
+    duplicates = sum(c is not None for c in canonical[:n])
+    return {"added": n - duplicates, "duplicates": duplicates, "restored": len(new) - (n - duplicates)}
+
+
+def _link_sources(collection, links: Dict[str, List[str]]) -> None:
+    found = collection.get(ids=list(links), include=["metadatas"])
+    ids, metas = [], []
+    for chunk_id, meta in zip(found["ids"], found["metadatas"]):
+        meta = dict(meta or {})
+        also_in = [s for s in (meta.get("also_in") or "").split(", ") if s]
+        for source in links[chunk_id]:
+            if source != meta.get("source") and source not in also_in:
+                also_in.append(source)
+        meta["also_in"] = ", ".join(also_in)[:MAX_ALSO_IN_CHARS]
+        ids.append(chunk_id)
+        metas.append(meta)
+    if ids:
+        collection.update(ids=ids, metadatas=metas)
+
+
+def scan_collection(collection, index_path: str = ":memory:", threshold: float = DEDUP_THRESHOLD) -> Dict[str, Any]:
+    """
+    Dry run over an existing store (nothing is changed): how many of its chunks the index would
+    have skipped. Uses a throwaway in-memory index by default.
+    """
+    from chroma_pages import iter_pages
+
+    index = DedupIndex(index_path, threshold=threshold)
+    start = time.perf_counter()
+    by_source: Dict[str, int] = {}
+    for page in iter_pages(collection, include=["documents", "metadatas"]):
+        canonical = index.check(page["ids"], page["documents"], page["metadatas"])
+        for meta, c in zip(page["metadatas"], canonical):
+            if c is not None:
+                source = (meta or {}).get("source") or "Unknown"
+                by_source[source] = by_source.get(source, 0) + 1
+    index.commit()
+    report = {**index.report(), **index.stats, "seconds": round(time.perf_counter() - start, 2)}
+    report["top_duplicated_sources"] = sorted(by_source.items(), key=lambda kv: -kv[1])[:10]
+    index.close()
+    return report
+
+
+if __name__ == "__main__":
+    # Usage: python dedup.py report        totals from the persistent index
+    #        python dedup.py scan          dry run over the current Chroma store
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "report"
+    if cmd == "scan":
+        # The configured store, checked against EMBEDDING_BACKEND; never creates an empty collection
+        from embeddings import open_collection
+        from shared_store import open_chroma_client
+        coll = open_collection(open_chroma_client(), "cocktailgpt", create=False)
+        print(f"🔎 Scanning {coll.count()} chunks for duplicates...")
+        for k, v in scan_collection(coll).items():
+            print(f"📏 {k}: {v}")
+    else:
+        with DedupIndex() as idx:
+            for k, v in idx.report().items():
+                print(f"📏 {k}: {v}")
@@ -0,0 +1,307 @@
+import os
+import sys
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from chromadb.api.types import Documents, Embeddings
+from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+
+# One place that decides how text becomes vectors, for the API (queries) and every ingest/maintenance
+# script (documents), so the two can't silently disagree.
+#
+#   EMBEDDING_BACKEND=onnx             all-MiniLM-L6-v2 on CPU through onnxruntime (384 dims). Same model
+#                                      and vectors as Chroma's default embedding, which built the existing
+#                                      stores; no network once the model is cached.
+#   EMBEDDING_BACKEND=openai           OpenAI embeddings API, EMBEDDING_MODEL (default text-embedding-ada-002)
+#   EMBEDDING_BACKEND=fixture-hashing  deterministic hashing embedder for the offline benchmarks
+#
+# open_collection() records the backend and dimension in the collection metadata (embedding_backend,
+# embedding_dim) the first time it sees a collection, and refuses to open one recorded under another
+# backend or holding vectors of another dimension (EmbeddingMismatchError), so the API fails at
+# startup instead of answering from mismatched vectors.
+#
+# ONNX: one inference session per process (Chroma's default embedding function builds a new one on
+# every call), batches padded to their longest text rather than to 256 tokens, and batches spread
+# over EMBEDDING_THREADS threads with onnxruntime's intra-op threads split between them.
+#
+#   python embeddings.py info [--store=/tmp/chroma_store]
+#   python embeddings.py bench [--texts=512]
+
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND") or os.environ.get("EMBEDDING_FUNCTION") or "onnx"
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "text-embedding-ada-002")
+EMBEDDING_BATCH = int(os.environ.get("EMBEDDING_BATCH", "32"))
+EMBEDDING_THREADS = int(os.environ.get("EMBEDDING_THREADS", str(min(4, os.cpu_count() or 1))))
+
+BACKEND_KEY = "embedding_backend"
+DIM_KEY = "embedding_dim"
+
+OPENAI_DIMS = {"text-embedding-ada-002": 1536, "text-embedding-3-small": 1536, "text-embedding-3-large": 3072}
+
+
+class EmbeddingMismatchError(RuntimeError):
+    pass
+
+
+class OnnxEmbeddingFunction(ONNXMiniLM_L6_V2):
+    """Chroma's MiniLM ONNX model with a reused session, dynamic padding and a thread pool."""
+
+    dimension = 384
+
+    def __init__(self, batch_size: int = EMBEDDING_BATCH, threads: int = EMBEDDING_THREADS):
+        super().__init__()
+        self.batch_size = batch_size
+        self.threads = max(threads, 1)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._ready = threading.Lock()
+
+    @property
+    def tokenizer(self) -> Any:
+        tokenizer = self.__dict__.get("_tokenizer")
+        if tokenizer is None:
+            tokenizer = self.Tokenizer.from_file(
+                os.path.join(self.DOWNLOAD_PATH, self.EXTRACTED_FOLDER_NAME, "tokenizer.json")
+            )
+            tokenizer.enable_truncation(max_length=256)
+            # Pad to the longest text in the batch: masked positions don't change the pooled vector
+            tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+            self.__dict__["_tokenizer"] = tokenizer
+        return tokenizer
+
+    @property
+    def model(self) -> Any:
+        session = self.__dict__.get("_session")
+        if session is None:
+            so = self.ort.SessionOptions()
+            so.log_severity_level = 3
+            so.graph_optimization_level = self.ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            so.intra_op_num_threads = max((os.cpu_count() or 1) // self.threads, 1)
+            session = self.ort.InferenceSession(
+                os.path.join(self.DOWNLOAD_PATH, self.EXTRACTED_FOLDER_NAME, "model.onnx"),
+                providers=["CPUExecutionProvider"],
+                sess_options=so,
+            )
+            self.__dict__["_session"] = session
+        return session
+
+    def _forward(self, documents: List[str]) -> np.ndarray:
+        # One batch: mean pooling over the attention mask, then L2-normalised (as Chroma's model)
+        encoded = self.tokenizer.encode_batch(list(documents))
+        input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+        hidden = self.model.run(None, {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "token_type_ids": np.zeros_like(input_ids),
+        })[0]
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(1) / np.clip(mask.sum(1), 1e-9, None)
+        return self._normalize(pooled).astype(np.float32)
+
+    def _warm(self) -> None:
+        # Download, tokenizer and session once, before several threads reach for them
+        with self._ready:
+            if "_session" not in self.__dict__:
+                self._download_model_if_not_exists()
+                _ = self.tokenizer, self.model
+                if self.threads > 1:
+                    self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="onnx-embed")
+
+    def __call__(self, input: Documents) -> Embeddings:
+        self._warm()
+        docs = list(input)
+        if not docs:
+            return []
+        batches = [docs[i:i + self.batch_size] for i in range(0, len(docs), self.batch_size)]
+        if self._pool is None or len(batches) == 1:
+            parts = [self._forward(batch) for batch in batches]
+        else:
+            parts = list(self._pool.map(self._forward, batches))
+        return [row for part in parts for row in part]
+
+    @staticmethod
+    def name() -> str:
+        # Persisted by Chroma as the collection's embedding function; "default" matches what the
+        # existing stores were created with (same model), so they open without a conflict
+        return "default"
+
+    def default_space(self) -> str:
+        return "l2"
+
+    def get_config(self) -> Dict[str, Any]:
+        return {}
+
+    @staticmethod
+    def build_from_config(config: Dict[str, Any]) -> "OnnxEmbeddingFunction":
+        return get_embedding_function("onnx")
+
+
+def _openai() -> Any:
+    from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
+
+    ef = OpenAIEmbeddingFunction(
+        api_key=os.getenv("OPENAI_API_KEY") or os.getenv("CHROMA_OPENAI_API_KEY"),
+        model_name=EMBEDDING_MODEL,
+        api_base=os.getenv("OPENAI_BASE_URL") or None,
+    )
+    ef.dimension = OPENAI_DIMS.get(EMBEDDING_MODEL)
+    return ef
+
+
+def _fixture_hashing() -> Any:
+    from fixture_store import HashingEmbeddingFunction
+
+    ef = HashingEmbeddingFunction()
+    ef.dimension = ef.dim
+    return ef
+
+
+BACKENDS: Dict[str, Callable[[], Any]] = {
+    "onnx": OnnxEmbeddingFunction,
+    "openai": _openai,
+    "fixture-hashing": _fixture_hashing,
+}
+# Chroma's own name for its default embedding (the ONNX model above)
+ALIASES = {"default": "onnx", "chroma-default": "onnx"}
+
+_instances: Dict[str, Any] = {}
+_instances_lock = threading.Lock()
+
+
+def register_backend(name: str, factory: Callable[[], Any]) -> None:
+    """`factory()` returns a Chroma embedding function, ideally with a `dimension` attribute."""
+    BACKENDS[name] = factory
+
+
+def backend_name(name: Optional[str] = None) -> str:
+    name = name or EMBEDDING_BACKEND
+    name = ALIASES.get(name, name)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {name!r} (known: {', '.join(sorted(BACKENDS))})")
+    return name
+
+
+def get_embedding_function(name: Optional[str] = None) -> Any:
+    """One instance per backend per process (the ONNX session and OpenAI client are reused)."""
+    name = backend_name(name)
+    with _instances_lock:
+        if name not in _instances:
+            _instances[name] = BACKENDS[name]()
+        return _instances[name]
+
+
+def backend_dimension(name: Optional[str] = None) -> int:
+    ef = get_embedding_function(name)
+    dim = getattr(ef, "dimension", None)
+    if not dim:
+        dim = len(ef(["dimension probe"])[0])
+        ef.dimension = dim
+    return dim
+
+
+def _stored_dimension(collection) -> Optional[int]:
+    embeddings = collection.get(limit=1, include=["embeddings"]).get("embeddings")
+    if embeddings is None or len(embeddings) == 0:
+        return None
+    return len(embeddings[0])
+
+
+def check_recorded(label: str, recorded: Optional[str], stored_dim: Optional[int], name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Raise EmbeddingMismatchError when vectors recorded as `recorded` / `stored_dim` (either may be
+    unknown) can't be queried with backend `name`. `label` names the store in the message.
+    """
+    name = backend_name(name)
+    if recorded is not None and ALIASES.get(recorded, recorded) != name:
+        raise EmbeddingMismatchError(
+            f"{label} was embedded with {recorded!r} ({stored_dim} dims) but "
+            f"EMBEDDING_BACKEND is {name!r}; set EMBEDDING_BACKEND={recorded} or re-ingest into a fresh store"
+        )
+    dim = backend_dimension(name)
+    if stored_dim is not None and stored_dim != dim:
+        raise EmbeddingMismatchError(
+            f"{label} holds {stored_dim}-dim vectors but {name!r} makes {dim}-dim ones; "
+            f"pick the backend it was built with or re-ingest into a fresh store"
+        )
+    return {"backend": name, "dim": dim}
+
+
+def check_collection(collection, name: Optional[str] = None, stamp: bool = True) -> Dict[str, Any]:
+    """
+    Raise EmbeddingMismatchError when `collection` was written with another backend or dimension;
+    stamp it with `name` when it carries no record yet (new, or built before the registry existed).
+    """
+    meta = dict(collection.metadata or {})
+    recorded = meta.get(BACKEND_KEY)
+    checked = check_recorded(f"Collection {collection.name!r}", recorded, meta.get(DIM_KEY) or _stored_dimension(collection), name)
+    if stamp and (recorded is None or meta.get(DIM_KEY) is None):
+        # modify() replaces the metadata and refuses hnsw:* keys (the space lives in the configuration)
+        keep = {k: v for k, v in meta.items() if not k.startswith("hnsw:")}
+        collection.modify(metadata={**keep, BACKEND_KEY: checked["backend"], DIM_KEY: checked["dim"]})
+    return checked
+
+
+def open_collection(client, collection_name: str, backend: Optional[str] = None, create: bool = True, check: bool = True):
+    """get_or_create_collection with the configured embedding function, checked against what the
+    collection was built with."""
+    ef = get_embedding_function(backend)
+    try:
+        if create:
+            collection = client.get_or_create_collection(collection_name, embedding_function=ef)
+        else:
+            collection = client.get_collection(collection_name, embedding_function=ef)
+    except ValueError as e:
+        # Chroma's own check, for collections whose persisted embedding function has another name
+        if "Embedding function conflict" not in str(e):
+            raise
+        raise EmbeddingMismatchError(f"Collection {collection_name!r} can't be opened with {backend_name(backend)!r}: {e}") from e
+    if check:
+        check_collection(collection, backend)
+    return collection
+
+
+def collection_info(collection) -> Dict[str, Any]:
+    meta = collection.metadata or {}
+    return {
+        "collection": collection.name,
+        "count": collection.count(),
+        "backend": meta.get(BACKEND_KEY),
+        "dim": meta.get(DIM_KEY) or _stored_dimension(collection),
+    }
+
+
+def bench(n_texts: int = 512, backend: Optional[str] = None) -> Dict[str, Any]:
+    """Texts per second for the configured backend, on fixture chunks."""
+    from fixture_store import load_docs
+
+    docs = [d["text"] for d in load_docs()]
+    texts = [docs[i % len(docs)] for i in range(n_texts)]
+    ef = get_embedding_function(backend)
+    ef(texts[:4])  # model load
+    started = time.perf_counter()
+    ef(texts)
+    seconds = time.perf_counter() - started
+    return {"backend": backend_name(backend), "texts": n_texts, "seconds": round(seconds, 3),
+            "texts_per_s": round(n_texts / seconds, 1), "threads": getattr(ef, "threads", None)}
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    opts = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    command = args[0] if args else "info"
+    if command == "info":
+        from shared_store import open_chroma_client
+
+        client = open_chroma_client(opts.get("store", "/tmp/chroma_store"), mode="embedded")
+        print(json.dumps({
+            "configured": {"backend": backend_name(), "dim": backend_dimension()},
+            "collections": [collection_info(client.get_collection(c.name)) for c in client.list_collections()],
+        }, indent=2))
+    elif command == "bench":
+        print(json.dumps(bench(int(opts.get("texts", "512")), opts.get("backend")), indent=2))
+    else:
+        print("usage: python embeddings.py info [--store=/tmp/chroma_store] | bench [--texts=512] [--backend=onnx]")
+        sys.exit(1)
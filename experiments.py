@@ -0,0 +1,443 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import defaultdict, deque
+from dataclasses import dataclass, fields
+from typing import Any, Deque, Dict, List, Optional
+
+from query_log import QUERY_LOG_PATH, iter_records, question_hash
+
+# A/B experiments on /ask: the answer-shaping settings that otherwise get changed in production blind
+# (RESPONSE_DETAIL, OPENAI_MAX_TOKENS, n_results, chunk size) as named variants, with the latency,
+# token and retrieval numbers to compare them by.
+#
+#   EXPERIMENT = JSON, or the path of a .json file; unset/empty → no experiment
+#     {"name": "answer-length", "salt": "2026-10",
+#      "variants": [{"name": "control", "weight": 50},
+#                   {"name": "short", "weight": 50, "response_detail": "default", "max_tokens": 500,
+#                    "n_results": 3}]}
+#
+# A variant only lists what it changes; everything else stays as configured. With ADAPTIVE_K=1,
+# n_results is the variant's max_k (the cutoff still decides how many of those are used). Requests are
+# bucketed deterministically: sha256(salt:name:key) picks a variant in proportion to the weights, where
+# the key is the conversation_id (a whole conversation stays in one variant) or else the question's
+# hash. A request may name its variant ("variant" in the body; /retrieve returns the one it used so
+# the UI can send it back to /ask), but that is only honoured when it is the request's own bucket, so
+# a client can't pick its arm and bias the numbers; with EXPERIMENT_NAMED_VARIANTS=1 (the offline
+# replay, which sends every question to every variant) any named variant is used. chunk_tokens is decided at ingest time, so it is only accepted
+# by the offline replay, which builds a re-chunked copy of the fixture corpus for it.
+#
+# Metrics: the variant goes into each query-log record (experiment: {name, variant}), and every worker
+# keeps per-variant aggregates (latency, LLM time, prompt/completion tokens, history-summary cache
+# hits, top retrieval score, k, short circuits, errors) at /debug/experiments.
+#
+#   python experiments.py report [--log=PATH] [--since-hours=24]   (per variant, from the query log)
+#   python experiments.py replay [--variants=FILE|JSON] [--questions=fixtures|log] [--log=PATH]
+#                                [--limit=50] [--stub-latency=0.05] [--answer-tokens=900] [--out=replay.json]
+#
+# `replay` runs questions through every variant in-process against the fixture store and the stub
+# OpenAI server (no credits, nothing deployed) and prints a comparison against the first variant.
+# The stub answers with --answer-tokens capped at the request's max_tokens, so completion tokens there
+# show the effect of max_tokens only; prompt tokens, retrieval scores and hit rate are the real thing.
+
+EXPERIMENT = os.environ.get("EXPERIMENT", "")
+EXPERIMENT_NAMED_VARIANTS = os.environ.get("EXPERIMENT_NAMED_VARIANTS", "0") == "1"
+EXPERIMENT_WINDOW = int(os.environ.get("EXPERIMENT_WINDOW", "1000"))  # requests per variant kept for percentiles
+
+OFFLINE_ONLY = ("chunk_tokens",)
+
+DEFAULT_REPLAY_VARIANTS: Dict[str, Any] = {
+    "name": "replay",
+    "variants": [
+        {"name": "control"},
+        {"name": "short-answers", "response_detail": "default", "max_tokens": 500},
+        {"name": "fewer-chunks", "n_results": 3},
+        {"name": "large-chunks", "chunk_tokens": 250},  # fixture chunks are ~60 tokens
+    ],
+}
+
+
+@dataclass
+class Variant:
+    name: str
+    weight: float = 1.0
+    response_detail: Optional[str] = None  # "default" | "double"
+    max_tokens: Optional[int] = None       # completion cap, replaces the routed tier's
+    n_results: Optional[int] = None        # chunks retrieved (fixed k; with ADAPTIVE_K the max_k)
+    chunk_tokens: Optional[int] = None     # offline replay only
+
+    def overrides(self) -> Dict[str, Any]:
+        return {f.name: getattr(self, f.name) for f in fields(self)
+                if f.name not in ("name", "weight") and getattr(self, f.name) is not None}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "weight": self.weight, **self.overrides()}
+
+
+class Experiment:
+    def __init__(self, name: str, variants: List[Variant], salt: str = "", online: bool = True,
+                 allow_named: bool = EXPERIMENT_NAMED_VARIANTS):
+        if not variants:
+            raise ValueError("An experiment needs at least one variant")
+        names = [v.name for v in variants]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Duplicate variant names in {names}")
+        if any(v.weight <= 0 for v in variants):
+            raise ValueError("Variant weights must be positive")
+        if online:
+            offline = [v.name for v in variants if any(k in v.overrides() for k in OFFLINE_ONLY)]
+            if offline:
+                raise ValueError(f"{', '.join(OFFLINE_ONLY)} only apply to the offline replay (variants {offline})")
+        self.name = name
+        self.salt = salt
+        self.allow_named = allow_named
+        self.variants = variants
+        self._by_name = {v.name: v for v in variants}
+        self._total = sum(v.weight for v in variants)
+
+    def variant(self, name: Any) -> Optional[Variant]:
+        return self._by_name.get(name) if isinstance(name, str) and name else None
+
+    def assign(self, key: str) -> Variant:
+        digest = hashlib.sha256(f"{self.salt}:{self.name}:{key}".encode("utf-8")).hexdigest()
+        point = int(digest[:15], 16) / 16 ** 15 * self._total
+        for v in self.variants:
+            point -= v.weight
+            if point < 0:
+                return v
+        return self.variants[-1]
+
+    def choose(self, payload: Dict[str, Any]) -> Variant:
+        """The request's bucket; a variant it names only when that is the same (or allow_named)."""
+        named = self.variant(payload.get("variant"))
+        if named is not None and self.allow_named:
+            return named
+        return self.assign(bucket_key(payload))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "salt": self.salt, "variants": [v.to_dict() for v in self.variants]}
+
+
+def bucket_key(payload: Dict[str, Any]) -> str:
+    conversation_id = payload.get("conversation_id")
+    if conversation_id:
+        return "conversation:" + str(conversation_id)
+    return "question:" + question_hash(str(payload.get("question") or ""))
+
+
+def parse_spec(spec: str) -> Dict[str, Any]:
+    spec = spec.strip()
+    if spec.startswith("{"):
+        return json.loads(spec)
+    with open(spec) as f:
+        return json.load(f)
+
+
+def experiment_from_dict(data: Dict[str, Any], online: bool = True) -> Experiment:
+    try:
+        variants = [Variant(**v) for v in data["variants"]]
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Invalid experiment variants: {e}")
+    return Experiment(data.get("name") or "experiment", variants, str(data.get("salt") or ""), online=online)
+
+
+def load_experiment(spec: str = EXPERIMENT, online: bool = True) -> Optional[Experiment]:
+    """None when no experiment is configured; ValueError for a spec that doesn't parse."""
+    if not spec.strip():
+        return None
+    return experiment_from_dict(parse_spec(spec), online=online)
+
+
+# ---------- Per-variant metrics ----------
+def _p(values, pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(int(len(ordered) * pct / 100.0), len(ordered) - 1)], 1)
+
+
+def _mean(values) -> Optional[float]:
+    return round(sum(values) / len(values), 4) if values else None
+
+
+class VariantMetrics:
+    """Counters plus the last `window` requests' numbers for one variant."""
+
+    def __init__(self, window: int = EXPERIMENT_WINDOW):
+        self.counts = {"requests": 0, "errors": 0, "short_circuits": 0, "summary_cache_hits": 0, "prefetched": 0}
+        self.series: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=window))
+
+    def add(self, latency_ms: float, llm_ms: Optional[float], prompt_tokens: Optional[int],
+            completion_tokens: Optional[int], top_score: Optional[float], k: Optional[int],
+            summary_cached: bool, short_circuit: bool, prefetched: bool, error: bool) -> None:
+        self.counts["requests"] += 1
+        self.counts["errors"] += 1 if error else 0
+        self.counts["short_circuits"] += 1 if short_circuit else 0
+        self.counts["summary_cache_hits"] += 1 if summary_cached else 0
+        self.counts["prefetched"] += 1 if prefetched else 0
+        for key, value in (("latency_ms", latency_ms), ("llm_ms", llm_ms), ("prompt_tokens", prompt_tokens),
+                           ("completion_tokens", completion_tokens), ("top_score", top_score), ("k", k)):
+            if value is not None:
+                self.series[key].append(value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        n = self.counts["requests"]
+        s = self.series
+        return {
+            **self.counts,
+            "latency_ms": {"p50": _p(s["latency_ms"], 50), "p95": _p(s["latency_ms"], 95)},
+            "llm_ms": {"p50": _p(s["llm_ms"], 50), "p95": _p(s["llm_ms"], 95)},
+            "prompt_tokens_mean": _mean(s["prompt_tokens"]),
+            "completion_tokens_mean": _mean(s["completion_tokens"]),
+            "top_score_mean": _mean(s["top_score"]),
+            "k_mean": _mean(s["k"]),
+            "error_rate": round(self.counts["errors"] / n, 4) if n else None,
+            "short_circuit_rate": round(self.counts["short_circuits"] / n, 4) if n else None,
+        }
+
+
+class ExperimentMetrics:
+    def __init__(self, window: int = EXPERIMENT_WINDOW):
+        self.window = window
+        self._variants: Dict[str, VariantMetrics] = {}
+        self._lock = threading.Lock()
+
+    def record(self, variant: str, timings: Dict[str, float], fields: Dict[str, Any],
+               results: Optional[Dict[str, Any]] = None) -> None:
+        """One /ask request, from the timings and query-log fields /ask already collects."""
+        usage = fields.get("usage") or {}
+        distances = ((results or {}).get("distances") or [[]])[0] or []
+        ids = ((results or {}).get("ids") or [[]])[0] or []
+        with self._lock:
+            metrics = self._variants.setdefault(variant, VariantMetrics(self.window))
+            metrics.add(
+                latency_ms=timings.get("total", 0.0) * 1000,
+                llm_ms=timings["llm"] * 1000 if "llm" in timings else None,
+                prompt_tokens=usage.get("prompt_tokens"),
+                completion_tokens=usage.get("completion_tokens"),
+                top_score=round(1.0 - min(float(d) for d in distances) / 2.0, 4) if distances else None,
+                k=len(ids) if results is not None else None,
+                summary_cached=bool((fields.get("cache") or {}).get("history_summary")),
+                short_circuit=bool(fields.get("short_circuit")),
+                prefetched=bool(fields.get("prefetched")),
+                error=bool(fields.get("error")),
+            )
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {name: m.snapshot() for name, m in sorted(self._variants.items())}
+
+
+def log_report(path: str = QUERY_LOG_PATH, since: Optional[float] = None) -> Dict[str, Any]:
+    """Per experiment and variant from the query log, i.e. across all workers."""
+    grouped: Dict[str, Dict[str, VariantMetrics]] = defaultdict(dict)
+    for r in iter_records(path, since):
+        exp = r.get("experiment")
+        if not exp:
+            continue
+        metrics = grouped[exp["name"]].setdefault(exp["variant"], VariantMetrics(window=10 ** 9))
+        latency = r.get("latency_ms") or {}
+        usage = r.get("usage") or {}
+        scores = r.get("scores") or []
+        metrics.add(
+            latency_ms=latency.get("total", 0.0),
+            llm_ms=latency.get("llm"),
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+            top_score=max(scores) if scores else None,
+            k=len(r["retrieved_ids"]) if "retrieved_ids" in r else None,
+            summary_cached=bool((r.get("cache") or {}).get("history_summary")),
+            short_circuit=bool(r.get("short_circuit")),
+            prefetched=bool(r.get("prefetched")),
+            error=bool(r.get("error")),
+        )
+    return {name: {v: m.snapshot() for v, m in sorted(variants.items())} for name, variants in grouped.items()}
+
+
+# ---------- Offline replay ----------
+def replay_questions(source: str = "fixtures", log_path: str = QUERY_LOG_PATH, limit: int = 50) -> List[Dict[str, Any]]:
+    """[{question, sources}]: the fixture questions (with expected sources), or the most asked logged ones."""
+    from fixture_store import load_questions
+
+    if source == "fixtures":
+        return load_questions()[:limit]
+    counts: Dict[str, int] = defaultdict(int)
+    text: Dict[str, str] = {}
+    for r in iter_records(log_path):
+        if r.get("question"):
+            counts[r["question_hash"]] += 1
+            text.setdefault(r["question_hash"], r["question"])
+    ranked = sorted(text, key=lambda h: -counts[h])[:limit]
+    return [{"question": text[h], "sources": []} for h in ranked]
+
+
+def rechunked_docs(chunk_tokens: int) -> List[Dict[str, Any]]:
+    """The fixture corpus re-chunked at `chunk_tokens`: each source's chunks joined back and split again."""
+    from fixture_store import load_docs
+    from utils import chunk_text
+
+    by_source: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for d in load_docs():
+        by_source[d["source"]].append(d)
+    docs = []
+    for source, chunks in by_source.items():
+        text = "\n".join(c["text"] for c in sorted(chunks, key=lambda c: c["chunk"]))
+        docs += [{"source": source, "chunk": i, "text": t} for i, t in enumerate(chunk_text(text, chunk_tokens))]
+    return docs
+
+
+def _delta(new: Optional[float], base: Optional[float]) -> Optional[float]:
+    if new is None or not base:
+        return None
+    return round(100.0 * (new - base) / base, 1)
+
+
+def replay(spec: Dict[str, Any], questions: List[Dict[str, Any]], stub_latency: float = 0.05,
+           answer_tokens: int = 900, keep: bool = False) -> Dict[str, Any]:
+    """
+    Every question through every variant (interleaved, so drift hits all alike) via /ask in-process,
+    on the fixture store with hashing embeddings and the stub OpenAI server.
+    """
+    experiment = experiment_from_dict(spec, online=False)
+    work = tempfile.mkdtemp(prefix="cocktailgpt_replay_")
+    store, ws_root = os.path.join(work, "store"), os.path.join(work, "workspaces")
+
+    # Set before serve, api and everything they import read their configuration
+    online = {**spec, "variants": [{k: v for k, v in var.to_dict().items() if k not in OFFLINE_ONLY}
+                                   for var in experiment.variants]}
+    overrides = {
+        "CHROMA_PATH": store,
+        "WORKSPACES_PATH": ws_root,
+        "STORE_GENERATION_PATH": store + ".generation",
+        "JOB_STATE_PATH": os.path.join(work, "jobs.json"),
+        "JOB_LOCK_DIR": os.path.join(work, "locks"),
+        "QUERY_LOG": "0",
+        "EXPERIMENT": json.dumps(online),
+        "EXPERIMENT_NAMED_VARIANTS": "1",
+    }
+    os.environ.update(overrides)
+    import serve
+    os.environ.update({**serve.bench_env("embedded"), **overrides})
+
+    from fixture_store import HashingEmbeddingFunction, build_fixture_store
+    from source_index import SOURCES_COLLECTION, build_source_index
+    from stub_openai import start_stub_openai
+    from workspaces import create_workspace, release_client, workspace_path
+
+    serve.prepare_bench_store(store)
+    release_client(store)
+    workspaces: Dict[str, str] = {}
+    for v in experiment.variants:
+        if v.chunk_tokens and v.chunk_tokens not in workspaces.values():
+            name = f"chunks-{v.chunk_tokens}"
+            create_workspace(name, max_mb=10 ** 6, root=ws_root)
+            ef = HashingEmbeddingFunction()
+            path = workspace_path(name, ws_root)
+            client, collection = build_fixture_store(path, embedding_function=ef, docs=rechunked_docs(v.chunk_tokens))
+            build_source_index(collection, client.get_or_create_collection(SOURCES_COLLECTION, embedding_function=ef))
+            release_client(path)
+        if v.chunk_tokens:
+            workspaces[v.name] = f"chunks-{v.chunk_tokens}"
+
+    stub = start_stub_openai(serve.BENCH_STUB_PORT, latency=stub_latency, answer_tokens=answer_tokens, seed=1)
+    try:
+        from fastapi.testclient import TestClient
+        import api
+
+        http = TestClient(api.app)
+        client_side: Dict[str, Dict[str, List[float]]] = {v.name: defaultdict(list) for v in experiment.variants}
+        for q in questions:
+            for v in experiment.variants:
+                payload = {"question": q["question"], "variant": v.name}
+                if v.name in workspaces:
+                    payload["workspace"] = workspaces[v.name]
+                start = time.perf_counter()
+                resp = http.post("/ask", json=payload)
+                row = client_side[v.name]
+                row["latency_ms"].append((time.perf_counter() - start) * 1000)
+                if resp.status_code != 200:
+                    row["errors"].append(1)
+                    continue
+                body = resp.json()
+                if q.get("sources"):
+                    got = [c["source"] for c in body.get("citations") or []]
+                    relevant = sum(1 for s in got if s in set(q["sources"]))
+                    row["precision"].append(relevant / len(got) if got else 0.0)
+                    row["hit"].append(1.0 if relevant else 0.0)
+                row["chars"].append(len(body.get("response") or ""))
+        server = http.get("/debug/experiments").json()["variants"]
+    finally:
+        stub.shutdown()
+        if not keep:
+            shutil.rmtree(work, ignore_errors=True)
+
+    variants: Dict[str, Any] = {}
+    for v in experiment.variants:
+        row, metrics = client_side[v.name], server.get(v.name, {})
+        variants[v.name] = {
+            "config": v.overrides(),
+            "requests": len(row["latency_ms"]),
+            "errors": len(row["errors"]),
+            "latency_ms": {"p50": _p(row["latency_ms"], 50), "p95": _p(row["latency_ms"], 95)},
+            "llm_ms": metrics.get("llm_ms"),
+            "prompt_tokens_mean": metrics.get("prompt_tokens_mean"),
+            "completion_tokens_mean": metrics.get("completion_tokens_mean"),
+            "top_score_mean": metrics.get("top_score_mean"),
+            "k_mean": metrics.get("k_mean"),
+            "answer_chars_mean": _mean(row["chars"]),
+            "precision": _mean(row["precision"]),
+            "hit_rate": _mean(row["hit"]),
+        }
+    base_name = experiment.variants[0].name
+    base = variants[base_name]
+    comparison = {
+        name: {
+            "latency_p50_pct": _delta(r["latency_ms"]["p50"], base["latency_ms"]["p50"]),
+            "prompt_tokens_pct": _delta(r["prompt_tokens_mean"], base["prompt_tokens_mean"]),
+            "completion_tokens_pct": _delta(r["completion_tokens_mean"], base["completion_tokens_mean"]),
+            "hit_rate_diff": (round(r["hit_rate"] - base["hit_rate"], 3)
+                              if r["hit_rate"] is not None and base["hit_rate"] is not None else None),
+        }
+        for name, r in variants.items() if name != base_name
+    }
+    return {
+        "experiment": experiment.name,
+        "questions": len(questions),
+        "stub": {"latency_s": stub_latency, "answer_tokens": answer_tokens},
+        "variants": variants,
+        "vs": base_name,
+        "comparison": comparison,
+    }
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    opts = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    command = args[0] if args else "report"
+    if command == "report":
+        since_h = float(opts["since-hours"]) if "since-hours" in opts else None
+        print(json.dumps(log_report(opts.get("log", QUERY_LOG_PATH),
+                                    since=time.time() - since_h * 3600 if since_h else None), indent=2))
+    elif command == "replay":
+        spec = parse_spec(opts["variants"]) if "variants" in opts else DEFAULT_REPLAY_VARIANTS
+        qs = replay_questions(opts.get("questions", "fixtures"), opts.get("log", QUERY_LOG_PATH), int(opts.get("limit", "50")))
+        out = replay(spec, qs, stub_latency=float(opts.get("stub-latency", "0.05")),
+                     answer_tokens=int(opts.get("answer-tokens", "900")))
+        for name, row in out["variants"].items():
+            print(f"📏 {name} {row['config']}: p50 {row['latency_ms']['p50']} ms · prompt {row['prompt_tokens_mean']} · "
+                  f"completion {row['completion_tokens_mean']} tokens · top score {row['top_score_mean']} · "
+                  f"hit rate {row['hit_rate']} · errors {row['errors']}")
+        for name, delta in out["comparison"].items():
+            print(f"📏 {name} vs {out['vs']}: {delta}")
+        if "out" in opts:
+            with open(opts["out"], "w") as f:
+                json.dump(out, f, indent=2)
+    else:
+        print("usage: python experiments.py report [--log=PATH] [--since-hours=24] | replay [--variants=FILE|JSON] "
+              "[--questions=fixtures|log] [--log=PATH] [--limit=50] [--stub-latency=0.05] [--answer-tokens=900] [--out=FILE]")
+        sys.exit(1)
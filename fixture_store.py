@@ -0,0 +1,150 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import zlib
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from chromadb import PersistentClient
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+# Small offline corpus + question set for benchmarking retrieval without Supabase or OpenAI.
+#   fixtures/docs.jsonl      : {"source", "chunk", "text"} per chunk
+#   fixtures/questions.jsonl : {"question", "sources"} with the sources a good answer should cite
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+DOCS_PATH = os.path.join(FIXTURE_DIR, "docs.jsonl")
+QUESTIONS_PATH = os.path.join(FIXTURE_DIR, "questions.jsonl")
+FIXTURE_CHROMA_PATH = "/tmp/chroma_fixture_store"
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+class HashingEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    Deterministic bag-of-words embedding (signed feature hashing of words and word bigrams).
+    No model download and no network, so fixture runs are reproducible anywhere.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def __call__(self, input: Documents) -> Embeddings:
+        out = []
+        for text in input:
+            vec = np.zeros(self.dim, dtype=np.float32)
+            tokens = _TOKEN_RE.findall(text.lower())
+            for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+                h = zlib.crc32(feature.encode("utf-8"))
+                vec[h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+            norm = np.linalg.norm(vec)
+            out.append(vec / norm if norm else vec)
+        return out
+
+    @staticmethod
+    def name() -> str:
+        return "fixture-hashing"
+
+    def get_config(self) -> Dict[str, Any]:
+        return {"dim": self.dim}
+
+    @staticmethod
+    def build_from_config(config: Dict[str, Any]) -> "HashingEmbeddingFunction":
+        return HashingEmbeddingFunction(dim=config.get("dim", 256))
+
+
+def load_jsonl(path: str) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_docs(path: str = DOCS_PATH) -> List[Dict[str, Any]]:
+    return load_jsonl(path)
+
+
+def load_questions(path: str = QUESTIONS_PATH) -> List[Dict[str, Any]]:
+    return load_jsonl(path)
+
+
+def chunk_id(source: str, chunk: int) -> str:
+    """Same id scheme as ingest_supabase.py."""
+    return hashlib.sha256((source + str(chunk)).encode()).hexdigest()
+
+
+def build_fixture_store(
+    path: str = FIXTURE_CHROMA_PATH,
+    collection_name: str = "cocktailgpt",
+    embedding_function=None,
+    docs: Optional[List[Dict[str, Any]]] = None,
+    reset: bool = True,
+):
+    """Create a Chroma store at `path` holding the fixture corpus. Returns (client, collection)."""
+    if reset and os.path.exists(path):
+        shutil.rmtree(path)
+    docs = docs if docs is not None else load_docs()
+    embedding_function = embedding_function or HashingEmbeddingFunction()
+
+    client = PersistentClient(path=path)
+    collection = client.get_or_create_collection(collection_name, embedding_function=embedding_function)
+    for i in range(0, len(docs), 100):
+        batch = docs[i:i + 100]
+        collection.upsert(
+            ids=[chunk_id(d["source"], d["chunk"]) for d in batch],
+            documents=[d["text"] for d in batch],
+            metadatas=[{"source": d["source"], "chunk": d["chunk"]} for d in batch],
+        )
+    return client, collection
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile; 0.0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(np.ceil(pct / 100.0 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def result_sources(results: Dict[str, Any]) -> List[str]:
+    metas = (results.get("metadatas") or [[]])[0]
+    return [(m or {}).get("source", "Unknown") for m in metas]
+
+
+def evaluate(query_fn: Callable[[str], Dict[str, Any]], questions: List[Dict[str, Any]], k: int = 5) -> Dict[str, Any]:
+    """
+    Run every fixture question through `query_fn` (question -> Chroma-shaped results) and report
+    latency plus precision@k (share of retrieved chunks from an expected source) and hit rate
+    (an expected source appears at all).
+    """
+    latencies, precisions, hits = [], [], 0
+    for q in questions:
+        start = time.perf_counter()
+        results = query_fn(q["question"])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        got = result_sources(results)[:k]
+        expected = set(q["sources"])
+        relevant = sum(1 for s in got if s in expected)
+        precisions.append(relevant / len(got) if got else 0.0)
+        hits += 1 if relevant else 0
+
+    n = len(questions) or 1
+    return {
+        "questions": len(questions),
+        f"precision@{k}": round(sum(precisions) / n, 3),
+        "hit_rate": round(hits / n, 3),
+        "latency_ms_mean": round(sum(latencies) / n, 2),
+        "latency_ms_p50": round(percentile(latencies, 50), 2),
+        "latency_ms_p95": round(percentile(latencies, 95), 2),
+    }
+
+
+if __name__ == "__main__":
+    # Usage: python fixture_store.py [path]
+    target = sys.argv[1] if len(sys.argv) > 1 else FIXTURE_CHROMA_PATH
+    _, col = build_fixture_store(target)
+    print(f"✅ Fixture store at {target} with {col.count()} chunks")
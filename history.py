@@ -0,0 +1,219 @@
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from prompting import count_tokens, message_tokens
+
+# Server-side conversation history management for /ask.
+#
+#   - stale "Web context:" blocks injected by the UI are dropped (only the current turn's is kept)
+#   - the most recent turns are kept verbatim within HISTORY_TOKEN_BUDGET
+#   - older turns are folded into a rolling summary, cached per conversation id so each turn
+#     only summarises the messages that have just aged out
+#   - follow-up questions are condensed into a standalone question for retrieval
+
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "1200"))
+SUMMARY_MAX_TOKENS = int(os.environ.get("HISTORY_SUMMARY_MAX_TOKENS", "250"))
+SUMMARY_CACHE_SIZE = int(os.environ.get("HISTORY_SUMMARY_CACHE_SIZE", "1000"))
+WEB_CONTEXT_PREFIX = "Web context:"
+
+# complete(messages, max_tokens) -> str; wraps whichever chat model does the summarising
+CompleteFn = Callable[[List[Dict[str, str]], int], str]
+
+# A follow-up that can't be understood on its own: it opens elliptically ("...", "and with rye?",
+# "what about a sour"), opens on a pronoun ("it", "those", "the same"), ends on one or on a
+# comparison with the last answer ("can I batch it?", "a cheaper one?", "rye instead?"), or has one
+# as its subject ("how long do they keep?"; not "is it better to ...", where "it" refers to nothing)
+_FOLLOW_UP_RE = re.compile(
+    r"^\s*(?:\.\.\.|…)"
+    r"|^\s*(?:and|but|or|also|then|what about|how about|what if|instead|with|without)\b"
+    r"|^\s*(?:it|its|it's|they|them|their|those|these|that one|this one|the same)\b"
+    r"|\b(?:it|them|those|these|that|one|ones|instead|too|as well)\s*[?.!]*\s*$"
+    r"|\b(?:do|does|did|can|could|should|will|would|are|were)\s+(?:it|they|those|these)\b",
+    re.IGNORECASE,
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """The prompt tokenizer (tiktoken, or ~4 chars/token when it can't be loaded); see prompting.py."""
+    return count_tokens(text)
+
+
+def messages_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(message_tokens(m) for m in messages)
+
+
+def _fingerprint(messages: List[Dict[str, str]]) -> str:
+    h = hashlib.sha1()
+    for m in messages:
+        h.update(m["role"].encode())
+        h.update(b"\0")
+        h.update(m["content"].encode("utf-8"))
+        h.update(b"\1")
+    return h.hexdigest()
+
+
+def conversation_key(conversation_id: Optional[str], history: List[Dict[str, str]]) -> Optional[str]:
+    """Use the client's conversation id; otherwise derive one from the opening user message."""
+    if conversation_id:
+        return str(conversation_id)
+    for m in history:
+        if m.get("role") == "user" and isinstance(m.get("content"), str):
+            return "auto:" + hashlib.sha1(m["content"].encode("utf-8")).hexdigest()
+    return None
+
+
+def clean_history(history: List[Dict[str, Any]], question: Optional[str] = None) -> List[Dict[str, str]]:
+    """
+    Keep user/assistant string messages. Web-context blocks are only kept when they belong to the
+    current turn, i.e. they come after the last assistant reply. If the client already put the
+    current `question` in the history, that copy is dropped; /ask appends it with the context.
+    """
+    msgs = [
+        {"role": m["role"], "content": m["content"]}
+        for m in history or []
+        if isinstance(m, dict) and m.get("role") in ("user", "assistant") and isinstance(m.get("content"), str)
+    ]
+    last_assistant = max((i for i, m in enumerate(msgs) if m["role"] == "assistant"), default=-1)
+    if question:
+        for i in range(len(msgs) - 1, last_assistant, -1):
+            if msgs[i]["role"] == "user" and msgs[i]["content"].strip() == question.strip():
+                del msgs[i]
+                break
+    return [
+        m for i, m in enumerate(msgs)
+        if not (m["content"].lstrip().startswith(WEB_CONTEXT_PREFIX) and i < last_assistant)
+    ]
+
+
+class SummaryCache:
+    """LRU of conversation id -> (rolling summary, number of messages it covers, fingerprint of those messages)."""
+
+    def __init__(self, max_entries: int = SUMMARY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[str, int, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[str, int, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, summary: str, covered: int, fingerprint: str) -> None:
+        with self._lock:
+            self._entries[key] = (summary, covered, fingerprint)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+summary_cache = SummaryCache()
+
+
+def summarise(complete: CompleteFn, previous: str, messages: List[Dict[str, str]]) -> str:
+    """Fold `messages` into the running summary `previous`."""
+    transcript = "\n".join(f"{m['role'].upper()}: {m['content']}" for m in messages)
+    prompt = (
+        "Update the running summary of a conversation between a user and CocktailGPT.\n"
+        "Keep recipes, quantities, ingredients, techniques and decisions the user cares about; drop pleasantries.\n"
+        f"Reply with the updated summary only, under {SUMMARY_MAX_TOKENS} tokens.\n\n"
+        f"Current summary:\n{previous or '(none)'}\n\nNew messages:\n{transcript}"
+    )
+    return complete([{"role": "user", "content": prompt}], SUMMARY_MAX_TOKENS).strip()
+
+
+def compact_history(
+    history: List[Dict[str, Any]],
+    complete: Optional[CompleteFn],
+    conversation_id: Optional[str] = None,
+    question: Optional[str] = None,
+    budget_tokens: int = HISTORY_TOKEN_BUDGET,
+    cache: SummaryCache = summary_cache,
+) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+    """
+    Returns (messages to send, stats). Messages are the recent turns verbatim, preceded by a
+    system message carrying the summary of everything older when there is anything older.
+    """
+    raw_tokens = messages_tokens([m for m in history or [] if isinstance(m, dict) and isinstance(m.get("content"), str)])
+    msgs = clean_history(history, question=question)
+
+    # Walk back from the newest message while the budget lasts
+    kept_from = len(msgs)
+    used = 0
+    while kept_from > 0:
+        cost = messages_tokens([msgs[kept_from - 1]])
+        if used + cost > budget_tokens:
+            break
+        used += cost
+        kept_from -= 1
+    older, recent = msgs[:kept_from], msgs[kept_from:]
+
+    summary = ""
+    cached = False
+    if older and complete is not None:
+        key = conversation_key(conversation_id, msgs)
+        entry = cache.get(key) if key else None
+        try:
+            if entry and entry[1] == len(older) and entry[2] == _fingerprint(older):
+                summary, cached = entry[0], True
+            elif entry and entry[1] < len(older) and entry[2] == _fingerprint(older[:entry[1]]):
+                summary = summarise(complete, entry[0], older[entry[1]:])
+            else:
+                summary = summarise(complete, "", older)
+            if key and not cached:
+                cache.put(key, summary, len(older), _fingerprint(older))
+        except Exception as e:
+            # Older turns are simply dropped this time; the next turn retries the summary
+            print(f"⚠️ History summary failed: {e}")
+            summary = ""
+
+    out = []
+    if summary:
+        out.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+    out.extend(recent)
+
+    sent_tokens = messages_tokens(out)
+    return out, {
+        "history_tokens_in": raw_tokens,
+        "history_tokens_sent": sent_tokens,
+        "history_tokens_saved": max(raw_tokens - sent_tokens, 0),
+        "messages_in": len(history or []),
+        "messages_verbatim": len(recent),
+        "messages_summarised": len(older) if summary else 0,
+        "summary_cached": cached,
+    }
+
+
+def needs_condensing(question: str, history: List[Dict[str, str]]) -> bool:
+    """Cheap gate: only elliptical or pronoun-dependent follow-ups get rewritten, and only mid-conversation."""
+    if not any(m["role"] == "assistant" for m in history):
+        return False
+    return bool(_FOLLOW_UP_RE.search(question))
+
+
+def condense_question(question: str, history: List[Dict[str, str]], complete: Optional[CompleteFn]) -> str:
+    """Rewrite a follow-up into a standalone question for retrieval; the original still goes to the model."""
+    if complete is None or not needs_condensing(question, history):
+        return question
+    recent = [m for m in history if not m["content"].lstrip().startswith(WEB_CONTEXT_PREFIX)][-4:]
+    transcript = "\n".join(f"{m['role'].upper()}: {m['content'][:600]}" for m in recent)
+    prompt = (
+        "Rewrite the follow-up question as a single standalone question that can be understood without the "
+        "conversation. Keep ingredient and technique names exactly. Reply with the question only.\n\n"
+        f"Conversation:\n{transcript}\n\nFollow-up: {question}"
+    )
+    try:
+        standalone = complete([{"role": "user", "content": prompt}], 80).strip()
+    except Exception as e:
+        print(f"⚠️ Question condensing failed: {e}")
+        return question
+    return standalone or question
@@ -1,23 +1,22 @@
 import os
-import openai
 from chromadb import PersistentClient
-from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
-from utils import extract_text_from_pdf, clean_text, chunk_text
+from utils import iter_pages_from_pdf, join_pages, chunk_document
+from text_store import write_document
+from embeddings import open_collection
+from source_index import SOURCES_COLLECTION, update_sources
 from tqdm import tqdm
 from dotenv import load_dotenv
 
-# Load API key from .env
+# Load API key from .env (EMBEDDING_BACKEND=openai needs it; onnx runs locally)
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
 
 # Initialise ChromaDB vector database (unified path)
 client = PersistentClient(path="/tmp/chroma_store")
 
-# Define collection (creates if not exists) — unified name
-collection = client.get_or_create_collection(
-    name="cocktailgpt",
-    embedding_function=OpenAIEmbeddingFunction(api_key=openai.api_key)
-)
+# Define collection (creates if not exists) — unified name, embedded with EMBEDDING_BACKEND
+collection = open_collection(client, "cocktailgpt")
+# Per-source summaries for two-stage retrieval (source_index.py)
+sources_collection = open_collection(client, SOURCES_COLLECTION)
 
 # Ingest all PDFs from the /pdfs folder
 pdf_folder = "./pdfs"
@@ -30,14 +29,15 @@ for fname in os.listdir(pdf_folder):
     print(f"📄 Processing {fname}...")
 
     full_path = os.path.join(pdf_folder, fname)
-    raw_text = extract_text_from_pdf(full_path)
-    cleaned = clean_text(raw_text)
-    chunks = chunk_text(cleaned)
+    text, page_starts = join_pages(iter_pages_from_pdf(full_path))
+    write_document(fname, text, page_starts)
+    chunks = list(chunk_document(text, page_starts))
 
-    for i, chunk in enumerate(tqdm(chunks, desc=f"Embedding chunks from {fname}")):
+    for i, (chunk, provenance) in enumerate(tqdm(chunks, desc=f"Embedding chunks from {fname}")):
         metadata = {
             "source": fname,
-            "chunk": i
+            "chunk": i,
+            **provenance
         }
         try:
             collection.add(
@@ -48,4 +48,7 @@ for fname in os.listdir(pdf_folder):
         except Exception as e:
             print(f"❌ Failed to add chunk {i} from {fname}: {e}")
 
+    # Without a summary entry the file could never be picked in two-stage retrieval's first stage
+    update_sources(collection, sources_collection, {fname})
+
 print("✅ All files processed and embedded.")
@@ -1,49 +1,80 @@
 import os
-from io import BytesIO
 import hashlib
 import json
+from itertools import islice
 from tqdm import tqdm
 
-from chromadb import PersistentClient
-from supabase import create_client
-from utils import extract_text_from_pdf, clean_text, chunk_text
+from utils import iter_pages_from_pdf, join_pages, chunk_document
+from text_store import TEXT_STORE_PATH, write_document
+from csv_ingest import iter_csv_chunks
+from source_index import SOURCES_COLLECTION, update_sources
+from shared_store import open_chroma_client
+from embeddings import open_collection
+from dedup import DEDUP_INDEX_PATH, DedupIndex, add_deduplicated
+from storage import open_storage, list_files, iter_downloads
 
-# Load environment variables
-SUPABASE_URL = os.environ["SUPABASE_URL"]
-SUPABASE_SERVICE_ROLE_KEY = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
-SUPABASE_BUCKET = os.environ.get("SUPABASE_BUCKET", "cocktailgpt-pdfs")
+# Nothing is opened at import: api.py passes its own collections (or a workspace's), and the bucket
+# (Supabase, or a local stand-in with STORAGE_BACKEND=local, see storage.py) is opened on first ingest
 
-# Supabase client
-supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+def open_store_collections():
+    """(chunks, sources) collections of the main store, for running ingest as a script.
+    PersistentClient, or the shared local server with CHROMA_MODE=http; documents are embedded with
+    EMBEDDING_BACKEND, the same backend the API embeds questions with."""
+    client = open_chroma_client()
+    return open_collection(client, "cocktailgpt"), open_collection(client, SOURCES_COLLECTION)
 
-# ✅ Chroma PersistentClient (v3+)
-client = PersistentClient(path="/tmp/chroma_store")
-collection = client.get_or_create_collection("cocktailgpt")
+# Skip (and link) chunks that duplicate one already in the store; DEDUP=0 embeds every copy
+DEDUP = os.environ.get("DEDUP", "1") == "1"
 
 # Track previously ingested files
 ingested_path = "ingested_files.json"
-if os.path.exists(ingested_path):
-    with open(ingested_path) as f:
-        ingested = json.load(f)
-else:
-    ingested = {}
 
-def ingest_supabase_docs(collection):
+def load_ingested(path=ingested_path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+def ingest_supabase_docs(collection, sources_collection=None, job=None, prefix="pdfs", text_path=TEXT_STORE_PATH,
+                         dedup_path=DEDUP_INDEX_PATH, state_path=ingested_path, max_chunks=None, storage=None):
+    """
+    `job` (jobs.Job) gets file/chunk/byte progress and is checked for cancellation between files.
+    A workspace (workspaces.py) passes its own bucket folder, text store, dedup index and state file,
+    plus `max_chunks` from its memory limit: files stop being added once the collection holds that many.
+    `storage` defaults to the configured bucket (storage.open_storage).
+    """
+    storage = storage or open_storage()
     print(f"🌐 Railway: {os.environ.get('RAILWAY_ENVIRONMENT') == 'true'} · SKIP_INGEST: {os.environ.get('SKIP_INGEST') == '1'}")
-    print("🔍 Fetching files from Supabase...")
+    print(f"🔍 Fetching files from {storage.name} storage ({prefix}/)...")
 
-    files = []
-    res = supabase.storage.from_(SUPABASE_BUCKET).list("pdfs/", {"limit": 10000})
-    for file in res:
-        if file["name"].endswith(".pdf") or file["name"].endswith(".csv"):
-            files.append(f"pdfs/{file['name']}")
+    ingested = load_ingested(state_path)
+    files = [entry.path for entry in list_files(storage, prefix, recursive=False)]
 
     print(f"📁 Files found: {files}")
+    if job is not None:
+        job.progress(files_total=len(files))
     skipped = 0
     added = 0
-
-    for filepath in tqdm(files):
+    ingested_now = []
+    dedup_index = DedupIndex(dedup_path) if DEDUP else None
+    duplicates = 0
+    limit_reached = False
+
+    # Downloads run ahead on a small pool into temp files; each one is removed once the loop moves on
+    downloads = iter_downloads(storage, files)
+    for download in tqdm(downloads, total=len(files)):
+        filepath = download.path
         filename = filepath.split("/")[-1]
+        if job is not None and job.cancelled:
+            # Stop between files so ingested_files.json and the source index stay consistent
+            print(f"🛑 Ingest cancelled before {filename}")
+            downloads.close()
+            break
+        if max_chunks is not None and collection.count() >= max_chunks:
+            print(f"🧱 Workspace limit of {max_chunks} chunks reached before {filename}; stopping")
+            limit_reached = True
+            downloads.close()
+            break
 
         # 🔁 Disable skip logic to force re-ingestion
         # if filename in ingested:
@@ -51,56 +82,82 @@ def ingest_supabase_docs(collection):
         #     continue
 
         try:
-            response = supabase.storage.from_(SUPABASE_BUCKET).download(filepath)
-            file_bytes = response
+            if download.error:
+                raise RuntimeError(download.error)
+            if job is not None:
+                job.add(bytes=download.size)
 
             if filename.endswith(".pdf"):
-                text = extract_text_from_pdf(BytesIO(file_bytes))
+                # Cleaned once, page by page (text_cleaning.py); page offsets let each chunk record
+                # the pages it spans, and the text goes to the text store for /source/{id}
+                text, page_starts = join_pages(iter_pages_from_pdf(download.local_path))
+                write_document(filename, text, page_starts, path=text_path)
+                records = (
+                    (chunk, {"source": filename, "chunk": i, **provenance})
+                    for i, (chunk, provenance) in enumerate(chunk_document(text, page_starts))
+                )
             elif filename.endswith(".csv"):
-                text = file_bytes.decode("utf-8")
+                # Row groups with the header repeated; rows are never split across chunks
+                records = iter_csv_chunks(download.local_path, filename)
             else:
                 continue
 
-            clean = clean_text(text)
-            chunks = chunk_text(clean)
-
-            if not chunks:
-                print(f"⚠️ No chunks from {filename}")
-                continue
-
-            valid_docs = []
-            valid_metadatas = []
-            valid_ids = []
-
-            for i, chunk in enumerate(chunks):
-                chunk_id = hashlib.sha256((filename + str(i)).encode()).hexdigest()
-                valid_docs.append(chunk)
-                valid_metadatas.append({"source": filename, "chunk": i})
-                valid_ids.append(chunk_id)
-
-            if valid_docs:
-                for i in range(0, len(valid_docs), 20):
-                    batch_ids = valid_ids[i:i+20]
-                    try:
-                        collection.delete(ids=batch_ids)
-                    except:
-                        pass
-
+            n_chunks = 0
+            records = iter(records)
+            while batch := list(islice(records, 20)):
+                batch_docs = [doc for doc, _ in batch]
+                batch_metadatas = [meta for _, meta in batch]
+                batch_ids = [hashlib.sha256((filename + str(meta["chunk"])).encode()).hexdigest() for meta in batch_metadatas]
+                try:
+                    collection.delete(ids=batch_ids)
+                except:
+                    pass
+
+                if dedup_index is not None:
+                    duplicates += add_deduplicated(collection, dedup_index, batch_ids, batch_docs, batch_metadatas)["duplicates"]
+                else:
                     collection.add(
-                        documents=valid_docs[i:i+20],
-                        metadatas=valid_metadatas[i:i+20],
+                        documents=batch_docs,
+                        metadatas=batch_metadatas,
                         ids=batch_ids
                     )
-                    print(f"🧮 Collection now has {collection.count()} chunks")
+                n_chunks += len(batch)
+                if job is not None:
+                    job.add(chunks=len(batch))
+                print(f"🧮 Collection now has {collection.count()} chunks")
 
+            if not n_chunks:
+                print(f"⚠️ No chunks from {filename}")
+                continue
 
             ingested[filename] = True
+            ingested_now.append(filename)
             added += 1
 
         except Exception as e:
             print(f"❌ Failed on {filepath}: {e}")
+        finally:
+            if job is not None:
+                job.add(files_done=1)
 
-    with open(ingested_path, "w") as f:
+    with open(state_path, "w") as f:
         json.dump(ingested, f)
 
+    dedup_report = {}
+    if dedup_index is not None:
+        dedup_report = {**dedup_index.stats, "totals": dedup_index.report()}
+        dedup_index.close()
+        print(f"🧬 Duplicates skipped this run: {duplicates} "
+              f"(exact {dedup_report['exact_duplicates']}, near {dedup_report['near_duplicates']}) · "
+              f"embedding calls saved: {duplicates} · totals: {dedup_report['totals']}")
+
+    # Refresh source-level summaries for two-stage retrieval
+    if sources_collection is not None and ingested_now:
+        try:
+            n = update_sources(collection, sources_collection, ingested_now)
+            print(f"🗂️ Source index updated for {n} files")
+        except Exception as e:
+            print(f"⚠️ Source index update failed: {e}")
+
     print(f"✅ Done. {added} files ingested, {skipped} skipped.")
+    return {"files_ingested": added, "skipped": skipped, "dedup": dedup_report, "limit_reached": limit_reached}
@@ -0,0 +1,397 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# In-process background jobs for maintenance work (ingest, retag, normalise, zip, assemble, restore).
+#
+#   - jobs run on their own small thread pool, so the FastAPI worker threads serving /ask are never tied up
+#   - job state is written to JOB_STATE_PATH and reloaded on start; jobs that were queued or running
+#     when the process died come back as "interrupted". A job records its owner as pid plus that
+#     process's start time, so a restarted container whose new process got the same pid (often this
+#     very one) doesn't keep the old jobs, and their locks, "running" forever
+#   - progress counters (files, chunks, bytes) are reported by the job function through `job.progress`
+#   - cancellation is cooperative: long loops check `job.cancelled` at a safe point and stop
+#   - named locks (e.g. "chroma_store") keep conflicting jobs apart: a restore waits for a running ingest,
+#     also when they were started by different uvicorn workers
+
+JOB_STATE_PATH = os.environ.get("JOB_STATE_PATH", "/tmp/cocktailgpt_jobs.json")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_LOCK_DIR = os.environ.get("JOB_LOCK_DIR", "/tmp/cocktailgpt_locks")
+JOB_HISTORY = int(os.environ.get("JOB_HISTORY", "200"))  # finished jobs kept in the state file
+SAVE_INTERVAL = 1.0  # seconds between progress-only state writes
+
+# Lock names shared by api.py and the maintenance scripts
+STORE_LOCK = "chroma_store"  # anything that writes (or snapshots) the vector store
+ZIP_LOCK = "chroma_zip"      # /tmp/chroma_store.zip and its parts
+
+ACTIVE = ("queued", "running")
+FINISHED = ("succeeded", "failed", "cancelled", "interrupted")
+
+
+def _process_token(pid: int) -> Optional[str]:
+    """"pid:start time" (clock ticks since boot, /proc/<pid>/stat field 22); None when there is no such process."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    return f"{pid}:{stat.rsplit(')', 1)[1].split()[19]}"  # the command name may contain spaces
+
+
+# Identifies this process in saved job state; a random one where there is no /proc
+BOOT_TOKEN = _process_token(os.getpid()) or f"{os.getpid()}:{uuid.uuid4().hex}"
+
+
+class JobCancelled(BaseException):
+    """
+    Raised by `job.raise_if_cancelled()`. Derives from BaseException (like KeyboardInterrupt) so the
+    broad `except Exception` blocks in the ingest/retag loops don't swallow it.
+    """
+
+
+class Job:
+    def __init__(self, kind: str, params: Optional[Dict[str, Any]] = None, locks: Iterable[str] = (), job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params or {}
+        self.locks = sorted(set(locks))  # always acquired in name order, so jobs can't deadlock
+        self.status = "queued"
+        self.message = ""
+        self.error: Optional[str] = None
+        self.result: Any = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.counters: Dict[str, int] = {"files_done": 0, "files_total": 0, "chunks": 0, "bytes": 0}
+        self.pid = os.getpid()
+        self.owner: Optional[str] = BOOT_TOKEN
+        self._cancel = threading.Event()
+        self._manager: Optional["JobManager"] = None
+
+    # ----- called from the job function -----
+    def progress(self, message: Optional[str] = None, **counters: int) -> None:
+        """Set counters, e.g. job.progress(files_total=12) or job.progress(chunks=job.counters["chunks"] + 20)."""
+        self.counters.update(counters)
+        if message is not None:
+            self.message = message
+        if self._manager is not None:
+            self._manager.save(force=False)
+
+    def add(self, **deltas: int) -> None:
+        """Increment counters, e.g. job.add(files_done=1, bytes=len(data))."""
+        self.progress(**{k: self.counters.get(k, 0) + v for k, v in deltas.items()})
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def raise_if_cancelled(self) -> None:
+        if self._cancel.is_set():
+            raise JobCancelled(self.id)
+
+    # ----- serialisation -----
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.finished_at or time.time()
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "params": self.params,
+            "locks": self.locks,
+            "message": self.message,
+            "error": self.error,
+            "result": self.result,
+            "progress": dict(self.counters),
+            "cancel_requested": self.cancelled,
+            "pid": self.pid,
+            "owner": self.owner,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_s": round(end - self.started_at, 1) if self.started_at else None,
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Job":
+        job = cls(d["kind"], d.get("params"), d.get("locks") or (), job_id=d["id"])
+        job.status = d.get("status", "interrupted")
+        job.message = d.get("message", "")
+        job.error = d.get("error")
+        job.result = d.get("result")
+        job.created_at = d.get("created_at") or time.time()
+        job.started_at = d.get("started_at")
+        job.finished_at = d.get("finished_at")
+        job.counters.update(d.get("progress") or {})
+        job.pid = d.get("pid")
+        job.owner = d.get("owner")
+        if d.get("cancel_requested"):
+            job._cancel.set()
+        return job
+
+
+class NamedLock:
+    """
+    threading.Lock for the threads of this process plus an flock on JOB_LOCK_DIR/<name>.lock for the
+    other API workers, so e.g. a restore in one uvicorn worker still waits for an ingest in another.
+    """
+
+    def __init__(self, name: str, lock_dir: str = JOB_LOCK_DIR):
+        os.makedirs(lock_dir, exist_ok=True)
+        self.name = name
+        self.path = os.path.join(lock_dir, f"{name}.lock")
+        self._thread_lock = threading.Lock()
+        self._file = None
+
+    def acquire(self, timeout: float) -> bool:
+        if not self._thread_lock.acquire(timeout=timeout):
+            return False
+        f = open(self.path, "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            self._thread_lock.release()
+            time.sleep(timeout)
+            return False
+        self._file = f
+        return True
+
+    def release(self) -> None:
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+        self._thread_lock.release()
+
+    def locked(self) -> bool:
+        if self._thread_lock.locked():
+            return True
+        with open(self.path, "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(f, fcntl.LOCK_UN)
+        return False
+
+
+@contextmanager
+def script_lock(name: str, lock_dir: str = JOB_LOCK_DIR, poll: float = 0.5):
+    """Hold a named lock from a maintenance script run outside the API, waiting for jobs that hold it."""
+    lock = NamedLock(name, lock_dir)
+    if not lock.acquire(timeout=poll):
+        print(f"⏳ Waiting for lock '{name}' (a job is using it)...")
+        while not lock.acquire(timeout=poll):
+            pass
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _owner_alive(d: Dict[str, Any]) -> bool:
+    """Whether the process that saved job `d` is still running (and is not a later one with its pid)."""
+    pid, owner = d.get("pid"), d.get("owner")
+    if not pid:
+        return False
+    if owner is None:
+        return _pid_alive(pid)  # saved before owners were recorded
+    if pid == os.getpid():
+        return owner == BOOT_TOKEN
+    if not os.path.isdir("/proc"):
+        return _pid_alive(pid)
+    return _process_token(pid) == owner
+
+
+class JobManager:
+    """
+    One per process. With several API workers they share JOB_STATE_PATH: each process merges its own
+    jobs into the file under an flock, and sees the others' jobs (read-only) through it.
+    """
+
+    def __init__(self, state_path: str = JOB_STATE_PATH, workers: int = JOB_WORKERS, lock_dir: str = JOB_LOCK_DIR):
+        self.state_path = state_path
+        self.lock_dir = lock_dir
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="job")
+        self._jobs: Dict[str, Job] = {}
+        self._locks: Dict[str, NamedLock] = {}
+        self._state_lock = threading.RLock()
+        self._last_save = 0.0
+        self.save()  # marks jobs whose owning process is gone as interrupted
+
+    # ----- persistence -----
+    def _read_state(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.state_path) as f:
+                return {d["id"]: d for d in json.load(f).get("jobs", [])}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ Could not read job state {self.state_path}: {e}")
+            return {}
+
+    def save(self, force: bool = True) -> None:
+        with self._state_lock:
+            now = time.time()
+            if not force and now - self._last_save < SAVE_INTERVAL:
+                return
+            self._last_save = now
+            try:
+                with open(self.state_path + ".lock", "a") as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    saved = self._read_state()
+                    for job_id, d in saved.items():
+                        if job_id in self._jobs:
+                            # /jobs/{id}/cancel handled by another worker
+                            if d.get("cancel_requested") and self._jobs[job_id].status in ACTIVE:
+                                self._jobs[job_id]._cancel.set()
+                        elif d.get("status") in ACTIVE and not _owner_alive(d):
+                            # The process that owned it is gone; it has to be resubmitted
+                            d["status"] = "interrupted"
+                            d["finished_at"] = d.get("finished_at") or now
+                    for job in list(self._jobs.values()):
+                        saved[job.id] = job.to_dict()
+                    jobs = sorted(saved.values(), key=lambda d: d.get("created_at") or 0)
+                    finished = [d for d in jobs if d.get("status") in FINISHED]
+                    drop = {d["id"] for d in finished[:max(len(finished) - JOB_HISTORY, 0)]}
+                    for job_id in drop:
+                        if job_id in self._jobs:
+                            del self._jobs[job_id]
+                    tmp = f"{self.state_path}.{os.getpid()}.tmp"
+                    with open(tmp, "w") as f:
+                        json.dump({"jobs": [d for d in jobs if d["id"] not in drop]}, f, default=str)
+                    os.replace(tmp, self.state_path)  # atomic, so a crash never leaves half a file
+            except OSError as e:
+                print(f"⚠️ Could not write job state {self.state_path}: {e}")
+
+    # ----- locks -----
+    def named_lock(self, name: str) -> NamedLock:
+        with self._state_lock:
+            if name not in self._locks:
+                self._locks[name] = NamedLock(name, self.lock_dir)
+            return self._locks[name]
+
+    def locked(self, name: str) -> bool:
+        return self.named_lock(name).locked()
+
+    def _acquire(self, job: Job) -> List[NamedLock]:
+        held = []
+        for name in job.locks:
+            lock = self.named_lock(name)
+            while not lock.acquire(timeout=0.5):
+                holder = next((j for j in self.list(status="running") if name in j.locks), None)
+                job.message = f"waiting for lock '{name}'" + (f" (held by {holder.kind} {holder.id})" if holder else "")
+                # Publishes the message and picks up a cancel sent through another worker
+                self.save(force=False)
+                if job.cancelled:
+                    for h in reversed(held):
+                        h.release()
+                    raise JobCancelled(job.id)
+            held.append(lock)
+        return held
+
+    # ----- jobs -----
+    def submit(self, kind: str, fn: Callable[..., Any], params: Optional[Dict[str, Any]] = None, locks: Iterable[str] = ()) -> Job:
+        """Queue `fn(job, **params)`; returns immediately with the Job."""
+        job = Job(kind, params, locks)
+        job._manager = self
+        with self._state_lock:
+            self._jobs[job.id] = job
+        self.save()
+        self._pool.submit(self._run, job, fn)
+        print(f"🧰 Job {job.id} queued: {kind} {job.params or ''}")
+        return job
+
+    def _run(self, job: Job, fn: Callable[..., Any]) -> None:
+        held: List[NamedLock] = []
+        try:
+            held = self._acquire(job)
+            job.raise_if_cancelled()
+            job.status, job.started_at, job.message = "running", time.time(), ""
+            self.save()
+            result = fn(job, **job.params)
+            job.result = result
+            job.status = "cancelled" if job.cancelled else "succeeded"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.status, job.error = "failed", str(e)
+            print(f"❌ Job {job.id} ({job.kind}) failed: {e}")
+        finally:
+            for lock in reversed(held):
+                lock.release()
+            job.finished_at = time.time()
+            self.save()
+        print(f"🧰 Job {job.id} {job.status}: {job.kind} {job.counters}")
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Jobs of this process are live objects; other workers' jobs are read from the state file."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            d = self._read_state().get(job_id)
+            job = Job.from_dict(d) if d else None
+        return job
+
+    def list(self, status: Optional[str] = None, kind: Optional[str] = None) -> List[Job]:
+        jobs = {job_id: Job.from_dict(d) for job_id, d in self._read_state().items()}
+        jobs.update(dict(self._jobs))
+        ordered = sorted(jobs.values(), key=lambda j: j.created_at, reverse=True)
+        return [j for j in ordered if (status is None or j.status == status) and (kind is None or j.kind == kind)]
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is None:
+            # Owned by another worker: flag it in the state file, the owner picks it up on its next save
+            with open(self.state_path + ".lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                saved = self._read_state()
+                d = saved.get(job_id)
+                if d is None:
+                    return None
+                if d.get("status") in ACTIVE:
+                    d["cancel_requested"] = True
+                    tmp = f"{self.state_path}.{os.getpid()}.tmp"
+                    with open(tmp, "w") as f:
+                        json.dump({"jobs": list(saved.values())}, f, default=str)
+                    os.replace(tmp, self.state_path)
+            return Job.from_dict(d)
+        if job.status in ACTIVE:
+            job._cancel.set()
+            job.message = "cancel requested"
+            self.save()
+        return job
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Job]:
+        """Block until the job finishes (scripts / tests; request handlers should poll /jobs/{id})."""
+        deadline = None if timeout is None else time.time() + timeout
+        job = self.get(job_id)
+        while job is not None and job.status in ACTIVE:
+            if deadline is not None and time.time() > deadline:
+                break
+            time.sleep(0.1)
+            job = self._jobs.get(job_id) or self.get(job_id)
+        return job
+
+    def shutdown(self) -> None:
+        for job in list(self._jobs.values()):
+            if job.status in ACTIVE:
+                job._cancel.set()
+        self._pool.shutdown(wait=False)
+        self.save()
@@ -0,0 +1,330 @@
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from fixture_store import load_questions, percentile
+
+# Load test for /ask without OpenAI credits: the API serves the fixture store (hashing embeddings)
+# and talks to stub_openai.py, and a driver replays a question mix at rising concurrency.
+#
+#   python loadtest.py run [--concurrency=1,4,8,16] [--requests=200] [--workers=1] [--mode=embedded]
+#                          [--stub-latency=0.3] [--stub-jitter=0.05] [--error-rate=0] [--adaptive-k=0]
+#                          [--url=http://host:port]  (drive an API that is already running instead)
+#                          [--out=loadtest.json]
+#   python loadtest.py compare base.json new.json [--tolerance=0.15]
+#   python loadtest.py admission [--stub-latency=0.5] [--out=admission.json]
+#
+# `run` prints (and with --out writes) one JSON report: per concurrency step the throughput,
+# p50/p95/p99/max latency and error rate. `compare` exits 1 when a step got slower (p95), lost
+# throughput or gained errors beyond the tolerance, so CI can diff two commits.
+#
+# `admission` exercises admission.py with small limits: identical concurrent questions (LLM calls vs
+# requests), more distinct concurrent questions than run + queue slots (fast 429s), then one client
+# bursting while another asks at a steady pace (the burst should get 429s, the steady client none).
+# It exits 1 when an expectation fails.
+
+STEPS = (1, 4, 8, 16)
+OFF_TOPIC = ["What's the weather in Paris tomorrow?", "How do I change a car tyre?", "Who won the 1998 World Cup?"]
+FOLLOW_UPS = ["What about with lime instead?", "Why does that work?", "How long does it keep?"]
+
+
+def question_mix(seed: int = 7) -> List[Dict[str, Any]]:
+    """Fixture questions, a few off-topic ones and follow-ups carrying a short history."""
+    rng = random.Random(seed)
+    fixtures = [q["question"] for q in load_questions()]
+    mix: List[Dict[str, Any]] = [{"question": q} for q in fixtures]
+    mix += [{"question": q} for q in OFF_TOPIC]
+    for q in FOLLOW_UPS:
+        opener = rng.choice(fixtures)
+        mix.append({
+            "question": q,
+            "history": [{"role": "user", "content": opener}, {"role": "assistant", "content": "Stub answer."}],
+            "conversation_id": "loadtest-" + hashlib.sha1(opener.encode("utf-8")).hexdigest()[:8],
+        })
+    rng.shuffle(mix)
+    return mix
+
+
+def run_step(url: str, payloads: List[Dict[str, Any]], requests: int, concurrency: int,
+             timeout: float = 120.0) -> Dict[str, Any]:
+    import httpx
+
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def one(i: int) -> None:
+        start = time.perf_counter()
+        try:
+            r = client.post(url + "/ask", json=payloads[i % len(payloads)], timeout=timeout)
+            failure = None if r.status_code == 200 else f"http_{r.status_code}"
+        except Exception as e:
+            failure = type(e).__name__
+        elapsed = time.perf_counter() - start
+        with lock:
+            if failure:
+                errors[failure] = errors.get(failure, 0) + 1
+            else:
+                latencies.append(elapsed)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    with httpx.Client(limits=limits) as client:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(requests)))
+        seconds = time.perf_counter() - started
+
+    n_errors = sum(errors.values())
+    ms = lambda p: round(percentile(latencies, p) * 1000, 1) if latencies else None
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "ok": len(latencies),
+        "errors": errors,
+        "error_rate": round(n_errors / requests, 4) if requests else 0.0,
+        "seconds": round(seconds, 2),
+        "throughput_rps": round(len(latencies) / seconds, 2) if seconds else 0.0,
+        "p50_ms": ms(50),
+        "p95_ms": ms(95),
+        "p99_ms": ms(99),
+        "max_ms": round(max(latencies) * 1000, 1) if latencies else None,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(
+    steps=STEPS,
+    requests: int = 200,
+    workers: int = 1,
+    mode: str = "embedded",
+    stub_latency: float = 0.3,
+    stub_jitter: float = 0.05,
+    error_rate: float = 0.0,
+    adaptive_k: bool = False,
+    url: Optional[str] = None,
+) -> Dict[str, Any]:
+    from serve import (BENCH_API_PORT, BENCH_CHROMA_PATH, BENCH_STUB_PORT, _wait_healthy, bench_env,
+                       prepare_bench_store, start_api, start_chroma_server, stop)
+    from stub_openai import start_stub_openai
+
+    payloads = question_mix()
+    report: Dict[str, Any] = {
+        "commit": _git_commit(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "requests_per_step": requests, "workers": workers, "chroma_mode": mode, "stub_latency_s": stub_latency,
+            "stub_jitter_s": stub_jitter, "stub_error_rate": error_rate, "adaptive_k": adaptive_k,
+            "question_mix": len(payloads), "target": url or "local",
+        },
+        "steps": [],
+    }
+
+    stub = chroma_proc = api_proc = None
+    try:
+        if url is None:
+            prepare_bench_store()
+            stub = start_stub_openai(BENCH_STUB_PORT, latency=stub_latency, jitter=stub_jitter,
+                                     answer_tokens=120, error_rate=error_rate, seed=1)
+            env = bench_env(mode)
+            env["ADAPTIVE_K"] = "1" if adaptive_k else "0"
+            env["QUERY_LOG"] = "1"
+            if mode == "http":
+                chroma_proc = start_chroma_server(BENCH_CHROMA_PATH, env)
+            api_proc = start_api(workers, BENCH_API_PORT, env, quiet=True)
+            url = f"http://127.0.0.1:{BENCH_API_PORT}"
+            _wait_healthy(url, workers)
+
+        run_step(url, payloads, max(steps) * 2, max(steps))  # warm-up
+        for concurrency in steps:
+            row = run_step(url, payloads, requests, concurrency)
+            print(f"📏 c={concurrency}: {row['throughput_rps']} req/s · p50 {row['p50_ms']} · p95 {row['p95_ms']} · "
+                  f"p99 {row['p99_ms']} ms · errors {row['error_rate']:.1%}")
+            report["steps"].append(row)
+    finally:
+        stop(api_proc)
+        stop(chroma_proc)
+        if stub is not None:
+            stub.shutdown()
+    return report
+
+
+def _send(url: str, jobs: List[Dict[str, Any]], concurrency: int, timeout: float = 120.0) -> List[Dict[str, Any]]:
+    """POST each {"payload", "key"} to /ask (X-API-Key: key); status, latency and X-Coalesced per job."""
+    import httpx
+
+    def one(job: Dict[str, Any]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            r = client.post(url + "/ask", json=job["payload"], headers={"X-API-Key": job["key"]}, timeout=timeout)
+            status, coalesced = r.status_code, r.headers.get("x-coalesced") == "1"
+        except Exception as e:
+            status, coalesced = type(e).__name__, False
+        return {"key": job["key"], "status": status, "coalesced": coalesced, "seconds": time.perf_counter() - start}
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    with httpx.Client(limits=limits) as client:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(one, jobs))
+
+
+def _outcome(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    ok = [r["seconds"] for r in rows if r["status"] == 200]
+    return {
+        "requests": len(rows),
+        "ok": len(ok),
+        "rejected_429": sum(1 for r in rows if r["status"] == 429),
+        "other_errors": sum(1 for r in rows if r["status"] not in (200, 429)),
+        "coalesced": sum(1 for r in rows if r["coalesced"]),
+        "p50_ms": round(percentile(ok, 50) * 1000, 1) if ok else None,
+        "p95_ms": round(percentile(ok, 95) * 1000, 1) if ok else None,
+    }
+
+
+def admission_scenario(stub_latency: float = 0.5, identical: int = 24, burst: int = 60, steady: int = 8) -> Dict[str, Any]:
+    import httpx
+    from serve import BENCH_API_PORT, BENCH_STUB_PORT, _wait_healthy, bench_env, prepare_bench_store, start_api, stop
+    from stub_openai import start_stub_openai
+
+    limits = {"RATE_LIMIT_RPS": "2", "RATE_LIMIT_BURST": "5", "ADMISSION_MAX_CONCURRENT": "4",
+              "ADMISSION_MAX_QUEUE": "8", "ADMISSION_QUEUE_TIMEOUT_S": "10"}
+    keys = [f"client-{i}" for i in range(identical)] + ["burst", "steady"]
+    questions = [q["question"] for q in load_questions()]
+    report: Dict[str, Any] = {"commit": _git_commit(), "config": {"stub_latency_s": stub_latency, **limits}}
+
+    stub = api_proc = None
+    try:
+        prepare_bench_store()
+        stub = start_stub_openai(BENCH_STUB_PORT, latency=stub_latency, answer_tokens=40, seed=1)
+        chat_calls = lambda: stub.RequestHandlerClass.config.stats["chat"]
+        env = bench_env("embedded")
+        env.update(limits, ADMISSION="1", RATE_LIMIT_KEYS=",".join(keys), QUERY_LOG="0")
+        api_proc = start_api(1, BENCH_API_PORT, env, quiet=True)
+        url = f"http://127.0.0.1:{BENCH_API_PORT}"
+        _wait_healthy(url, 1)
+
+        # Same question from many clients at once: one retrieval and one LLM call between them
+        before = chat_calls()
+        same = {"question": questions[0]}
+        rows = _send(url, [{"payload": same, "key": key} for key in keys[:identical]], identical)
+        report["identical"] = {**_outcome(rows), "llm_calls": chat_calls() - before}
+        print(f"📏 identical ×{identical}: {report['identical']['ok']} ok, {report['identical']['coalesced']} coalesced, "
+              f"{report['identical']['llm_calls']} LLM calls")
+
+        # Distinct questions from as many clients: 4 run, 8 queue, the rest get an immediate 429
+        rows = _send(url, [{"payload": {"question": questions[i % len(questions)] + f" [{i}]"}, "key": key}
+                           for i, key in enumerate(keys[:identical])], identical)
+        report["overload"] = _outcome(rows)
+        print(f"📏 overload ×{identical}: {report['overload']['ok']} ok, {report['overload']['rejected_429']} × 429")
+        time.sleep(3)  # let the buckets refill
+
+        # One client fires a burst of distinct questions while another asks every half second
+        steady_rows: List[Dict[str, Any]] = []
+
+        def pace() -> None:
+            for i in range(steady):
+                steady_rows.extend(_send(url, [{"payload": {"question": questions[-1 - i % len(questions)]}, "key": "steady"}], 1))
+                time.sleep(0.5)
+
+        pacer = threading.Thread(target=pace)
+        pacer.start()
+        burst_rows = _send(url, [{"payload": {"question": questions[i % len(questions)] + f" ({i})"}, "key": "burst"}
+                                 for i in range(burst)], 30)
+        pacer.join()
+        report["burst"] = _outcome(burst_rows)
+        report["steady"] = _outcome(steady_rows)
+        print(f"📏 burst ×{burst}: {report['burst']['ok']} ok, {report['burst']['rejected_429']} × 429 · "
+              f"steady ×{steady}: {report['steady']['ok']} ok, p95 {report['steady']['p95_ms']} ms")
+        report["admission"] = httpx.get(url + "/debug/admission", timeout=10).json()
+    finally:
+        stop(api_proc)
+        if stub is not None:
+            stub.shutdown()
+
+    report["failures"] = [
+        msg for bad, msg in (
+            (report["identical"]["llm_calls"] >= identical, "identical questions were not coalesced"),
+            (report["overload"]["rejected_429"] == 0, "the queue never filled up"),
+            (report["burst"]["rejected_429"] == 0, "the burst was never rate limited"),
+            (report["steady"]["ok"] < steady, "the steady client was rejected"),
+        ) if bad
+    ]
+    return report
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any], tolerance: float = 0.15) -> Dict[str, Any]:
+    """Step-by-step diff of two reports; `regressions` lists what moved the wrong way beyond `tolerance`."""
+    base_steps = {s["concurrency"]: s for s in base["steps"]}
+    rows, regressions = [], []
+    for step in new["steps"]:
+        old = base_steps.get(step["concurrency"])
+        if old is None:
+            continue
+        row = {"concurrency": step["concurrency"]}
+        for key, worse_if_higher in (("p95_ms", True), ("p99_ms", True), ("throughput_rps", False)):
+            a, b = old.get(key), step.get(key)
+            change = (b - a) / a if a and b is not None else None
+            row[key] = {"base": a, "new": b, "change": round(change, 3) if change is not None else None}
+            if change is not None and (change > tolerance if worse_if_higher else change < -tolerance):
+                regressions.append(f"c={step['concurrency']} {key} {a} → {b} ({change:+.0%})")
+        row["error_rate"] = {"base": old["error_rate"], "new": step["error_rate"]}
+        if step["error_rate"] > old["error_rate"] + 0.01:
+            regressions.append(f"c={step['concurrency']} error_rate {old['error_rate']:.1%} → {step['error_rate']:.1%}")
+        rows.append(row)
+    return {"base": base.get("commit"), "new": new.get("commit"), "tolerance": tolerance,
+            "steps": rows, "regressions": regressions}
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    opts = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    command = args[0] if args else "run"
+    if command == "run":
+        result = run(
+            steps=[int(c) for c in opts.get("concurrency", ",".join(map(str, STEPS))).split(",")],
+            requests=int(opts.get("requests", "200")),
+            workers=int(opts.get("workers", "1")),
+            mode=opts.get("mode", "embedded"),
+            stub_latency=float(opts.get("stub-latency", "0.3")),
+            stub_jitter=float(opts.get("stub-jitter", "0.05")),
+            error_rate=float(opts.get("error-rate", "0")),
+            adaptive_k=opts.get("adaptive-k", "0") == "1",
+            url=opts.get("url"),
+        )
+        text = json.dumps(result, indent=2)
+        if opts.get("out"):
+            with open(opts["out"], "w") as f:
+                f.write(text + "\n")
+        print(text)
+    elif command == "admission":
+        result = admission_scenario(stub_latency=float(opts.get("stub-latency", "0.5")))
+        text = json.dumps(result, indent=2)
+        if opts.get("out"):
+            with open(opts["out"], "w") as f:
+                f.write(text + "\n")
+        print(text)
+        sys.exit(1 if result["failures"] else 0)
+    elif command == "compare" and len(args) == 3:
+        with open(args[1]) as f:
+            base = json.load(f)
+        with open(args[2]) as f:
+            new = json.load(f)
+        diff = compare(base, new, tolerance=float(opts.get("tolerance", "0.15")))
+        print(json.dumps(diff, indent=2))
+        sys.exit(1 if diff["regressions"] else 0)
+    else:
+        print("usage: python loadtest.py run [--concurrency=1,4,8,16] [--requests=200] [...] | compare base.json new.json [--tolerance=0.15] | admission")
+        sys.exit(1)
@@ -0,0 +1,425 @@
+import os
+import sys
+import json
+import mmap
+import time
+import shutil
+import tempfile
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from chroma_pages import iter_pages, current_rss_mb, DEFAULT_PAGE_SIZE
+from embeddings import BACKEND_KEY, check_recorded
+from source_index import SOURCES_COLLECTION
+
+# Low-memory vector index for small instances.
+#
+# A Chroma collection is exported to a directory of flat files that are memory-mapped, not loaded:
+#   vectors.npy      : float16, L2-normalised embeddings (N x D)
+#   coarse.npy       : optional float16 PCA projection (N x d) used for the first-pass scan
+#   pca.npz          : PCA mean + components when coarse.npy exists
+#   sources.npy      : int32 source index per row (for {"source": ...} filters)
+#   records.jsonl    : {"id", "document", "metadata"} per row, addressed via records_offsets.npy
+#   ids.npy          : the ids as UTF-8 bytes, sorted, with id_rows.npy giving each one's row (get by id)
+#   manifest.json    : counts, dims, source names, embedding backend the vectors were built with
+#
+# Queries scan the coarse matrix (or the float16 vectors when there is no PCA), keep the best
+# candidates and re-score them exactly against the full-dimension vectors in float32.
+# LowMemIndex.query() mirrors Collection.query(), so /ask can use either backend. open_lowmem_store()
+# refuses an index built with another embedding backend or dimension, like embeddings.open_collection().
+
+LOWMEM_INDEX_PATH = os.environ.get("LOWMEM_INDEX_PATH", "/tmp/lowmem_index")
+RESCORE_FACTOR = int(os.environ.get("LOWMEM_RESCORE_FACTOR", "40"))
+RESCORE_MIN = 50
+BLOCK_ROWS = 4096
+PCA_SAMPLE = 20000
+DEFAULT_DIMS = 64  # PCA dims for the coarse scan; 0 = scan the float16 vectors directly
+VERSION = 2  # 2: ids.npy / id_rows.npy
+
+
+# ---------- Export ----------
+def export_lowmem_index(
+    collection,
+    out_dir: str,
+    dims: int = 0,
+    page_size: int = DEFAULT_PAGE_SIZE,
+) -> Dict[str, Any]:
+    """Stream `collection` into a low-memory index at `out_dir`. `dims` > 0 adds a PCA coarse matrix."""
+    tmp_dir = out_dir.rstrip("/") + ".building"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    expected = collection.count()
+    vectors = None
+    source_rows = np.zeros(max(expected, 1), dtype=np.int32)
+    source_names: List[str] = []
+    source_index: Dict[str, int] = {}
+    ids: List[str] = []
+    offsets = [0]
+    rows = 0
+
+    with open(os.path.join(tmp_dir, "records.jsonl"), "wb") as records:
+        for page in iter_pages(collection, page_size=page_size, include=["embeddings", "documents", "metadatas"]):
+            emb = np.asarray(page["embeddings"], dtype=np.float32)
+            if vectors is None:
+                vectors = open_memmap(os.path.join(tmp_dir, "vectors.npy"), mode="w+", dtype=np.float16, shape=(expected, emb.shape[1]))
+            take = min(len(emb), expected - rows)  # the collection may grow while we export
+            if take <= 0:
+                break
+            norms = np.linalg.norm(emb[:take], axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            vectors[rows:rows + take] = (emb[:take] / norms).astype(np.float16)
+
+            for i in range(take):
+                meta = page["metadatas"][i] or {}
+                source = meta.get("source") or ""
+                if source not in source_index:
+                    source_index[source] = len(source_names)
+                    source_names.append(source)
+                source_rows[rows + i] = source_index[source]
+                ids.append(page["ids"][i])
+                line = json.dumps({"id": page["ids"][i], "document": page["documents"][i], "metadata": meta}, ensure_ascii=False)
+                records.write(line.encode("utf-8") + b"\n")
+                offsets.append(records.tell())
+            rows += take
+
+    if vectors is None:
+        raise ValueError("collection is empty; nothing to export")
+    vectors.flush()
+    dim = vectors.shape[1]
+    del vectors
+
+    np.save(os.path.join(tmp_dir, "sources.npy"), source_rows[:rows])
+    np.save(os.path.join(tmp_dir, "records_offsets.npy"), np.asarray(offsets, dtype=np.uint64))
+    _write_id_table(tmp_dir, ids)
+
+    coarse_dim = 0
+    if 0 < dims < dim:
+        coarse_dim = _build_pca(tmp_dir, rows, dims)
+
+    manifest = {
+        "version": VERSION,
+        "collection": collection.name,
+        "count": rows,
+        "dim": dim,
+        "coarse_dim": coarse_dim,
+        # Copied from the collection's stamp (None for collections never opened through embeddings.py)
+        "embedding_backend": (collection.metadata or {}).get(BACKEND_KEY),
+        "embedding_dim": dim,
+        "sources": source_names,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    os.replace(tmp_dir, out_dir)
+    return manifest
+
+
+def _write_id_table(index_dir: str, ids: List[str]) -> None:
+    encoded = np.array([i.encode("utf-8") for i in ids], dtype=bytes)
+    order = np.argsort(encoded, kind="stable")
+    np.save(os.path.join(index_dir, "ids.npy"), encoded[order])
+    np.save(os.path.join(index_dir, "id_rows.npy"), order.astype(np.int64))
+
+
+def _build_pca(index_dir: str, rows: int, dims: int) -> int:
+    vectors = np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode="r")[:rows]
+    rng = np.random.default_rng(0)
+    pick = np.sort(rng.choice(rows, size=min(rows, PCA_SAMPLE), replace=False))
+    sample = np.asarray(vectors[pick], dtype=np.float32)
+    mean = sample.mean(axis=0)
+    _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+    components = vt[:dims].astype(np.float32)
+    np.savez(os.path.join(index_dir, "pca.npz"), mean=mean, components=components)
+
+    coarse = open_memmap(os.path.join(index_dir, "coarse.npy"), mode="w+", dtype=np.float16, shape=(rows, components.shape[0]))
+    for start in range(0, rows, BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + BLOCK_ROWS], dtype=np.float32)
+        coarse[start:start + len(block)] = ((block - mean) @ components.T).astype(np.float16)
+    coarse.flush()
+    return components.shape[0]
+
+
+def export_lowmem_store(client, out_dir: str = LOWMEM_INDEX_PATH, dims: int = DEFAULT_DIMS) -> Dict[str, Any]:
+    """Export the chunk collection and (if present) the source index side by side."""
+    collection = client.get_collection("cocktailgpt")
+    manifests = {"chunks": export_lowmem_index(collection, os.path.join(out_dir, "chunks"), dims=dims)}
+    try:
+        sources = client.get_collection(SOURCES_COLLECTION)
+        if sources.count():
+            manifests["sources"] = export_lowmem_index(sources, os.path.join(out_dir, "sources"))
+    except Exception as e:
+        print(f"⚠️ Source index not exported: {e}")
+    return manifests
+
+
+# ---------- Serving ----------
+class LowMemIndex:
+    """Read-only, memory-mapped stand-in for a Chroma collection (query/get/count)."""
+
+    def __init__(self, path: str, embedding_function=None, rescore_factor: int = RESCORE_FACTOR):
+        self.path = path
+        self.embedding_function = embedding_function
+        self.rescore_factor = rescore_factor
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.name = self.manifest["collection"]
+        n = self.manifest["count"]
+
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")[:n]
+        self.source_rows = np.load(os.path.join(path, "sources.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "records_offsets.npy"), mmap_mode="r")
+        self.source_names = self.manifest["sources"]
+        self._source_lookup = {s: i for i, s in enumerate(self.source_names)}
+
+        self.coarse = None
+        self.pca_components = None
+        if self.manifest.get("coarse_dim"):
+            self.coarse = np.load(os.path.join(path, "coarse.npy"), mmap_mode="r")[:n]
+            self.pca_components = np.load(os.path.join(path, "pca.npz"))["components"]
+
+        self._records_file = open(os.path.join(path, "records.jsonl"), "rb")
+        self._records = mmap.mmap(self._records_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.ids = self.id_rows = None
+        if os.path.exists(os.path.join(path, "ids.npy")):
+            self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+            self.id_rows = np.load(os.path.join(path, "id_rows.npy"), mmap_mode="r")
+        self._id_rows: Optional[Dict[str, int]] = None  # only for indexes exported before ids.npy
+
+    def count(self) -> int:
+        return self.manifest["count"]
+
+    def close(self) -> None:
+        self._records.close()
+        self._records_file.close()
+
+    def _record(self, row: int) -> Dict[str, Any]:
+        return json.loads(self._records[int(self.offsets[row]):int(self.offsets[row + 1])])
+
+    def _row(self, chunk_id: str) -> Optional[int]:
+        """Binary search of the memory-mapped id table; None for an unknown id."""
+        if self.ids is None:
+            if self._id_rows is None:
+                self._id_rows = {self._record(r)["id"]: r for r in range(self.count())}
+            return self._id_rows.get(chunk_id)
+        key = chunk_id.encode("utf-8")
+        if not key or len(key) > self.ids.dtype.itemsize:
+            return None
+        pos = int(np.searchsorted(self.ids, key))
+        if pos < len(self.ids) and self.ids[pos] == key:
+            return int(self.id_rows[pos])
+        return None
+
+    def _mask(self, where: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        if not where:
+            return None
+        if set(where) != {"source"}:
+            raise ValueError(f"lowmem backend only supports source filters, got {where}")
+        cond = where["source"]
+        if isinstance(cond, str):
+            names = [cond]
+        elif isinstance(cond, dict) and set(cond) <= {"$eq", "$in"}:
+            names = cond.get("$in") or [cond.get("$eq")]
+        else:
+            raise ValueError(f"unsupported source filter: {cond}")
+        wanted = [self._source_lookup[s] for s in names if s in self._source_lookup]
+        return np.isin(self.source_rows, np.asarray(wanted, dtype=np.int32))
+
+    def _coarse_scores(self, q: np.ndarray) -> np.ndarray:
+        if self.coarse is not None:
+            matrix, qv = self.coarse, self.pca_components @ q
+        else:
+            matrix, qv = self.vectors, q
+        scores = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), BLOCK_ROWS):
+            scores[start:start + BLOCK_ROWS] = np.asarray(matrix[start:start + BLOCK_ROWS], dtype=np.float32) @ qv
+        return scores
+
+    def _search(self, q: np.ndarray, n_results: int, mask: Optional[np.ndarray]):
+        scores = self._coarse_scores(q)
+        if mask is not None:
+            scores[~mask] = -np.inf
+            available = int(mask.sum())
+        else:
+            available = len(scores)
+        if not available:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        n_candidates = min(available, max(n_results * self.rescore_factor, RESCORE_MIN))
+        cand = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+        cand = np.sort(cand)  # sequential reads from the memory map
+        exact = np.asarray(self.vectors[cand], dtype=np.float32) @ q
+        order = np.argsort(-exact)[:min(n_results, n_candidates)]
+        return cand[order], exact[order]
+
+    def query(
+        self,
+        query_embeddings=None,
+        query_texts=None,
+        n_results: int = 10,
+        include: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        include = list(include) if include is not None else ["documents", "metadatas", "distances"]
+        if query_embeddings is None:
+            if self.embedding_function is None:
+                raise ValueError("query_texts needs an embedding_function")
+            query_embeddings = self.embedding_function(list(query_texts))
+        mask = self._mask(where)
+
+        out: Dict[str, Any] = {"ids": [], "documents": [], "metadatas": [], "distances": [], "embeddings": None}
+        for qe in query_embeddings:
+            q = np.asarray(qe, dtype=np.float32)
+            norm = np.linalg.norm(q)
+            q = q / norm if norm else q
+            rows, sims = self._search(q, n_results, mask)
+            records = [self._record(r) for r in rows]
+            out["ids"].append([r["id"] for r in records])
+            out["documents"].append([r["document"] for r in records])
+            out["metadatas"].append([r["metadata"] for r in records])
+            # Squared L2 between unit vectors, i.e. what Chroma's default "l2" space reports
+            out["distances"].append([float(2.0 - 2.0 * s) for s in sims])
+
+        for key in ("documents", "metadatas", "distances"):
+            if key not in include:
+                out[key] = None
+        out["included"] = include
+        return out
+
+    def get(self, ids: Optional[List[str]] = None, include: Optional[List[str]] = None, **unsupported) -> Dict[str, Any]:
+        """Chroma's get(ids=...) only: filters and paging (where, limit, offset, ...) raise rather than being ignored."""
+        unsupported = {k: v for k, v in unsupported.items() if v is not None}
+        if unsupported:
+            raise ValueError(f"lowmem backend's get only supports ids and include, got {sorted(unsupported)}")
+        if ids is None:
+            raise ValueError("lowmem backend's get needs ids")
+        include = list(include) if include is not None else ["documents", "metadatas"]
+        rows = [r for r in map(self._row, ids) if r is not None]
+        records = [self._record(r) for r in rows]
+        return {
+            "ids": [r["id"] for r in records],
+            "documents": [r["document"] for r in records] if "documents" in include else None,
+            "metadatas": [r["metadata"] for r in records] if "metadatas" in include else None,
+            "embeddings": [np.asarray(self.vectors[r], dtype=np.float32) for r in rows] if "embeddings" in include else None,
+            "included": include,
+        }
+
+
+def check_index(index: LowMemIndex, backend: Optional[str] = None) -> Dict[str, Any]:
+    """Raise EmbeddingMismatchError when `index` was exported from vectors of another backend or dimension."""
+    manifest = index.manifest
+    return check_recorded(
+        f"Low-memory index {index.path!r}",
+        manifest.get("embedding_backend"),
+        manifest.get("embedding_dim") or manifest["dim"],
+        backend,
+    )
+
+
+def open_lowmem_store(path: str = LOWMEM_INDEX_PATH, embedding_function=None, backend: Optional[str] = None):
+    """
+    (chunk index, source index or None) for a directory written by export_lowmem_store.
+    Raises EmbeddingMismatchError when either was built with another backend than `backend`
+    (default EMBEDDING_BACKEND).
+    """
+    chunks = LowMemIndex(os.path.join(path, "chunks"), embedding_function=embedding_function)
+    sources_path = os.path.join(path, "sources")
+    sources = LowMemIndex(sources_path, embedding_function=embedding_function) if os.path.exists(sources_path) else None
+    for index in (chunks, sources):
+        if index is None:
+            continue
+        try:
+            check_index(index, backend)
+        except Exception:
+            chunks.close()
+            if sources is not None:
+                sources.close()
+            raise
+    return chunks, sources
+
+
+# ---------- Report ----------
+def _dir_bytes(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def _zip_bytes(path: str) -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = shutil.make_archive(os.path.join(tmp, "snapshot"), "zip", path)
+        return os.path.getsize(archive)
+
+
+def compare_with_chroma(chroma_path: str, index_path: str, n_queries: int = 200, k: int = 5) -> Dict[str, Any]:
+    """
+    Memory, on-disk/snapshot size and recall@k of the low-memory index against the Chroma collection
+    it was exported from. Queries are stored chunk embeddings with a little noise added.
+    The low-memory index is measured first so Chroma's segment loading doesn't mask it.
+    """
+    from chromadb import PersistentClient
+
+    rng = np.random.default_rng(42)
+    rss_start = current_rss_mb()
+    index = LowMemIndex(os.path.join(index_path, "chunks"))
+    pick = rng.choice(index.count(), size=min(n_queries, index.count()), replace=False)
+    queries = np.asarray(index.vectors[np.sort(pick)], dtype=np.float32)
+    queries += rng.normal(scale=0.02, size=queries.shape).astype(np.float32)
+
+    start = time.perf_counter()
+    low_ids = [index.query(query_embeddings=[q], n_results=k, include=[])["ids"][0] for q in queries]
+    low_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    low_rss = current_rss_mb() - rss_start
+
+    rss_start = current_rss_mb()
+    collection = PersistentClient(path=chroma_path).get_collection("cocktailgpt")
+    start = time.perf_counter()
+    chroma_ids = [collection.query(query_embeddings=[q.tolist()], n_results=k, include=[])["ids"][0] for q in queries]
+    chroma_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    chroma_rss = current_rss_mb() - rss_start
+
+    recall = np.mean([len(set(a) & set(b)) / max(len(b), 1) for a, b in zip(low_ids, chroma_ids)])
+    return {
+        "rows": index.count(),
+        "dim": index.manifest["dim"],
+        "coarse_dim": index.manifest["coarse_dim"],
+        f"recall@{k}_vs_chroma": round(float(recall), 4),
+        "chroma_disk_mb": round(_dir_bytes(chroma_path) / 1e6, 2),
+        "lowmem_disk_mb": round(_dir_bytes(index_path) / 1e6, 2),
+        "chroma_snapshot_zip_mb": round(_zip_bytes(chroma_path) / 1e6, 2),
+        "lowmem_snapshot_zip_mb": round(_zip_bytes(index_path) / 1e6, 2),
+        "chroma_rss_growth_mb": round(chroma_rss, 1),
+        "lowmem_rss_growth_mb": round(low_rss, 1),
+        "chroma_query_ms": round(chroma_ms, 2),
+        "lowmem_query_ms": round(low_ms, 2),
+    }
+
+
+if __name__ == "__main__":
+    # Usage:
+    #   python lowmem_index.py export  [--dims=64 | --dims=0] [--src=/tmp/chroma_store] [--dst=/tmp/lowmem_index]
+    #   python lowmem_index.py compare [--src=/tmp/chroma_store] [--dst=/tmp/lowmem_index] [--queries=200]
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "export"
+    opts = dict(a[2:].split("=", 1) for a in sys.argv[2:] if a.startswith("--") and "=" in a)
+    src = opts.get("src", "/tmp/chroma_store")
+    dst = opts.get("dst", LOWMEM_INDEX_PATH)
+
+    if cmd == "export":
+        from chromadb import PersistentClient
+        manifests = export_lowmem_store(PersistentClient(path=src), dst, dims=int(opts.get("dims", DEFAULT_DIMS)))
+        for name, m in manifests.items():
+            print(f"✅ {name}: {m['count']} rows · dim {m['dim']} · coarse {m['coarse_dim']} → {os.path.join(dst, name)}")
+    elif cmd == "compare":
+        for key, value in compare_with_chroma(src, dst, n_queries=int(opts.get("queries", 200))).items():
+            print(f"📏 {key}: {value}")
+    else:
+        print(f"❌ Unknown command: {cmd}")
+        sys.exit(1)
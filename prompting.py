@@ -0,0 +1,259 @@
+import os
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+# Prompt assembly for /ask with token accounting.
+#
+#   - the system prompt is static per (locale, detail) and is built and counted once
+#   - text is counted with tiktoken (a requirement; encoder cached per model). If it can't be loaded
+#     (e.g. its BPE file can't be downloaded) counts fall back to ~4 chars/token: the breakdown is then
+#     marked "estimated" and PROMPT_ESTIMATE_MARGIN of extra room is kept, since the guess undercounts
+#     non-English and markup-heavy text
+#   - each segment has a budget and a truncation policy:
+#       system   : never truncated
+#       history  : oldest messages dropped first (the rolling summary, if any, goes last)
+#       context  : lowest-ranked documents dropped first, then the last one kept is cut short
+#       question : cut short (keeps the beginning)
+#   - whatever still doesn't fit the model window (minus the completion's max_tokens) is trimmed in the
+#     order context → history → question, so an oversized request is answered instead of failing
+
+PROMPT_CONTEXT_BUDGET = int(os.environ.get("PROMPT_CONTEXT_BUDGET", "6000"))
+PROMPT_HISTORY_BUDGET = int(os.environ.get("PROMPT_HISTORY_BUDGET", "1600"))
+PROMPT_QUESTION_BUDGET = int(os.environ.get("PROMPT_QUESTION_BUDGET", "1000"))
+# Optional cap on the whole prompt (cost control); the model window always applies
+PROMPT_INPUT_BUDGET = int(os.environ.get("PROMPT_INPUT_BUDGET", "0"))
+MODEL_CONTEXT_WINDOW = int(os.environ.get("MODEL_CONTEXT_WINDOW", "0"))  # overrides the table below
+# Headroom (fraction of the counted prompt) kept when tokens are estimated rather than counted
+PROMPT_ESTIMATE_MARGIN = float(os.environ.get("PROMPT_ESTIMATE_MARGIN", "0.25"))
+
+CONTEXT_WINDOWS = {
+    "gpt-4o-mini": 128000,
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4.1": 1047576,
+    "gpt-4-32k": 32768,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Chat format overhead: ~3 tokens per message plus 3 to prime the reply
+MESSAGE_OVERHEAD = 3
+REPLY_OVERHEAD = 3
+TRUNCATION_MARK = " …[truncated]"
+
+
+# ---------- Tokenizer ----------
+_tiktoken_failed = False
+
+
+@lru_cache(maxsize=None)
+def _encoder(model: Optional[str]):
+    global _tiktoken_failed
+    if _tiktoken_failed:
+        return None
+    try:
+        import tiktoken
+
+        try:
+            return tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("cl100k_base")
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:  # not installed, or the encoding file can't be fetched
+        _tiktoken_failed = True
+        print(f"⚠️ tiktoken unavailable ({e.__class__.__name__}), estimating tokens as chars/4")
+        return None
+
+
+def is_estimated(model: Optional[str] = None) -> bool:
+    """True when counts are the chars/4 guess rather than the model's tokenizer."""
+    return _encoder(model) is None
+
+
+def tokenizer_name(model: Optional[str] = None) -> str:
+    enc = _encoder(model)
+    return f"tiktoken:{enc.name}" if enc is not None else "chars/4"
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    enc = _encoder(model)
+    if enc is None:
+        return (len(text) + 3) // 4  # same rule of thumb as utils.chunk_text
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """Keep the beginning of `text` within max_tokens (marker included)."""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    room = max_tokens - count_tokens(TRUNCATION_MARK, model)
+    if room <= 0:
+        return ""
+    enc = _encoder(model)
+    if enc is None:
+        return text[:room * 4].rstrip() + TRUNCATION_MARK
+    return enc.decode(enc.encode(text, disallowed_special=())[:room]).rstrip() + TRUNCATION_MARK
+
+
+def message_tokens(message: Dict[str, str], model: Optional[str] = None) -> int:
+    return count_tokens(message.get("content", ""), model) + MESSAGE_OVERHEAD
+
+
+def context_window(model: str) -> int:
+    if MODEL_CONTEXT_WINDOW:
+        return MODEL_CONTEXT_WINDOW
+    # Longest matching prefix, so dated snapshots ("gpt-4o-2024-08-06") resolve too
+    for name in sorted(CONTEXT_WINDOWS, key=len, reverse=True):
+        if model.startswith(name):
+            return CONTEXT_WINDOWS[name]
+    return DEFAULT_CONTEXT_WINDOW
+
+
+# ---------- Static segments ----------
+@lru_cache(maxsize=16)
+def system_prompt(locale: str, detail: str, model: Optional[str] = None) -> Tuple[str, int]:
+    """(system prompt, its token count); UK English and ~2x detail. Built once per configuration."""
+    base = (
+        "You are CocktailGPT, a precise assistant for cocktails, flavour, and food science.\n"
+        f"- Use {locale} spelling and grammar (UK English).\n"
+        "- Use metric units (mL, grams, °C) by default; include imperial only if the source uses it explicitly.\n"
+        "- Use ingredient and technique names faithfully as written in the sources.\n"
+        "- If the answer is not present in the provided context, say you don't know.\n"
+        "- Always stay faithful to the context; do not invent sources.\n"
+    )
+    if detail.lower() == "double":
+        base += (
+            "\nDetail & structure:\n"
+            "- Provide approximately twice the normal detail.\n"
+            "- When relevant, add two short sections at the end:\n"
+            "  * Why it matters — one or two sentences that explain the practical significance.\n"
+            "  * Practical tips — concise, actionable pointers a bartender or chef can use immediately.\n"
+        )
+    return base, count_tokens(base, model) + MESSAGE_OVERHEAD
+
+
+USER_TEMPLATE = "Context:\n{context}\n\nQuestion: {question}"
+
+
+@lru_cache(maxsize=None)
+def _template_tokens(model: Optional[str]) -> int:
+    return count_tokens(USER_TEMPLATE.format(context="", question=""), model) + MESSAGE_OVERHEAD
+
+
+# ---------- Budgets ----------
+def fit_history(messages: List[Dict[str, str]], budget: int, model: Optional[str] = None) -> Tuple[List[Dict[str, str]], int, int]:
+    """Drop the oldest verbatim messages first; a leading summary (system message) is dropped last."""
+    msgs = list(messages)
+    costs = [message_tokens(m, model) for m in msgs]
+    dropped = 0
+    while msgs and sum(costs) > budget:
+        i = 1 if msgs[0]["role"] == "system" and len(msgs) > 1 else 0
+        del msgs[i], costs[i]
+        dropped += 1
+    return msgs, sum(costs), dropped
+
+
+def fit_context(rows: List[str], budget: int, model: Optional[str] = None) -> Tuple[List[str], int, int, bool]:
+    """Keep documents in rank order while they fit; the first one that doesn't is cut short if worthwhile."""
+    kept: List[str] = []
+    used = 0
+    sep = count_tokens("\n\n", model)
+    for row in rows:
+        cost = count_tokens(row, model) + (sep if kept else 0)
+        if used + cost <= budget:
+            kept.append(row)
+            used += cost
+            continue
+        room = budget - used - (sep if kept else 0)
+        truncated = room >= 64 and truncate_tokens(row, room, model)
+        if truncated:
+            kept.append(truncated)
+            used += count_tokens(truncated, model) + (sep if len(kept) > 1 else 0)
+        return kept, used, len(rows) - len(kept), bool(truncated)
+    return kept, used, 0, False
+
+
+def completion_budget(model: str, max_tokens: int) -> int:
+    """The completion cap for `model`, leaving at least three quarters of its window for the prompt."""
+    return min(max_tokens, max(context_window(model) // 4, 256))
+
+
+def assemble_messages(
+    question: str,
+    context_rows: List[str],
+    history: List[Dict[str, str]],
+    model: str,
+    locale: str,
+    detail: str,
+    max_tokens: int,
+) -> Tuple[List[Dict[str, str]], int, Dict[str, Any]]:
+    """
+    Returns (messages, max_tokens for the completion, token breakdown for the response's debug field).
+    """
+    window = context_window(model)
+    sys_text, sys_tokens = system_prompt(locale, detail, model)
+    fixed = sys_tokens + _template_tokens(model) + REPLY_OVERHEAD
+
+    estimated = is_estimated(model)
+    margin = 1.0 + (PROMPT_ESTIMATE_MARGIN if estimated else 0.0)
+
+    # Keep at least a short answer's worth of room for the completion
+    completion_tokens = completion_budget(model, max_tokens)
+    input_budget = window - completion_tokens
+    if PROMPT_INPUT_BUDGET:
+        input_budget = min(input_budget, PROMPT_INPUT_BUDGET)
+    input_budget = int(input_budget / margin)
+
+    question_budget = PROMPT_QUESTION_BUDGET
+    history_budget = PROMPT_HISTORY_BUDGET
+    context_budget = PROMPT_CONTEXT_BUDGET
+
+    q_text = truncate_tokens(question, question_budget, model)
+    q_tokens = count_tokens(q_text, model)
+    hist, h_tokens, h_dropped = fit_history(history, history_budget, model)
+    ctx, c_tokens, c_dropped, c_cut = fit_context(context_rows, context_budget, model)
+
+    # Over the window (or the overall cap): shrink context, then history, then the question
+    overflow = fixed + q_tokens + h_tokens + c_tokens - input_budget
+    trimmed_for_window = overflow > 0
+    if overflow > 0:
+        ctx, c_tokens, more, cut = fit_context(context_rows, max(c_tokens - overflow, 0), model)
+        c_dropped, c_cut = more, c_cut or cut
+        overflow = fixed + q_tokens + h_tokens + c_tokens - input_budget
+    if overflow > 0:
+        hist, h_tokens, more = fit_history(hist, max(h_tokens - overflow, 0), model)
+        h_dropped += more
+        overflow = fixed + q_tokens + h_tokens + c_tokens - input_budget
+    if overflow > 0:
+        q_text = truncate_tokens(q_text, max(q_tokens - overflow, 16), model)
+        q_tokens = count_tokens(q_text, model)
+
+    messages = [{"role": "system", "content": sys_text}]
+    messages.extend(hist)
+    messages.append({"role": "user", "content": USER_TEMPLATE.format(context="\n\n".join(ctx), question=q_text)})
+
+    prompt_tokens = fixed + q_tokens + h_tokens + c_tokens
+    completion_tokens = max(min(max_tokens, window - int(prompt_tokens * margin)), 1)
+    breakdown = {
+        "tokenizer": tokenizer_name(model),
+        "estimated": estimated,
+        "model": model,
+        "window": window,
+        "input_budget": input_budget,
+        "system": sys_tokens,
+        "history": h_tokens,
+        "context": c_tokens,
+        "question": q_tokens,
+        "overhead": fixed - sys_tokens,
+        "prompt_total": prompt_tokens,
+        "max_tokens": completion_tokens,
+        "budgets": {"history": history_budget, "context": context_budget, "question": question_budget},
+        "truncated": {
+            "history_messages_dropped": h_dropped,
+            "context_docs_dropped": c_dropped,
+            "context_doc_cut": c_cut,
+            "question_cut": q_text != question,
+            "to_fit_window": trimmed_for_window,
+        },
+    }
+    return messages, completion_tokens, breakdown
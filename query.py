@@ -1,9 +1,11 @@
 import os
-import datetime
+import time
 from dotenv import load_dotenv
 from openai import OpenAI
 from chromadb import PersistentClient
 from utils import format_response_with_citations
+from query_log import log_query
+from embeddings import open_collection
 
 # Load .env and initialize OpenAI + Chroma
 load_dotenv()
@@ -11,15 +13,18 @@ client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 # Unified Chroma path and collection name
 chroma_client = PersistentClient(path="/tmp/chroma_store")
-collection = chroma_client.get_or_create_collection("cocktailgpt")
+collection = open_collection(chroma_client, "cocktailgpt")
 
 def ask(question):
+    started = time.perf_counter()
     results = collection.query(
         query_texts=[question],
         n_results=5,
-        include=["documents", "metadatas"]
+        include=["documents", "metadatas", "distances"]
     )
+    timings = {"retrieve": time.perf_counter() - started}
 
+    mark = time.perf_counter()
     response = client.chat.completions.create(
         model="gpt-4-turbo",
         messages=[
@@ -29,11 +34,13 @@ def ask(question):
         temperature=0.2
     )
 
+    timings["llm"] = time.perf_counter() - mark
+
     content = response.choices[0].message.content
     content = format_response_with_citations(content, results)
 
-    with open("query_log.jsonl", "a") as log:
-        log.write(f'{datetime.datetime.utcnow().isoformat()} {question}\n')
+    timings["total"] = time.perf_counter() - started
+    log_query(question, results, timings, model="gpt-4-turbo", client="query.py")
 
     return content
 
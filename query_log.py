@@ -0,0 +1,299 @@
+import os
+import re
+import sys
+import json
+import time
+import queue
+import fcntl
+import atexit
+import hashlib
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterator, List, Optional
+
+# Structured query log for /ask (and query.py), one JSON object per line:
+#   ts, question_hash, question, model/tier, retrieved ids + scores + sources, per-stage latencies (ms),
+#   token counts, cache hits, short-circuit / error
+#
+# Records go onto an in-memory queue and a background thread writes them in batches (every
+# QUERY_LOG_FLUSH_S or QUERY_LOG_BATCH records), so the request path never touches the disk. When the
+# queue is full records are dropped and counted rather than blocking. The file rotates at
+# QUERY_LOG_MAX_BYTES keeping QUERY_LOG_BACKUPS old files; batches are written under an flock so
+# several API workers can share one log.
+#
+# Offline: python query_log.py report [--store=/tmp/chroma_store] [--top=20]
+
+QUERY_LOG_PATH = os.environ.get("QUERY_LOG_PATH", "/tmp/cocktailgpt_queries.jsonl")
+QUERY_LOG_ENABLED = os.environ.get("QUERY_LOG", "1") == "1"
+QUERY_LOG_QUESTIONS = os.environ.get("QUERY_LOG_QUESTIONS", "1") == "1"  # 0 keeps only the hash
+QUERY_LOG_MAX_BYTES = int(os.environ.get("QUERY_LOG_MAX_BYTES", str(20 * 1024 * 1024)))
+QUERY_LOG_BACKUPS = int(os.environ.get("QUERY_LOG_BACKUPS", "5"))
+QUERY_LOG_FLUSH_S = float(os.environ.get("QUERY_LOG_FLUSH_S", "1.0"))
+QUERY_LOG_BATCH = int(os.environ.get("QUERY_LOG_BATCH", "200"))
+QUERY_LOG_QUEUE = int(os.environ.get("QUERY_LOG_QUEUE", "10000"))
+MAX_QUESTION_CHARS = 500
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalise_question(question: str) -> str:
+    return _WS_RE.sub(" ", question.strip().lower()).rstrip("?!. ")
+
+
+def question_hash(question: str) -> str:
+    """Same hash for questions that differ only in case, spacing or trailing punctuation."""
+    return hashlib.sha256(normalise_question(question).encode("utf-8")).hexdigest()[:16]
+
+
+class QueryLogWriter:
+    def __init__(
+        self,
+        path: str = QUERY_LOG_PATH,
+        max_bytes: int = QUERY_LOG_MAX_BYTES,
+        backups: int = QUERY_LOG_BACKUPS,
+        flush_s: float = QUERY_LOG_FLUSH_S,
+        batch: int = QUERY_LOG_BATCH,
+        queue_size: int = QUERY_LOG_QUEUE,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_s = flush_s
+        self.batch = batch
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=queue_size)
+        self.stats = {"logged": 0, "written": 0, "dropped": 0, "batches": 0, "rotations": 0, "errors": 0}
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                directory = os.path.dirname(os.path.abspath(self.path))
+                os.makedirs(directory, exist_ok=True)
+                self._thread = threading.Thread(target=self._run, name="query-log", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def log(self, record: Dict[str, Any]) -> None:
+        """Never blocks: a full queue drops the record."""
+        if self._closed:
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+            self.stats["logged"] += 1
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def _run(self) -> None:
+        pending: List[str] = []
+        deadline = time.monotonic() + self.flush_s
+        while True:
+            timeout = max(deadline - time.monotonic(), 0.0)
+            try:
+                record = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                record = False
+            if record is None:  # close()
+                self._write(pending)
+                return
+            if record:
+                pending.append(json.dumps(record, ensure_ascii=False, default=str))
+            if len(pending) >= self.batch or time.monotonic() >= deadline:
+                self._write(pending)
+                pending = []
+                deadline = time.monotonic() + self.flush_s
+
+    def _write(self, lines: List[str]) -> None:
+        if not lines:
+            return
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        try:
+            with open(self.path + ".lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_bytes:
+                        self._rotate()
+                    with open(self.path, "ab") as f:
+                        f.write(data)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+            self.stats["written"] += len(lines)
+            self.stats["batches"] += 1
+        except OSError as e:
+            self.stats["errors"] += 1
+            print(f"⚠️ Query log write failed ({len(lines)} records lost): {e}")
+
+    def _rotate(self) -> None:
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.stats["rotations"] += 1
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Flush what is queued and stop the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            try:
+                self._queue.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+
+
+query_log = QueryLogWriter()
+
+
+def log_query(
+    question: str,
+    results: Optional[Dict[str, Any]] = None,
+    timings: Optional[Dict[str, float]] = None,
+    **fields: Any,
+) -> None:
+    """Build the record for one question and hand it to the background writer."""
+    if not QUERY_LOG_ENABLED:
+        return
+    record: Dict[str, Any] = {
+        "ts": round(time.time(), 3),
+        "question_hash": question_hash(question),
+        "pid": os.getpid(),
+    }
+    if QUERY_LOG_QUESTIONS:
+        record["question"] = question[:MAX_QUESTION_CHARS]
+    if results is not None:
+        metas = (results.get("metadatas") or [[]])[0] or []
+        distances = (results.get("distances") or [[]])[0] or []
+        record["retrieved_ids"] = list((results.get("ids") or [[]])[0] or [])
+        record["retrieved_sources"] = [(m or {}).get("source") for m in metas]
+        record["scores"] = [round(1.0 - float(d) / 2.0, 4) for d in distances]
+    if timings is not None:
+        record["latency_ms"] = {k: round(v * 1000, 1) for k, v in timings.items()}
+    record.update({k: v for k, v in fields.items() if v is not None})
+    query_log.log(record)
+
+
+# ---------- Offline analytics ----------
+def log_files(path: str = QUERY_LOG_PATH) -> List[str]:
+    """Current file plus rotated ones, oldest first."""
+    rotated = []
+    i = 1
+    while os.path.exists(f"{path}.{i}"):
+        rotated.append(f"{path}.{i}")
+        i += 1
+    return list(reversed(rotated)) + ([path] if os.path.exists(path) else [])
+
+
+def iter_records(path: str = QUERY_LOG_PATH, since: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+    for name in log_files(path):
+        with open(name, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # a torn line from a crash
+                if since is None or record.get("ts", 0) >= since:
+                    yield record
+
+
+def _pct(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(int(round(pct / 100.0 * (len(ordered) - 1))), len(ordered) - 1)], 1)
+
+
+def store_sources(store_path: str) -> List[str]:
+    """Every source in the store's main collection (paged, metadatas only)."""
+    from shared_store import open_chroma_client
+    from chroma_pages import iter_pages
+
+    collection = open_chroma_client(store_path, mode="embedded").get_collection("cocktailgpt")
+    sources = set()
+    for page in iter_pages(collection, include=["metadatas"]):
+        sources.update((m or {}).get("source") for m in page["metadatas"] or [])
+    sources.discard(None)
+    return sorted(sources)
+
+
+def report(path: str = QUERY_LOG_PATH, store_path: Optional[str] = None, top: int = 20,
+           since: Optional[float] = None) -> Dict[str, Any]:
+    stages: Dict[str, List[float]] = defaultdict(list)
+    questions: Counter = Counter()
+    examples: Dict[str, str] = {}
+    models: Counter = Counter()
+    retrieved: Counter = Counter()
+    tokens: List[float] = []
+    n = errors = short_circuits = summary_hits = 0
+    first = last = None
+
+    for r in iter_records(path, since):
+        n += 1
+        first = r["ts"] if first is None else min(first, r["ts"])
+        last = r["ts"] if last is None else max(last, r["ts"])
+        for stage, ms in (r.get("latency_ms") or {}).items():
+            stages[stage].append(ms)
+        questions[r["question_hash"]] += 1
+        if r.get("question") and r["question_hash"] not in examples:
+            examples[r["question_hash"]] = r["question"]
+        if r.get("model"):
+            models[r["model"]] += 1
+        retrieved.update(s for s in r.get("retrieved_sources") or [] if s)
+        if (r.get("tokens") or {}).get("prompt_total") is not None:
+            tokens.append(r["tokens"]["prompt_total"])
+        errors += 1 if r.get("error") else 0
+        short_circuits += 1 if r.get("short_circuit") else 0
+        summary_hits += 1 if (r.get("cache") or {}).get("history_summary") else 0
+
+    out: Dict[str, Any] = {
+        "records": n,
+        "from": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(first)) if first else None,
+        "to": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(last)) if last else None,
+        "latency_ms": {
+            stage: {"p50": _pct(values, 50), "p95": _pct(values, 95), "n": len(values)}
+            for stage, values in sorted(stages.items())
+        },
+        "prompt_tokens": {"p50": _pct(tokens, 50), "p95": _pct(tokens, 95)},
+        "models": dict(models.most_common()),
+        "error_rate": round(errors / n, 4) if n else None,
+        "short_circuit_rate": round(short_circuits / n, 4) if n else None,
+        "history_summary_cache_hits": summary_hits,
+        # Asked more than once: candidates for an answer cache
+        "top_questions": [
+            {"question_hash": h, "count": c, "question": examples.get(h)}
+            for h, c in questions.most_common(top) if c > 1
+        ],
+        "distinct_questions": len(questions),
+        "top_sources": dict(retrieved.most_common(top)),
+    }
+    if store_path:
+        sources = store_sources(store_path)
+        never = [s for s in sources if s not in retrieved]
+        out["sources_in_store"] = len(sources)
+        out["never_retrieved"] = never
+    return out
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    opts = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    command = args[0] if args else "report"
+    if command == "report":
+        since_h = float(opts["since-hours"]) if "since-hours" in opts else None
+        print(json.dumps(report(
+            opts.get("log", QUERY_LOG_PATH),
+            store_path=opts.get("store"),
+            top=int(opts.get("top", "20")),
+            since=time.time() - since_h * 3600 if since_h else None,
+        ), indent=2, ensure_ascii=False))
+    else:
+        print("usage: python query_log.py report [--log=PATH] [--store=CHROMA_PATH] [--top=20] [--since-hours=24]")
+        sys.exit(1)
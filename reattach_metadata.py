@@ -1,33 +1,23 @@
-import os
-import io
 import json
-import requests
-import fitz
-import pandas as pd
-from io import BytesIO
 from dotenv import load_dotenv
 from tqdm import tqdm
 from chromadb import PersistentClient
-from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
-from supabase import create_client, Client
+from csv_ingest import iter_csv_chunks
+from utils import iter_pages_from_pdf, join_pages, chunk_text
+from storage import open_storage, list_files, iter_downloads
+from embeddings import open_collection
+from source_index import update_sources
 
 # --- Setup ---
 load_dotenv()
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-SUPABASE_BUCKET = os.getenv("SUPABASE_BUCKET", "cocktailgpt-pdfs")
-
-os.environ["CHROMA_OPENAI_API_KEY"] = OPENAI_API_KEY
 client = PersistentClient(path="/tmp/chroma_store")
-embedding_function = OpenAIEmbeddingFunction()
-collection = client.get_or_create_collection(
-    name="cocktail_docs",
-    embedding_function=embedding_function
-)
+# EMBEDDING_BACKEND (embeddings.py); refuses a collection embedded with a different backend
+collection = open_collection(client, "cocktail_docs")
+# Per-source summaries for two-stage retrieval over this collection (source_index.py)
+sources_collection = open_collection(client, "cocktail_docs_sources")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+storage = open_storage()
 
 # --- State ---
 STATE_FILE = "reattached_metadata.json"
@@ -38,106 +28,58 @@ except:
     already_patched = set()
 
 # --- Helpers ---
-def fetch_file_bytes(url):
-    res = requests.get(url)
-    res.raise_for_status()
-    return BytesIO(res.content)
-
-def extract_text_from_pdf(pdf_bytes):
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    return "\n".join([page.get_text() for page in doc])
-
-def extract_text_from_csv(csv_bytes):
-    df = pd.read_csv(csv_bytes)
-    return df.to_string(index=False)
-
-def clean_text(text):
-    return "\n".join([line.strip() for line in text.splitlines() if line.strip()])
-
-def chunk_text(text, max_tokens=300):
-    paras = text.split("\n")
-    chunks, current = [], ""
-    for para in paras:
-        if len(current + para) < max_tokens * 4:
-            current += para + "\n"
-        else:
-            chunks.append(current.strip())
-            current = para + "\n"
-    if current:
-        chunks.append(current.strip())
-    return chunks
-
-def list_all_files(bucket_name, path=""):
-    files = []
-    limit = 100
-    offset = 0
-    while True:
-        result = supabase.storage.from_(bucket_name).list(path, {"limit": limit, "offset": offset})
-        if not result:
-            break
-        for item in result:
-            if item["name"].startswith("."):
-                continue
-            full_path = f"{path}/{item['name']}" if path else item["name"]
-            if "." not in item["name"]:
-                files.extend(list_all_files(bucket_name, full_path))
-            elif item["name"].endswith(".pdf") or item["name"].endswith(".csv"):
-                files.append(full_path)
-        if len(result) < limit:
-            break
-        offset += limit
-    return files
+def list_all_files(path=""):
+    # Paginated, with sub-folders listed concurrently (storage.py)
+    return [entry.path for entry in list_files(storage, path)]
 
 # --- Main Patch Function ---
 def reattach_metadata():
     print("🔧 Reattaching missing metadata...")
-    files = list_all_files(SUPABASE_BUCKET)
+    files = list_all_files()
+    pending = [f for f in files if f not in already_patched]
     patched = 0
-    skipped = 0
-
-    for file_path in tqdm(files):
-        if file_path in already_patched:
-            skipped += 1
-            continue
+    skipped = len(files) - len(pending)
 
+    for download in tqdm(iter_downloads(storage, pending), total=len(pending)):
+        file_path = download.path
         filename = file_path.split("/")[-1]
-        url = f"{SUPABASE_URL}/storage/v1/object/public/{SUPABASE_BUCKET}/{file_path}"
 
         try:
-            file_bytes = fetch_file_bytes(url)
+            if download.error:
+                raise RuntimeError(download.error)
             if filename.endswith(".pdf"):
-                raw = extract_text_from_pdf(file_bytes)
+                # Same page-aware cleaning as ingest (text_cleaning.py), with this script's 300-token chunks
+                cleaned, _ = join_pages(iter_pages_from_pdf(download.local_path))
+                records = [(chunk, {"source": filename, "chunk": i}) for i, chunk in enumerate(chunk_text(cleaned, max_tokens=300))]
             elif filename.endswith(".csv"):
-                raw = extract_text_from_csv(file_bytes)
+                # Row groups with the header repeated, key columns copied into metadata
+                records = iter_csv_chunks(download.local_path, filename)
             else:
                 continue
 
-            cleaned = clean_text(raw)
-            chunks = chunk_text(cleaned)
             doc_id = filename.replace(".pdf", "").replace(".csv", "").replace(" ", "_")
 
+            documents = []
             metadatas = []
             ids = []
 
-            for i, chunk in enumerate(chunks):
+            for chunk, meta in records:
                 if len(chunk.strip()) == 0 or len(chunk) > 16000:
                     continue
+                i = meta["chunk"]
                 ids.append(f"{doc_id}_{i}")
-                metadatas.append({
-                    "source": filename,
-                    "chunk": i,
-                    "chunk_id": i,
-                    "path": file_path
-                })
+                documents.append(chunk)
+                metadatas.append({**meta, "chunk_id": i, "path": file_path})
 
             if ids:
                 batch_size = 100
                 for i in range(0, len(ids), batch_size):
                     collection.add(
                         ids=ids[i:i+batch_size],
-                        documents=chunks[i:i+batch_size],  # ✅ required to avoid error
+                        documents=documents[i:i+batch_size],  # ✅ required to avoid error
                         metadatas=metadatas[i:i+batch_size]
                     )
+                update_sources(collection, sources_collection, {filename})
                 already_patched.add(file_path)
                 with open(STATE_FILE, "w") as f:
                     json.dump(list(already_patched), f, indent=2)
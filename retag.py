@@ -1,45 +1,29 @@
 import os
 import json
 from openai import OpenAI
-from chromadb import PersistentClient
-from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
 from dotenv import load_dotenv
 from tqdm import tqdm
+from chroma_pages import iter_pages, peak_rss_mb, DEFAULT_PAGE_SIZE
+from tag_normalise import load_canonical_map, normalise_metadata
+from shared_store import open_chroma_client
+from embeddings import open_collection
 
 # Load your OpenAI API key
 load_dotenv()
 openai_api_key = os.getenv("OPENAI_API_KEY")
 
-# Setup OpenAI client and embedding function
-openai_client = OpenAI(api_key=openai_api_key)
-embedding_function = OpenAIEmbeddingFunction(api_key=openai_api_key)
+# OpenAI client (tagging only; retagging never re-embeds), created on first use so importing this
+# module opens nothing
+_openai_client = None
 
-# Connect to your ChromaDB collection (unified name/path)
-client = PersistentClient(path="/tmp/chroma_store")
-collection = client.get_or_create_collection(
-    name="cocktailgpt",
-    embedding_function=embedding_function
-)
+def get_openai_client():
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = OpenAI(api_key=openai_api_key)
+    return _openai_client
 
-# Synonym map for tag normalisation
-TAG_SYNONYM_MAP = {
-    "citrusy": "citrus",
-    "green apple": "green-fruit",
-    "herbal": "herbaceous",
-    "savoury": "umami",
-    "floral notes": "floral",
-    "fruity": "fruit",
-    "earthy": "earth",
-    "mushroomy": "earth",
-    "meaty": "umami"
-}
-
-def normalise_tags(tag_list):
-    normalised = []
-    for tag in tag_list:
-        base = tag.lower().strip()
-        normalised.append(TAG_SYNONYM_MAP.get(base, base))
-    return list(set(normalised))
+# Canonical tag mapping built by tag_normalise.py (seed synonyms are applied even without it)
+CANONICAL_TAGS = load_canonical_map()
 
 def generate_tags_for_chunk(chunk_text):
     system_prompt = (
@@ -51,7 +35,7 @@ def generate_tags_for_chunk(chunk_text):
     user_prompt = f"Chunk:\n{chunk_text[:1000]}"
 
     try:
-        response = openai_client.chat.completions.create(
+        response = get_openai_client().chat.completions.create(
             model="gpt-4-turbo",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -60,38 +44,60 @@ def generate_tags_for_chunk(chunk_text):
             temperature=0.2
         )
         tags = json.loads(response.choices[0].message.content.strip())
-        for key in tags:
-            if isinstance(tags[key], list):
-                tags[key] = normalise_tags(tags[key])
-        return tags
+        # Chroma metadata values must be scalars, so tag lists are stored ", "-joined
+        return normalise_metadata(tags, CANONICAL_TAGS)
     except Exception as e:
         print(f"⚠️ Tagging failed: {e}")
         return {}
 
-# Retrieve all documents and metadata from the collection
-print("🔍 Retrieving all documents...")
-results = collection.get(include=["documents", "metadatas"])
-docs = results["documents"]
-metas = results["metadatas"]
-ids = results.get("ids", [f"chunk_{i}" for i in range(len(docs))])
-
-print(f"🔁 Retagging {len(docs)} chunks...")
+def retag_all(page_size=DEFAULT_PAGE_SIZE, job=None, target=None):
+    """
+    Stream the collection page by page so memory stays bounded by one page, not the whole store.
+    `job` (jobs.Job) gets chunk progress and is checked for cancellation between pages;
+    `target` lets the API pass its own open collection; otherwise the main store is opened (unified
+    name/path, with the store's EMBEDDING_BACKEND).
+    """
+    collection_ = target if target is not None else open_collection(open_chroma_client(), "cocktailgpt")
+    total = collection_.count()
+    done = 0
+    print(f"🔁 Retagging {total} chunks in pages of {page_size}...")
 
-# Loop through each chunk and apply updated tags
-for i in tqdm(range(len(docs))):
-    doc = docs[i]
-    meta = metas[i]
-    chunk_id = ids[i]
+    with tqdm(total=total) as bar:
+        for page in iter_pages(collection_, page_size=page_size, include=["documents", "metadatas"]):
+            if job is not None and job.cancelled:
+                print(f"🛑 Retagging cancelled after {done} chunks")
+                break
+            ids = page["ids"]
+            updated = []
+            for doc, meta in zip(page["documents"], page["metadatas"]):
+                new_tags = generate_tags_for_chunk(doc)
+                updated.append({**(meta or {}), **new_tags})
 
-    new_tags = generate_tags_for_chunk(doc)
-    updated_metadata = {**meta, **new_tags}
+            try:
+                collection_.update(ids=ids, metadatas=updated)
+            except Exception as e:
+                # Fall back to per-chunk updates so one bad record doesn't lose the page
+                print(f"⚠️ Page update failed ({e}), retrying chunk by chunk")
+                for chunk_id, meta in zip(ids, updated):
+                    try:
+                        collection_.update(ids=[chunk_id], metadatas=[meta])
+                    except Exception as e:
+                        print(f"❌ Failed to update chunk {chunk_id}: {e}")
+            bar.update(len(ids))
+            done += len(ids)
+            if job is not None:
+                job.progress(chunks=done)
 
-    try:
-        collection.update(
-            ids=[chunk_id],
-            metadatas=[updated_metadata]
-        )
-    except Exception as e:
-        print(f"❌ Failed to update chunk {chunk_id}: {e}")
+    print(f"✅ Retagging complete. Peak RSS {peak_rss_mb():.1f} MB")
+    return {"chunks": done, "total": total}
 
-print("✅ Retagging complete.")
+if __name__ == "__main__":
+    # Holds the store lock, so it waits for (and keeps out) ingest, normalise, compact and restore jobs;
+    # workers reopen the store afterwards
+    from jobs import STORE_LOCK, script_lock
+    from shared_store import bump_generation
+    with script_lock(STORE_LOCK):
+        try:
+            retag_all()
+        finally:
+            bump_generation("retag")
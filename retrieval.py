@@ -0,0 +1,228 @@
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# Retrieval strategies used by /ask. Both return the usual Chroma query dict
+# (documents/metadatas/... as single-query nested lists).
+#
+#   flat      : top-k over every chunk
+#   two_stage : top-M sources from the source index (see source_index.py),
+#               then top-k chunks restricted to those sources
+
+#
+# Adaptive k (ADAPTIVE_K=1): fetch up to RETRIEVAL_MAX_K candidates with their distances and keep them
+# in rank order while the similarity (1 - d/2) stays at or above RETRIEVAL_MIN_SCORE and doesn't fall
+# by more than RETRIEVAL_CLIFF from one candidate to the next. Nothing kept means "no relevant sources".
+
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "two_stage")  # "flat" | "two_stage"
+TOP_SOURCES = int(os.environ.get("RETRIEVAL_TOP_SOURCES", "8"))
+DEFAULT_INCLUDE = ["documents", "metadatas"]
+
+ADAPTIVE_K = os.environ.get("ADAPTIVE_K", "1") == "1"
+RETRIEVAL_MAX_K = int(os.environ.get("RETRIEVAL_MAX_K", "10"))
+RETRIEVAL_MIN_SCORE = float(os.environ.get("RETRIEVAL_MIN_SCORE", "0.25"))
+RETRIEVAL_CLIFF = float(os.environ.get("RETRIEVAL_CLIFF", "0.12"))
+
+
+def flat_query(
+    collection,
+    query_embedding,
+    n_results: int = 5,
+    include: Optional[List[str]] = None,
+    where: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    kwargs = {
+        "query_embeddings": [query_embedding],
+        "n_results": n_results,
+        "include": list(include) if include is not None else list(DEFAULT_INCLUDE),
+    }
+    if where:
+        kwargs["where"] = where
+    return collection.query(**kwargs)
+
+
+def pick_sources(sources_collection, query_embedding, n_sources: int = TOP_SOURCES) -> List[str]:
+    """Coarse stage: the `n_sources` source files whose summary embedding is closest to the query."""
+    count = sources_collection.count() if sources_collection is not None else 0
+    if not count:
+        return []
+    res = sources_collection.query(
+        query_embeddings=[query_embedding],
+        n_results=min(n_sources, count),
+        include=["metadatas"],
+    )
+    return [m["source"] for m in (res.get("metadatas") or [[]])[0] if m and m.get("source")]
+
+
+def two_stage_query(
+    collection,
+    sources_collection,
+    query_embedding,
+    n_results: int = 5,
+    n_sources: int = TOP_SOURCES,
+    include: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """Coarse-to-fine query. Falls back to a flat query when the source index is empty."""
+    sources = pick_sources(sources_collection, query_embedding, n_sources=n_sources)
+    if not sources:
+        return flat_query(collection, query_embedding, n_results=n_results, include=include)
+
+    where = {"source": sources[0]} if len(sources) == 1 else {"source": {"$in": sources}}
+    results = flat_query(collection, query_embedding, n_results=n_results, include=include, where=where)
+    results["candidate_sources"] = sources
+    return results
+
+
+def distance_to_similarity(distance: float) -> float:
+    """Chroma's default space is squared L2; on unit vectors that is 2 - 2·cos."""
+    return 1.0 - float(distance) / 2.0
+
+
+def adaptive_cutoff(
+    distances: List[float],
+    min_score: float = RETRIEVAL_MIN_SCORE,
+    cliff: float = RETRIEVAL_CLIFF,
+    max_k: int = RETRIEVAL_MAX_K,
+) -> Dict[str, Any]:
+    """How many of the ranked candidates to keep, and why the list stopped there."""
+    scores = [distance_to_similarity(d) for d in distances[:max_k]]
+    kept, reason = 0, "max_k" if len(distances) >= max_k else "exhausted"
+    for i, score in enumerate(scores):
+        if score < min_score:
+            reason = "min_score"
+            break
+        if i and scores[i - 1] - score > cliff:
+            reason = "cliff"
+            break
+        kept += 1
+    return {
+        "k": kept,
+        "candidates": len(scores),
+        "stopped_by": reason if kept else "no_relevant_sources",
+        "scores": [round(s, 4) for s in scores],
+        "min_score": min_score,
+        "cliff": cliff,
+        "max_k": max_k,
+    }
+
+
+def trim_results(results: Dict[str, Any], k: int) -> Dict[str, Any]:
+    """Keep the first k hits of a single-query Chroma result."""
+    out = dict(results)
+    for key in ("ids", "documents", "metadatas", "distances", "embeddings", "uris", "data"):
+        value = results.get(key)
+        if isinstance(value, list) and value and isinstance(value[0], list):
+            out[key] = [value[0][:k]]
+    return out
+
+
+def retrieve(
+    collection,
+    sources_collection,
+    query_embedding,
+    n_results: int = 5,
+    include: Optional[List[str]] = None,
+    mode: str = RETRIEVAL_MODE,
+    adaptive: bool = ADAPTIVE_K,
+    max_k: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    With `adaptive`, up to `max_k` (default RETRIEVAL_MAX_K) hits are fetched and cut by adaptive_cutoff
+    (n_results is then ignored); the decision is returned under results["adaptive_k"].
+    """
+    if adaptive:
+        include = list(include) if include is not None else list(DEFAULT_INCLUDE)
+        if "distances" not in include:
+            include.append("distances")
+        n_results = max_k or RETRIEVAL_MAX_K
+    if mode == "two_stage":
+        results = two_stage_query(collection, sources_collection, query_embedding, n_results=n_results, include=include)
+    else:
+        results = flat_query(collection, query_embedding, n_results=n_results, include=include)
+    if not adaptive:
+        return results
+
+    decision = adaptive_cutoff((results.get("distances") or [[]])[0], max_k=n_results)
+    results = trim_results(results, decision["k"])
+    results["adaptive_k"] = decision
+    return results
+
+
+def results_from_ids(
+    collection,
+    ids: List[str],
+    query_embedding=None,
+    include: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """
+    A single-query Chroma result for chunks already retrieved (by /retrieve), read by id without
+    searching again; ids no longer in the store are dropped. With `query_embedding`, distances are
+    computed here from the stored embeddings (squared L2, as Chroma reports them) and the hits are
+    ordered by them, so nothing the client sends besides the ids is trusted; otherwise they stay in
+    the given order without distances.
+    """
+    include = [i for i in (include or DEFAULT_INCLUDE) if i != "distances"]
+    fetch = include + ["embeddings"] if query_embedding is not None and "embeddings" not in include else include
+    found = collection.get(ids=list(ids), include=fetch) if ids else {"ids": []}
+    position = {chunk_id: i for i, chunk_id in enumerate(found.get("ids") or [])}
+    order = [(rank, position[chunk_id]) for rank, chunk_id in enumerate(ids) if chunk_id in position]
+    distances: List[float] = []
+    if query_embedding is not None and order:
+        q = np.asarray(query_embedding, dtype=np.float32)
+        vectors = np.asarray([found["embeddings"][i] for _, i in order], dtype=np.float32)
+        distances = [float(d) for d in ((vectors - q) ** 2).sum(axis=1)]
+        ranked = sorted(range(len(order)), key=lambda j: distances[j])
+        order, distances = [order[j] for j in ranked], [distances[j] for j in ranked]
+    results: Dict[str, Any] = {"ids": [[ids[rank] for rank, _ in order]]}
+    for key in include:
+        values = found.get(key)
+        results[key] = [[values[i] for _, i in order]] if values is not None else None
+    if query_embedding is not None:
+        results["distances"] = [distances]
+    return results
+
+
+if __name__ == "__main__":
+    # Usage: python retrieval.py [--min-score=0.25] [--cliff=0.12] [--max-k=10]
+    # Fixed k=5 vs adaptive k over the fixture store (plus a few off-topic questions): context tokens,
+    # hit rate and short-circuits. Scores from the offline hashing embedder run lower than from the
+    # default model, so pass thresholds that suit it (e.g. --min-score=0.12 --cliff=0.08).
+    import sys
+    import json
+    from fixture_store import HashingEmbeddingFunction, build_fixture_store, load_questions, result_sources
+    from prompting import count_tokens
+
+    opts = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    min_score = float(opts.get("min-score", RETRIEVAL_MIN_SCORE))
+    cliff = float(opts.get("cliff", RETRIEVAL_CLIFF))
+    max_k = int(opts.get("max-k", RETRIEVAL_MAX_K))
+
+    ef = HashingEmbeddingFunction()
+    _, col = build_fixture_store("/tmp/chroma_adaptive_k_store", embedding_function=ef)
+    off_topic = ["What's the weather in Paris tomorrow?", "How do I change a car tyre?", "Who won the 1998 World Cup?"]
+    questions = load_questions() + [{"question": q, "sources": []} for q in off_topic]
+
+    report = {"fixed": {"tokens": 0, "hits": 0, "chunks": 0}, "adaptive": {"tokens": 0, "hits": 0, "chunks": 0},
+              "short_circuits": {"on_topic": 0, "off_topic": 0}, "stopped_by": {}}
+    for q in questions:
+        embedding = ef([q["question"]])[0]
+        candidates = flat_query(col, embedding, n_results=max_k, include=["documents", "metadatas", "distances"])
+        decision = adaptive_cutoff(candidates["distances"][0], min_score=min_score, cliff=cliff, max_k=max_k)
+        report["stopped_by"][decision["stopped_by"]] = report["stopped_by"].get(decision["stopped_by"], 0) + 1
+        for name, k in (("fixed", 5), ("adaptive", decision["k"])):
+            kept = trim_results(candidates, k)
+            report[name]["tokens"] += count_tokens("\n\n".join(kept["documents"][0]))
+            report[name]["chunks"] += k
+            report[name]["hits"] += bool(set(result_sources(kept)) & set(q["sources"]))
+        if decision["k"] == 0:
+            report["short_circuits"]["on_topic" if q["sources"] else "off_topic"] += 1
+
+    on_topic = len(questions) - len(off_topic)
+    for name in ("fixed", "adaptive"):
+        r = report[name]
+        r["mean_chunks"] = round(r.pop("chunks") / len(questions), 2)
+        r["mean_context_tokens"] = round(r.pop("tokens") / len(questions), 1)
+        r["hit_rate"] = round(r.pop("hits") / on_topic, 3)
+    report["settings"] = {"min_score": min_score, "cliff": cliff, "max_k": max_k, "questions": len(questions)}
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,232 @@
+import os
+import re
+import sys
+import time
+import threading
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+from retrieval import distance_to_similarity
+
+# Model routing for /ask: simple lookups go to a fast, cheap model and synthesis questions to the
+# large one.
+#
+#   complexity : a local heuristic over the question (length, synthesis vs lookup cues, several asks in one)
+#   confidence : similarity of the best retrieved chunk (1 - d/2 for Chroma's squared-L2 on unit vectors)
+#
+#   fast   when the question looks simple AND retrieval found a close match
+#   strong otherwise, and as the fallback if the fast model errors
+#
+# A request can force a tier with {"tier": "fast" | "strong"}; ROUTING=off sends everything to OPENAI_MODEL.
+
+ROUTING = os.environ.get("ROUTING", "auto")  # "auto" | "off"
+OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4-turbo")
+OPENAI_MAX_TOKENS = int(os.environ.get("OPENAI_MAX_TOKENS", "900"))
+OPENAI_FAST_MODEL = os.environ.get("OPENAI_FAST_MODEL", "gpt-4o-mini")
+OPENAI_FAST_MAX_TOKENS = int(os.environ.get("OPENAI_FAST_MAX_TOKENS", "500"))
+ROUTE_MIN_SIMILARITY = float(os.environ.get("ROUTE_MIN_SIMILARITY", "0.55"))
+ROUTE_MAX_COMPLEXITY = int(os.environ.get("ROUTE_MAX_COMPLEXITY", "1"))  # scores above this are "complex"
+LATENCY_WINDOW = 500  # recent calls kept per tier for p50/p95
+
+TIERS = ("fast", "strong")
+
+_SYNTHESIS_RE = re.compile(
+    r"\b(why|explain|compare|comparison|difference|differ|versus|vs\.?|contrast|design|create|invent|develop|"
+    r"balance|improve|adapt|substitut\w*|replace|pair\w*|menu|theory|science|chemistry|history|evolution|"
+    r"pros and cons|trade-?offs?|should i|what if|analy[sz]e|recommend\w*)\b",
+    re.IGNORECASE,
+)
+_LOOKUP_RE = re.compile(
+    r"^(what is|what's|what are|who (is|was|created|invented)|when|how much|how many|how long|define|list)\b|"
+    r"\b(recipe|spec|ratio|abv|proof|ml|millilitres?|grams?|ounces?|oz|temperature|°c|garnish|glass(ware)?)\b",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class RouteDecision:
+    tier: str
+    model: str
+    max_tokens: int
+    reason: str
+    complexity: int
+    top_similarity: Optional[float]
+    features: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def top_similarity(results: Dict[str, Any]) -> Optional[float]:
+    distances = (results.get("distances") or [[]])[0] if results else []
+    if not distances:
+        return None
+    return distance_to_similarity(min(distances))
+
+
+def question_features(question: str, history_turns: int = 0) -> Dict[str, Any]:
+    words = len(question.split())
+    return {
+        "words": words,
+        "questions": max(question.count("?"), 1),
+        "synthesis_cues": len(_SYNTHESIS_RE.findall(question)),
+        "lookup_cues": len(_LOOKUP_RE.findall(question)),
+        "clauses": len(re.findall(r"\b(and|also|then|plus)\b|[;,]", question, re.IGNORECASE)),
+        "history_turns": history_turns,
+    }
+
+
+def complexity_score(features: Dict[str, Any]) -> int:
+    """0 = plain lookup; every synthesis signal adds to it, lookup cues take one point off."""
+    score = 2 * features["synthesis_cues"]
+    score += features["questions"] - 1
+    score += 1 if features["words"] > 25 else 0
+    score += 1 if features["words"] > 60 else 0
+    score += 1 if features["clauses"] >= 3 else 0
+    score -= 1 if features["lookup_cues"] and not features["synthesis_cues"] else 0
+    return max(score, 0)
+
+
+class Router:
+    """Picks a tier per question and runs the completion, keeping per-tier latency and counts."""
+
+    def __init__(
+        self,
+        strong_model: str = OPENAI_MODEL,
+        fast_model: str = OPENAI_FAST_MODEL,
+        strong_max_tokens: int = OPENAI_MAX_TOKENS,
+        fast_max_tokens: int = OPENAI_FAST_MAX_TOKENS,
+        min_similarity: float = ROUTE_MIN_SIMILARITY,
+        max_complexity: int = ROUTE_MAX_COMPLEXITY,
+        enabled: bool = ROUTING != "off",
+    ):
+        self.models = {"fast": fast_model, "strong": strong_model}
+        self.max_tokens = {"fast": fast_max_tokens, "strong": strong_max_tokens}
+        self.min_similarity = min_similarity
+        self.max_complexity = max_complexity
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._latency = {tier: deque(maxlen=LATENCY_WINDOW) for tier in TIERS}
+        self._counts = {tier: 0 for tier in TIERS}
+        self._fallbacks = 0
+
+    def _decision(self, tier: str, reason: str, complexity: int, similarity: Optional[float], features) -> RouteDecision:
+        return RouteDecision(tier, self.models[tier], self.max_tokens[tier], reason, complexity,
+                             None if similarity is None else round(similarity, 4), features)
+
+    def decide(
+        self,
+        question: str,
+        results: Optional[Dict[str, Any]] = None,
+        override: Optional[str] = None,
+        history_turns: int = 0,
+    ) -> RouteDecision:
+        features = question_features(question, history_turns)
+        complexity = complexity_score(features)
+        similarity = top_similarity(results or {})
+
+        if override in TIERS:
+            return self._decision(override, "override", complexity, similarity, features)
+        if not self.enabled:
+            return self._decision("strong", "routing off", complexity, similarity, features)
+        if complexity > self.max_complexity:
+            return self._decision("strong", f"complex question (score {complexity})", complexity, similarity, features)
+        if similarity is None or similarity < self.min_similarity:
+            return self._decision("strong", "low retrieval confidence", complexity, similarity, features)
+        return self._decision("fast", "simple lookup, confident retrieval", complexity, similarity, features)
+
+    def complete(self, client, messages: List[Dict[str, str]], decision: RouteDecision,
+                 max_tokens: Optional[int] = None, fallback_max_tokens: Optional[int] = None, **kwargs) -> Any:
+        """
+        `client` is anything with chat.completions.create (the OpenAI client, or a stub in tests).
+        A failing fast call is retried once on the strong tier; `decision` is updated to match. The retry
+        is capped at `fallback_max_tokens`, else the strong tier's own cap (not the fast one's).
+        """
+        try:
+            return self._timed(client, messages, decision, max_tokens, **kwargs)
+        except Exception as e:
+            if decision.tier != "fast":
+                raise
+            print(f"⚠️ Fast model {decision.model} failed ({e}); falling back to {self.models['strong']}")
+            with self._lock:
+                self._fallbacks += 1
+            decision.tier, decision.model = "strong", self.models["strong"]
+            decision.reason += " → fallback after fast-model error"
+            decision.max_tokens = fallback_max_tokens or self.max_tokens["strong"]
+            return self._timed(client, messages, decision, None, **kwargs)
+
+    def _timed(self, client, messages, decision: RouteDecision, max_tokens: Optional[int], **kwargs) -> Any:
+        t = time.perf_counter()
+        completion = client.chat.completions.create(
+            model=decision.model,
+            messages=messages,
+            max_tokens=decision.max_tokens if max_tokens is None else max_tokens,
+            **kwargs,
+        )
+        elapsed = time.perf_counter() - t
+        decision.features["latency_s"] = round(elapsed, 3)
+        with self._lock:
+            self._latency[decision.tier].append(elapsed)
+            self._counts[decision.tier] += 1
+        print(f"🧭 Route {decision.tier} ({decision.model}): {decision.reason} · complexity {decision.complexity} · "
+              f"top sim {decision.top_similarity} · {elapsed * 1000:.0f} ms")
+        return completion
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = {"enabled": self.enabled, "fallbacks": self._fallbacks}
+            for tier in TIERS:
+                lat = sorted(self._latency[tier])
+                out[tier] = {
+                    "model": self.models[tier],
+                    "requests": self._counts[tier],
+                    "p50_ms": round(lat[len(lat) // 2] * 1000, 1) if lat else None,
+                    "p95_ms": round(lat[min(int(len(lat) * 0.95), len(lat) - 1)] * 1000, 1) if lat else None,
+                }
+            return out
+
+
+# ---------- Stub client (tests, offline runs) ----------
+class _StubCompletions:
+    def __init__(self, latency: Dict[str, float], fail: Sequence[str]):
+        self.latency, self.fail, self.calls = latency, set(fail), []
+
+    def create(self, model: str, messages, max_tokens: int, **kwargs):
+        from types import SimpleNamespace
+        self.calls.append({"model": model, "max_tokens": max_tokens})
+        time.sleep(self.latency.get(model, 0.0))
+        if model in self.fail:
+            raise RuntimeError(f"stub failure for {model}")
+        message = SimpleNamespace(content=f"Stub answer from {model}.")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], model=model)
+
+
+class StubChatClient:
+    """Stands in for OpenAI(): per-model latency, optional failing models, and a record of calls."""
+
+    def __init__(self, latency: Optional[Dict[str, float]] = None, fail: Sequence[str] = ()):
+        self.chat = type("Chat", (), {})()
+        self.chat.completions = _StubCompletions(latency or {}, fail)
+
+
+if __name__ == "__main__":
+    # python routing.py "question" [distance]   → decision for one question
+    # python routing.py                          → a few examples through the stub client
+    router = Router()
+    if len(sys.argv) > 1:
+        distance = float(sys.argv[2]) if len(sys.argv) > 2 else 0.6
+        print(router.decide(sys.argv[1], {"distances": [[distance]]}).to_dict())
+        sys.exit(0)
+    stub = StubChatClient(latency={OPENAI_FAST_MODEL: 0.01, OPENAI_MODEL: 0.05})
+    examples = [
+        ("What is the spec for a Negroni?", 0.5),
+        ("How many ml of lime juice go in a Daiquiri?", 0.6),
+        ("What is the spec for a Negroni?", 1.4),
+        ("Why does clarified milk punch stay clear, and how would I adapt it for a low-ABV menu?", 0.5),
+        ("Compare shaking and stirring for dilution and texture.", 0.4),
+    ]
+    for question, distance in examples:
+        decision = router.decide(question, {"distances": [[distance]]})
+        router.complete(stub, [{"role": "user", "content": question}], decision)
+    print(router.stats())
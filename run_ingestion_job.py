@@ -1,4 +1,4 @@
-from ingest_supabase import ingest_supabase_docs, collection
+from ingest_supabase import ingest_supabase_docs, open_store_collections
 
 if __name__ == "__main__":
-    ingest_supabase_docs(collection)
+    ingest_supabase_docs(*open_store_collections())
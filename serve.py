@@ -0,0 +1,286 @@
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from shared_store import (
+    CHROMA_HOST, CHROMA_MODE, CHROMA_PATH, CHROMA_PORT, SWAP_REQUEST_SUFFIX,
+    bump_generation, staging_path, swap_requested, wait_for_server,
+)
+from stub_openai import start_stub_openai
+
+# Multi-worker launcher for api.py.
+#
+#   python serve.py [--workers=4] [--port=8000]
+#
+# With CHROMA_MODE=http it first starts a local `chroma run` on CHROMA_PATH and points every uvicorn
+# worker at it (one copy of the index instead of one per worker). It then supervises both processes:
+# restores unpacked by a worker into CHROMA_PATH.next are swapped in here (stop server, swap dirs,
+# start server, bump the store generation so every worker reopens).
+#
+#   python serve.py bench [--workers=1,2,4] [--modes=embedded,http] [--requests=300] [--concurrency=8]
+#
+# Throughput of /ask against the fixture store with a local stub in place of OpenAI.
+
+API_HOST = os.environ.get("HOST", "0.0.0.0")
+API_PORT = int(os.environ.get("PORT", "8000"))
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
+
+
+def start_chroma_server(path: str = CHROMA_PATH, env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+    os.makedirs(path, exist_ok=True)
+    env = env or os.environ
+    host, port = env.get("CHROMA_HOST", CHROMA_HOST), int(env.get("CHROMA_PORT", CHROMA_PORT))
+    cmd = [shutil.which("chroma") or "chroma", "run", "--path", path, "--host", host, "--port", str(port)]
+    print(f"🗄️ Starting Chroma server: {' '.join(cmd)}")
+    proc = subprocess.Popen(cmd, env=dict(env), stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    if not wait_for_server(host, port):
+        proc.terminate()
+        raise RuntimeError("Chroma server did not come up")
+    return proc
+
+
+def start_api(workers: int, port: int, env: Optional[Dict[str, str]] = None, quiet: bool = False) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "uvicorn", "api:app", "--host", API_HOST, "--port", str(port), "--workers", str(workers)]
+    print(f"🚀 Starting API: {' '.join(cmd[2:])}")
+    out = subprocess.DEVNULL if quiet else None
+    return subprocess.Popen(cmd, env=dict(env or os.environ), cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=out, stderr=out)
+
+
+def stop(proc: Optional[subprocess.Popen], timeout: float = 15.0) -> None:
+    if proc is None or proc.poll() is not None:
+        return
+    proc.terminate()
+    try:
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def swap_store(chroma_proc: subprocess.Popen, path: str = CHROMA_PATH) -> subprocess.Popen:
+    """Stop the server, replace `path` with the staged restore, start it again and tell the workers."""
+    staged = staging_path(path)
+    if not os.path.isdir(staged):
+        print(f"⚠️ Swap requested but {staged} is missing")
+        os.remove(path + SWAP_REQUEST_SUFFIX)
+        return chroma_proc
+    print(f"🔁 Swapping {staged} → {path}")
+    stop(chroma_proc)
+    old = path + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old)
+    os.rename(staged, path)
+    proc = start_chroma_server(path)
+    shutil.rmtree(old, ignore_errors=True)
+    os.remove(path + SWAP_REQUEST_SUFFIX)
+    bump_generation("restore")
+    return proc
+
+
+def serve(workers: int = WEB_CONCURRENCY, port: int = API_PORT) -> int:
+    chroma_proc = start_chroma_server() if CHROMA_MODE == "http" else None
+    api_proc = start_api(workers, port)
+
+    def shutdown(signum, frame):
+        stop(api_proc)
+        stop(chroma_proc)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    while True:
+        time.sleep(0.5)
+        if api_proc.poll() is not None:
+            print(f"❌ API exited with {api_proc.returncode}")
+            stop(chroma_proc)
+            return api_proc.returncode
+        if chroma_proc is not None:
+            if swap_requested():
+                chroma_proc = swap_store(chroma_proc)
+            elif chroma_proc.poll() is not None:
+                # Workers' HttpClients reconnect by themselves; nothing on disk changed
+                print(f"⚠️ Chroma server exited with {chroma_proc.returncode}, restarting")
+                chroma_proc = start_chroma_server()
+
+
+# ---------- Benchmark ----------
+BENCH_CHROMA_PATH = "/tmp/chroma_bench_store"
+BENCH_API_PORT = 8765
+BENCH_CHROMA_PORT = 8766
+BENCH_STUB_PORT = 8767
+
+
+def _children(pid: int) -> List[int]:
+    out = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                out.extend(int(c) for c in f.read().split())
+    except OSError:
+        pass
+    return out
+
+
+def tree_rss_mb(pids: List[int]) -> float:
+    """Summed VmRSS of the given processes and all their descendants (Linux)."""
+    seen, stack, total_kb = set(), list(pids), 0
+    while stack:
+        pid = stack.pop()
+        if pid in seen:
+            continue
+        seen.add(pid)
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                total_kb += next((int(line.split()[1]) for line in f if line.startswith("VmRSS:")), 0)
+        except OSError:
+            continue
+        stack.extend(_children(pid))
+    return total_kb / 1024
+
+
+def _wait_healthy(url: str, workers: int, timeout: float = 120.0) -> None:
+    import httpx
+    deadline = time.time() + timeout
+    pids = set()
+    while time.time() < deadline:
+        try:
+            r = httpx.get(url + "/health", timeout=5)
+            if r.status_code == 200 and r.json().get("status") == "ok":
+                pids.add(r.json().get("worker_pid"))
+                if len(pids) >= workers or time.time() > deadline - timeout / 2:
+                    return
+                continue
+        except Exception:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"API at {url} did not become healthy")
+
+
+def _fire(url: str, questions: List[str], n: int, concurrency: int) -> Dict[str, Any]:
+    import httpx
+    from fixture_store import percentile
+
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(i: int):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            r = client.post(url + "/ask", json={"question": questions[i % len(questions)]}, timeout=60)
+            ok = r.status_code == 200
+        except Exception:
+            ok = False
+        with lock:
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    with httpx.Client() as client:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(n)))
+        seconds = time.perf_counter() - start
+    return {
+        "requests": n,
+        "errors": errors,
+        "req_per_s": round(len(latencies) / seconds, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+    }
+
+
+def prepare_bench_store(path: str = BENCH_CHROMA_PATH) -> None:
+    """Fresh fixture store (hashing embeddings) with its source index."""
+    from fixture_store import HashingEmbeddingFunction, build_fixture_store
+    from source_index import SOURCES_COLLECTION, build_source_index
+
+    ef = HashingEmbeddingFunction()
+    client, collection = build_fixture_store(path, embedding_function=ef)
+    build_source_index(collection, client.get_or_create_collection(SOURCES_COLLECTION, embedding_function=ef))
+
+
+def bench_env(mode: str = "embedded") -> Dict[str, str]:
+    """Environment for an API that serves the fixture store and talks to the stub instead of OpenAI."""
+    env = dict(os.environ)
+    env.update({
+        "CHROMA_MODE": mode,
+        "CHROMA_PATH": BENCH_CHROMA_PATH,
+        "CHROMA_HOST": "127.0.0.1",
+        "CHROMA_PORT": str(BENCH_CHROMA_PORT),
+        "EMBEDDING_BACKEND": "fixture-hashing",
+        # The hashing embedder scores below the adaptive-k thresholds; keep a fixed k so every request reaches the model
+        "ADAPTIVE_K": "0",
+        # Benchmarks drive the raw request path from one address; loadtest.py admission turns it back on
+        "ADMISSION": "0",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{BENCH_STUB_PORT}/v1",
+        "OPENAI_API_KEY": "stub",
+        "SKIP_INGEST": "1",
+        "VECTOR_BACKEND": "chroma",
+        "STORE_GENERATION_PATH": BENCH_CHROMA_PATH + ".generation",
+        "JOB_STATE_PATH": "/tmp/cocktailgpt_bench_jobs.json",
+        "JOB_LOCK_DIR": "/tmp/cocktailgpt_bench_locks",
+        "QUERY_LOG_PATH": "/tmp/cocktailgpt_bench_queries.jsonl",
+        "SUPABASE_URL": os.environ.get("SUPABASE_URL", "http://127.0.0.1:9"),
+        "SUPABASE_SERVICE_ROLE_KEY": os.environ.get("SUPABASE_SERVICE_ROLE_KEY", "unused"),
+    })
+    return env
+
+
+def benchmark(workers_list=(1, 2, 4), modes=("embedded", "http"), requests: int = 300,
+              concurrency: int = 8, stub_latency: float = 0.0) -> List[Dict[str, Any]]:
+    from fixture_store import load_questions
+
+    prepare_bench_store()
+    questions = [q["question"] for q in load_questions()]
+    stub = start_stub_openai(BENCH_STUB_PORT, latency=stub_latency)
+    url = f"http://127.0.0.1:{BENCH_API_PORT}"
+    rows = []
+    try:
+        for mode in modes:
+            for workers in workers_list:
+                env = bench_env(mode)
+                chroma_proc = api_proc = None
+                try:
+                    if mode == "http":
+                        chroma_proc = start_chroma_server(BENCH_CHROMA_PATH, env)
+                    api_proc = start_api(workers, BENCH_API_PORT, env, quiet=True)
+                    _wait_healthy(url, workers)
+                    _fire(url, questions, concurrency * 4, concurrency)  # warm-up
+                    row = {"mode": mode, "workers": workers, **_fire(url, questions, requests, concurrency)}
+                    row["rss_mb"] = round(tree_rss_mb([p.pid for p in (api_proc, chroma_proc) if p is not None]), 1)
+                    print(f"📏 {row}")
+                    rows.append(row)
+                finally:
+                    stop(api_proc)
+                    stop(chroma_proc)
+    finally:
+        stub.shutdown()
+    return rows
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    opts = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    if args and args[0] == "bench":
+        results = benchmark(
+            workers_list=[int(w) for w in opts.get("workers", "1,2,4").split(",")],
+            modes=opts.get("modes", "embedded,http").split(","),
+            requests=int(opts.get("requests", 300)),
+            concurrency=int(opts.get("concurrency", 8)),
+            stub_latency=float(opts.get("stub-latency", 0.0)),
+        )
+        print(json.dumps(results, indent=2))
+    else:
+        sys.exit(serve(workers=int(opts.get("workers", WEB_CONCURRENCY)), port=int(opts.get("port", API_PORT))))
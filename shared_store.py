@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import fcntl
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+# Sharing one vector store between several API worker processes.
+#
+#   CHROMA_MODE=embedded : every process opens its own PersistentClient on CHROMA_PATH (the old behaviour;
+#                          one copy of the HNSW index per worker)
+#   CHROMA_MODE=http     : one local `chroma run` server owns CHROMA_PATH (started by serve.py) and every
+#                          worker talks to it with an HttpClient, so the index is loaded once
+#
+# Restores and reloads are broadcast through a generation counter in a small file next to the store:
+# whoever replaces the store bumps it, and each worker compares it against the generation it opened
+# (one os.stat per request) and reopens when it moved.
+
+CHROMA_MODE = os.environ.get("CHROMA_MODE", "embedded")  # "embedded" | "http"
+CHROMA_PATH = os.environ.get("CHROMA_PATH", "/tmp/chroma_store")
+CHROMA_HOST = os.environ.get("CHROMA_HOST", "127.0.0.1")
+CHROMA_PORT = int(os.environ.get("CHROMA_PORT", "8001"))
+STORE_GENERATION_PATH = os.environ.get("STORE_GENERATION_PATH", "/tmp/chroma_store.generation")
+
+# http mode: a restore is unpacked here, then serve.py stops the server, swaps directories and restarts it
+STAGING_SUFFIX = ".next"
+SWAP_REQUEST_SUFFIX = ".swap"
+
+
+def open_chroma_client(path: str = CHROMA_PATH, mode: str = CHROMA_MODE):
+    if mode == "http":
+        from chromadb import HttpClient
+        return HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+    from chromadb import PersistentClient
+    return PersistentClient(path=path)
+
+
+def release_embedded_clients() -> None:
+    """
+    Chroma caches one embedded system per path for the life of the process, so a PersistentClient
+    opened after the files were replaced would still read the old (deleted) ones. Drop the cache first.
+    """
+    from chromadb.api.client import SharedSystemClient
+    SharedSystemClient.clear_system_cache()
+
+
+def wait_for_server(host: str = CHROMA_HOST, port: int = CHROMA_PORT, timeout: float = 60.0) -> bool:
+    from chromadb import HttpClient
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            HttpClient(host=host, port=port).heartbeat()
+            return True
+        except Exception:
+            time.sleep(0.25)
+    return False
+
+
+# ---------- Generation counter ----------
+@contextmanager
+def _file_lock(path: str):
+    with open(path + ".lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_generation(path: str = STORE_GENERATION_PATH) -> Dict[str, Any]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"generation": 0}
+
+
+def bump_generation(reason: str = "", path: str = STORE_GENERATION_PATH) -> int:
+    """Increment the counter (atomically, across processes) and return the new generation."""
+    with _file_lock(path):
+        generation = int(read_generation(path).get("generation", 0)) + 1
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"generation": generation, "reason": reason, "pid": os.getpid(), "at": time.time()}, f)
+        os.replace(tmp, path)
+    print(f"🔁 Store generation → {generation} ({reason})")
+    return generation
+
+
+class GenerationWatcher:
+    """Per-process view of the counter; `changed()` is cheap enough to call on every request."""
+
+    def __init__(self, path: str = STORE_GENERATION_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stamp = self._stat()
+        self.generation = int(read_generation(path).get("generation", 0))
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+            return st.st_ino, st.st_mtime_ns  # os.replace gives a new inode on every bump
+        except OSError:
+            return None
+
+    def changed(self) -> bool:
+        """True once per bump made since this process last looked (or marked it seen)."""
+        stamp = self._stat()
+        if stamp == self._stamp:
+            return False
+        with self._lock:
+            if stamp == self._stamp:
+                return False
+            self._stamp = stamp
+            generation = int(read_generation(self.path).get("generation", 0))
+            if generation == self.generation:
+                return False
+            self.generation = generation
+            return True
+
+    def mark_seen(self, generation: Optional[int] = None) -> None:
+        """After this process replaced/reopened the store itself."""
+        with self._lock:
+            self._stamp = self._stat()
+            self.generation = generation if generation is not None else int(read_generation(self.path).get("generation", 0))
+
+
+# ---------- http mode restores ----------
+def staging_path(path: str = CHROMA_PATH) -> str:
+    return path + STAGING_SUFFIX
+
+
+def request_swap(path: str = CHROMA_PATH) -> int:
+    """Ask serve.py to swap in staging_path(path); returns the generation to wait beyond."""
+    current = int(read_generation().get("generation", 0))
+    with open(path + SWAP_REQUEST_SUFFIX, "w") as f:
+        json.dump({"requested_by": os.getpid(), "at": time.time(), "generation": current}, f)
+    return current
+
+
+def swap_requested(path: str = CHROMA_PATH) -> bool:
+    return os.path.exists(path + SWAP_REQUEST_SUFFIX)
+
+
+def wait_for_generation(after: int, timeout: float = 180.0) -> int:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        generation = int(read_generation().get("generation", 0))
+        if generation > after:
+            return generation
+        time.sleep(0.25)
+    raise TimeoutError("No store swap happened; is serve.py supervising the Chroma server?")
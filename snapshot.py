@@ -0,0 +1,327 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import zipfile
+from typing import Any, Dict, List, Optional
+
+from shared_store import CHROMA_PATH
+
+# Snapshot manifests, validation and differential snapshots of the Chroma store.
+#
+# A manifest records every file in the store (size, sha256 and a hash per DIFF_BLOCK block), the count
+# of every collection and the chunk count per source. It is written into each snapshot ZIP as
+# snapshot_manifest.json and kept inside the restored store, so a restore can be checked file by file
+# and record by record.
+#
+# A differential snapshot carries the full manifest of the new state but only what differs from a base
+# manifest: new files whole, changed files as just their changed blocks. Blocks rather than whole files
+# because Chroma writes a row to chroma.sqlite3 every time a store is opened, so the sqlite file never
+# matches byte for byte, while most of its pages do. Take the base from the live server
+# (GET /snapshot/manifest) so it reflects what is actually on disk there.
+# Applying a diff copies the current store, patches it, and only accepts the result when every file
+# matches the manifest, so a store that isn't the base is refused instead of half-updated.
+
+MANIFEST_NAME = "snapshot_manifest.json"
+MANIFEST_VERSION = 1
+DIFF_BLOCK = 256 * 1024
+EXCLUDE = {MANIFEST_NAME}
+
+
+def file_hashes(path: str, block_size: int = DIFF_BLOCK) -> Dict[str, Any]:
+    """size, sha256 and short per-block hashes from a single read of the file."""
+    whole = hashlib.sha256()
+    blocks = []
+    size = 0
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            whole.update(block)
+            blocks.append(hashlib.sha1(block).hexdigest()[:12])
+            size += len(block)
+    return {"size": size, "sha256": whole.hexdigest(), "blocks": blocks}
+
+
+def hash_files(store_path: str) -> Dict[str, Dict[str, Any]]:
+    files = {}
+    for root, _, names in os.walk(store_path):
+        for name in names:
+            full = os.path.join(root, name)
+            rel = os.path.relpath(full, store_path)
+            if rel in EXCLUDE or name.endswith((".lock", ".tmp")):
+                continue
+            files[rel] = file_hashes(full)
+    return dict(sorted(files.items()))
+
+
+def files_id(files: Dict[str, Dict[str, Any]]) -> str:
+    """Identity of a store state: hash over the (path, sha256) table."""
+    h = hashlib.sha256()
+    for rel, meta in sorted(files.items()):
+        h.update(f"{rel}\0{meta['sha256']}\n".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def store_counts(client) -> Dict[str, Any]:
+    """Count per collection and chunks per source (cocktailgpt) via paged metadata reads."""
+    from chroma_pages import iter_pages
+
+    collections = {}
+    sources: Dict[str, int] = {}
+    for c in client.list_collections():
+        name = c if isinstance(c, str) else c.name
+        coll = client.get_collection(name)
+        collections[name] = coll.count()
+        if name == "cocktailgpt":
+            for page in iter_pages(coll, include=["metadatas"]):
+                for meta in page["metadatas"]:
+                    source = (meta or {}).get("source") or "Unknown"
+                    sources[source] = sources.get(source, 0) + 1
+    return {"collections": dict(sorted(collections.items())), "sources": dict(sorted(sources.items()))}
+
+
+def _open_store(store_path: str):
+    from chromadb import PersistentClient
+    return PersistentClient(path=store_path)
+
+
+def build_manifest(store_path: str = CHROMA_PATH, client=None, counts: bool = True) -> Dict[str, Any]:
+    """Counts first: opening a Chroma store writes to its sqlite file, so the hashing has to come after."""
+    manifest: Dict[str, Any] = {"version": MANIFEST_VERSION, "block_size": DIFF_BLOCK}
+    if counts:
+        manifest.update(store_counts(client if client is not None else _open_store(store_path)))
+    files = hash_files(store_path)
+    manifest.update({
+        "id": files_id(files),
+        "created_at": time.time(),
+        "files": files,
+        "total_bytes": sum(f["size"] for f in files.values()),
+    })
+    return manifest
+
+
+def load_manifest(path: str) -> Dict[str, Any]:
+    """From a manifest file, a store directory, a snapshot ZIP or a URL (GET /snapshot/manifest)."""
+    if path.startswith(("http://", "https://")):
+        import requests
+        res = requests.get(path, timeout=600)
+        res.raise_for_status()
+        return res.json()
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            return json.loads(zf.read(MANIFEST_NAME))
+    if os.path.isdir(path):
+        path = os.path.join(path, MANIFEST_NAME)
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: Dict[str, Any], path: str) -> None:
+    if os.path.isdir(path):
+        path = os.path.join(path, MANIFEST_NAME)
+    with open(path, "w") as f:
+        json.dump(manifest, f)
+
+
+# ---------- Validation ----------
+def validate_files(store_path: str, manifest: Dict[str, Any]) -> List[str]:
+    errors = []
+    current = hash_files(store_path)
+    for rel, meta in manifest["files"].items():
+        have = current.get(rel)
+        if have is None:
+            errors.append(f"missing file: {rel}")
+        elif have["size"] != meta["size"]:
+            errors.append(f"size mismatch: {rel} ({have['size']} != {meta['size']})")
+        elif have["sha256"] != meta["sha256"]:
+            errors.append(f"hash mismatch: {rel}")
+    for rel in current.keys() - manifest["files"].keys():
+        errors.append(f"unexpected file: {rel}")
+    return errors
+
+
+def validate_counts(client, manifest: Dict[str, Any]) -> List[str]:
+    errors = []
+    counts = store_counts(client)
+    for name, expected in (manifest.get("collections") or {}).items():
+        got = counts["collections"].get(name)
+        if got != expected:
+            errors.append(f"collection {name}: {got} records, manifest says {expected}")
+    expected_sources = manifest.get("sources") or {}
+    for source in sorted(expected_sources.keys() | counts["sources"].keys()):
+        got, expected = counts["sources"].get(source, 0), expected_sources.get(source, 0)
+        if got != expected:
+            errors.append(f"source {source}: {got} chunks, manifest says {expected}")
+    return errors
+
+
+def validate_store(store_path: str = CHROMA_PATH, manifest: Optional[Dict[str, Any]] = None, client=None,
+                   check_files: bool = True) -> Dict[str, Any]:
+    """
+    Check a restored store against its manifest (by default the one kept inside the store).
+    Files are checked before the store is opened; pass check_files=False for a store that is
+    already being served (Chroma rewrites its files while open).
+    """
+    start = time.perf_counter()
+    if manifest is None:
+        manifest = load_manifest(store_path)
+    errors = validate_files(store_path, manifest) if check_files else []
+    if manifest.get("collections") is not None:
+        try:
+            errors += validate_counts(client if client is not None else _open_store(store_path), manifest)
+        except Exception as e:
+            errors.append(f"could not open store: {e}")
+    return {
+        "ok": not errors,
+        "manifest_id": manifest.get("id"),
+        "files": len(manifest["files"]),
+        "collections": manifest.get("collections"),
+        "errors": errors[:200],
+        "error_count": len(errors),
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+
+
+# ---------- Export / import ----------
+def diff_plan(manifest: Dict[str, Any], base: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """rel -> "file" (ship whole) or [block indices] (ship those blocks); unchanged files are left out."""
+    plan: Dict[str, Any] = {}
+    for rel, meta in manifest["files"].items():
+        old = (base or {}).get("files", {}).get(rel)
+        if old is not None and old["sha256"] == meta["sha256"]:
+            continue
+        if old is None or not old.get("blocks") or base.get("block_size") != manifest["block_size"]:
+            plan[rel] = "file"
+            continue
+        changed = [i for i, h in enumerate(meta["blocks"]) if i >= len(old["blocks"]) or old["blocks"][i] != h]
+        plan[rel] = "file" if len(changed) * 2 > len(meta["blocks"]) else changed
+    return plan
+
+
+def export_snapshot(out_zip: str, store_path: str = CHROMA_PATH, base: Optional[Dict[str, Any]] = None,
+                    client=None, job=None) -> Dict[str, Any]:
+    """
+    Write a snapshot ZIP with the manifest inside. With a base manifest only new files and the
+    changed blocks of changed files are included (a differential snapshot).
+    """
+    manifest = build_manifest(store_path, client=client)
+    block = manifest["block_size"]
+    plan = diff_plan(manifest, base) if base is not None else {rel: "file" for rel in manifest["files"]}
+    manifest["base_id"] = base["id"] if base is not None else None
+    manifest["included"] = plan
+    if job is not None:
+        job.progress(files_total=len(plan))
+
+    shipped = 0
+    with zipfile.ZipFile(out_zip, "w", zipfile.ZIP_DEFLATED) as zf:
+        for rel, what in plan.items():
+            if job is not None:
+                job.raise_if_cancelled()
+            path = os.path.join(store_path, rel)
+            if what == "file":
+                zf.write(path, "files/" + rel)
+                n = manifest["files"][rel]["size"]
+            else:
+                with open(path, "rb") as f, zf.open("blocks/" + rel, "w") as out:
+                    n = 0
+                    for i in what:
+                        f.seek(i * block)
+                        data = f.read(block)
+                        out.write(data)
+                        n += len(data)
+            shipped += n
+            if job is not None:
+                job.add(files_done=1, bytes=n)
+        # Written last, once everything it describes is in the archive
+        zf.writestr(MANIFEST_NAME, json.dumps(manifest))
+
+    manifest["shipped_bytes"] = shipped
+    print(f"📦 Snapshot {manifest['id']} → {out_zip}: {len(plan)}/{len(manifest['files'])} files, "
+          f"{shipped / 1e6:.1f} of {manifest['total_bytes'] / 1e6:.1f} MB, zip {os.path.getsize(out_zip) / 1e6:.1f} MB"
+          + (f" (diff against {base['id']})" if base is not None else ""))
+    return manifest
+
+
+def is_snapshot_zip(zip_path: str) -> bool:
+    with zipfile.ZipFile(zip_path) as zf:
+        return MANIFEST_NAME in zf.namelist()
+
+
+def apply_snapshot(zip_path: str, out_dir: str, base_dir: Optional[str] = None, job=None) -> Dict[str, Any]:
+    """
+    Materialise the snapshot in `out_dir` (replaced if present) and validate its files. A differential
+    snapshot starts from a copy of `base_dir`, which must match the snapshot's base.
+    Returns the manifest; raises ValueError if the result doesn't match it.
+    """
+    with zipfile.ZipFile(zip_path) as zf:
+        manifest = json.loads(zf.read(MANIFEST_NAME))
+        block = manifest["block_size"]
+        if os.path.exists(out_dir):
+            shutil.rmtree(out_dir)
+        if manifest.get("base_id"):
+            if not base_dir or not os.path.isdir(base_dir):
+                raise ValueError(f"Differential snapshot needs the base store (base {manifest['base_id']})")
+            shutil.copytree(base_dir, out_dir, ignore=shutil.ignore_patterns(MANIFEST_NAME))
+        else:
+            os.makedirs(out_dir)
+
+        plan = manifest["included"]
+        if job is not None:
+            job.progress(files_total=len(plan))
+        for rel, what in plan.items():
+            if job is not None:
+                job.raise_if_cancelled()
+            target = os.path.join(out_dir, rel)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if what == "file":
+                with zf.open("files/" + rel) as src, open(target, "wb") as dst:
+                    shutil.copyfileobj(src, dst, block)
+            else:
+                if not os.path.exists(target):
+                    raise ValueError(f"Differential snapshot patches {rel}, which the base store doesn't have")
+                with zf.open("blocks/" + rel) as src, open(target, "r+b") as dst:
+                    for i in what:
+                        dst.seek(i * block)
+                        dst.write(src.read(block))
+                    dst.truncate(manifest["files"][rel]["size"])
+            if job is not None:
+                job.add(files_done=1, bytes=manifest["files"][rel]["size"])
+
+    # Files the new state no longer has (e.g. a dropped HNSW segment)
+    for rel in hash_files(out_dir).keys() - manifest["files"].keys():
+        os.remove(os.path.join(out_dir, rel))
+
+    errors = validate_files(out_dir, manifest)
+    if errors:
+        hint = " (the current store is not this diff's base; send a full snapshot)" if manifest.get("base_id") else ""
+        raise ValueError(f"Snapshot {manifest['id']} failed validation{hint}: " + "; ".join(errors[:5]))
+    save_manifest(manifest, out_dir)
+    return manifest
+
+
+if __name__ == "__main__":
+    # Usage:
+    #   python snapshot.py manifest [store] [out.json]
+    #   python snapshot.py export out.zip [store] [--base=manifest.json|snapshot.zip|https://…/snapshot/manifest]
+    #   python snapshot.py apply snapshot.zip out_dir [--base-dir=/tmp/chroma_store]
+    #   python snapshot.py validate [store] [--manifest=manifest.json|snapshot.zip]
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    opts = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    cmd = args[0] if args else "manifest"
+    if cmd == "manifest":
+        m = build_manifest(args[1] if len(args) > 1 else CHROMA_PATH)
+        if len(args) > 2:
+            save_manifest(m, args[2])
+        print(json.dumps({k: v for k, v in m.items() if k != "files"}, indent=2))
+    elif cmd == "export":
+        export_snapshot(args[1], args[2] if len(args) > 2 else CHROMA_PATH,
+                        base=load_manifest(opts["base"]) if "base" in opts else None)
+    elif cmd == "apply":
+        m = apply_snapshot(args[1], args[2], base_dir=opts.get("base-dir"))
+        print(f"✅ Applied snapshot {m['id']} to {args[2]}")
+    elif cmd == "validate":
+        store = args[1] if len(args) > 1 else CHROMA_PATH
+        report = validate_store(store, load_manifest(opts["manifest"]) if "manifest" in opts else None)
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report["ok"] else 1)
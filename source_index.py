@@ -0,0 +1,166 @@
+import re
+import sys
+import hashlib
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from chroma_pages import iter_pages, DEFAULT_PAGE_SIZE
+
+# Source-level index for coarse-to-fine retrieval.
+# One entry per source file in a small second collection:
+#   embedding : normalised mean of the source's chunk embeddings
+#   metadata  : {"source", "chunks", "key_terms"}
+# /ask first picks the top sources from here, then searches chunks only within them.
+
+SOURCES_COLLECTION = "cocktailgpt_sources"
+KEY_TERMS = 20
+MAX_TERMS_PER_SOURCE = 5000  # prune term counters beyond this to keep memory bounded
+SOURCE_BATCH = 50  # sources summarised per pass; bounds how many accumulators are held at once
+
+_WORD_RE = re.compile(r"[a-z][a-z\-]{2,}")
+STOPWORDS = set("""
+the and for are but not you all any can had her was one our out has him his how its may new now
+old see two who did get let put say she too use that with have this will your from they been more
+when were what which their there than then them these some such into also only other over most
+very would could should about after before while where each those through between during under
+both same being using used uses here just many much well even like make made does done because
+figure table chapter page pages section edition press university copyright isbn http www com
+""".split())
+
+
+class _SourceAccumulator:
+    __slots__ = ("total", "chunks", "terms", "chunk_df")
+
+    def __init__(self):
+        self.total = None
+        self.chunks = 0
+        self.terms: Counter = Counter()
+        self.chunk_df: Counter = Counter()
+
+    def add(self, embedding, document: Optional[str]) -> None:
+        vec = np.asarray(embedding, dtype=np.float64)
+        norm = np.linalg.norm(vec)
+        if norm:
+            vec = vec / norm
+        self.total = vec if self.total is None else self.total + vec
+        self.chunks += 1
+        if document:
+            words = [w for w in _WORD_RE.findall(document.lower()) if w not in STOPWORDS]
+            self.terms.update(words)
+            self.chunk_df.update(set(words))
+            if len(self.terms) > MAX_TERMS_PER_SOURCE:
+                keep = dict(self.terms.most_common(MAX_TERMS_PER_SOURCE // 4))
+                self.terms = Counter(keep)
+                self.chunk_df = Counter({w: c for w, c in self.chunk_df.items() if w in keep})
+
+    def embedding(self) -> List[float]:
+        norm = np.linalg.norm(self.total)
+        return (self.total / norm if norm else self.total).astype(np.float32).tolist()
+
+    def key_terms(self, n: int = KEY_TERMS) -> List[str]:
+        # Favour terms that recur across many chunks of the source, not one-off bursts in a single chunk
+        scored = {w: (self.chunk_df[w] / self.chunks) * np.log1p(tf) for w, tf in self.terms.items()}
+        return [w for w, _ in sorted(scored.items(), key=lambda kv: kv[1], reverse=True)[:n]]
+
+
+def source_id(source: str) -> str:
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def build_source_index(
+    collection,
+    sources_collection,
+    where: Optional[Dict[str, Any]] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+) -> int:
+    """
+    Stream chunk embeddings from `collection` and upsert one summary entry per source
+    into `sources_collection`. Pass `where` to refresh only some sources. Returns the number
+    of sources written.
+
+    A full rebuild first lists the source names (metadata only), then summarises them
+    SOURCE_BATCH at a time, so only one batch of accumulators is held however large the corpus.
+    """
+    if where is not None:
+        return _index_sources(collection, sources_collection, where, page_size)
+    sources = set()
+    for page in iter_pages(collection, page_size=page_size, include=["metadatas"]):
+        sources.update(m["source"] for m in page["metadatas"] if m and m.get("source"))
+    return update_sources(collection, sources_collection, sources, page_size=page_size)
+
+
+def _index_sources(collection, sources_collection, where: Dict[str, Any], page_size: int) -> int:
+    acc: Dict[str, _SourceAccumulator] = {}
+    for page in iter_pages(collection, page_size=page_size, where=where, include=["embeddings", "documents", "metadatas"]):
+        for emb, doc, meta in zip(page["embeddings"], page["documents"], page["metadatas"]):
+            source = (meta or {}).get("source")
+            if not source or emb is None:
+                continue
+            acc.setdefault(source, _SourceAccumulator()).add(emb, doc)
+
+    items = list(acc.items())
+    if items:
+        sources_collection.upsert(
+            ids=[source_id(s) for s, _ in items],
+            embeddings=[a.embedding() for _, a in items],
+            documents=[f"{s}\n{', '.join(a.key_terms())}" for s, a in items],
+            metadatas=[{"source": s, "chunks": a.chunks, "key_terms": ", ".join(a.key_terms())} for s, a in items],
+        )
+    return len(items)
+
+
+def update_sources(collection, sources_collection, sources: Iterable[str], page_size: int = DEFAULT_PAGE_SIZE) -> int:
+    """Refresh the summary entries for just these sources (used at the end of an ingest run)."""
+    sources = sorted(set(sources))
+    written = 0
+    # Keep $in lists short; Chroma evaluates them in SQLite
+    for i in range(0, len(sources), SOURCE_BATCH):
+        batch = sources[i:i + SOURCE_BATCH]
+        where = {"source": batch[0]} if len(batch) == 1 else {"source": {"$in": batch}}
+        written += _index_sources(collection, sources_collection, where, page_size)
+    return written
+
+
+def compare_on_fixtures(n_sources: int = 3, k: int = 5) -> Dict[str, Dict[str, Any]]:
+    """Flat vs two-stage retrieval on the offline fixture store."""
+    from fixture_store import build_fixture_store, evaluate, load_questions, HashingEmbeddingFunction
+    from retrieval import flat_query, two_stage_query
+
+    ef = HashingEmbeddingFunction()
+    client, collection = build_fixture_store(embedding_function=ef)
+    sources_collection = client.get_or_create_collection(SOURCES_COLLECTION, embedding_function=ef)
+    build_source_index(collection, sources_collection)
+
+    questions = load_questions()
+    flat = evaluate(lambda q: flat_query(collection, ef([q])[0], n_results=k), questions, k=k)
+    two_stage = evaluate(
+        lambda q: two_stage_query(collection, sources_collection, ef([q])[0], n_results=k, n_sources=n_sources),
+        questions,
+        k=k,
+    )
+    return {"flat": flat, f"two_stage (top {n_sources} sources)": two_stage}
+
+
+if __name__ == "__main__":
+    # Usage:
+    #   python source_index.py build   # (re)build the source index of the configured store (CHROMA_PATH / CHROMA_MODE)
+    #   python source_index.py bench   # flat vs two-stage on the offline fixtures
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "build"
+    if cmd == "build":
+        from embeddings import open_collection
+        from shared_store import bump_generation, open_chroma_client
+
+        client = open_chroma_client()
+        collection = open_collection(client, "cocktailgpt")
+        sources_collection = open_collection(client, SOURCES_COLLECTION)
+        n = build_source_index(collection, sources_collection)
+        bump_generation("source-index")  # workers reopen the sources collection
+        print(f"✅ Source index built: {n} sources from {collection.count()} chunks")
+    elif cmd == "bench":
+        for mode, stats in compare_on_fixtures().items():
+            print(f"📏 {mode}: {stats}")
+    else:
+        print(f"❌ Unknown command: {cmd}")
+        sys.exit(1)
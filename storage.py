@@ -0,0 +1,353 @@
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+# Access to the bucket the source PDFs/CSVs live in, shared by the ingest, reattach and validation scripts.
+#
+#   STORAGE_BACKEND=supabase : the Supabase Storage bucket (SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY / SUPABASE_BUCKET)
+#   STORAGE_BACKEND=local    : a directory laid out like the bucket (LOCAL_STORAGE_ROOT), for tests and benchmarks;
+#                              LOCAL_STORAGE_LATENCY adds a per-request delay so it behaves like a remote store
+#
+# Listings are paginated and sub-folders are listed concurrently; downloads run on a bounded pool and
+# stream into temp files (nothing holds a whole PDF in memory), with retries and exponential backoff.
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "supabase")  # "supabase" | "local"
+LOCAL_STORAGE_ROOT = os.environ.get("LOCAL_STORAGE_ROOT", "./bucket")
+LOCAL_STORAGE_LATENCY = float(os.environ.get("LOCAL_STORAGE_LATENCY", "0"))
+
+PAGE_SIZE = 100
+LIST_WORKERS = int(os.environ.get("STORAGE_LIST_WORKERS", "8"))
+DOWNLOAD_WORKERS = int(os.environ.get("STORAGE_DOWNLOAD_WORKERS", "4"))
+RETRIES = int(os.environ.get("STORAGE_RETRIES", "4"))
+BACKOFF_BASE = 0.5   # seconds; doubled per attempt, with jitter
+BACKOFF_MAX = 8.0
+STREAM_CHUNK = 1024 * 1024
+INGEST_EXTENSIONS = (".pdf", ".csv")
+
+
+@dataclass
+class Entry:
+    path: str          # relative to the bucket root, "/"-separated
+    name: str
+    is_dir: bool
+    size: Optional[int] = None
+
+
+@dataclass
+class Download:
+    path: str
+    local_path: Optional[str]   # temp file; removed once the consumer moves on to the next download
+    size: int = 0
+    attempts: int = 0
+    error: Optional[str] = None
+
+
+# ---------- Retries ----------
+class PermanentError(Exception):
+    """Raised by backends for failures that retrying won't fix (missing object, bad credentials)."""
+
+
+def with_retries(fn: Callable[[], Any], what: str = "", attempts: int = RETRIES,
+                 base: float = BACKOFF_BASE, max_delay: float = BACKOFF_MAX) -> Tuple[Any, int]:
+    """Call fn() until it succeeds; returns (result, attempts used). Backoff is exponential with full jitter."""
+    for attempt in range(1, attempts + 1):
+        try:
+            return fn(), attempt
+        except PermanentError:
+            raise
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            delay = random.uniform(0, min(max_delay, base * 2 ** (attempt - 1)))
+            print(f"🔁 {what or 'storage request'} failed ({e}); retry {attempt}/{attempts - 1} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+# ---------- Backends ----------
+class Storage(ABC):
+    """A bucket: one page of a folder listing and one object download at a time; the helpers below do the rest."""
+
+    name = "storage"
+
+    @abstractmethod
+    def list_page(self, prefix: str, limit: int, offset: int) -> List[Entry]:
+        ...
+
+    @abstractmethod
+    def download_to(self, path: str, fileobj) -> int:
+        """Stream the object into an open binary file; returns bytes written."""
+
+    def url(self, path: str) -> str:
+        return path
+
+
+class SupabaseStorage(Storage):
+    name = "supabase"
+
+    def __init__(self, url: Optional[str] = None, key: Optional[str] = None, bucket: Optional[str] = None):
+        import httpx
+        from supabase import create_client
+
+        self.base_url = (url or os.environ["SUPABASE_URL"]).rstrip("/")
+        key = key or os.environ["SUPABASE_SERVICE_ROLE_KEY"]
+        self.bucket = bucket or os.environ.get("SUPABASE_BUCKET", "cocktailgpt-pdfs")
+        self.client = create_client(self.base_url, key)
+        # One pooled HTTP client for downloads (thread-safe); the SDK's download() returns the whole body as bytes
+        self.http = httpx.Client(
+            headers={"Authorization": f"Bearer {key}", "apikey": key},
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            limits=httpx.Limits(max_connections=max(DOWNLOAD_WORKERS, LIST_WORKERS) * 2),
+        )
+
+    def list_page(self, prefix: str, limit: int, offset: int) -> List[Entry]:
+        items = self.client.storage.from_(self.bucket).list(
+            prefix, {"limit": limit, "offset": offset, "sortBy": {"column": "name", "order": "asc"}}
+        )
+        entries = []
+        for item in items:
+            name = item["name"]
+            # Folders come back without an id/metadata
+            is_dir = item.get("id") is None and not item.get("metadata")
+            size = (item.get("metadata") or {}).get("size")
+            entries.append(Entry(path=f"{prefix}/{name}" if prefix else name, name=name, is_dir=is_dir, size=size))
+        return entries
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}/storage/v1/object/{self.bucket}/{quote(path)}"
+
+    def download_to(self, path: str, fileobj) -> int:
+        size = 0
+        with self.http.stream("GET", self.url(path)) as response:
+            if response.status_code in (400, 401, 403, 404):
+                raise PermanentError(f"{response.status_code} for {path}")
+            response.raise_for_status()
+            for chunk in response.iter_bytes(STREAM_CHUNK):
+                fileobj.write(chunk)
+                size += len(chunk)
+        return size
+
+
+class LocalStorage(Storage):
+    """A directory standing in for the bucket. `latency` (seconds) is added to every list/download request."""
+
+    name = "local"
+
+    def __init__(self, root: str = LOCAL_STORAGE_ROOT, latency: float = LOCAL_STORAGE_LATENCY):
+        self.root = os.path.abspath(root)
+        self.latency = latency
+
+    def _full(self, path: str) -> str:
+        full = os.path.abspath(os.path.join(self.root, path))
+        if os.path.commonpath([full, self.root]) != self.root:
+            raise PermanentError(f"{path} is outside {self.root}")
+        return full
+
+    def list_page(self, prefix: str, limit: int, offset: int) -> List[Entry]:
+        if self.latency:
+            time.sleep(self.latency)
+        folder = self._full(prefix)
+        if not os.path.isdir(folder):
+            return []
+        names = sorted(os.listdir(folder))[offset:offset + limit]
+        entries = []
+        for name in names:
+            full = os.path.join(folder, name)
+            is_dir = os.path.isdir(full)
+            entries.append(Entry(
+                path=f"{prefix}/{name}" if prefix else name, name=name, is_dir=is_dir,
+                size=None if is_dir else os.path.getsize(full),
+            ))
+        return entries
+
+    def url(self, path: str) -> str:
+        return self._full(path)
+
+    def download_to(self, path: str, fileobj) -> int:
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            with open(self._full(path), "rb") as src:
+                shutil.copyfileobj(src, fileobj, STREAM_CHUNK)
+                return src.tell()
+        except FileNotFoundError as e:
+            raise PermanentError(str(e))
+
+
+_default: Optional[Storage] = None
+_default_lock = threading.Lock()
+
+
+def open_storage(backend: Optional[str] = None) -> Storage:
+    """The bucket configured by STORAGE_BACKEND (one shared instance per process unless `backend` is given)."""
+    global _default
+    if backend is not None:
+        return LocalStorage() if backend == "local" else SupabaseStorage()
+    with _default_lock:
+        if _default is None:
+            _default = LocalStorage() if STORAGE_BACKEND == "local" else SupabaseStorage()
+        return _default
+
+
+# ---------- Listing ----------
+def list_folder(storage: Storage, prefix: str = "", page_size: int = PAGE_SIZE) -> List[Entry]:
+    """Every entry directly under `prefix`, one page at a time (hidden placeholders like .emptyFolderPlaceholder dropped)."""
+    prefix = prefix.strip("/")
+    entries: List[Entry] = []
+    offset = 0
+    while True:
+        page, _ = with_retries(lambda: storage.list_page(prefix, page_size, offset), f"list {prefix or '/'}@{offset}")
+        entries.extend(e for e in page if not e.name.startswith("."))
+        if len(page) < page_size:
+            return entries
+        offset += page_size
+
+
+def list_files(storage: Storage, prefix: str = "", recursive: bool = True,
+               extensions: Optional[Sequence[str]] = INGEST_EXTENSIONS, workers: int = LIST_WORKERS,
+               page_size: int = PAGE_SIZE) -> List[Entry]:
+    """
+    Files under `prefix` (sorted by path), optionally filtered by extension. Folders found while
+    listing are listed concurrently, each on its own paginated walk.
+    """
+    files: List[Entry] = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        pending = deque([pool.submit(list_folder, storage, prefix, page_size)])
+        while pending:
+            for entry in pending.popleft().result():
+                if entry.is_dir:
+                    if recursive:
+                        pending.append(pool.submit(list_folder, storage, entry.path, page_size))
+                elif not extensions or entry.name.lower().endswith(tuple(extensions)):
+                    files.append(entry)
+    return sorted(files, key=lambda e: e.path)
+
+
+# ---------- Downloads ----------
+def download_file(storage: Storage, path: str, tmp_dir: Optional[str] = None) -> Download:
+    """Fetch one object into a temp file (kept on success, removed on failure)."""
+    suffix = os.path.splitext(path)[1]
+
+    def attempt() -> Tuple[str, int]:
+        fd, local_path = tempfile.mkstemp(prefix="cocktailgpt_", suffix=suffix, dir=tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                size = storage.download_to(path, f)
+            return local_path, size
+        except BaseException:
+            os.remove(local_path)
+            raise
+
+    try:
+        (local_path, size), attempts = with_retries(attempt, f"download {path}")
+        return Download(path=path, local_path=local_path, size=size, attempts=attempts)
+    except Exception as e:
+        return Download(path=path, local_path=None, error=str(e))
+
+
+def iter_downloads(storage: Storage, paths: Iterable[str], workers: int = DOWNLOAD_WORKERS,
+                   prefetch: Optional[int] = None, tmp_dir: Optional[str] = None) -> Iterator[Download]:
+    """
+    Download `paths` on a pool of `workers` threads and yield them in order. At most `workers + prefetch`
+    files are in flight or waiting on disk; each temp file is deleted when the consumer asks for the next
+    one (or stops iterating), so process it inside the loop body. Failures are yielded with `.error` set.
+    """
+    paths = iter(paths)
+    window = max(1, workers) + (workers if prefetch is None else prefetch)
+    pool = ThreadPoolExecutor(max_workers=max(1, workers))
+    pending: deque = deque()
+    current: Optional[Download] = None
+    try:
+        for path in paths:
+            pending.append(pool.submit(download_file, storage, path, tmp_dir))
+            if len(pending) >= window:
+                break
+        while pending:
+            current = pending.popleft().result()
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append(pool.submit(download_file, storage, next_path, tmp_dir))
+            yield current
+            _discard(current)
+            current = None
+    finally:
+        # Consumer stopped early (cancelled job, exception): drop queued work and every temp file
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
+        _discard(current)
+        for future in pending:
+            if not future.cancelled() and future.exception() is None:
+                _discard(future.result())
+
+
+def _discard(download: Optional[Download]) -> None:
+    if download is not None and download.local_path:
+        try:
+            os.remove(download.local_path)
+        except FileNotFoundError:
+            pass
+
+
+# ---------- CLI ----------
+def benchmark(root: str, latency: float = 0.05, workers: int = DOWNLOAD_WORKERS, prefix: str = "") -> Dict[str, Any]:
+    """Serial single-request listing/downloads (the old scripts) vs this module, against a local stand-in."""
+    storage = LocalStorage(root, latency=latency)
+
+    def serial_list(path: str) -> List[str]:
+        found = []
+        for entry in list_folder(storage, path):
+            found.extend(serial_list(entry.path) if entry.is_dir else [entry.path])
+        return found
+
+    report: Dict[str, Any] = {"root": root, "latency_s": latency, "workers": workers}
+    t = time.perf_counter()
+    serial = [p for p in serial_list(prefix) if p.lower().endswith(INGEST_EXTENSIONS)]
+    report["list_serial_s"] = round(time.perf_counter() - t, 3)
+    t = time.perf_counter()
+    files = list_files(storage, prefix)
+    report["list_concurrent_s"] = round(time.perf_counter() - t, 3)
+    assert sorted(serial) == [f.path for f in files]
+    report["files"] = len(files)
+
+    t = time.perf_counter()
+    total = 0
+    for d in iter_downloads(storage, [f.path for f in files], workers=1, prefetch=0):
+        total += d.size
+    report["download_serial_s"] = round(time.perf_counter() - t, 3)
+    t = time.perf_counter()
+    for d in iter_downloads(storage, [f.path for f in files], workers=workers):
+        pass
+    report["download_pool_s"] = round(time.perf_counter() - t, 3)
+    report["bytes"] = total
+    return report
+
+
+if __name__ == "__main__":
+    import json
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    opts = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    command = args[0] if args else "list"
+    if command == "list":
+        entries = list_files(open_storage(), args[1] if len(args) > 1 else "", extensions=None)
+        for e in entries:
+            print(f"📄 {e.path} ({e.size if e.size is not None else '?'} bytes)")
+        print(f"✅ {len(entries)} files")
+    elif command == "bench":
+        print(json.dumps(benchmark(
+            opts.get("root", LOCAL_STORAGE_ROOT),
+            latency=float(opts.get("latency", "0.05")),
+            workers=int(opts.get("workers", str(DOWNLOAD_WORKERS))),
+        ), indent=2))
+    else:
+        print("usage: python storage.py list [prefix] | bench --root=DIR [--latency=0.05] [--workers=4]")
+        sys.exit(1)
@@ -3,7 +3,9 @@
 
 import os
 import json
-from typing import List, Dict, Any, Tuple
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 import requests
 import streamlit as st
 
@@ -16,6 +18,19 @@ BACKEND_URL = os.environ.get(
 ).rstrip("/")
 
 SERP_API_KEY = os.environ.get("SERPAPI_API_KEY", "").strip()
+# A bar group's private document set on the backend (workspaces.py); empty = the main library
+WORKSPACE = os.environ.get("WORKSPACE", "").strip()
+# Listed in the backend's RATE_LIMIT_KEYS: every browser session then gets its own rate-limit bucket
+# (X-Client-Id) instead of all users sharing this server's IP
+BACKEND_API_KEY = os.environ.get("BACKEND_API_KEY", "").strip()
+
+def backend_headers(client_id: str = "") -> Dict[str, str]:
+    if not BACKEND_API_KEY:
+        return {}
+    headers = {"X-API-Key": BACKEND_API_KEY}
+    if client_id:
+        headers["X-Client-Id"] = client_id
+    return headers
 
 def check_backend_health() -> Tuple[bool, int]:
     try:
@@ -26,11 +41,39 @@ def check_backend_health() -> Tuple[bool, int]:
     except Exception:
         return False, 0
 
-def call_backend(prompt: str, history: List[Dict[str, str]]) -> Dict[str, Any]:
+def call_retrieve(prompt: str, history: List[Dict[str, str]], conversation_id: str = "",
+                  client_id: str = "") -> Optional[Dict[str, Any]]:
+    """Sources only (fast); None when the backend has no /retrieve or it failed, and /ask retrieves itself."""
+    payload: Dict[str, Any] = {"question": prompt}
+    if conversation_id:
+        payload["conversation_id"] = conversation_id  # same experiment bucket as the /ask that follows
+    if history:
+        payload["history"] = history
+    if WORKSPACE:
+        payload["workspace"] = WORKSPACE
+    try:
+        r = requests.post(f"{BACKEND_URL}/retrieve", json=payload, headers=backend_headers(client_id), timeout=15)
+        r.raise_for_status()
+        return r.json()
+    except Exception:
+        return None
+
+def call_backend(prompt: str, history: List[Dict[str, str]], conversation_id: str = "",
+                 retrieved: Optional[Dict[str, Any]] = None, client_id: str = "") -> Dict[str, Any]:
     payload = {"question": prompt}
     if history:
         payload["history"] = history
-    r = requests.post(f"{BACKEND_URL}/ask", json=payload, timeout=120)
+    if conversation_id:
+        payload["conversation_id"] = conversation_id
+    if WORKSPACE:
+        payload["workspace"] = WORKSPACE
+    if retrieved is not None:
+        # Skip the second vector query: /ask reads these chunks by id
+        payload["retrieved_ids"] = retrieved.get("ids") or []
+        payload["search_question"] = retrieved.get("search_question")
+        if retrieved.get("experiment"):
+            payload["variant"] = retrieved["experiment"]["variant"]
+    r = requests.post(f"{BACKEND_URL}/ask", json=payload, headers=backend_headers(client_id), timeout=120)
     r.raise_for_status()
     return r.json()
 
@@ -70,6 +113,10 @@ if "messages" not in st.session_state:
     st.session_state.messages: List[Dict[str, Any]] = []
 
 st.session_state.setdefault("use_web", False)
+# Lets the backend cache a rolling summary of older turns instead of re-reading the whole chat
+st.session_state.setdefault("conversation_id", uuid.uuid4().hex)
+# The backend's rate-limit bucket for this browser session (kept across "new chat")
+st.session_state.setdefault("client_id", uuid.uuid4().hex)
 
 # ================================================================
 # Sidebar — Controls (no colour pickers)
@@ -93,6 +140,7 @@ with st.sidebar:
     if up:
         try:
             st.session_state.messages = json.loads(up.read().decode("utf-8"))
+            st.session_state.conversation_id = uuid.uuid4().hex
             st.success("Conversation restored")
             st.experimental_rerun()
         except Exception as e:
@@ -102,6 +150,7 @@ with st.sidebar:
     with col_a:
         if st.button("Clear", use_container_width=True):
             st.session_state.messages = []
+            st.session_state.conversation_id = uuid.uuid4().hex
             st.experimental_rerun()
     with col_b:
         if st.button("Regenerate", use_container_width=True):
@@ -150,12 +199,23 @@ def _render_sources(sources: List[Any]) -> None:
             link = s.get("link", "")
             snippet = s.get("snippet", "")
             if link:
-                st.markdown(f"- [{title}]({link}) — {snippet}")
+                st.markdown(f"- [{title}]({link})" + (f" — {snippet}" if snippet else ""))
             else:
                 st.markdown(f"- {title}")
         else:
             st.markdown(f"- {s}")
 
+def _citation_sources(citations: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """Backend citations as links to the cited pages (one per source + page range)."""
+    out, seen = [], set()
+    for c in citations:
+        title = c.get("source", "Source") + (f", {c['pages']}" if c.get("pages") else "")
+        if title in seen:
+            continue
+        seen.add(title)
+        out.append({"title": title, "link": BACKEND_URL.rstrip("/") + c.get("url", ""), "snippet": c.get("snippet", "")})
+    return out
+
 # ================================================================
 # Render conversation
 # ================================================================
@@ -179,29 +239,42 @@ if prompt or regen_prompt:
     if user_text:
         st.session_state.messages.append({"role": "user", "content": user_text})
 
-        web_results = []
-        if st.session_state.use_web:
-            try:
-                web_results = serp_search(user_text, num_results=6)
-            except Exception:
-                web_results = []
-
         history = _compact_history()
-        if web_results:
-            lines = []
-            for i, r in enumerate(web_results, start=1):
-                lines.append(f"[W{i}] {r.get('title','')}\n{r.get('snippet','')}\n{r.get('link','')}".strip())
-            web_block = "Web context:\n" + "\n\n".join(lines)
-            history.append({"role": "user", "content": web_block})
 
         with st.chat_message("CocktailGPT"):
             placeholder = st.empty()
             placeholder.markdown("_BRB, changing a keg…_")
+            sources_box = st.empty()
+
+            # Sources first: /retrieve runs alongside the web search while the /ask request is put
+            # together, so they show before the answer however long the model takes
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                retrieve_future = pool.submit(call_retrieve, user_text, history[:-1], st.session_state.conversation_id,
+                                              st.session_state.client_id)
+                web_future = pool.submit(serp_search, user_text, 6) if st.session_state.use_web else None
+
+                retrieved = retrieve_future.result()
+                if retrieved and retrieved.get("citations"):
+                    with sources_box.container():
+                        _render_sources(_citation_sources(retrieved["citations"]))
+                try:
+                    web_results = web_future.result() if web_future is not None else []
+                except Exception:
+                    web_results = []
+
+            if web_results:
+                lines = []
+                for i, r in enumerate(web_results, start=1):
+                    lines.append(f"[W{i}] {r.get('title','')}\n{r.get('snippet','')}\n{r.get('link','')}".strip())
+                web_block = "Web context:\n" + "\n\n".join(lines)
+                history.append({"role": "user", "content": web_block})
 
             try:
-                resp = call_backend(user_text, history=history)
+                resp = call_backend(user_text, history=history, conversation_id=st.session_state.conversation_id,
+                                    retrieved=retrieved, client_id=st.session_state.client_id)
                 answer = (resp.get("response") or "").strip()
-                local_sources = resp.get("sources") or []
+                # Page-level citations link to /source/{id}; older backends only send labels
+                local_sources = _citation_sources(resp.get("citations") or []) or resp.get("sources") or []
             except requests.HTTPError as e:
                 answer = f"**Backend error:** {e.response.status_code} {e.response.text}"
                 local_sources = []
@@ -219,7 +292,8 @@ if prompt or regen_prompt:
 
             placeholder.markdown(answer)
             if local_sources or compact_web:
-                _render_sources(list(local_sources) + compact_web)
+                with sources_box.container():
+                    _render_sources(list(local_sources) + compact_web)
 
             st.session_state.messages.append({
                 "role": "assistant",
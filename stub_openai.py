@@ -0,0 +1,182 @@
+import sys
+import json
+import time
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+# Local OpenAI-compatible stub for load tests and offline runs; point the client at it with
+# OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+#
+#   POST /v1/chat/completions  (stream=true answers as server-sent events, one chunk per token)
+#   POST /v1/embeddings        (deterministic unit vectors from a hash of the input)
+#   GET  /v1/models
+#
+# Latency: `latency` seconds (± `jitter`) before the reply, or before the first token when streaming,
+# then `token_latency` per streamed token. `error_rate` of requests get a 500.
+#
+#   python stub_openai.py [--port=8767] [--latency=0.3] [--jitter=0.1] [--token-latency=0.01]
+#                         [--answer-tokens=120] [--error-rate=0]
+
+STUB_PORT = 8767
+EMBEDDING_DIM = 1536
+WORDS = ("Stir", "with", "ice", "for", "about", "thirty", "seconds", "then", "strain", "into", "a", "chilled",
+         "coupe", "and", "garnish", "with", "an", "expressed", "lemon", "twist.")
+
+
+class StubConfig:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, token_latency: float = 0.0,
+                 answer_tokens: int = 2, error_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_latency = token_latency
+        self.answer_tokens = answer_tokens
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"chat": 0, "stream": 0, "embeddings": 0, "errors_injected": 0}
+
+    def delay(self) -> float:
+        with self.lock:
+            return max(self.latency + self.random.uniform(-self.jitter, self.jitter), 0.0)
+
+    def fail(self) -> bool:
+        with self.lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def count(self, key: str) -> None:
+        with self.lock:
+            self.stats[key] += 1
+
+
+def _answer_tokens(n: int) -> List[str]:
+    if n <= 2:
+        return ["Stub", " answer."][:max(n, 1)]
+    return [("" if i == 0 else " ") + WORDS[i % len(WORDS)] for i in range(n)]
+
+
+def _prompt_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum((len(str(m.get("content", ""))) + 3) // 4 + 3 for m in messages)
+
+
+def _embedding(text: str) -> List[float]:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    vec = [rng.gauss(0.0, 1.0) for _ in range(EMBEDDING_DIM)]
+    norm = sum(v * v for v in vec) ** 0.5
+    return [v / norm for v in vec]
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    config = StubConfig()
+    protocol_version = "HTTP/1.1"
+
+    def _json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._json(200, {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "stub"}]})
+        else:
+            self._json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        if self.config.fail():
+            self.config.count("errors_injected")
+            time.sleep(self.config.delay())
+            self._json(500, {"error": {"message": "stub: injected failure", "type": "server_error"}})
+        elif self.path.rstrip("/").endswith("/embeddings"):
+            self._embeddings(request)
+        elif self.path.rstrip("/").endswith("/chat/completions"):
+            if request.get("stream"):
+                self._stream(request)
+            else:
+                self._chat(request)
+        else:
+            self._json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def _chat(self, request: Dict[str, Any]) -> None:
+        self.config.count("chat")
+        time.sleep(self.config.delay())
+        tokens = _answer_tokens(min(self.config.answer_tokens, request.get("max_tokens") or 10 ** 6))
+        prompt = _prompt_tokens(request.get("messages") or [])
+        self._json(200, {
+            "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": request.get("model", "stub"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "".join(tokens)}}],
+            "usage": {"prompt_tokens": prompt, "completion_tokens": len(tokens), "total_tokens": prompt + len(tokens)},
+        })
+
+    def _stream(self, request: Dict[str, Any]) -> None:
+        self.config.count("stream")
+        time.sleep(self.config.delay())
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        base = {"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": request.get("model", "stub")}
+
+        def send(delta: Dict[str, Any], finish: Optional[str] = None) -> None:
+            chunk = {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+
+        send({"role": "assistant", "content": ""})
+        for i, token in enumerate(_answer_tokens(min(self.config.answer_tokens, request.get("max_tokens") or 10 ** 6))):
+            if i and self.config.token_latency:
+                time.sleep(self.config.token_latency)
+            send({"content": token})
+        send({}, finish="stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+    def _embeddings(self, request: Dict[str, Any]) -> None:
+        self.config.count("embeddings")
+        time.sleep(self.config.delay())
+        inputs = request.get("input") or []
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        self._json(200, {
+            "object": "list", "model": request.get("model", "stub"),
+            "data": [{"object": "embedding", "index": i, "embedding": _embedding(str(text))} for i, text in enumerate(inputs)],
+            "usage": {"prompt_tokens": sum(len(str(t)) // 4 for t in inputs), "total_tokens": sum(len(str(t)) // 4 for t in inputs)},
+        })
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_openai(port: int = STUB_PORT, latency: float = 0.0, **config: Any) -> ThreadingHTTPServer:
+    """Serve the stub on 127.0.0.1:`port` from a daemon thread; `config` as StubConfig. Stop with .shutdown()."""
+    handler = type("StubOpenAI", (StubOpenAIHandler,), {"config": StubConfig(latency=latency, **config)})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    opts = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    port = int(opts.get("port", STUB_PORT))
+    server = start_stub_openai(
+        port,
+        latency=float(opts.get("latency", "0")),
+        jitter=float(opts.get("jitter", "0")),
+        token_latency=float(opts.get("token-latency", "0")),
+        answer_tokens=int(opts.get("answer-tokens", "2")),
+        error_rate=float(opts.get("error-rate", "0")),
+    )
+    print(f"🧪 Stub OpenAI on http://127.0.0.1:{port}/v1 (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,355 @@
+import os
+import re
+import sys
+import json
+import zlib
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Vocabulary-level tag normalisation.
+#
+#   1. split compound values ("fermentation, bottling, heating") into single tags
+#   2. build the whole tag vocabulary once, with frequencies
+#   3. score every pair of tags in batched NumPy matrix products
+#      (embedding cosine + character-trigram cosine) and attach each tag to its
+#      best-scoring, more frequent neighbour
+#   4. write the resulting canonical mapping and apply it to all chunk metadata in bulk
+
+TAGS_JSON_PATH = "tags_by_chunk.json"
+CANONICAL_MAP_PATH = "tag_canonical_map.json"
+
+# Only these metadata fields hold facet tags; everything else (recipes, methods, notes) is free text.
+TAG_FIELDS = ("technique", "flavour", "ingredient", "category", "process", "skill_level", "discipline", "equipment")
+
+# Hand-curated seeds, applied before clustering and always winning over it
+TAG_SYNONYM_MAP = {
+    "citrusy": "citrus",
+    "green apple": "green-fruit",
+    "herbal": "herbaceous",
+    "savoury": "umami",
+    "floral notes": "floral",
+    "fruity": "fruit",
+    "earthy": "earth",
+    "mushroomy": "earth",
+    "meaty": "umami"
+}
+
+# Placeholder values the tagger emits when it has nothing to say
+EMPTY_TAGS = {"", "n/a", "na", "none", "null", "unknown", "not provided", "not specified", "not applicable", "various"}
+
+OUTPUT_SEPARATOR = ", "
+# ", " / "; " / " | " / " & " / " / " separate tags; bare commas are left alone ("1,2,4-triazole")
+_SPLIT_RE = re.compile(r",\s+|;\s*|\s+\|\s+|\s+&\s+|\s+/\s+")
+_SPACE_RE = re.compile(r"\s+")
+_DIGITS_RE = re.compile(r"\d+")
+_EDGE_PUNCT = " \t\"'`.:;-*()[]{}"
+
+TRIGRAM_DIM = 1024
+BLOCK_SIZE = 512
+EMBED_BATCH = 1000
+
+
+# ---------- Splitting / surface normalisation ----------
+def base_form(tag: str) -> str:
+    """Lower-case, collapse whitespace, trim stray punctuation, then apply the seed synonyms."""
+    t = _SPACE_RE.sub(" ", tag.lower()).strip(_EDGE_PUNCT)
+    if t.count("(") > t.count(")"):
+        # Splitting "ssf (simultaneous saccharification, fermentation)" leaves an open bracket
+        t += ")"
+    return TAG_SYNONYM_MAP.get(t, t)
+
+
+def split_tags(value) -> List[str]:
+    """Split a compound tag value (string or list) into base-form tags, dropping placeholders."""
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        pieces = [p for v in value for p in _SPLIT_RE.split(str(v))]
+    else:
+        pieces = _SPLIT_RE.split(str(value))
+    out = []
+    for piece in pieces:
+        t = base_form(piece)
+        if t not in EMPTY_TAGS:
+            out.append(t)
+    return out
+
+
+def build_vocabulary(entries: Iterable[Dict[str, object]], fields: Iterable[str] = TAG_FIELDS) -> Counter:
+    """Count every base-form tag across all tag fields of all chunks, in one pass."""
+    fields = set(fields)
+    vocab: Counter = Counter()
+    for entry in entries:
+        for field, value in (entry or {}).items():
+            if field in fields:
+                vocab.update(split_tags(value))
+    return vocab
+
+
+# ---------- Vectorisation ----------
+def trigram_matrix(terms: List[str], dim: int = TRIGRAM_DIM) -> np.ndarray:
+    """L2-normalised hashed character-trigram counts, one row per term."""
+    rows, cols = [], []
+    for i, term in enumerate(terms):
+        padded = f"  {term} "
+        for j in range(len(padded) - 2):
+            rows.append(i)
+            cols.append(zlib.crc32(padded[j:j + 3].encode("utf-8")) % dim)
+    mat = np.zeros((len(terms), dim), dtype=np.float32)
+    np.add.at(mat, (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)), 1.0)
+    return _normalise_rows(mat)
+
+
+def embedding_matrix(terms: List[str], embedding_function, batch_size: int = EMBED_BATCH) -> np.ndarray:
+    """Embed the vocabulary in large batches (one request per `batch_size` terms, not per chunk)."""
+    parts = []
+    for i in range(0, len(terms), batch_size):
+        parts.append(np.asarray(embedding_function(terms[i:i + batch_size]), dtype=np.float32))
+    return _normalise_rows(np.vstack(parts))
+
+
+def _normalise_rows(mat: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+# ---------- Clustering ----------
+def cluster_vocabulary(
+    vocab: Counter,
+    embeddings: Optional[np.ndarray] = None,
+    embed_weight: float = 0.6,
+    threshold: float = 0.9,
+    block_size: int = BLOCK_SIZE,
+) -> Dict[str, str]:
+    """
+    Map each tag to a canonical tag. Terms are ranked by frequency; every term may only
+    attach to a strictly more frequent one, so each cluster's canonical form is its most
+    common spelling and chains always terminate. Similarities are computed block by block
+    as dense matrix products, so memory is O(block_size * vocab_size).
+
+    Terms only merge when they contain the same numbers: "isohumulone b" and "isohumulone"
+    may be spelling variants, "thermozeaxanthin 13-13" and "13-15" are different compounds.
+
+    `embeddings` must be row-aligned with `vocab.most_common()`. Without embeddings the
+    score is string similarity alone.
+    """
+    ranked = [t for t, _ in vocab.most_common()]
+    n = len(ranked)
+    if n == 0:
+        return {}
+
+    trigrams = trigram_matrix(ranked)
+    weight = embed_weight if embeddings is not None else 0.0
+    parent = np.arange(n)
+    _, digit_class = np.unique([" ".join(_DIGITS_RE.findall(t)) for t in ranked], return_inverse=True)
+
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        scores = (1.0 - weight) * (trigrams[start:stop] @ trigrams.T)
+        if embeddings is not None:
+            scores += weight * (embeddings[start:stop] @ embeddings.T)
+
+        # Only look "up" the frequency ranking: column j is allowed for row i iff j < i
+        cols = np.arange(n)[None, :]
+        rows = np.arange(start, stop)[:, None]
+        scores[cols >= rows] = -np.inf
+        scores[digit_class[start:stop, None] != digit_class[None, :]] = -np.inf
+
+        best = scores.argmax(axis=1)
+        best_score = scores[np.arange(stop - start), best]
+        accept = best_score >= threshold
+        parent[start:stop][accept] = best[accept]
+
+    # parent[i] < i whenever it moved, so one forward pass resolves every chain to its root
+    root = parent.copy()
+    for i in range(n):
+        root[i] = root[parent[i]]
+
+    return {ranked[i]: ranked[root[i]] for i in range(n)}
+
+
+def build_canonical_map(
+    entries: Iterable[Dict[str, object]],
+    embedding_function=None,
+    embed_weight: float = 0.6,
+    threshold: float = 0.9,
+) -> Tuple[Dict[str, str], Dict[str, object]]:
+    """Vocabulary -> (mapping of every changed tag to its canonical form, stats)."""
+    start = time.perf_counter()
+    vocab = build_vocabulary(entries)
+    ranked = [t for t, _ in vocab.most_common()]
+    embeddings = embedding_matrix(ranked, embedding_function) if embedding_function is not None and ranked else None
+    mapping = cluster_vocabulary(vocab, embeddings=embeddings, embed_weight=embed_weight, threshold=threshold)
+    changed = {t: c for t, c in mapping.items() if t != c}
+    stats = {
+        "vocabulary": len(vocab),
+        "canonical": len(set(mapping.values())),
+        "remapped": len(changed),
+        "embeddings": embeddings is not None,
+        "threshold": threshold,
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+    return changed, stats
+
+
+def save_canonical_map(mapping: Dict[str, str], stats: Dict[str, object], path: str = CANONICAL_MAP_PATH) -> None:
+    with open(path, "w") as f:
+        json.dump({"stats": stats, "mapping": dict(sorted(mapping.items()))}, f, indent=2, ensure_ascii=False)
+
+
+def load_canonical_map(path: str = CANONICAL_MAP_PATH) -> Dict[str, str]:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f).get("mapping", {})
+
+
+# ---------- Applying ----------
+def normalise_value(value, mapping: Dict[str, str]) -> str:
+    """Compound value -> ", "-joined canonical tags, de-duplicated in first-seen order."""
+    seen = []
+    for tag in split_tags(value):
+        canon = mapping.get(tag, tag)
+        if canon not in seen:
+            seen.append(canon)
+    return OUTPUT_SEPARATOR.join(seen)
+
+
+def normalise_metadata(meta: Dict[str, object], mapping: Dict[str, str], fields: Iterable[str] = TAG_FIELDS) -> Dict[str, object]:
+    """Return a copy of a chunk's metadata with its tag fields canonicalised; empty tag fields are dropped."""
+    fields = set(fields)
+    out = {}
+    for key, value in (meta or {}).items():
+        if key in fields:
+            value = normalise_value(value, mapping)
+            if not value:
+                continue
+        out[key] = value
+    return out
+
+
+def apply_to_tags_json(mapping: Dict[str, str], src: str = TAGS_JSON_PATH, dst: Optional[str] = None) -> int:
+    """
+    Rewrite tags_by_chunk.json (or a copy) with canonical tags, and rebuild its compact store next to
+    it (tag_store.py, <name>.ctag) so that never lags the JSON. Returns the number of chunks changed.
+    """
+    from tag_store import write_tag_store
+
+    with open(src) as f:
+        data = json.load(f)
+    changed = 0
+    for chunk_id, entry in data.items():
+        new = normalise_metadata(entry, mapping)
+        if new != entry:
+            data[chunk_id] = new
+            changed += 1
+    with open(dst or src, "w") as f:
+        json.dump(data, f, indent=2)
+    write_tag_store(data, os.path.splitext(dst or src)[0] + ".ctag")
+    return changed
+
+
+def apply_to_collection(collection, mapping: Dict[str, str], page_size: int = 500, job=None) -> int:
+    """
+    Canonicalise tag metadata for every chunk, one page read + one bulk update per page. Chroma merges
+    metadata on update and doesn't accept None to drop a key, so chunks that lose a field (it normalised
+    to nothing) are rewritten whole afterwards: read with their embedding, deleted and re-added with the
+    new metadata (after paging, so the offsets don't move underneath it). If that add fails, the batch
+    is put back as it was read. Run it under the store lock (the /jobs/normalise job, or apply-chroma).
+    `job` (jobs.Job) gets chunk progress and is checked for cancellation between pages and batches.
+    """
+    from chroma_pages import iter_pages
+
+    changed = 0
+    rewrite: Dict[str, Dict[str, object]] = {}
+    for page in iter_pages(collection, page_size=page_size, include=["metadatas"]):
+        if job is not None:
+            job.raise_if_cancelled()
+        ids, metas = [], []
+        for chunk_id, meta in zip(page["ids"], page["metadatas"]):
+            new = normalise_metadata(meta, mapping)
+            if new == meta:
+                continue
+            if set(meta or {}) - set(new):
+                rewrite[chunk_id] = new
+            else:
+                ids.append(chunk_id)
+                metas.append(new)
+        if ids:
+            collection.update(ids=ids, metadatas=metas)
+            changed += len(ids)
+            if job is not None:
+                job.progress(chunks=changed)
+
+    pending = list(rewrite)
+    for start in range(0, len(pending), page_size):
+        if job is not None:
+            job.raise_if_cancelled()
+        batch = pending[start:start + page_size]
+        found = collection.get(ids=batch, include=["embeddings", "documents", "metadatas"])
+        collection.delete(ids=found["ids"])
+        try:
+            collection.add(
+                ids=found["ids"],
+                embeddings=found["embeddings"],
+                documents=found["documents"],
+                metadatas=[rewrite[i] for i in found["ids"]],
+            )
+        except Exception:
+            # Never leave the batch deleted: restore the records as they were read
+            collection.add(ids=found["ids"], embeddings=found["embeddings"], documents=found["documents"],
+                           metadatas=found["metadatas"])
+            raise
+        changed += len(found["ids"])
+        if job is not None:
+            job.progress(chunks=changed)
+    return changed
+
+
+if __name__ == "__main__":
+    # Usage:
+    #   python tag_normalise.py build [--no-embeddings] [--threshold=0.9]
+    #   python tag_normalise.py apply-json [dst]
+    #   python tag_normalise.py apply-chroma
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "build"
+    opts = dict(a[2:].split("=", 1) if "=" in a else (a[2:], "1") for a in sys.argv[2:] if a.startswith("--"))
+    args = [a for a in sys.argv[2:] if not a.startswith("--")]
+
+    if cmd == "build":
+        embedding_function = None
+        if "no-embeddings" not in opts:
+            from dotenv import load_dotenv
+            from embeddings import get_embedding_function
+            load_dotenv()
+            embedding_function = get_embedding_function()
+        with open(TAGS_JSON_PATH) as f:
+            entries = json.load(f).values()
+        mapping, stats = build_canonical_map(
+            entries,
+            embedding_function=embedding_function,
+            threshold=float(opts.get("threshold", 0.9)),
+        )
+        save_canonical_map(mapping, stats)
+        print(f"✅ Wrote {CANONICAL_MAP_PATH}: {stats}")
+    elif cmd == "apply-json":
+        n = apply_to_tags_json(load_canonical_map(), dst=args[0] if args else None)
+        print(f"✅ Normalised tags for {n} chunks")
+    elif cmd == "apply-chroma":
+        # The configured store (CHROMA_PATH, or the server with CHROMA_MODE=http), checked against
+        # EMBEDDING_BACKEND; workers reopen it afterwards
+        # Holds the store lock, so it waits for (and keeps out) ingest, retag, compact and restore jobs
+        from shared_store import bump_generation, open_chroma_client
+        from embeddings import open_collection
+        from jobs import STORE_LOCK, script_lock
+        with script_lock(STORE_LOCK):
+            collection = open_collection(open_chroma_client(), "cocktailgpt")
+            n = apply_to_collection(collection, load_canonical_map())
+            bump_generation("normalise")
+        print(f"✅ Normalised tags for {n} chunks in Chroma")
+    else:
+        print(f"❌ Unknown command: {cmd}")
+        sys.exit(1)
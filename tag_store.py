@@ -0,0 +1,400 @@
+import os
+import sys
+import json
+import mmap
+import time
+import zlib
+import struct
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Compact, memory-mappable replacement for tags_by_chunk.json.
+#
+# The .ctag file is generated (python tag_store.py build, and by tag_normalise.py apply-json each time
+# it rewrites the JSON) and not committed.
+#
+# Layout (little-endian, every section 4-byte aligned; integer arrays use the narrowest
+# of u8/u16/u32 that fits their largest value):
+#   header   : magic "CTAG", version, then (offset, length, item size) for each section below
+#   fields   : interned field names ("technique", "flavour", ...)
+#   tags     : interned tag values, one per ", "-separated piece of a field value
+#   chunks   : chunk ids + offsets into the postings arrays
+#   postings : (field id, tag id) pairs per chunk, in original order
+#   slots    : open-addressing hash tables for chunk id -> index and tag -> index
+#   inverted : tag id -> sorted chunk indices
+#
+# Values are split on ", " (comma + space) only, so "1,2,4-triazole" stays intact and
+# joining the pieces back with ", " reproduces the original JSON strings exactly.
+
+JSON_PATH = "tags_by_chunk.json"
+STORE_PATH = "tags_by_chunk.ctag"
+
+MAGIC = b"CTAG"
+VERSION = 1
+SEPARATOR = ", "
+
+SECTIONS = (
+    "field_offsets", "field_blob",
+    "tag_offsets", "tag_blob",
+    "chunk_offsets", "chunk_blob",
+    "chunk_postings",
+    "posting_fields", "posting_tags",
+    "chunk_slots",
+    "tag_chunk_offsets", "tag_chunks",
+    "tag_slots",
+)
+HEADER = struct.Struct("<4sI" + "III" * len(SECTIONS))
+TYPECODES = {1: "B", 2: "H", 4: "I"}
+EMPTY_SLOT = 0
+
+
+def _hash(key: bytes) -> int:
+    return zlib.crc32(key)
+
+
+def _slot_count(n: int) -> int:
+    """Power of two with load factor <= 0.75, so probes stay short."""
+    size = 2
+    while size * 3 < n * 4:
+        size *= 2
+    return size
+
+
+def _ints(values: Iterable[int]) -> Tuple[int, bytes]:
+    """Pack integers into the narrowest unsigned width that holds them. Returns (item size, bytes)."""
+    values = list(values)
+    top = max(values, default=0)
+    itemsize = 1 if top < 1 << 8 else 2 if top < 1 << 16 else 4
+    arr = array(TYPECODES[itemsize], values)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return itemsize, arr.tobytes()
+
+
+def _string_table(strings: List[str]) -> Tuple[Tuple[int, bytes], Tuple[int, bytes]]:
+    offsets = [0]
+    blob = bytearray()
+    for s in strings:
+        blob += s.encode("utf-8")
+        offsets.append(len(blob))
+    return _ints(offsets), (1, bytes(blob))
+
+
+def _hash_table(strings: List[str]) -> Tuple[int, bytes]:
+    size = _slot_count(len(strings))
+    mask = size - 1
+    slots = [EMPTY_SLOT] * size
+    for idx, s in enumerate(strings):
+        pos = _hash(s.encode("utf-8")) & mask
+        while slots[pos] != EMPTY_SLOT:
+            pos = (pos + 1) & mask
+        slots[pos] = idx + 1
+    return _ints(slots)
+
+
+def build_tag_store(tags_by_chunk: Dict[str, Dict[str, str]]) -> bytes:
+    """Serialise {chunk_id: {field: "a, b, c"}} into the binary store format."""
+    field_index: Dict[str, int] = {}
+    tag_index: Dict[str, int] = {}
+    fields: List[str] = []
+    tags: List[str] = []
+
+    chunk_ids: List[str] = []
+    chunk_postings = [0]
+    posting_fields: List[int] = []
+    posting_tags: List[int] = []
+    tag_members: List[List[int]] = []
+
+    for chunk_idx, (chunk_id, entry) in enumerate(tags_by_chunk.items()):
+        chunk_ids.append(chunk_id)
+        for field, value in (entry or {}).items():
+            if not isinstance(value, str):
+                value = SEPARATOR.join(str(v) for v in value) if isinstance(value, list) else str(value)
+            f = field_index.get(field)
+            if f is None:
+                f = field_index[field] = len(fields)
+                fields.append(field)
+            for piece in value.split(SEPARATOR):
+                t = tag_index.get(piece)
+                if t is None:
+                    t = tag_index[piece] = len(tags)
+                    tags.append(piece)
+                    tag_members.append([])
+                posting_fields.append(f)
+                posting_tags.append(t)
+                members = tag_members[t]
+                if not members or members[-1] != chunk_idx:
+                    members.append(chunk_idx)
+        chunk_postings.append(len(posting_tags))
+
+    tag_chunk_offsets = [0]
+    tag_chunks: List[int] = []
+    for members in tag_members:
+        tag_chunks.extend(members)
+        tag_chunk_offsets.append(len(tag_chunks))
+
+    field_offsets, field_blob = _string_table(fields)
+    tag_offsets, tag_blob = _string_table(tags)
+    chunk_offsets, chunk_blob = _string_table(chunk_ids)
+
+    payloads = {
+        "field_offsets": field_offsets, "field_blob": field_blob,
+        "tag_offsets": tag_offsets, "tag_blob": tag_blob,
+        "chunk_offsets": chunk_offsets, "chunk_blob": chunk_blob,
+        "chunk_postings": _ints(chunk_postings),
+        "posting_fields": _ints(posting_fields), "posting_tags": _ints(posting_tags),
+        "chunk_slots": _hash_table(chunk_ids),
+        "tag_chunk_offsets": _ints(tag_chunk_offsets), "tag_chunks": _ints(tag_chunks),
+        "tag_slots": _hash_table(tags),
+    }
+
+    body = bytearray()
+    table: List[int] = []
+    for name in SECTIONS:
+        itemsize, data = payloads[name]
+        offset = HEADER.size + len(body)
+        table.extend([offset, len(data), itemsize])
+        body += data
+        body += b"\0" * (-len(body) % 4)
+    return HEADER.pack(MAGIC, VERSION, *table) + bytes(body)
+
+
+def write_tag_store(tags_by_chunk: Dict[str, Dict[str, str]], path: str = STORE_PATH) -> int:
+    data = build_tag_store(tags_by_chunk)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return len(data)
+
+
+class TagStore:
+    """Read-only view over a .ctag file. Nothing is parsed up front; lookups read the mmap directly."""
+
+    def __init__(self, path: str = STORE_PATH):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buf = memoryview(self._mm)
+
+        magic, version, *table = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a tag store")
+        if version != VERSION:
+            raise ValueError(f"{path} has unsupported tag store version {version}")
+        self._sections = {name: tuple(table[3 * i:3 * i + 3]) for i, name in enumerate(SECTIONS)}
+
+        self._field_offsets = self._ints("field_offsets")
+        self._tag_offsets = self._ints("tag_offsets")
+        self._chunk_offsets = self._ints("chunk_offsets")
+        self._chunk_postings = self._ints("chunk_postings")
+        self._posting_fields = self._ints("posting_fields")
+        self._posting_tags = self._ints("posting_tags")
+        self._chunk_slots = self._ints("chunk_slots")
+        self._tag_chunk_offsets = self._ints("tag_chunk_offsets")
+        self._tag_chunks = self._ints("tag_chunks")
+        self._tag_slots = self._ints("tag_slots")
+        self._field_names = [self._string("field_blob", self._field_offsets, i) for i in range(len(self._field_offsets) - 1)]
+
+    def _raw(self, name: str) -> memoryview:
+        offset, length, _ = self._sections[name]
+        return self._buf[offset:offset + length]
+
+    def _ints(self, name: str):
+        raw = self._raw(name)
+        typecode = TYPECODES[self._sections[name][2]]
+        if sys.byteorder == "big":
+            arr = array(typecode, raw.tobytes())
+            arr.byteswap()
+            return arr
+        return raw.cast(typecode)
+
+    def _string(self, blob: str, offsets, i: int) -> str:
+        start = self._sections[blob][0]
+        return bytes(self._buf[start + offsets[i]:start + offsets[i + 1]]).decode("utf-8")
+
+    def _find(self, slots, offsets, blob: str, key: str) -> Optional[int]:
+        raw = key.encode("utf-8")
+        mask = len(slots) - 1
+        start = self._sections[blob][0]
+        pos = _hash(raw) & mask
+        while True:
+            slot = slots[pos]
+            if slot == EMPTY_SLOT:
+                return None
+            idx = slot - 1
+            if self._buf[start + offsets[idx]:start + offsets[idx + 1]] == raw:
+                return idx
+            pos = (pos + 1) & mask
+
+    # ---------- Lookups ----------
+    def __len__(self) -> int:
+        return len(self._chunk_offsets) - 1
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return self._find(self._chunk_slots, self._chunk_offsets, "chunk_blob", chunk_id) is not None
+
+    def chunk_id(self, idx: int) -> str:
+        return self._string("chunk_blob", self._chunk_offsets, idx)
+
+    def tag(self, idx: int) -> str:
+        return self._string("tag_blob", self._tag_offsets, idx)
+
+    @property
+    def fields(self) -> List[str]:
+        return list(self._field_names)
+
+    def vocabulary(self) -> Iterator[str]:
+        for i in range(len(self._tag_offsets) - 1):
+            yield self.tag(i)
+
+    def postings(self, chunk_id: str) -> Optional[List[Tuple[str, str]]]:
+        """(field, tag) pairs for a chunk in original order, or None if the chunk is unknown."""
+        idx = self._find(self._chunk_slots, self._chunk_offsets, "chunk_blob", chunk_id)
+        if idx is None:
+            return None
+        lo, hi = self._chunk_postings[idx], self._chunk_postings[idx + 1]
+        return [(self._field_names[self._posting_fields[p]], self.tag(self._posting_tags[p])) for p in range(lo, hi)]
+
+    def get(self, chunk_id: str) -> Optional[Dict[str, str]]:
+        """Tags for a chunk in the tags_by_chunk.json shape: {field: "a, b, c"}."""
+        pairs = self.postings(chunk_id)
+        if pairs is None:
+            return None
+        grouped: Dict[str, List[str]] = {}
+        for field, tag in pairs:
+            grouped.setdefault(field, []).append(tag)
+        return {field: SEPARATOR.join(values) for field, values in grouped.items()}
+
+    def chunks_with_tag(self, tag: str, field: Optional[str] = None) -> List[str]:
+        """Chunk ids carrying `tag` (optionally only under `field`)."""
+        t = self._find(self._tag_slots, self._tag_offsets, "tag_blob", tag)
+        if t is None:
+            return []
+        members = self._tag_chunks[self._tag_chunk_offsets[t]:self._tag_chunk_offsets[t + 1]]
+        if field is None:
+            return [self.chunk_id(c) for c in members]
+        out = []
+        for c in members:
+            lo, hi = self._chunk_postings[c], self._chunk_postings[c + 1]
+            for p in range(lo, hi):
+                if self._posting_tags[p] == t and self._field_names[self._posting_fields[p]] == field:
+                    out.append(self.chunk_id(c))
+                    break
+        return out
+
+    # ---------- Export ----------
+    def items(self) -> Iterator[Tuple[str, Dict[str, str]]]:
+        for i in range(len(self)):
+            chunk_id = self.chunk_id(i)
+            yield chunk_id, self.get(chunk_id)
+
+    def to_dict(self) -> Dict[str, Dict[str, str]]:
+        return dict(self.items())
+
+    def close(self) -> None:
+        # Release every exported view before closing the mmap
+        for name in ("_field_offsets", "_tag_offsets", "_chunk_offsets", "_chunk_postings",
+                     "_posting_fields", "_posting_tags", "_chunk_slots", "_tag_chunk_offsets",
+                     "_tag_chunks", "_tag_slots"):
+            view = getattr(self, name)
+            if isinstance(view, memoryview):
+                view.release()
+        self._buf.release()
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def json_to_store(json_path: str = JSON_PATH, store_path: str = STORE_PATH) -> int:
+    with open(json_path) as f:
+        data = json.load(f)
+    return write_tag_store(data, store_path)
+
+
+def store_to_json(store_path: str = STORE_PATH, json_path: str = JSON_PATH) -> None:
+    with TagStore(store_path) as store:
+        data = store.to_dict()
+    with open(json_path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def compare_with_json(json_path: str = JSON_PATH, store_path: str = STORE_PATH, lookups: int = 1000) -> Dict[str, float]:
+    """Size and load/lookup timings for the JSON file against the binary store."""
+    start = time.perf_counter()
+    with open(json_path) as f:
+        data = json.load(f)
+    json_load = time.perf_counter() - start
+    sample = list(data.keys())[:lookups]
+
+    start = time.perf_counter()
+    for chunk_id in sample:
+        _ = data[chunk_id]
+    json_lookup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    store = TagStore(store_path)
+    store_load = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for chunk_id in sample:
+        _ = store.get(chunk_id)
+    store_lookup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    hits = store.chunks_with_tag("fermentation")
+    store_tag = time.perf_counter() - start
+
+    start = time.perf_counter()
+    json_hits = [k for k, v in data.items() if any("fermentation" in str(x).split(SEPARATOR) for x in v.values())]
+    json_tag = time.perf_counter() - start
+
+    if store.to_dict() != data:
+        raise AssertionError("tag store does not round-trip the JSON file")
+    store.close()
+
+    return {
+        "json_bytes": os.path.getsize(json_path),
+        "store_bytes": os.path.getsize(store_path),
+        "json_load_ms": round(json_load * 1000, 2),
+        "store_open_ms": round(store_load * 1000, 2),
+        f"json_{len(sample)}_lookups_ms": round(json_lookup * 1000, 2),
+        f"store_{len(sample)}_lookups_ms": round(store_lookup * 1000, 2),
+        "json_tag_scan_ms": round(json_tag * 1000, 2),
+        "store_tag_lookup_ms": round(store_tag * 1000, 3),
+        "tag_hits": len(hits),
+        "tag_hits_match": len(hits) == len(json_hits),
+    }
+
+
+if __name__ == "__main__":
+    # Usage:
+    #   python tag_store.py build  [json_path] [store_path]
+    #   python tag_store.py export [store_path] [json_path]
+    #   python tag_store.py bench  [json_path] [store_path]
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "bench"
+    if cmd == "build":
+        src = sys.argv[2] if len(sys.argv) > 2 else JSON_PATH
+        dst = sys.argv[3] if len(sys.argv) > 3 else STORE_PATH
+        size = json_to_store(src, dst)
+        print(f"✅ Wrote {dst} ({size:,} bytes)")
+    elif cmd == "export":
+        src = sys.argv[2] if len(sys.argv) > 2 else STORE_PATH
+        dst = sys.argv[3] if len(sys.argv) > 3 else JSON_PATH
+        store_to_json(src, dst)
+        print(f"✅ Exported {src} → {dst}")
+    elif cmd == "bench":
+        src = sys.argv[2] if len(sys.argv) > 2 else JSON_PATH
+        dst = sys.argv[3] if len(sys.argv) > 3 else STORE_PATH
+        if not os.path.exists(dst):
+            json_to_store(src, dst)
+        for key, value in compare_with_json(src, dst).items():
+            print(f"📏 {key}: {value}")
+    else:
+        print(f"❌ Unknown command: {cmd}")
+        sys.exit(1)
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Tests import the top-level modules directly and never need network access or model downloads
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("EMBEDDING_BACKEND", "fixture-hashing")
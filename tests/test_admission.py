@@ -0,0 +1,97 @@
+import asyncio
+
+import httpx
+import pytest
+
+from admission import SingleFlight
+from fixture_store import load_questions
+from loadtest import _send
+from serve import _wait_healthy, bench_env, prepare_bench_store, start_api, stop
+from stub_openai import start_stub_openai
+
+API_PORT = 8775
+STUB_PORT = 8777
+URL = f"http://127.0.0.1:{API_PORT}"
+LIMITS = {"RATE_LIMIT_RPS": "100", "RATE_LIMIT_BURST": "100", "ADMISSION_MAX_CONCURRENT": "2",
+          "ADMISSION_MAX_QUEUE": "3", "ADMISSION_QUEUE_TIMEOUT_S": "30"}
+
+
+@pytest.fixture(scope="module")
+def api(tmp_path_factory):
+    """The API with admission on and small limits, in front of the fixture store and a slow stub LLM."""
+    root = tmp_path_factory.mktemp("admission")
+    store = str(root / "chroma")
+    prepare_bench_store(store)
+    stub = start_stub_openai(STUB_PORT, latency=1.0, answer_tokens=20, seed=1)
+    env = bench_env("embedded")
+    env.update(LIMITS, ADMISSION="1", QUERY_LOG="0", CHROMA_PATH=store,
+               OPENAI_BASE_URL=f"http://127.0.0.1:{STUB_PORT}/v1",
+               STORE_GENERATION_PATH=store + ".generation", WORKSPACES_PATH=str(root / "workspaces"),
+               JOB_STATE_PATH=str(root / "jobs.json"), JOB_LOCK_DIR=str(root / "locks"))
+    proc = start_api(1, API_PORT, env, quiet=True)
+    try:
+        _wait_healthy(URL, 1)
+        yield stub.RequestHandlerClass.config.stats
+    finally:
+        stop(proc)
+        stub.shutdown()
+
+
+def admission_stats():
+    return httpx.get(URL + "/debug/admission", timeout=10).json()
+
+
+def test_identical_questions_are_coalesced(api):
+    question = load_questions()[0]["question"]
+    before, chat_before = admission_stats(), api["chat"]
+
+    rows = _send(URL, [{"payload": {"question": question}, "key": f"client-{i}"} for i in range(8)], 8)
+
+    assert [r["status"] for r in rows] == [200] * 8
+    coalesced = sum(r["coalesced"] for r in rows)
+    assert coalesced >= 6  # all but the first, give or take one that arrived after it finished
+    assert api["chat"] - chat_before == 8 - coalesced
+    after = admission_stats()
+    assert after["coalesced"] - before["coalesced"] == coalesced
+    assert after["admitted"] - before["admitted"] == 8 - coalesced
+
+
+def test_full_queue_rejects_with_429(api):
+    questions = [q["question"] for q in load_questions()]
+    before = admission_stats()
+
+    # 2 run, 3 wait, the rest are turned away at once
+    rows = _send(URL, [{"payload": {"question": questions[i % len(questions)] + f" [{i}]"}, "key": f"client-{i}"}
+                       for i in range(12)], 12)
+
+    statuses = [r["status"] for r in rows]
+    assert statuses.count(200) == 5
+    assert statuses.count(429) == 7
+    after = admission_stats()
+    assert after["queue_full"] - before["queue_full"] == 7
+    assert after["admitted"] - before["admitted"] == 5
+    assert after["coalesced"] == before["coalesced"]
+    assert after["running"] == after["waiting"] == 0
+
+
+def test_a_cancelled_leader_hands_over_to_a_waiter():
+    async def scenario():
+        flights, calls = SingleFlight(), []
+
+        async def answer(name):
+            calls.append(name)
+            await asyncio.sleep(0.05)
+            return name
+
+        leader = asyncio.create_task(flights.do("q", lambda: answer("leader")))
+        await asyncio.sleep(0.01)
+        waiters = [asyncio.create_task(flights.do("q", lambda n=n: answer(n))) for n in ("first", "second")]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return [await w for w in waiters], calls
+
+    results, calls = asyncio.run(scenario())
+    assert results == [("first", False), ("first", True)]
+    assert calls == ["leader", "first"]
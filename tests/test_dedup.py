@@ -0,0 +1,48 @@
+import chromadb
+
+from dedup import DedupIndex, add_deduplicated
+from fixture_store import HashingEmbeddingFunction
+
+OLD = "Stir the gin and vermouth over plenty of ice for thirty seconds, then strain into a chilled coupe."
+NEW = "Shake the rum, lime and sugar hard with cubed ice, then double strain into a frozen glass and serve."
+
+
+def ingest(collection, index, chunk_id, text, source):
+    collection.delete(ids=[chunk_id])  # as ingest_supabase.py does before every batch
+    return add_deduplicated(collection, index, [chunk_id], [text], [{"source": source, "chunk": 0}])
+
+
+def store(tmp_path):
+    client = chromadb.PersistentClient(path=str(tmp_path / "chroma"))
+    collection = client.get_or_create_collection("cocktailgpt", embedding_function=HashingEmbeddingFunction())
+    return collection, DedupIndex(str(tmp_path / "dedup.sqlite3"))
+
+
+def test_duplicates_are_embedded_when_their_canonical_changes(tmp_path):
+    collection, index = store(tmp_path)
+    assert ingest(collection, index, "a0", OLD, "a.pdf")["added"] == 1
+    assert ingest(collection, index, "b0", OLD, "b.pdf")["duplicates"] == 1
+    assert collection.get(ids=["a0"])["metadatas"][0]["also_in"] == "b.pdf"
+    assert collection.get(ids=["b0"])["ids"] == []
+
+    assert ingest(collection, index, "a0", NEW, "a.pdf") == {"added": 1, "duplicates": 0, "restored": 1}
+
+    found = collection.get(ids=["a0", "b0"], include=["documents", "metadatas"])
+    by_id = dict(zip(found["ids"], zip(found["documents"], found["metadatas"])))
+    assert by_id["a0"][0] == NEW
+    assert by_id["b0"] == (OLD, {"source": "b.pdf", "chunk": 0})
+    assert index.dependants(["a0", "b0"]) == []
+    index.close()
+
+
+def test_unchanged_canonical_keeps_its_duplicates_linked(tmp_path):
+    collection, index = store(tmp_path)
+    ingest(collection, index, "a0", OLD, "a.pdf")
+    ingest(collection, index, "b0", OLD, "b.pdf")
+
+    assert ingest(collection, index, "a0", OLD, "a.pdf") == {"added": 1, "duplicates": 0, "restored": 0}
+
+    assert collection.count() == 1
+    assert collection.get(ids=["a0"])["metadatas"][0]["also_in"] == "b.pdf"
+    assert [d[0] for d in index.dependants(["a0"])] == ["b0"]
+    index.close()
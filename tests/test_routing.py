@@ -0,0 +1,93 @@
+import pytest
+
+from routing import Router, StubChatClient
+
+LOOKUP = "What is the recipe for a Negroni?"
+TWO_ASKS = "Is a Gimlet sour? Is it sweet?"
+SYNTHESIS = "Explain why a stirred Manhattan tastes smoother than a shaken one"
+
+
+def results(distance):
+    return {"distances": [[distance, distance + 0.3]]}
+
+
+def router(**kw):
+    return Router(strong_model="strong-model", fast_model="fast-model", strong_max_tokens=900,
+                  fast_max_tokens=300, min_similarity=0.55, max_complexity=1, **kw)
+
+
+def test_confident_simple_lookup_goes_fast():
+    decision = router().decide(LOOKUP, results(0.2))  # similarity 0.9
+    assert (decision.tier, decision.model, decision.max_tokens) == ("fast", "fast-model", 300)
+    assert decision.complexity == 0
+    assert decision.top_similarity == 0.9
+
+
+@pytest.mark.parametrize("distance,tier", [(0.88, "fast"), (0.9, "fast"), (0.92, "strong"), (1.4, "strong")])
+def test_similarity_threshold(distance, tier):
+    # similarity = 1 - d/2; exactly at min_similarity (d = 0.9) still counts as confident
+    assert router().decide(LOOKUP, results(distance)).tier == tier
+
+
+def test_no_retrieval_goes_strong():
+    decision = router().decide(LOOKUP, {"distances": [[]]})
+    assert decision.tier == "strong"
+    assert decision.top_similarity is None
+    assert decision.reason == "low retrieval confidence"
+
+
+def test_complexity_threshold():
+    decision = router().decide(TWO_ASKS, results(0.2))
+    assert decision.complexity == 1  # at max_complexity: still simple
+    assert decision.tier == "fast"
+    assert Router(max_complexity=0).decide(TWO_ASKS, results(0.2)).tier == "strong"
+
+    decision = router().decide(SYNTHESIS, results(0.2))
+    assert decision.complexity > 1
+    assert decision.tier == "strong"
+    assert decision.reason.startswith("complex question")
+
+
+def test_override_and_routing_off():
+    assert router().decide(SYNTHESIS, results(1.5), override="fast").tier == "fast"
+    assert router().decide(LOOKUP, results(0.2), override="strong").tier == "strong"
+    assert router().decide(LOOKUP, results(0.2), override="bogus").tier == "fast"
+
+    decision = router(enabled=False).decide(LOOKUP, results(0.2))
+    assert (decision.tier, decision.reason) == ("strong", "routing off")
+
+
+def test_fast_failure_falls_back_to_strong_cap():
+    r, client = router(), StubChatClient(fail=["fast-model"])
+    decision = r.decide(LOOKUP, results(0.2))
+
+    completion = r.complete(client, [{"role": "user", "content": LOOKUP}], decision, max_tokens=250)
+
+    assert completion.model == "strong-model"
+    assert client.chat.completions.calls == [
+        {"model": "fast-model", "max_tokens": 250},
+        {"model": "strong-model", "max_tokens": 900},  # the strong cap, not the fast call's 250
+    ]
+    assert (decision.tier, decision.model, decision.max_tokens) == ("strong", "strong-model", 900)
+    assert decision.reason.endswith("fallback after fast-model error")
+    assert r.stats()["fallbacks"] == 1
+
+
+def test_fallback_max_tokens_caps_the_retry():
+    r, client = router(), StubChatClient(fail=["fast-model"])
+    decision = r.decide(LOOKUP, results(0.2))
+
+    r.complete(client, [{"role": "user", "content": LOOKUP}], decision, max_tokens=250, fallback_max_tokens=700)
+
+    assert client.chat.completions.calls[-1] == {"model": "strong-model", "max_tokens": 700}
+    assert decision.max_tokens == 700
+
+
+def test_strong_failure_is_not_retried():
+    r, client = router(), StubChatClient(fail=["strong-model"])
+    decision = r.decide(SYNTHESIS, results(0.2))
+
+    with pytest.raises(RuntimeError):
+        r.complete(client, [{"role": "user", "content": SYNTHESIS}], decision)
+    assert len(client.chat.completions.calls) == 1
+    assert r.stats()["fallbacks"] == 0
@@ -0,0 +1,59 @@
+import chromadb
+import pytest
+
+from tag_normalise import apply_to_collection
+
+
+def test_apply_to_collection_drops_fields_without_none(tmp_path):
+    col = chromadb.PersistentClient(path=str(tmp_path)).get_or_create_collection("cocktailgpt")
+    ids = [f"c{i}" for i in range(7)]
+    col.add(
+        ids=ids,
+        embeddings=[[float(i), 1.0, 0.0] for i in range(7)],
+        documents=[f"doc {i}" for i in range(7)],
+        metadatas=[{"source": "a.pdf", "technique": "Shaken", "flavour": "Bitter, bitterness" if i % 2 else " "}
+                   for i in range(7)],
+    )
+
+    changed = apply_to_collection(col, {"bitterness": "bitter", "shaken": "shaking"}, page_size=3)
+
+    assert changed == 7
+    assert col.count() == 7
+    found = col.get(ids=ids, include=["metadatas", "embeddings", "documents"])
+    by_id = {i: (m, e, d) for i, m, e, d in zip(found["ids"], found["metadatas"], found["embeddings"], found["documents"])}
+    for i in range(7):
+        meta, embedding, document = by_id[f"c{i}"]
+        assert meta["technique"] == "shaking"
+        assert meta["source"] == "a.pdf"
+        if i % 2:
+            assert meta["flavour"] == "bitter"
+        else:
+            assert "flavour" not in meta  # normalised to nothing: the key is gone, not None
+        assert list(embedding) == [float(i), 1.0, 0.0]
+        assert document == f"doc {i}"
+
+
+def test_apply_to_collection_puts_a_batch_back_when_the_add_fails(tmp_path):
+    col = chromadb.PersistentClient(path=str(tmp_path)).get_or_create_collection("cocktailgpt")
+    col.add(ids=["c0", "c1"], embeddings=[[0.0, 1.0], [1.0, 0.0]], documents=["doc 0", "doc 1"],
+            metadatas=[{"source": "a.pdf", "flavour": " "}, {"source": "a.pdf", "flavour": " "}])
+
+    class FailingAdd:
+        def __init__(self, collection):
+            self.collection, self.adds = collection, 0
+
+        def __getattr__(self, name):
+            return getattr(self.collection, name)
+
+        def add(self, **kwargs):
+            self.adds += 1
+            if self.adds == 1:
+                raise RuntimeError("disk full")
+            return self.collection.add(**kwargs)
+
+    with pytest.raises(RuntimeError):
+        apply_to_collection(FailingAdd(col), {})
+
+    found = col.get(ids=["c0", "c1"], include=["metadatas", "documents"])
+    assert sorted(found["ids"]) == ["c0", "c1"]
+    assert all(m == {"source": "a.pdf", "flavour": " "} for m in found["metadatas"])
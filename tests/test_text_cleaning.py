@@ -0,0 +1,25 @@
+from text_cleaning import FURNITURE_WINDOW, clean_pages
+
+
+def test_first_page_hyphens_use_the_held_windows_vocabulary():
+    pages = ["Muddle the pine and the apple with pine-\napple syrup.", "Top with pineapple juice."]
+    assert list(clean_pages(pages))[0] == "Muddle the pine and the apple with pineapple syrup."
+
+
+def test_first_pages_lose_their_furniture_too():
+    body = ["Stir with ice.", "Strain into a coupe.", "Garnish with a twist.", "Serve at once."]
+    pages = ["THE BAR BOOK\n" + "\n".join(body[p % 4:] + body[:p % 4]) + f"\n{p + 1}" for p in range(6)]
+    assert [page.split("\n") for page in clean_pages(pages)] == [body[p % 4:] + body[:p % 4] for p in range(6)]
+
+
+def test_pages_are_emitted_before_the_document_is_read():
+    read = []
+
+    def pages():
+        for p in range(40):
+            read.append(p)
+            yield ["Stir with ice.", "Strain into a coupe.", "Garnish with a twist."][p % 3]
+
+    cleaned = clean_pages(pages())
+    assert next(cleaned) == "Stir with ice."
+    assert len(read) == FURNITURE_WINDOW + 1
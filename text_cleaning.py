@@ -0,0 +1,331 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+from collections import Counter, deque
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# The one text cleaner for every ingest path (utils.join_pages / clean_text, ingest.py,
+# ingest_supabase.py, reattach_metadata.py), page-aware and streaming:
+#
+#   - characters : ligatures (U+FB01 → fi), soft hyphens, zero-width and non-breaking spaces
+#   - hyphenation: "stabil-\nise" → "stabilise", but "sugar-\nfree" → "sugar-free". The break is
+#                  rejoined when the joined word occurs elsewhere in the document; the hyphen is kept
+#                  when "sugar-free" does, when both halves are words of the document, or when the
+#                  second half is a common compound ending (COMPOUND_ENDINGS); otherwise rejoined
+#   - furniture  : running headers/footers and page numbers. A short line in the top or bottom
+#                  FURNITURE_EDGE_LINES of a page is furniture once the exact same line has been at
+#                  that edge on more than FURNITURE_MIN_SHARE (three quarters) of the last
+#                  FURNITURE_WINDOW pages, two consecutive pages among them. Only a number that advances with the page ("47",
+#                  "Page 3 of 40", "12 · THE BAR BOOK") is masked when comparing, so a bare page
+#                  number is furniture like a running head, while recipe titles, "Glass: Coupe" or a
+#                  quantity that happen to recur stay in the text
+#   - whitespace : lines stripped, blank lines dropped, runs of spaces collapsed
+#
+# Pages go through once, as they are extracted. The first FURNITURE_WINDOW pages are held back until
+# the repeated lines have been learnt from them (so they are cleaned like the rest); after that every
+# page is judged against the window ending at it and emitted as soon as it arrives (furniture that
+# starts or stops later is picked up as it does). Hyphens are resolved against the vocabulary seen
+# so far: the held pages against all of the window, later pages against everything up to them. A word
+# whose only unbroken occurrence comes later in the document than the window can therefore be judged
+# on fewer words than a second pass would give it; that is the price of never holding the document.
+# Heads that alternate between left and right pages are each on only half of the pages and are left
+# in. All patterns are compiled once.
+#
+#   python text_cleaning.py bench [--pages=2000]
+#   python text_cleaning.py report [file.pdf | folder ...]   (token savings vs the old cleaners)
+
+FURNITURE_EDGE_LINES = int(os.environ.get("FURNITURE_EDGE_LINES", "2"))
+FURNITURE_MIN_PAGES = int(os.environ.get("FURNITURE_MIN_PAGES", "3"))
+FURNITURE_WINDOW = int(os.environ.get("FURNITURE_WINDOW", "12"))
+FURNITURE_MIN_SHARE = float(os.environ.get("FURNITURE_MIN_SHARE", "0.75"))
+FURNITURE_MAX_CHARS = 80
+
+_CHAR_MAP = {
+    "\ufb00": "ff", "\ufb01": "fi", "\ufb02": "fl", "\ufb03": "ffi", "\ufb04": "ffl", "\ufb05": "st", "\ufb06": "st",
+    "\u00ad": "", "\u200b": "", "\u200c": "", "\u200d": "", "\ufeff": "",  # soft hyphen, zero-width
+    "\u00a0": " ", "\u2009": " ", "\u202f": " ", "\t": " ", "\r": "\n", "\f": "\n",
+}
+# One regex pass that only touches the characters above (str.translate with multi-character
+# replacements is several times slower on pages that contain none of them)
+_CHAR_RE = re.compile("[" + "".join(_CHAR_MAP) + "]")
+_LIGATURE_RE = re.compile("[\ufb00-\ufb06]")
+_HYPHEN_BREAK_RE = re.compile(r"([A-Za-z]+)-[ ]*\n[ ]*([a-z]+)")
+_COMPOUND_RE = re.compile(r"\b[a-z]+-[a-z]+\b")
+_WORD_RE = re.compile(r"[a-z]+")
+_SPACES_RE = re.compile(r" {2,}")
+_PAGE_NUMBER_RE = re.compile(r"^(?:page\s+)?[-–—\s]*\d{1,4}(?:\s*(?:of|/)\s*\d{1,4})?[-–—\s]*$", re.I)
+_NUMBER_RE = re.compile(r"\b\d{1,4}\b")
+
+# Second halves that make a compound rather than the rest of a broken word
+COMPOUND_ENDINGS = frozenset({
+    "free", "based", "style", "made", "proof", "aged", "infused", "washed", "like", "friendly", "forward",
+    "bodied", "sized", "level", "up", "down", "off", "over", "out", "in", "on", "dry", "sweet", "rich",
+    "strength", "fat", "house", "time", "point", "term", "day", "year", "old", "new", "fresh", "dried",
+})
+
+
+class Vocabulary:
+    """Whole words and hyphenated compounds seen so far in a document, for resolving line-end hyphens."""
+
+    def __init__(self):
+        self.words: set = set()
+        self.compounds: set = set()
+
+    def update(self, text: str) -> None:
+        # The halves of a broken word aren't words of the document
+        lowered = _HYPHEN_BREAK_RE.sub(" ", text).lower()
+        self.compounds.update(_COMPOUND_RE.findall(lowered))
+        self.words.update(_WORD_RE.findall(lowered))
+
+    def rejoin(self, left: str, right: str) -> str:
+        lo, ro = left.lower(), right.lower()
+        if lo + ro in self.words:
+            return left + right
+        if f"{lo}-{ro}" in self.compounds or (lo in self.words and ro in self.words) or ro in COMPOUND_ENDINGS:
+            return left + "-" + right
+        return left + right
+
+
+def normalise_chars(text: str) -> str:
+    return _CHAR_RE.sub(lambda m: _CHAR_MAP[m.group()], text)
+
+
+def _normalise(text: str) -> str:
+    return _SPACES_RE.sub(" ", normalise_chars(text))
+
+
+def _lines(text: str, vocabulary: Optional[Vocabulary] = None) -> Tuple[List[str], int]:
+    """Hyphenated breaks in normalised `text` resolved against `vocabulary` (default: the text's own),
+    then stripped non-empty lines (+ words rejoined)."""
+    if vocabulary is None:
+        vocabulary = Vocabulary()
+        vocabulary.update(text)
+    joins = 0
+
+    def fix(m: "re.Match") -> str:
+        nonlocal joins
+        out = vocabulary.rejoin(m.group(1), m.group(2))
+        joins += "-" not in out
+        return out
+
+    text = _HYPHEN_BREAK_RE.sub(fix, text)
+    return [line for line in map(str.strip, text.split("\n")) if line], joins
+
+
+def _furniture_keys(line: str, side: str, page: int) -> List[str]:
+    """The exact line, plus one key per number in it with that number replaced by its offset from the
+    page index (the same on every page only for a page number)."""
+    if len(line) > FURNITURE_MAX_CHARS:
+        return []
+    text = line.lower()
+    keys = [f"{side}:{text}"]
+    for m in _NUMBER_RE.finditer(text):
+        keys.append(f"{side}:{text[:m.start()]}#{int(m.group()) - page}{text[m.end():]}")
+    return keys
+
+
+def clean_text(text: str) -> str:
+    """One page or any loose text: character fixes, hyphenation, whitespace (no furniture pass)."""
+    return "\n".join(_lines(_normalise(text))[0])
+
+
+class PageCleaner:
+    """Cleans a document page by page; see the module comment."""
+
+    def __init__(self, edge_lines: int = FURNITURE_EDGE_LINES, min_pages: int = FURNITURE_MIN_PAGES,
+                 window: int = FURNITURE_WINDOW, min_share: float = FURNITURE_MIN_SHARE):
+        self.edge_lines = edge_lines
+        self.min_pages = min_pages
+        self.window = window
+        self.min_share = min_share
+        self.vocabulary = Vocabulary()
+        self.recent: Deque[set] = deque()  # edge-line keys of the last `window` pages
+        self.seen: Counter = Counter()  # key -> pages among `recent` it was on
+        self.consecutive: set = set()  # keys seen on two pages in a row
+        self.pages = 0
+        self.stats = {"pages": 0, "chars_in": 0, "chars_out": 0, "furniture_lines": 0, "page_numbers": 0,
+                      "hyphen_joins": 0, "ligatures": 0}
+
+    def _edges(self, lines: List[str]) -> List[Tuple[int, str]]:
+        """(index, "top"/"bottom") of the edge lines; a header only matches headers, a footer footers."""
+        n = min(self.edge_lines, len(lines))
+        top = [(i, "top") for i in range(n)]
+        return top + [(i, "bottom") for i in range(max(len(lines) - n, n), len(lines))]
+
+    def _is_furniture(self, key: str) -> bool:
+        """On most pages of the current window, two of them consecutive."""
+        need = max(self.min_pages, int(len(self.recent) * self.min_share) + 1)
+        return self.seen[key] >= need and key in self.consecutive
+
+    def _learn(self, lines: List[str], page: int) -> None:
+        keys = {k for i, side in self._edges(lines) for k in _furniture_keys(lines[i], side, page)}
+        if self.recent:
+            self.consecutive.update(keys & self.recent[-1])
+        self.recent.append(keys)
+        self.seen.update(keys)
+        if len(self.recent) > self.window:
+            self.seen -= Counter(self.recent.popleft())  # also drops keys that reach zero
+
+    def _normalise(self, page: str) -> str:
+        self.stats["pages"] += 1
+        self.stats["chars_in"] += len(page)
+        self.stats["ligatures"] += len(_LIGATURE_RE.findall(page))
+        text = _normalise(page)
+        self.vocabulary.update(text)
+        return text
+
+    def _prepare(self, text: str) -> List[str]:
+        lines, joins = _lines(text, self.vocabulary)
+        self.stats["hyphen_joins"] += joins
+        return lines
+
+    def _strip(self, lines: List[str], page: int) -> str:
+        drop = set()
+        for i, side in self._edges(lines):
+            if any(self._is_furniture(k) for k in _furniture_keys(lines[i], side, page)):
+                drop.add(i)
+                self.stats["page_numbers" if _PAGE_NUMBER_RE.match(lines[i]) else "furniture_lines"] += 1
+        out = "\n".join(line for i, line in enumerate(lines) if i not in drop)
+        self.stats["chars_out"] += len(out)
+        return out
+
+    def _release(self, held: Deque[Tuple[str, int]]) -> Iterator[str]:
+        # Held pages are re-resolved now that the vocabulary covers the whole window
+        while held:
+            text, page = held.popleft()
+            yield self._strip(self._prepare(text), page)
+
+    def clean_pages(self, pages: Iterable[str]) -> Iterator[str]:
+        """Yield each page cleaned, in order (blank pages as ""), reading `pages` once."""
+        held: Deque[Tuple[str, int]] = deque()
+        for page in pages:
+            text = self._normalise(page)
+            self.pages += 1
+            if self.pages <= self.window:
+                # Provisional lines, only to learn the window's furniture
+                self._learn(_lines(text, self.vocabulary)[0], self.pages)
+                held.append((text, self.pages))
+                continue
+            lines = self._prepare(text)
+            self._learn(lines, self.pages)
+            yield from self._release(held)
+            yield self._strip(lines, self.pages)
+        yield from self._release(held)
+
+
+def clean_pages(pages: Iterable[str]) -> Iterator[str]:
+    return PageCleaner().clean_pages(pages)
+
+
+# ---------- Benchmark / report ----------
+def legacy_utils_clean(text: str) -> str:
+    """utils.clean_text before this module (two passes over the joined document)."""
+    text = re.sub(r"\n+", "\n", text)
+    text = re.sub(r"[^\S\r\n]{2,}", " ", text)
+    return text.strip()
+
+
+def legacy_reattach_clean(text: str) -> str:
+    """reattach_metadata.clean_text before this module."""
+    return "\n".join([line.strip() for line in text.splitlines() if line.strip()])
+
+
+def synthetic_pages(n_pages: int = 2000, seed: int = 3) -> List[str]:
+    """Book-like pages from the fixture chunks: running header, page-number footer, ligatures,
+    hyphenated line breaks and ragged spacing, as PyMuPDF tends to return them, with recipe titles and
+    "Glass: …" lines at page edges on some pages (content the furniture pass must keep)."""
+    from fixture_store import load_docs
+
+    rng = random.Random(seed)
+    paragraphs = [d["text"] for d in load_docs()]
+    ligatures = {"fi": "\ufb01", "fl": "\ufb02", "ff": "\ufb00"}
+    pages = []
+    for p in range(n_pages):
+        body = []
+        for para in rng.sample(paragraphs, 3):
+            for pair, lig in ligatures.items():
+                para = para.replace(pair, lig)
+            words, line = para.split(), []
+            # Rotated so repeated fixture paragraphs don't break into identical lines
+            cut = rng.randrange(len(words))
+            words = words[cut:] + words[:cut]
+            for w in words:
+                if sum(len(x) + 1 for x in line) + len(w) > 70:
+                    if len(w) > 7 and rng.random() < 0.3:
+                        line.append(w[:4] + "-")
+                        body.append("  ".join(line) if rng.random() < 0.2 else " ".join(line))
+                        line = [w[4:]]
+                        continue
+                    body.append(" ".join(line))
+                    line = []
+                line.append(w)
+            body.append(" ".join(line) + "\n")
+        title = f"Recipe {rng.randrange(1, 300)}\n" if rng.random() < 0.3 else ""
+        glass = "\nGlass: Coupe" if rng.random() < 0.3 else ""
+        pages.append(f"THE BAR BOOK  ·  Modern Technique\n{title}\n" + "\n".join(body) + f"{glass}\n{p + 1}\n")
+    return pages
+
+
+def bench(n_pages: int = 2000) -> Dict[str, Dict[str, float]]:
+    """Pages per second and output size, old whole-document cleaners vs PageCleaner."""
+    pages = synthetic_pages(n_pages)
+    mb = sum(len(p.encode("utf-8")) for p in pages) / 1e6
+
+    def run(fn) -> Dict[str, float]:
+        start = time.perf_counter()
+        out = fn()
+        seconds = time.perf_counter() - start
+        return {"seconds": round(seconds, 3), "pages_per_s": round(n_pages / seconds), "mb_per_s": round(mb / seconds, 1),
+                "chars_out": len(out), "approx_tokens": (len(out) + 3) // 4}
+
+    return {
+        "utils.clean_text (old)": run(lambda: legacy_utils_clean("".join(pages))),
+        "reattach clean_text (old)": run(lambda: legacy_reattach_clean("\n".join(pages))),
+        "PageCleaner": run(lambda: "\n".join(p for p in clean_pages(pages) if p)),
+    }
+
+
+def token_report(pdf_paths: List[str]) -> Dict[str, object]:
+    """Per PDF: approximate tokens (chars / 4, as chunk_text budgets them) and chunks, old vs new."""
+    from utils import chunk_text, extract_pages_from_pdf
+
+    rows, totals = [], Counter()
+    for path in pdf_paths:
+        pages = extract_pages_from_pdf(path)
+        old = legacy_utils_clean("".join(pages))
+        cleaner = PageCleaner()
+        new = "\n".join(p for p in cleaner.clean_pages(pages) if p)
+        row = {
+            "file": os.path.basename(path), "pages": len(pages),
+            "tokens_old": (len(old) + 3) // 4, "tokens_new": (len(new) + 3) // 4,
+            "chunks_old": len(chunk_text(old)), "chunks_new": len(chunk_text(new)),
+            **{k: cleaner.stats[k] for k in ("furniture_lines", "page_numbers", "hyphen_joins", "ligatures")},
+        }
+        totals.update({k: v for k, v in row.items() if isinstance(v, int)})
+        rows.append(row)
+    saved = totals["tokens_old"] - totals["tokens_new"]
+    return {"files": rows, "totals": dict(totals),
+            "tokens_saved": saved, "saved_pct": round(100 * saved / totals["tokens_old"], 2) if totals["tokens_old"] else None}
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    opts = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    command = args[0] if args else "bench"
+    if command == "bench":
+        for name, stats in bench(int(opts.get("pages", "2000"))).items():
+            print(f"📏 {name}: {stats}")
+    elif command == "report":
+        paths: List[str] = []
+        for target in args[1:] or ["./pdfs"]:
+            if os.path.isdir(target):
+                paths += sorted(os.path.join(target, f) for f in os.listdir(target) if f.lower().endswith(".pdf"))
+            else:
+                paths.append(target)
+        print(json.dumps(token_report(paths), indent=2, ensure_ascii=False))
+    else:
+        print("usage: python text_cleaning.py bench [--pages=2000] | report [file.pdf | folder ...]")
+        sys.exit(1)
@@ -0,0 +1,160 @@
+import os
+import sys
+import json
+import mmap
+import hashlib
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+from shared_store import CHROMA_PATH
+
+# Cleaned page text per source, written at ingest so /source/{id} can serve the exact pages a chunk
+# came from without re-parsing the PDF.
+#
+#   <TEXT_STORE_PATH>/<key>.txt   : the joined, cleaned document text (utils.join_pages), UTF-8
+#   <TEXT_STORE_PATH>/<key>.json  : {"source", "pages", "page_chars", "page_bytes", "chars", "bytes"}
+#
+# Chunk metadata carries page_start/page_end and char_start/char_end into that text. Files are read
+# through mmap (only the touched pages are paged in) and kept open in a small LRU; an entry is
+# reopened when its file was replaced (restore, re-ingest). The directory lives inside the Chroma
+# store so snapshots and restores carry it along.
+
+TEXT_STORE_PATH = os.environ.get("TEXT_STORE_PATH", os.path.join(CHROMA_PATH, "texts"))
+TEXT_STORE_OPEN_FILES = int(os.environ.get("TEXT_STORE_OPEN_FILES", "64"))
+
+
+def source_key(source: str) -> str:
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()[:20]
+
+
+def write_document(source: str, text: str, page_starts: List[int], path: str = TEXT_STORE_PATH) -> Dict[str, Any]:
+    """Store a document's joined text plus its page offsets (characters and bytes); atomic per file."""
+    os.makedirs(path, exist_ok=True)
+    key = source_key(source)
+    data = text.encode("utf-8")
+
+    # Byte offset of each page start, encoding one page-sized slice at a time
+    page_bytes, byte_pos, prev = [], 0, 0
+    for start in page_starts:
+        byte_pos += len(text[prev:start].encode("utf-8"))
+        page_bytes.append(byte_pos)
+        prev = start
+
+    index = {
+        "source": source,
+        "pages": len(page_starts),
+        "page_chars": page_starts,
+        "page_bytes": page_bytes,
+        "chars": len(text),
+        "bytes": len(data),
+    }
+    for suffix, payload in ((".txt", data), (".json", json.dumps(index).encode("utf-8"))):
+        tmp = os.path.join(path, f"{key}{suffix}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(payload)
+        os.replace(tmp, os.path.join(path, key + suffix))
+    return index
+
+
+def delete_document(source: str, path: str = TEXT_STORE_PATH) -> None:
+    for suffix in (".txt", ".json"):
+        try:
+            os.remove(os.path.join(path, source_key(source) + suffix))
+        except FileNotFoundError:
+            pass
+
+
+class _Document:
+    # Never closed explicitly: a request may still be reading an entry that was just evicted, and
+    # the mapping is released when the last reference goes
+    __slots__ = ("stamp", "index", "map")
+
+    def __init__(self, txt_path: str, json_path: str):
+        with open(json_path) as f:
+            self.index = json.load(f)
+        with open(txt_path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self.stamp = (st.st_ino, st.st_mtime_ns)
+            # mmap can't map an empty file
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if st.st_size else b""
+
+    def page_range(self, page: int) -> Tuple[int, int]:
+        """Byte range of a 1-based page (without the newline that joins it to the next)."""
+        starts = self.index["page_bytes"]
+        start = min(starts[page - 1], self.index["bytes"])
+        if page == len(starts):
+            return start, self.index["bytes"]
+        # A blank page shares its offset with the next page
+        return start, max(starts[page] - 1, start)
+
+
+class TextStore:
+    def __init__(self, path: str = TEXT_STORE_PATH, max_open: int = TEXT_STORE_OPEN_FILES):
+        self.path = path
+        self.max_open = max_open
+        self._open: "OrderedDict[str, _Document]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _doc(self, source: str) -> _Document:
+        key = source_key(source)
+        txt_path = os.path.join(self.path, key + ".txt")
+        json_path = os.path.join(self.path, key + ".json")
+        try:
+            st = os.stat(txt_path)
+        except FileNotFoundError:
+            raise KeyError(f"No stored text for {source}")
+        with self._lock:
+            doc = self._open.get(key)
+            if doc is not None and doc.stamp == (st.st_ino, st.st_mtime_ns):
+                self._open.move_to_end(key)
+                return doc
+            doc = _Document(txt_path, json_path)
+            self._open[key] = doc
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+            return doc
+
+    def has(self, source: str) -> bool:
+        return os.path.exists(os.path.join(self.path, source_key(source) + ".txt"))
+
+    def page_count(self, source: str) -> int:
+        return self._doc(source).index["pages"]
+
+    def page_text(self, source: str, page: int) -> str:
+        doc = self._doc(source)
+        if not 1 <= page <= doc.index["pages"]:
+            raise IndexError(f"{source} has pages 1–{doc.index['pages']}, not {page}")
+        start, end = doc.page_range(page)
+        return bytes(doc.map[start:end]).decode("utf-8")
+
+    def span(self, source: str, char_start: int, char_end: int) -> str:
+        """Text between two character offsets, decoding only the pages it touches."""
+        doc = self._doc(source)
+        chars, bytes_ = doc.index["page_chars"], doc.index["page_bytes"]
+        first = max(bisect_right(chars, char_start) - 1, 0)
+        last = max(bisect_right(chars, max(char_end - 1, char_start)) - 1, first)
+        end_byte = bytes_[last + 1] if last + 1 < len(bytes_) else doc.index["bytes"]
+        text = bytes(doc.map[bytes_[first]:end_byte]).decode("utf-8")
+        return text[char_start - chars[first]:char_end - chars[first]]
+
+    def clear(self) -> None:
+        """Drop every mapping (after the store directory was swapped out)."""
+        with self._lock:
+            self._open.clear()
+
+
+text_store = TextStore()
+
+
+if __name__ == "__main__":
+    # python text_store.py <source> [page]
+    if len(sys.argv) < 2:
+        print("usage: python text_store.py <source> [page]")
+        sys.exit(1)
+    src = sys.argv[1]
+    if len(sys.argv) > 2:
+        print(text_store.page_text(src, int(sys.argv[2])))
+    else:
+        print(f"{src}: {text_store.page_count(src)} pages")
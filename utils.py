@@ -1,11 +1,13 @@
 import fitz  # PyMuPDF
-import re
+from bisect import bisect_right
 from io import BytesIO
 
-def extract_text_from_pdf(source):
+import text_cleaning
+
+def iter_pages_from_pdf(source):
     """
     Accepts either a file path (str) or a BytesIO object.
-    Returns the full extracted text from the PDF.
+    Yields the extracted text of each page, in order (page 1 first), one page at a time.
     """
     if isinstance(source, str):
         doc = fitz.open(source)
@@ -14,29 +16,97 @@ def extract_text_from_pdf(source):
     else:
         raise ValueError("source must be a file path or BytesIO")
 
-    text = ""
-    for page in doc:
-        text += page.get_text()
-    return text
+    with doc:
+        for page in doc:
+            yield page.get_text()
+
+def extract_pages_from_pdf(source):
+    """
+    Accepts either a file path (str) or a BytesIO object.
+    Returns the extracted text of each page, in order (page 1 first).
+    """
+    return list(iter_pages_from_pdf(source))
+
+def extract_text_from_pdf(source):
+    """
+    Accepts either a file path (str) or a BytesIO object.
+    Returns the full extracted text from the PDF.
+    """
+    return "".join(extract_pages_from_pdf(source))
 
 def clean_text(text):
-    text = re.sub(r'\n+', '\n', text)
-    text = re.sub(r'[^\S\r\n]{2,}', ' ', text)
-    return text.strip()
+    # Ligatures, soft hyphens, hyphenated line breaks, blank lines, runs of spaces (text_cleaning.py)
+    return text_cleaning.clean_text(text)
 
-def chunk_text(text, max_tokens=500):
-    paragraphs = text.split("\n")
-    chunks, current = [], ""
-    for para in paragraphs:
+def join_pages(pages):
+    """
+    Clean each page (running headers/footers and page numbers removed, see text_cleaning.py) and
+    join them with a newline. `pages` can be any iterable, e.g. iter_pages_from_pdf. Returns
+    (document text, page_starts) where page_starts[i] is the character offset at which page i + 1
+    begins in the document text.
+    """
+    parts, page_starts, pos = [], [], 0
+    for cleaned in text_cleaning.clean_pages(pages):
+        page_starts.append(pos)
+        if not cleaned:
+            continue  # blank page: shares its offset with the next one, which page_at() picks
+        parts.append(cleaned)
+        pos += len(cleaned) + 1
+    return "\n".join(parts), page_starts
+
+def chunk_text_with_offsets(text, max_tokens=500):
+    """
+    Same chunks as chunk_text, each as (chunk, char_start, char_end) with text[char_start:char_end] == chunk.
+    """
+    chunks = []
+    current, current_start, pos = "", 0, 0
+    for para in text.split("\n"):
         if len(current + para) < max_tokens * 4:  # Approx. 4 chars/token
             current += para + "\n"
         else:
-            chunks.append(current.strip())
-            current = para + "\n"
+            stripped = current.strip()
+            start = current_start + len(current) - len(current.lstrip())
+            chunks.append((stripped, start, start + len(stripped)))
+            current, current_start = para + "\n", pos
+        pos += len(para) + 1
     if current:
-        chunks.append(current.strip())
+        stripped = current.strip()
+        start = current_start + len(current) - len(current.lstrip())
+        chunks.append((stripped, start, start + len(stripped)))
     return chunks
 
+def chunk_text(text, max_tokens=500):
+    return [chunk for chunk, _, _ in chunk_text_with_offsets(text, max_tokens)]
+
+def page_at(page_starts, offset):
+    """1-based page number holding character `offset` of the joined document text."""
+    return max(bisect_right(page_starts, offset), 1)
+
+def chunk_document(text, page_starts, max_tokens=500):
+    """
+    Chunk a joined document (join_pages). Yields (chunk, provenance) where provenance is
+    {"page_start", "page_end", "char_start", "char_end"}; offsets index `text`, which is what
+    text_store.py keeps.
+    """
+    for chunk, start, end in chunk_text_with_offsets(text, max_tokens):
+        yield chunk, {
+            "page_start": page_at(page_starts, start),
+            "page_end": page_at(page_starts, max(end - 1, start)),
+            "char_start": start,
+            "char_end": end,
+        }
+
+def chunk_pages(pages, max_tokens=500):
+    """chunk_document over join_pages(pages), for callers that don't need the joined text."""
+    return chunk_document(*join_pages(pages), max_tokens=max_tokens)
+
+def page_label(meta):
+    """'p. 4' / 'pp. 4–5' from chunk metadata, or None for chunks without page provenance."""
+    if not isinstance(meta, dict) or meta.get("page_start") is None:
+        return None
+    start, end = meta["page_start"], meta.get("page_end", meta["page_start"])
+    return f"p. {start}" if start == end else f"pp. {start}–{end}"
+
 def format_response_with_citations(answer: str, results: dict) -> str:
     docs = results.get("documents", [[]])[0]
     metas = results.get("metadatas", [[]])[0]
@@ -45,6 +115,9 @@ def format_response_with_citations(answer: str, results: dict) -> str:
     for i, meta in enumerate(metas):
         if isinstance(meta, dict):
             source = meta.get("source") or meta.get("path") or "Unknown"
+            pages = page_label(meta)
+            if pages:
+                source = f"{source}, {pages}"
         elif isinstance(meta, str):
             source = meta
         else:
@@ -1,14 +1,10 @@
-import os
 import json
 from dotenv import load_dotenv
-from supabase import create_client
+from storage import open_storage, list_files
 
 # Load .env
 load_dotenv()
-url = os.environ.get("SUPABASE_URL")
-key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-bucket = os.environ.get("SUPABASE_BUCKET")
-client = create_client(url, key)
+storage = open_storage()
 
 # Load local ingested state
 try:
@@ -17,9 +13,8 @@ try:
 except FileNotFoundError:
     local_ingested = set()
 
-# List Supabase files
-response = client.storage.from_(bucket).list("pdfs", {"limit": 9999})
-remote_files = set(f["name"] for f in response)
+# List bucket files (paginated, so buckets past one page are covered too)
+remote_files = set(entry.name for entry in list_files(storage, "pdfs", recursive=False))
 
 # Detect untracked files
 missing = remote_files - local_ingested
@@ -30,4 +25,3 @@ if missing:
         print(f" - {f}")
 else:
     print("✅ All Supabase files have been ingested.")
-
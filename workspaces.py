@@ -0,0 +1,352 @@
+import os
+import re
+import json
+import time
+import shutil
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from shared_store import CHROMA_PATH, GenerationWatcher, bump_generation
+from source_index import SOURCES_COLLECTION
+from embeddings import backend_dimension, open_collection
+from text_store import TextStore
+
+# Private document sets ("workspaces") for separate bar groups on one deployment.
+#
+# The default workspace is the existing store (CHROMA_PATH, served exactly as before). Every other
+# workspace is a store of its own in WORKSPACES_PATH/<name>/: Chroma files with the usual cocktailgpt
+# and cocktailgpt_sources collections, its text store (texts/) and its dedup index. One group's
+# documents never grow another group's index, and snapshots/restores work per directory with the
+# same snapshot.py code as the main store. Workspaces are always opened embedded, also with
+# CHROMA_MODE=http (the Chroma server only serves the default store).
+#
+#   WORKSPACES_PATH/<name>.json       : {"name", "created_at", "max_mb"}; next to the store, not in it,
+#                                       so a snapshot restored into a workspace doesn't bring its own
+#   WORKSPACES_PATH/<name>.generation : bumped after every ingest, compaction and restore into the
+#                                       workspace, so other workers reopen it instead of serving old data
+#
+# Each worker opens workspaces lazily and keeps them in an LRU pool: at most WORKSPACE_POOL_SIZE open,
+# and least recently used ones are closed while the open ones together are estimated above
+# WORKSPACE_POOL_MB. The estimate is chunks × (dim × 4 bytes + HNSW_LINK_BYTES), i.e. what the HNSW
+# index holds in memory once queried. Each workspace also has its own limit (max_mb, WORKSPACE_MAX_MB
+# unless set at creation): ingest stops taking new files once a workspace has reached it. A workspace
+# a job is working on (ingest, compaction, snapshot) is pinned: never evicted or closed underneath it,
+# which would leave the job writing through a second Chroma instance on the same files.
+#
+#   python workspaces.py list
+#   python workspaces.py create <name> [--max-mb=256]
+
+WORKSPACES_PATH = os.environ.get("WORKSPACES_PATH", CHROMA_PATH.rstrip("/") + "_workspaces")
+WORKSPACE_POOL_SIZE = int(os.environ.get("WORKSPACE_POOL_SIZE", "8"))
+WORKSPACE_POOL_MB = float(os.environ.get("WORKSPACE_POOL_MB", "1024"))
+WORKSPACE_MAX_MB = float(os.environ.get("WORKSPACE_MAX_MB", "256"))
+# Bucket folder a workspace is ingested from: <prefix>/<name>/ (the default workspace keeps pdfs/)
+WORKSPACE_STORAGE_PREFIX = os.environ.get("WORKSPACE_STORAGE_PREFIX", "workspaces")
+
+DEFAULT_WORKSPACE = "default"
+CHUNKS_COLLECTION = "cocktailgpt"
+HNSW_LINK_BYTES = 2 * 16 * 4 + 64  # level-0 neighbour lists at hnsw:M=16, plus per-element overhead
+
+_NAME_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{2,39}$")
+
+
+class UnknownWorkspace(KeyError):
+    pass
+
+
+def workspace_name(name: Optional[str]) -> str:
+    """Normalised name; None/"" mean the default workspace. ValueError for names that aren't allowed."""
+    name = (name or "").strip().lower() or DEFAULT_WORKSPACE
+    if name != DEFAULT_WORKSPACE and not _NAME_RE.match(name):
+        raise ValueError(f"Invalid workspace name {name!r}: 3–40 of a-z, 0-9, - and _")
+    return name
+
+
+def workspace_path(name: str, root: str = WORKSPACES_PATH) -> str:
+    return CHROMA_PATH if name == DEFAULT_WORKSPACE else os.path.join(root, name)
+
+
+def storage_prefix(name: str) -> str:
+    return "pdfs" if name == DEFAULT_WORKSPACE else f"{WORKSPACE_STORAGE_PREFIX}/{name}"
+
+
+def lock_name(name: str, base: str) -> str:
+    """jobs.py lock for one workspace's store, so work on one workspace doesn't wait for another."""
+    return base if name == DEFAULT_WORKSPACE else f"{base}.{name}"
+
+
+def estimate_mb(chunks: int, dim: Optional[int] = None) -> float:
+    dim = dim if dim is not None else backend_dimension()
+    return round(chunks * (dim * 4 + HNSW_LINK_BYTES) / 1e6, 2)
+
+
+def meta_path(name: str, root: str = WORKSPACES_PATH) -> str:
+    return os.path.join(root, name + ".json")
+
+
+def read_meta(name: str, root: str = WORKSPACES_PATH) -> Dict[str, Any]:
+    if name == DEFAULT_WORKSPACE:
+        return {"name": name, "max_mb": None}
+    try:
+        with open(meta_path(name, root)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise UnknownWorkspace(name)
+
+
+def create_workspace(name: str, max_mb: Optional[float] = None, root: str = WORKSPACES_PATH) -> Dict[str, Any]:
+    name = workspace_name(name)
+    if name == DEFAULT_WORKSPACE:
+        raise ValueError("The default workspace always exists")
+    path = workspace_path(name, root)
+    os.makedirs(path, exist_ok=True)
+    target = meta_path(name, root)
+    if os.path.exists(target):
+        meta = read_meta(name, root)
+        if max_mb is None or meta.get("max_mb") == max_mb:
+            return meta
+    else:
+        meta = {"name": name, "created_at": time.time()}
+    meta["max_mb"] = float(max_mb) if max_mb is not None else WORKSPACE_MAX_MB
+    tmp = f"{target}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, target)
+    print(f"🏷️ Workspace {name} (limit {meta['max_mb']} MB) at {path}")
+    return meta
+
+
+def list_workspaces(root: str = WORKSPACES_PATH) -> List[str]:
+    if not os.path.isdir(root):
+        return []
+    return sorted(n[:-5] for n in os.listdir(root) if n.endswith(".json") and os.path.isdir(os.path.join(root, n[:-5])))
+
+
+def release_client(path: str) -> None:
+    """Forget Chroma's cached embedded system for one store path (cf. shared_store.release_embedded_clients);
+    its memory goes once the last handle on it is dropped."""
+    from chromadb.api.client import SharedSystemClient
+    SharedSystemClient._identifier_to_system.pop(path, None)
+
+
+class Workspace:
+    """Open handles on one workspace's store."""
+
+    def __init__(self, name: str, path: str, client, collection, sources_collection, text_store: TextStore,
+                 max_mb: Optional[float] = None, watcher: Optional[GenerationWatcher] = None):
+        self.name = name
+        self.path = path
+        self.client = client
+        self.collection = collection
+        self.sources_collection = sources_collection
+        self.text_store = text_store
+        self.max_mb = max_mb
+        self.watcher = watcher
+        self.chunks = 0  # refreshed by open_workspace and after ingest
+        self.opened_at = time.time()
+
+    @property
+    def est_mb(self) -> float:
+        return estimate_mb(self.chunks)
+
+    def max_chunks(self) -> Optional[int]:
+        """Chunks that fit in max_mb (None: no limit)."""
+        if self.max_mb is None:
+            return None
+        return int(self.max_mb * 1e6 / (backend_dimension() * 4 + HNSW_LINK_BYTES))
+
+    def refresh(self) -> None:
+        self.chunks = self.collection.count()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "chunks": self.chunks, "est_mb": self.est_mb, "max_mb": self.max_mb,
+                "path": self.path, "opened_at": self.opened_at}
+
+
+def ingest_options(ws: Workspace, root: str = WORKSPACES_PATH) -> Dict[str, Any]:
+    """Keyword arguments for ingest_supabase.ingest_supabase_docs into a (non-default) workspace."""
+    ws.max_mb = read_meta(ws.name, root).get("max_mb")  # the limit may have changed since it was opened
+    return {
+        "prefix": storage_prefix(ws.name),
+        "text_path": ws.text_store.path,
+        "dedup_path": os.path.join(ws.path, "dedup_index.sqlite3"),
+        "state_path": os.path.join(root, ws.name + ".ingested.json"),
+        "max_chunks": ws.max_chunks(),
+    }
+
+
+def open_workspace(name: str, root: str = WORKSPACES_PATH) -> Workspace:
+    """Open a non-default workspace's store (embedded), checking the embedding backend like the main store."""
+    from chromadb import PersistentClient
+
+    meta = read_meta(name, root)
+    path = workspace_path(name, root)
+    watcher = GenerationWatcher(path + ".generation")
+    client = PersistentClient(path=path)
+    ws = Workspace(
+        name, path, client,
+        open_collection(client, CHUNKS_COLLECTION),
+        open_collection(client, SOURCES_COLLECTION),
+        TextStore(os.path.join(path, "texts")),
+        max_mb=meta.get("max_mb"),
+        watcher=watcher,
+    )
+    ws.refresh()
+    return ws
+
+
+class WorkspacePool:
+    """Lazily opened workspaces, least recently used closed first (see the module comment)."""
+
+    def __init__(self, root: str = WORKSPACES_PATH, max_open: int = WORKSPACE_POOL_SIZE, max_mb: float = WORKSPACE_POOL_MB):
+        self.root = root
+        self.max_open = max_open
+        self.max_mb = max_mb
+        self._open: "OrderedDict[str, Workspace]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pins: Dict[str, int] = {}
+        self._opening: Dict[str, threading.Lock] = {}  # name -> held while that workspace is being opened
+        self.stats = {"opens": 0, "hits": 0, "evictions": 0, "reopens": 0}
+
+    def __len__(self) -> int:
+        return len(self._open)
+
+    def get(self, name: str) -> Workspace:
+        """Raises UnknownWorkspace for a workspace that was never created."""
+        with self._lock:
+            ws = self._open.get(name)
+            if ws is not None and not self.busy(name) and ws.watcher is not None and ws.watcher.changed():
+                # Restored by another worker: reopen on the new files
+                self._close(name)
+                self.stats["reopens"] += 1
+                ws = None
+            if ws is not None:
+                self._open.move_to_end(name)
+                self.stats["hits"] += 1
+                return ws
+            opening = self._opening.setdefault(name, threading.Lock())
+        # Opened outside the pool lock so a slow open doesn't hold up other workspaces; the per-name
+        # lock keeps two requests from opening the same one
+        with opening:
+            with self._lock:
+                ws = self._open.get(name)
+                if ws is not None:  # opened by the request we waited for
+                    self._open.move_to_end(name)
+                    self.stats["hits"] += 1
+                    return ws
+            ws = open_workspace(name, self.root)
+            with self._lock:
+                self._open[name] = ws
+                self.stats["opens"] += 1
+                self._evict(keep=name)
+            return ws
+
+    @contextmanager
+    def pinned(self, name: str):
+        """The workspace, kept open (not evicted or closed) until the block is left; for jobs."""
+        with self._lock:
+            self._pins[name] = self._pins.get(name, 0) + 1
+        try:
+            yield self.get(name)
+        finally:
+            with self._lock:
+                self._pins[name] -= 1
+                if not self._pins[name]:
+                    del self._pins[name]
+                    self._evict(keep=name)  # what couldn't be closed while it was in use
+
+    def busy(self, name: str) -> bool:
+        return name in self._pins
+
+    def _evict(self, keep: str) -> None:
+        while len(self._open) > 1 and (
+            len(self._open) > self.max_open or sum(w.est_mb for w in self._open.values()) > self.max_mb
+        ):
+            oldest = next((n for n in self._open if n != keep and not self.busy(n)), None)
+            if oldest is None:
+                break  # the rest are in use; over the limits until their jobs finish
+            self._close(oldest)
+            self.stats["evictions"] += 1
+
+    def _close(self, name: str) -> None:
+        # Not closed explicitly: a request may still be querying it; it goes with the last reference
+        ws = self._open.pop(name, None)
+        if ws is not None:
+            ws.text_store.clear()
+            release_client(ws.path)
+
+    def close(self, name: str, force: bool = False) -> bool:
+        """False (and left open) while a job has it pinned, unless `force` (the job swapping its store)."""
+        with self._lock:
+            if self.busy(name) and not force:
+                return False
+            self._close(name)
+            return True
+
+    def set_max_mb(self, name: str, max_mb: Optional[float]) -> None:
+        """A new limit for a workspace this worker has open (without reopening it)."""
+        with self._lock:
+            if name in self._open:
+                self._open[name].max_mb = max_mb
+
+    def mark_seen(self, name: str, generation: int) -> None:
+        """After this worker changed the workspace itself: no need to reopen it here."""
+        with self._lock:
+            ws = self._open.get(name)
+            if ws is not None and ws.watcher is not None:
+                ws.watcher.mark_seen(generation)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            open_ws = [w.to_dict() for w in self._open.values()]
+            pinned = sorted(self._pins)
+        return {
+            **self.stats,
+            "open": open_ws,
+            "pinned": pinned,
+            "open_mb": round(sum(w["est_mb"] for w in open_ws), 2),
+            "limits": {"max_open": self.max_open, "max_mb": self.max_mb},
+        }
+
+
+def bump_workspace(name: str, reason: str, pool: Optional[WorkspacePool] = None, root: str = WORKSPACES_PATH) -> int:
+    """Tell the other workers a workspace's store changed (they reopen it on next use)."""
+    generation = bump_generation(f"{reason}:{name}", path=workspace_path(name, root) + ".generation")
+    if pool is not None:
+        pool.mark_seen(name, generation)
+    return generation
+
+
+def swap_in(name: str, incoming: str, pool: Optional[WorkspacePool] = None, root: str = WORKSPACES_PATH,
+            reason: str = "restore") -> int:
+    """Replace a workspace's store with `incoming` (a validated copy) and tell the other workers."""
+    path = workspace_path(name, root)
+    if pool is not None:
+        pool.close(name, force=True)
+    release_client(path)
+    release_client(incoming)  # validation opened it
+    old = path + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old)
+    os.rename(incoming, path)
+    shutil.rmtree(old, ignore_errors=True)
+    return bump_workspace(name, reason, root=root)
+
+
+if __name__ == "__main__":
+    import sys
+
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    opts = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    command = args[0] if args else "list"
+    if command == "list":
+        for ws_name in list_workspaces():
+            print(json.dumps(read_meta(ws_name)))
+    elif command == "create" and len(args) > 1:
+        print(json.dumps(create_workspace(args[1], float(opts["max-mb"]) if "max-mb" in opts else None)))
+    else:
+        print("usage: python workspaces.py list | create <name> [--max-mb=256]")
+        sys.exit(1)
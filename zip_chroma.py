@@ -1,17 +1,30 @@
 import os
-import shutil
 
-def zip_chroma_store():
-    chroma_dir = "/tmp/chroma_store"
-    zip_base = "/tmp/chroma_store_part"
+from shared_store import CHROMA_PATH
+from snapshot import export_snapshot
+
+ZIP_PART_BASE = "/tmp/chroma_store_part"
+
+def zip_chroma_store(job=None, client=None, base=None, chroma_dir=CHROMA_PATH, zip_base=ZIP_PART_BASE):
+    """
+    Snapshot the Chroma store (manifest included) into ~100MB parts.
+    With `base` (a manifest, e.g. from GET /snapshot/manifest on the target) only the changes are shipped.
+    A workspace (workspaces.py) passes its own store directory and part file prefix.
+    """
     if not os.path.exists(chroma_dir):
         raise FileNotFoundError(f"{chroma_dir} not found")
 
     part_size = 100 * 1024 * 1024  # 100MB
-    temp_zip = "/tmp/chroma_store_full.zip"
+    temp_zip = f"{zip_base}_full.zip"
 
-    # Step 1: Zip the entire chroma_store dir
-    shutil.make_archive(temp_zip.replace(".zip", ""), 'zip', chroma_dir)
+    # Step 1: Zip the chroma_store dir (or just what changed since `base`) with its manifest
+    try:
+        manifest = export_snapshot(temp_zip, chroma_dir, base=base, client=client, job=job)
+    except BaseException:
+        if os.path.exists(temp_zip):
+            os.remove(temp_zip)
+        raise
+    zip_bytes = os.path.getsize(temp_zip)
 
     # Step 2: Split the zip into ~100MB parts
     with open(temp_zip, "rb") as f:
@@ -21,5 +34,18 @@ def zip_chroma_store():
                 part.write(chunk)
             i += 1
 
+    # Drop parts left over from an earlier, bigger snapshot so they can't be assembled by mistake
+    stale = i
+    while os.path.exists(f"{zip_base}{stale}.zip"):
+        os.remove(f"{zip_base}{stale}.zip")
+        stale += 1
+
     os.remove(temp_zip)
     print(f"✅ Created {i - 1} chunk(s) at {zip_base}*.zip")
+    return {
+        "parts": i - 1,
+        "manifest_id": manifest["id"],
+        "base_id": manifest["base_id"],
+        "zip_bytes": zip_bytes,
+        "store_bytes": manifest["total_bytes"],
+    }